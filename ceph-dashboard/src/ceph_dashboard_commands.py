@@ -9,7 +9,7 @@ import os
 import re
 import socket
 import tempfile
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 from functools import partial
 
 import subprocess
@@ -94,6 +94,23 @@ def ceph_config_list() -> list:
     return json.loads(_run_cmd(cmd))
 
 
+def dashboard_config_dump() -> Optional[dict]:
+    "Fetch the mgr/dashboard settings of the ceph config database, or None."
+    cmd = ["ceph", "config", "dump", "--format=json"]
+    try:
+        dump = json.loads(_run_cmd(cmd))
+    except (subprocess.CalledProcessError, FileNotFoundError,
+            ValueError) as exc:
+        logger.warning("Unable to read the ceph config database: %s", exc)
+        return None
+    return {
+        entry["name"]: entry["value"]
+        for entry in dump
+        if entry.get("section") == "mgr" and
+        entry.get("name", "").startswith("mgr/dashboard/")
+    }
+
+
 def ceph_config_set(key: str, value: str) -> None:
     "Remove the provided key/value pair"
     cmd = ["ceph", "config-key", "set", key, value]
@@ -8,6 +8,7 @@
 
 import json
 import base64
+import hashlib
 import logging
 import re
 import secrets
@@ -15,9 +16,10 @@ import socket
 import string
 import subprocess
 import tempfile
+from functools import partial
 from subprocess import CalledProcessError
 from pathlib import Path
-from typing import List, Tuple, Union
+from typing import Callable, Dict, List, Tuple, Union
 
 import charms_ceph.selog as selog
 import charms_ceph.utils as ceph_utils
@@ -39,7 +41,7 @@ from ops.model import ActiveStatus, BlockedStatus, StatusBase
 
 # Charm Src
 import ceph_dashboard_commands as cmds
-from charm_option import CharmCephOptionList
+from charm_option import CharmCephOptionList, setting_config_key
 
 logger = logging.getLogger(__name__)
 
@@ -159,7 +161,9 @@ class CephDashboardCharm(ops_openstack.core.OSBaseCharm):
             self.on.enable_ssl_from_config, self._enable_ssl_from_config
         )
 
-        self._stored.set_default(is_started=False)
+        self._stored.set_default(
+            is_started=False, dashboard_state={}, dashboard_state_hash='',
+            grafana_dashboards_hash='')
 
     def _request_loadbalancer(self, _event) -> None:
         """Send request to create loadbalancer"""
@@ -172,16 +176,35 @@ class CephDashboardCharm(ops_openstack.core.OSBaseCharm):
         )
 
     def _register_dashboards(self) -> None:
-        """Register all dashboards with grafana"""
+        """Register all dashboards with grafana
+
+        The dashboards only change with the charm revision, so they are
+        only parsed and sent again when their content or the grafana
+        relation changes.
+        """
         if not self.unit.is_leader():
             return  # Do nothing on non leader units.
 
-        for dash_file in self.DASH_DIR.glob("*.json"):
+        relation = self.grafana_dashboard.dashboard_relation
+        if not relation:
+            return
+
+        dashboards = [(dash_file, dash_file.read_bytes())
+                      for dash_file in sorted(self.DASH_DIR.glob("*.json"))]
+        digest = hashlib.sha256(str(relation.id).encode())
+        for dash_file, content in dashboards:
+            digest.update(dash_file.name.encode())
+            digest.update(content)
+        if digest.hexdigest() == self._stored.grafana_dashboards_hash:
+            logging.debug("Grafana dashboards unchanged, not registering")
+            return
+
+        for dash_file, content in dashboards:
             self.grafana_dashboard.register_dashboard(
-                dash_file.stem,
-                json.loads(dash_file.read_text()))
+                dash_file.stem, json.loads(content))
             logging.debug(
                 "register_grafana_dashboard: {}".format(dash_file))
+        self._stored.grafana_dashboards_hash = digest.hexdigest()
 
     def _update_radosgw_creds(
         self, access_key: str, secret_key: str
@@ -318,57 +341,109 @@ class CephDashboardCharm(ops_openstack.core.OSBaseCharm):
                 settings.extend(extra_args)
             cmds.apply_setting(ceph_setting, settings)
 
-    def _apply_ceph_config_from_charm_config(self) -> None:
-        """Read charm config and apply settings to dashboard config"""
-        for option in self.CHARM_TO_CEPH_OPTIONS:
-            try:
-                value = self.config[option.charm_option_name]
-            except KeyError:
-                logging.error(
-                    "Unknown charm option {}, skipping".format(
-                        option.charm_option_name))
-                continue
-            if option.is_supported():
+    def _apply_charm_option(self, option, value) -> bool:
+        """Apply a charm option to dashboard config"""
+        try:
+            cmds.exec_option_ceph_cmd(option, value)
+        except FileNotFoundError:
+            logging.warning(
+                "Skipping charm option {}, ceph command not found".
+                format(option.charm_option_name))
+            return False
+        except CalledProcessError as exc:
+            logging.warning(
+                "Skipping charm option %s, ceph command failed: %s",
+                option.charm_option_name, exc)
+            return False
+        return True
+
+    def _get_desired_dashboard_state(self) -> Dict[str, Tuple[str, Callable]]:
+        """Map each dashboard setting to its desired value and applier.
+
+        Keys under mgr/dashboard/ match the names reported by
+        `ceph config dump`, the others are only tracked locally.
+        """
+        state = {}
+        if self.unit.is_leader():
+            for option in self.CHARM_TO_CEPH_OPTIONS:
                 try:
-                    cmds.exec_option_ceph_cmd(option, value)
-                except FileNotFoundError:
+                    value = self.config[option.charm_option_name]
+                except KeyError:
+                    logging.error(
+                        "Unknown charm option {}, skipping".format(
+                            option.charm_option_name))
+                    continue
+                if not option.is_supported():
                     logging.warning(
-                        "Skipping charm option {}, ceph command not found".
-                        format(option.charm_option_name))
-                except CalledProcessError as exc:
-                    logging.warning(
-                        "Skipping charm option %s, ceph command failed: %s",
-                        option.charm_option_name, exc)
-            else:
-                logging.warning(
-                    "Skipping charm option {}, not supported".format(
-                        option.charm_option_name))
-
-    def _configure_service_apis(self) -> None:
-        """Configure related service APIs in ceph dashboard"""
+                        "Skipping charm option {}, not supported".format(
+                            option.charm_option_name))
+                    continue
+                state[option.config_key] = (
+                    option.config_value(value),
+                    partial(self._apply_charm_option, option, value))
+
+            saml = [self.config.get('saml-base-url'),
+                    self.config.get('saml-idp-metadata'),
+                    self.config.get('saml-username-attribute'),
+                    self.config.get('saml-idp-entity-id')]
+            if saml[0] and saml[1]:
+                state['saml'] = (json.dumps(saml), self._configure_saml)
+
+        server_addr = "mgr/dashboard/{hostname}/server_addr".format(
+            hostname=socket.gethostname())
+        bind_ip = str(self._get_bind_ip())
+        state[server_addr] = (
+            bind_ip, partial(ceph_utils.mgr_config_set, server_addr, bind_ip))
+
+        # grafana, prometheus and alertmanager API endpoints
         if self.unit.is_leader():
-            grafana_ep = self.config.get("grafana-api-url")
-            if grafana_ep:
-                cmds.dashboard_set("set-grafana-api-url", grafana_ep)
-
-            alertmanager_conn = self.alertmanager.get_service_ep_data()
-            if alertmanager_conn:
-                cmds.dashboard_set(
-                    "set-alertmanager-api-host",
-                    "http://{}:{}".format(
-                        alertmanager_conn["hostname"],
-                        alertmanager_conn["port"]
-                    ),
-                )
-
-            prometheus_conn = self.prometheus.get_service_ep_data()
-            if prometheus_conn:
-                cmds.dashboard_set(
-                    "set-prometheus-api-host",
-                    "http://{}:{}".format(
-                        prometheus_conn["hostname"], prometheus_conn["port"]
-                    ),
-                )
+            service_apis = [
+                ("set-grafana-api-url", self.config.get("grafana-api-url"))]
+            for setting, relation in [
+                    ("set-alertmanager-api-host", self.alertmanager),
+                    ("set-prometheus-api-host", self.prometheus)]:
+                conn = relation.get_service_ep_data()
+                if conn:
+                    service_apis.append((setting, "http://{}:{}".format(
+                        conn["hostname"], conn["port"])))
+            for setting, value in service_apis:
+                if value:
+                    state[setting_config_key(setting)] = (
+                        value, partial(cmds.dashboard_set, setting, value))
+        return state
+
+    def _reconcile_dashboard_config(self) -> None:
+        """Apply the dashboard settings which differ from the desired state.
+
+        The settings under mgr/dashboard/ are always compared against
+        `ceph config dump`, so changes made outside the charm are
+        reverted.  The others can't be read back, they are compared
+        against the last applied state and only written when the digest
+        of the desired state changed.
+        """
+        desired = self._get_desired_dashboard_state()
+        digest = hashlib.sha256(json.dumps(
+            {key: value for key, (value, _) in desired.items()},
+            sort_keys=True).encode()).hexdigest()
+        unchanged = digest == self._stored.dashboard_state_hash
+
+        current = dict(self._stored.dashboard_state)
+        dump = cmds.dashboard_config_dump()
+        applied = {}
+        complete = True
+        for key, (value, apply_setting) in desired.items():
+            if key.startswith('mgr/dashboard/') and dump is not None:
+                differs = dump.get(key) != value
+            else:
+                differs = not unchanged and current.get(key) != value
+            if differs:
+                logging.debug("Applying dashboard setting %s", key)
+                if apply_setting() is False:
+                    complete = False
+                    continue
+            applied[key] = value
+        self._stored.dashboard_state = applied
+        self._stored.dashboard_state_hash = digest if complete else ''
 
     def _configure_dashboard(self, event) -> None:
         """Configure dashboard"""
@@ -390,6 +465,10 @@ class CephDashboardCharm(ops_openstack.core.OSBaseCharm):
                 # configuration below
                 logging.debug("Enabling dashboard as leader.")
                 ceph_utils.mgr_enable_dashboard()
+                # nothing is known to be applied to a freshly enabled
+                # dashboard
+                self._stored.dashboard_state = {}
+                self._stored.dashboard_state_hash = ''
             else:
                 # non-leader, defer event until leader has enabled and
                 # configured the dashboard
@@ -412,20 +491,9 @@ class CephDashboardCharm(ops_openstack.core.OSBaseCharm):
                 if not self.is_ceph_dashboard_ssl_key_cert_same(key, cert):
                     # clean SSL if not configured using relation
                     self.on.disable_ssl.emit()
-            # apply charm config
-            self._apply_ceph_config_from_charm_config()
-
-        self._configure_saml()
 
-        ceph_utils.mgr_config_set(
-            "mgr/dashboard/{hostname}/server_addr".format(
-                hostname=socket.gethostname()
-            ),
-            str(self._get_bind_ip()),
-        )
-
-        # configure grafana, prometheus and alertmanager API endpoints
-        self._configure_service_apis()
+        # apply charm config, SAML, server address and service endpoints
+        self._reconcile_dashboard_config()
 
         self._register_dashboards()
         self._manage_radosgw()
@@ -614,20 +682,21 @@ class CephDashboardCharm(ops_openstack.core.OSBaseCharm):
 
         self.kick_dashboard()
 
-    def _configure_saml(self) -> None:
+    def _configure_saml(self) -> bool:
+        """Configure SAML, returning whether it was applied"""
         selog.log('Configure SAML from charm configuration',
                   event='authz_saml_config',
                   detail='saml_config_set')
         if not self.unit.is_leader():
             logger.debug("Unit not leader, skipping saml config")
-            return
+            return False
 
         base_url = self.config.get('saml-base-url')
         idp_metadata = self.config.get('saml-idp-metadata')
         username_attr = self.config.get('saml-username-attribute')
         idp_entity_id = self.config.get('saml-idp-entity-id')
         if not base_url or not idp_metadata:
-            return
+            return False
 
         try:
             cmds.ceph_dashboard_config_saml(
@@ -637,8 +706,9 @@ class CephDashboardCharm(ops_openstack.core.OSBaseCharm):
             stderr = getattr(exc, 'stderr', '') or ''
             if 'Required library not found: `python3-saml`' in stderr:
                 logger.warning("Skipping SAML config: %s", stderr)
-                return
+                return False
             raise
+        return True
 
     def _gen_user_password(self, length: int = 12) -> str:
         """Generate a password"""
@@ -12,6 +12,12 @@ from typing import List, Union
 logger = logging.getLogger(__name__)
 
 
+def setting_config_key(ceph_option_name: str) -> str:
+    """Name under which ceph config reports a `ceph dashboard set-*` value"""
+    setting = ceph_option_name[len('set-'):]
+    return 'mgr/dashboard/{}'.format(setting.upper().replace('-', '_'))
+
+
 class CharmCephOption():
     """Manage a charm option to ceph command to manage that option"""
 
@@ -44,6 +50,15 @@ class CharmCephOption():
             dashboard command"""
         return [str(value)]
 
+    @property
+    def config_key(self) -> str:
+        """Key identifying the option in the dashboard settings"""
+        return setting_config_key(self.ceph_option_name)
+
+    def config_value(self, value: Union[bool, str, int]) -> str:
+        """Convert a value to the form ceph config reports it in"""
+        return str(value)
+
     def ceph_command(self, value: List[str]) -> List[str]:
         """Shell command to set option to desired value"""
         cmd = ['ceph', 'dashboard', self.ceph_option_name]
@@ -60,6 +75,13 @@ class DebugOption(CharmCephOption):
         else:
             return ['disable']
 
+    @property
+    def config_key(self):
+        return 'mgr/dashboard/debug'
+
+    def config_value(self, value):
+        return str(bool(value))
+
 
 class MOTDOption(CharmCephOption):
 
@@ -70,6 +92,12 @@ class MOTDOption(CharmCephOption):
         else:
             return ['clear']
 
+    @property
+    def config_key(self):
+        # The motd lives in the config-key store rather than in the
+        # ceph config database.
+        return 'motd'
+
 
 class CharmCephOptionList():
     def get(self) -> List:
@@ -109,13 +109,19 @@ class GrafanaDashboardProvides(Object):
             request_id = self.get_request_id(name, self.dashboard_relation,
                                              _dashboard.get('digest'))
             rq_key = self.get_request_key(request_id)
-            self.dashboard_relation.data[self.model.unit][rq_key] = json.dumps(
+            # Dashboards are large, keep the request compact and skip the
+            # write if an identical request is already present.
+            request = json.dumps(
                 {
                     'request_id': request_id,
                     'name': name,
                     'dashboard': _dashboard,
                 },
-                sort_keys=True)
+                sort_keys=True,
+                separators=(',', ':'))
+            unit_data = self.dashboard_relation.data[self.model.unit]
+            if unit_data.get(rq_key) != request:
+                unit_data[rq_key] = request
             self.clear_old_requests(
                 name,
                 self.dashboard_relation,
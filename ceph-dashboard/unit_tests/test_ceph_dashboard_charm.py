@@ -349,6 +349,8 @@ class TestCephDashboardCharmBase(CharmTestCase):
             'ceph-mon/0',
             {
                 'mon-ready': 'True'})
+        subprocess.run.return_value.stdout = '[]'
+        subprocess.run.return_value.stderr = ''
         self.ceph_utils.mgr_config_set.reset_mock()
         self.ceph_utils.is_dashboard_enabled.return_value = True
         self.harness.set_leader()
@@ -367,6 +369,97 @@ class TestCephDashboardCharmBase(CharmTestCase):
             'mgr/dashboard/server1/server_addr',
             '10.0.0.10')
 
+    @patch('ceph_dashboard_commands.subprocess.run')
+    @patch('charm_option.ch_host')
+    def test_configure_dashboard_unchanged(self, option_ch_host, mock_run):
+        self.ceph_utils.is_dashboard_enabled.return_value = True
+        option_ch_host.cmp_pkgrevno.return_value = 0
+        config_dump = [
+            {'section': 'mgr', 'name': 'mgr/dashboard/PWD_POLICY_ENABLED',
+             'value': 'True'},
+            {'section': 'mgr', 'name': 'mgr/dashboard/server1/server_addr',
+             'value': '10.0.0.10'},
+            {'section': 'osd', 'name': 'osd_memory_target',
+             'value': '4294967296'}]
+        mock_run.side_effect = lambda *args, **kwargs: \
+            subprocess.CompletedProcess(
+                args=[], returncode=0, stdout=json.dumps(config_dump),
+                stderr='')
+        dump_cmd = ['ceph', 'config', 'dump', '--format=json']
+        rel_id = self.harness.add_relation('dashboard', 'ceph-mon')
+        self.harness.add_relation_unit(rel_id, 'ceph-mon/0')
+        self.harness.update_relation_data(
+            rel_id, 'ceph-mon/0', {'mon-ready': 'True'})
+        self.harness.begin()
+        self.harness.set_leader(True)
+        self.harness.charm.is_ceph_dashboard_ssl_key_cert_same = \
+            lambda *_: True
+
+        self.harness.charm._configure_dashboard(None)
+        cmds = [c[0][0] for c in mock_run.call_args_list]
+        self.assertEqual(cmds.count(dump_cmd), 1)
+        # Settings already held by the cluster are not applied again.
+        self.assertNotIn(
+            ['ceph', 'dashboard', 'set-pwd-policy-enabled', 'True'], cmds)
+        self.assertIn(
+            ['ceph', 'dashboard', 'set-pwd-policy-min-length', '8'], cmds)
+        self.assertFalse(self.ceph_utils.mgr_config_set.called)
+
+        # The cluster now holds all the settings.
+        config_dump[:] = [
+            {'section': 'mgr', 'name': key, 'value': value}
+            for key, (value, _) in
+            self.harness.charm._get_desired_dashboard_state().items()
+            if key.startswith('mgr/dashboard/')]
+
+        # Nothing changed, the settings are only read.
+        mock_run.reset_mock()
+        self.harness.charm._configure_dashboard(None)
+        self.assertEqual(
+            [c[0][0] for c in mock_run.call_args_list], [dump_cmd])
+
+        # A setting changed outside the charm is applied again.
+        mock_run.reset_mock()
+        for entry in config_dump:
+            if entry['name'] == 'mgr/dashboard/PWD_POLICY_MIN_LENGTH':
+                entry['value'] = '6'
+        self.harness.charm._configure_dashboard(None)
+        self.assertEqual(
+            [c[0][0] for c in mock_run.call_args_list],
+            [dump_cmd,
+             ['ceph', 'dashboard', 'set-pwd-policy-min-length', '8']])
+
+        # Only the changed option is applied.
+        mock_run.reset_mock()
+        self.harness.update_config(
+            key_values={'password-policy-min-length': 10})
+        self.assertEqual(
+            [c[0][0] for c in mock_run.call_args_list],
+            [dump_cmd,
+             ['ceph', 'dashboard', 'set-pwd-policy-min-length', '10']])
+
+    def test_register_dashboards(self):
+        rel_id = self.harness.add_relation('grafana-dashboard', 'grafana')
+        self.harness.begin()
+        self.harness.set_leader(True)
+        dash_count = len(list(self.harness.charm.DASH_DIR.glob('*.json')))
+        with patch.object(self.harness.charm.grafana_dashboard,
+                          'register_dashboard') as register_dashboard:
+            self.harness.charm._register_dashboards()
+            self.assertEqual(register_dashboard.call_count, dash_count)
+            register_dashboard.assert_any_call('ceph-cluster', ANY)
+
+            # Unchanged dashboards are not sent again.
+            register_dashboard.reset_mock()
+            self.harness.charm._register_dashboards()
+            register_dashboard.assert_not_called()
+
+            # A new grafana relation gets all the dashboards.
+            self.harness.remove_relation(rel_id)
+            self.harness.add_relation('grafana-dashboard', 'grafana')
+            self.harness.charm._register_dashboards()
+            self.assertEqual(register_dashboard.call_count, dash_count)
+
     def test__get_bind_ip(self):
         self.harness.begin()
         self.assertEqual(
@@ -497,6 +590,8 @@ class TestCephDashboardCharmBase(CharmTestCase):
     @patch('ceph_dashboard_commands.subprocess.run')
     def test_rados_gateway(self, mock_run):
         self.ceph_utils.is_dashboard_enabled.return_value = True
+        mock_run.return_value.stdout = '[]'
+        mock_run.return_value.stderr = ''
         mon_rel_id = self.harness.add_relation('dashboard', 'ceph-mon')
         rel_id = self.harness.add_relation('radosgw-dashboard', 'ceph-radosgw')
         self.harness.begin()
@@ -564,6 +659,8 @@ class TestCephDashboardCharmBase(CharmTestCase):
     @patch('ceph_dashboard_commands.subprocess.run')
     def test_rados_gateway_multi_relations_pacific(self, mock_run):
         self.ceph_utils.is_dashboard_enabled.return_value = True
+        mock_run.return_value.stdout = '[]'
+        mock_run.return_value.stderr = ''
         rel_id1 = self.harness.add_relation('radosgw-dashboard', 'ceph-eu')
         rel_id2 = self.harness.add_relation('radosgw-dashboard', 'ceph-us')
         mon_rel_id = self.harness.add_relation('dashboard', 'ceph-mon')
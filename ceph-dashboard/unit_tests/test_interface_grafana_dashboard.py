@@ -121,7 +121,7 @@ provides:
             "request_id": key.replace("request_", "")}
         self.assertEqual(
             requests[key],
-            json.dumps(expect))
+            json.dumps(expect, separators=(',', ':')))
         # Register the same dashboard again
         self.harness.charm.grafana_dashboard.register_dashboard(
             'my-dash.json',
@@ -147,7 +147,7 @@ provides:
             "request_id": new_key.replace("request_", "")}
         self.assertEqual(
             requests[new_key],
-            json.dumps(expect))
+            json.dumps(expect, separators=(',', ':')))
         # Update an existing dashboard with a new version. This should create
         # a new request and remove the old one.
         updated_dashboard = {
@@ -179,4 +179,4 @@ provides:
             "request_id": updated_key.replace("request_", "")}
         self.assertEqual(
             requests[updated_key],
-            json.dumps(expect))
+            json.dumps(expect, separators=(',', ':')))
@@ -3,6 +3,7 @@
 
 import json
 import logging
+import time
 
 from ops.framework import Object
 from ops.framework import StoredState
@@ -10,6 +11,7 @@ from ops.framework import StoredState
 from charmhelpers.contrib.storage.linux.ceph import (
     send_osd_settings,
 )
+from charmhelpers.core.unitdata import kv
 import charms_ceph.utils as ceph
 
 
@@ -22,6 +24,102 @@ from utils import (
 logger = logging.getLogger(__name__)
 
 
+class BrokerResponseCache(object):
+    """Bounded cache of processed broker responses.
+
+    Responses are keyed by request id and requesting unit and kept as
+    individual entries in the unit's key/value store, so that looking up or
+    adding a response does not load and save every other response.  Entries
+    older than ``max_age`` seconds are dropped and, once more than
+    ``max_entries`` are stored, the least recently used ones are evicted.
+    """
+
+    KEY_PREFIX = 'broker-rsp-cache.'
+    MAX_ENTRIES = 1024
+    MAX_AGE = 7 * 24 * 60 * 60
+
+    def __init__(self, db=None, max_entries=MAX_ENTRIES, max_age=MAX_AGE):
+        self._db = db
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def db(self):
+        if self._db is None:
+            self._db = kv()
+        return self._db
+
+    def _key(self, request_id, unit_id):
+        return '{}{}.{}'.format(self.KEY_PREFIX, unit_id, request_id)
+
+    def get(self, request_id, unit_id):
+        """Return the cached response for a request, if any.
+
+        :param request_id: The broker request id.
+        :type request_id: str
+        :param unit_id: The requesting unit, e.g. ``glance-0``.
+        :type unit_id: str
+        :returns: The cached response or None.
+        :rtype: Optional[str]
+        """
+        key = self._key(request_id, unit_id)
+        entry = self.db.get(key)
+        now = time.time()
+        if entry is not None and now - entry['created'] > self.max_age:
+            self.db.unset(key)
+            self.db.flush()
+            entry = None
+        if entry is None:
+            self.misses += 1
+            self._log_stats('miss', request_id)
+            return None
+        self.hits += 1
+        self._log_stats('hit', request_id)
+        entry['used'] = now
+        self.db.set(key, entry)
+        self.db.flush()
+        return entry['rsp']
+
+    def set(self, request_id, unit_id, rsp):
+        """Cache the response for a request and evict stale entries.
+
+        :param request_id: The broker request id.
+        :type request_id: str
+        :param unit_id: The requesting unit, e.g. ``glance-0``.
+        :type unit_id: str
+        :param rsp: The broker response.
+        :type rsp: str
+        """
+        now = time.time()
+        self.db.set(self._key(request_id, unit_id),
+                    {'rsp': rsp, 'created': now, 'used': now})
+        self.evict(now)
+        self.db.flush()
+
+    def evict(self, now=None):
+        """Drop expired entries and the least recently used overflow."""
+        now = now or time.time()
+        entries = self.db.getrange(self.KEY_PREFIX)
+        expired = [key for key, entry in entries.items()
+                   if now - entry['created'] > self.max_age]
+        live = sorted((key for key in entries if key not in expired),
+                      key=lambda key: entries[key]['used'])
+        overflow = live[:max(0, len(live) - self.max_entries)]
+        if expired or overflow:
+            logger.debug(
+                'Evicting {} expired and {} least recently used broker '
+                'responses'.format(len(expired), len(overflow)))
+            self.db.unsetrange(expired + overflow)
+
+    def _log_stats(self, result, request_id):
+        logger.debug(
+            'Broker response cache {} for request {} '
+            '(hits={}, misses={})'.format(
+                result, request_id, self.hits, self.misses))
+
+
 class CephClientProvides(Object):
     """
     Encapsulate the Provides side of the Ceph Client relation.
@@ -37,7 +135,7 @@ class CephClientProvides(Object):
     def __init__(self, charm, relation_name='client'):
         super().__init__(charm, relation_name)
 
-        self._stored.set_default(processed=[], processed_map={})
+        self._stored.set_default(processed=[])
         self.charm = charm
         self.this_unit = self.model.unit
         self.relation_name = relation_name
@@ -50,7 +148,7 @@ class CephClientProvides(Object):
             self._on_relation_changed
         )
 
-        self._stored.processed_map = {}
+        self.response_cache = BrokerResponseCache()
 
     def notify_all(self):
         send_osd_settings()
@@ -188,8 +286,10 @@ class CephClientProvides(Object):
             unit_id = settings.get(
                 'unit-name', unit.name).replace('/', '-')
             unit_response_key = 'broker-rsp-' + unit_id
-            prev_result = self._stored.processed_map.get(broker_req_id)
-            if prev_result is not None and not force:
+            prev_result = None
+            if not force:
+                prev_result = self.response_cache.get(broker_req_id, unit_id)
+            if prev_result is not None:
                 # The broker request has been processed already and we have
                 # stored the result. Log it so that the users may know and
                 # return the cached value, with the unit key.
@@ -206,7 +306,7 @@ class CephClientProvides(Object):
             response.update({unit_response_key: rsp})
             if add_legacy_response:
                 response.update({'broker_rsp': rsp})
-            self._stored.processed_map[broker_req_id] = rsp
+            self.response_cache.set(broker_req_id, unit_id, rsp)
         else:
             logger.warn('broker_req not in settings: {}'.format(settings))
         return response
@@ -652,7 +652,10 @@ def attempt_mon_cluster_bootstrap():
 
 
 def notify_relations(reprocess_broker_requests=False):
-    notify_osds(reprocess_broker_requests=reprocess_broker_requests)
+    # NOTE: the radosgw and rbd-mirror relations are updated right below,
+    #       no need for notify_osds to do it as well.
+    notify_osds(reprocess_broker_requests=reprocess_broker_requests,
+                notify_clients=False)
     notify_radosgws(reprocess_broker_requests=reprocess_broker_requests)
     notify_rbd_mirrors(reprocess_broker_requests=reprocess_broker_requests)
     notify_prometheus()
@@ -670,12 +673,45 @@ def notify_prometheus():
                                 module_enabled=module_enabled)
 
 
-def notify_osds(reprocess_broker_requests=False):
+def notify_osds(reprocess_broker_requests=False, notify_clients=True):
+    """Update the ``osd`` relations with all of the related units.
+
+    The data shared by every OSD unit is computed once, each relation is
+    written at most once with only the settings that changed, and whatever
+    depends on the presence of OSD units is refreshed once at the end rather
+    than once per OSD unit.
+
+    :param reprocess_broker_requests: Process broker requests even if they
+                                      have already been processed.
+    :type reprocess_broker_requests: bool
+    :param notify_clients: Whether the radosgw and rbd-mirror relations
+                           should be updated too.
+    :type notify_clients: bool
+    """
+    osd_units = {}
     for relid in relation_ids('osd'):
-        for unit in related_units(relid):
-            osd_relation(
-                relid=relid, unit=unit,
-                reprocess_broker_requests=reprocess_broker_requests)
+        units = related_units(relid)
+        if units:
+            osd_units[relid] = units
+    if not osd_units:
+        return
+    if not ceph.is_quorum():
+        log('mon cluster not in quorum - deferring fsid provision')
+        return
+
+    log('mon cluster in quorum - providing fsid & keys')
+    shared_data = get_osd_relation_data()
+    for relid, units in osd_units.items():
+        data = dict(shared_data)
+        for unit in units:
+            # NOTE: rbd-mirror relations are updated once all of the broker
+            #       requests have been handled.
+            data.update(handle_broker_request(
+                relid, unit, recurse=False,
+                force=reprocess_broker_requests))
+            set_osd_memory_target(relid, unit)
+        relation_set_changed(relid, data)
+    update_osd_dependents(notify_clients=notify_clients)
 
 
 def notify_radosgws(reprocess_broker_requests=False):
@@ -884,79 +920,129 @@ def handle_broker_request(relid, unit, add_legacy_response=False,
     return response
 
 
-@hooks.hook('osd-relation-joined')
-@hooks.hook('osd-relation-changed')
-def osd_relation(relid=None, unit=None, reprocess_broker_requests=False):
-    if ceph.is_quorum():
-        log('mon cluster in quorum - providing fsid & keys')
-        public_addr = get_public_addr()
-        data = {
-            'pending_key': '',
-            'fsid': leader_get('fsid'),
-            'osd_bootstrap_key': ceph.get_osd_bootstrap_key(),
-            'auth': 'cephx',
-            'ceph-public-address': public_addr,
-            'osd_upgrade_key': ceph.get_named_key('osd-upgrade',
-                                                  caps=ceph.osd_upgrade_caps),
-            'osd_disk_removal_key': ceph.get_named_key(
-                'osd-removal',
-                caps={
-                    'mgr': ['allow *'],
-                    'mon': [
-                        'allow r',
-                        'allow command "osd crush reweight"',
-                        'allow command "osd purge"',
-                        'allow command "osd destroy"',
-                    ]
-                }
-            ),
-            # Provide a key to the osd for use by the crash module:
-            # https://docs.ceph.com/en/latest/mgr/crash/
-            'client_crash_key': ceph.create_named_keyring(
-                'client',
-                'crash',
-                caps={
-                    'mon': ['profile crash'],
-                    'mgr': ['profile crash'],
-                }
-            )
-        }
+def relation_set_changed(relid, data):
+    """Publish the relation settings which differ from the current ones.
+
+    :param relid: Relation ID
+    :type relid: str
+    :param data: Desired relation settings of the local unit.
+    :type data: dict
+    :returns: Whether any setting had to be written.
+    :rtype: bool
+    """
+    def _value(value):
+        return '' if value is None else str(value)
+
+    current = relation_get(rid=relid, unit=local_unit()) or {}
+    changed = {key: value for key, value in data.items()
+               if _value(current.get(key)) != _value(value)}
+    if not changed:
+        return False
+    relation_set(relation_id=relid, relation_settings=changed)
+    return True
 
-        data.update(handle_broker_request(
-            relid, unit, force=reprocess_broker_requests))
-        relation_set(relation_id=relid,
-                     relation_settings=data)
 
-        if is_leader():
-            ceph_osd_releases = get_ceph_osd_releases()
-            if len(ceph_osd_releases) == 1:
-                execute_post_osd_upgrade_steps(ceph_osd_releases[0])
+def get_osd_relation_data():
+    """Relation settings shared by all units of the ``osd`` relations.
 
+    :returns: Dictionary of relation settings.
+    :rtype: dict
+    """
+    return {
+        'pending_key': '',
+        'fsid': leader_get('fsid'),
+        'osd_bootstrap_key': ceph.get_osd_bootstrap_key(),
+        'auth': 'cephx',
+        'ceph-public-address': get_public_addr(),
+        'osd_upgrade_key': ceph.get_named_key('osd-upgrade',
+                                              caps=ceph.osd_upgrade_caps),
+        'osd_disk_removal_key': ceph.get_named_key(
+            'osd-removal',
+            caps={
+                'mgr': ['allow *'],
+                'mon': [
+                    'allow r',
+                    'allow command "osd crush reweight"',
+                    'allow command "osd purge"',
+                    'allow command "osd destroy"',
+                ]
+            }
+        ),
+        # Provide a key to the osd for use by the crash module:
+        # https://docs.ceph.com/en/latest/mgr/crash/
+        'client_crash_key': ceph.create_named_keyring(
+            'client',
+            'crash',
+            caps={
+                'mon': ['profile crash'],
+                'mgr': ['profile crash'],
+            }
+        )
+    }
+
+
+def set_osd_memory_target(relid, unit):
+    """Apply the osd_memory_target requested by an OSD unit for its host.
+
+    :param relid: Relation ID
+    :type relid: str
+    :param unit: Remote unit name
+    :type unit: str
+    """
+    if not is_leader():
+        return
+    osd_host = relation_get(rid=relid, unit=unit, attribute='osd-host')
+    osd = f"osd/host:{osd_host}"
+    osd_memory_target = relation_get(
+        rid=relid, unit=unit, attribute='osd-memory-target'
+    )
+    if all([osd_host, osd_memory_target]):
+        ceph.ceph_config_set(
+            "osd_memory_target",
+            osd_memory_target,
+            osd,
+        )
+
+
+def update_osd_dependents(notify_clients=True):
+    """Refresh everything depending on the OSD units related to us.
+
+    :param notify_clients: Whether the radosgw and rbd-mirror relations
+                           should be updated too.
+    :type notify_clients: bool
+    """
+    if is_leader():
+        ceph_osd_releases = get_ceph_osd_releases()
+        if len(ceph_osd_releases) == 1:
+            execute_post_osd_upgrade_steps(ceph_osd_releases[0])
+
+    if notify_clients:
         # NOTE: radosgw key provision is gated on presence of OSD
         #       units so ensure that any deferred hooks are processed
         notify_radosgws()
         notify_rbd_mirrors()
-        send_osd_settings()
+    send_osd_settings()
 
-        for dashboard_relid in relation_ids('dashboard'):
-            dashboard_relation(dashboard_relid)
+    for dashboard_relid in relation_ids('dashboard'):
+        dashboard_relation(dashboard_relid)
 
-        if ready_for_service():
-            update_host_osd_count_report()
+    if ready_for_service():
+        update_host_osd_count_report()
 
-        if is_leader():
-            osd_host = relation_get(rid=relid, unit=unit, attribute='osd-host')
-            osd = f"osd/host:{osd_host}"
-            osd_memory_target = relation_get(
-                rid=relid, unit=unit, attribute='osd-memory-target'
-            )
-            if all([osd_host, osd_memory_target]):
-                ceph.ceph_config_set(
-                    "osd_memory_target",
-                    osd_memory_target,
-                    osd,
-                )
 
+@hooks.hook('osd-relation-joined')
+@hooks.hook('osd-relation-changed')
+def osd_relation(relid=None, unit=None, reprocess_broker_requests=False):
+    if ceph.is_quorum():
+        log('mon cluster in quorum - providing fsid & keys')
+        if not unit:
+            unit = remote_unit()
+        data = get_osd_relation_data()
+        data.update(handle_broker_request(
+            relid, unit, force=reprocess_broker_requests))
+        relation_set_changed(relid, data)
+        set_osd_memory_target(relid, unit)
+        update_osd_dependents()
     else:
         log('mon cluster not in quorum - deferring fsid provision')
 
@@ -23,6 +23,7 @@ import os
 import subprocess
 
 import charms.operator_libs_linux.v1.systemd as systemd
+import charms_ceph.utils as ceph_utils
 
 
 logger = logging.getLogger(__name__)
@@ -44,6 +45,7 @@ def _create_key(entity, event):
         cmd = ["sudo", "ceph", "auth", "get-or-create-pending",
                entity, "--format=json"]
         out = subprocess.check_output(cmd).decode("utf-8")
+        ceph_utils.flush_ceph_auth_cache()
         return json.loads(out)[0]["pending_key"]
     except (subprocess.SubprocessError, json.decoder.JSONDecodeError) as exc:
         logger.exception(exc)
@@ -14,9 +14,11 @@
 """Tests for reweight_osd action."""
 
 # import json
+import unittest
 import unittest.mock as mock
 from test_utils import CharmTestCase
 from ops.testing import Harness
+from charmhelpers.core import unitdata
 from manage_test_relations import (
     add_ceph_client_relation,
     add_ceph_mds_relation,
@@ -29,6 +31,8 @@ with mock.patch('charmhelpers.contrib.hardening.harden.harden') as mock_dec:
     # of the 'harden' decorator.
     from src.charm import CephMonCharm
 
+import ceph_client
+
 
 class CephClientTestCase(CharmTestCase):
     """Run tests for action."""
@@ -36,6 +40,10 @@ class CephClientTestCase(CharmTestCase):
     def setUp(self):
         self.harness = Harness(CephMonCharm)
         self.addCleanup(self.harness.cleanup)
+        kv = mock.patch("src.charm.ceph_client.kv",
+                        return_value=unitdata.Storage(':memory:'))
+        kv.start()
+        self.addCleanup(kv.stop)
 
     @mock.patch("src.charm.ceph_client.ceph.get_named_key")
     @mock.patch("src.charm.ceph_client.get_rbd_features")
@@ -154,3 +162,43 @@ class CephClientTestCase(CharmTestCase):
                 'rbd-features': '42',
             })
         self.assertEqual(self.harness.charm.mds._mds_name, "ceph-fs")
+
+
+class BrokerResponseCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.db = unitdata.Storage(':memory:')
+        self.cache = ceph_client.BrokerResponseCache(
+            db=self.db, max_entries=2, max_age=100)
+
+    @mock.patch.object(ceph_client.time, 'time')
+    def test_get_set(self, _time):
+        _time.return_value = 10
+        self.assertIsNone(self.cache.get('req', 'glance-0'))
+        self.cache.set('req', 'glance-0', 'AOK')
+        self.assertEqual(self.cache.get('req', 'glance-0'), 'AOK')
+        # Responses are cached per requesting unit.
+        self.assertIsNone(self.cache.get('req', 'glance-1'))
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 2))
+
+    @mock.patch.object(ceph_client.time, 'time')
+    def test_expired(self, _time):
+        _time.return_value = 10
+        self.cache.set('req', 'glance-0', 'AOK')
+        _time.return_value = 111
+        self.assertIsNone(self.cache.get('req', 'glance-0'))
+        self.assertEqual(self.db.getrange(self.cache.KEY_PREFIX), {})
+
+    @mock.patch.object(ceph_client.time, 'time')
+    def test_evict_least_recently_used(self, _time):
+        _time.return_value = 10
+        self.cache.set('req1', 'glance-0', 'AOK1')
+        _time.return_value = 11
+        self.cache.set('req2', 'glance-0', 'AOK2')
+        _time.return_value = 12
+        self.cache.get('req1', 'glance-0')
+        _time.return_value = 13
+        self.cache.set('req3', 'glance-0', 'AOK3')
+        self.assertEqual(self.cache.get('req1', 'glance-0'), 'AOK1')
+        self.assertIsNone(self.cache.get('req2', 'glance-0'))
+        self.assertEqual(self.cache.get('req3', 'glance-0'), 'AOK3')
@@ -522,6 +522,116 @@ class CephMonRelationTestCase(test_utils.CharmTestCase):
             'still waiting for leader to setup keys')
 
 
+class NotifyOSDsTestCase(test_utils.CharmTestCase):
+
+    TO_PATCH = [
+        'ceph',
+        'dashboard_relation',
+        'get_ceph_osd_releases',
+        'get_public_addr',
+        'handle_broker_request',
+        'is_leader',
+        'leader_get',
+        'local_unit',
+        'log',
+        'ready_for_service',
+        'related_units',
+        'relation_get',
+        'relation_ids',
+        'relation_set',
+        'radosgw_relation',
+        'rbd_mirror_relation',
+        'send_osd_settings',
+        'update_host_osd_count_report',
+    ]
+
+    def setUp(self):
+        super(NotifyOSDsTestCase, self).setUp(ceph_hooks, self.TO_PATCH)
+        self.relation_data = {}
+        self.ceph.is_quorum.return_value = True
+        self.ceph.get_osd_bootstrap_key.return_value = 'bootstrap-key'
+        self.ceph.get_named_key.side_effect = lambda name, caps: name
+        self.ceph.create_named_keyring.return_value = 'crash-key'
+        self.get_ceph_osd_releases.return_value = ['reef']
+        self.get_public_addr.return_value = '10.0.0.1'
+        self.handle_broker_request.return_value = {}
+        self.is_leader.return_value = False
+        self.leader_get.return_value = '1234'
+        self.local_unit.return_value = 'ceph-mon/0'
+        self.relation_get.side_effect = (
+            lambda rid, unit, attribute=None: self.relation_data.get(rid, {}))
+        self.relation_set.side_effect = (
+            lambda relation_id, relation_settings:
+                self.relation_data.setdefault(relation_id, {}).update(
+                    relation_settings))
+
+    def _relate(self, osd_units, rgw_units=12, rbd_mirror_units=2):
+        units = {
+            'osd:1': ['ceph-osd/{}'.format(i)
+                      for i in range(0, osd_units, 2)],
+            'osd:2': ['ceph-osd-ssd/{}'.format(i)
+                      for i in range(1, osd_units, 2)],
+            'radosgw:3': ['ceph-radosgw/{}'.format(i)
+                          for i in range(rgw_units)],
+            'rbd-mirror:4': ['ceph-rbd-mirror/{}'.format(i)
+                             for i in range(rbd_mirror_units)],
+        }
+        self.relation_ids.side_effect = lambda endpoint: [
+            relid for relid in units if relid.startswith(endpoint + ':')]
+        self.related_units.side_effect = units.get
+
+    def _external_calls(self):
+        return sum(
+            getattr(self, name).call_count for name in self.TO_PATCH
+            if name != 'ceph') + len(self.ceph.mock_calls)
+
+    def test_notify_osds(self):
+        self._relate(osd_units=300)
+        ceph_hooks.notify_osds()
+        self.ceph.get_osd_bootstrap_key.assert_called_once_with()
+        self.assertEqual(self.ceph.get_named_key.call_count, 2)
+        self.ceph.create_named_keyring.assert_called_once()
+        self.assertEqual(self.handle_broker_request.call_count, 300)
+        self.assertEqual(self.relation_set.call_count, 2)
+        self.assertEqual(self.relation_data['osd:1']['osd_upgrade_key'],
+                         'osd-upgrade')
+        self.assertEqual(self.radosgw_relation.call_count, 12)
+        self.assertEqual(self.rbd_mirror_relation.call_count, 2)
+        self.send_osd_settings.assert_called_once_with()
+
+        # Nothing changed, nothing is written.
+        self.relation_set.reset_mock()
+        self.handle_broker_request.side_effect = (
+            lambda relid, unit, **kwargs:
+                {'broker-rsp-ceph-osd-4': 'ok'} if unit == 'ceph-osd/4'
+                else {})
+        ceph_hooks.notify_osds(notify_clients=False)
+        self.relation_set.assert_called_once_with(
+            relation_id='osd:1',
+            relation_settings={'broker-rsp-ceph-osd-4': 'ok'})
+        self.assertEqual(self.radosgw_relation.call_count, 12)
+
+    def test_notify_osds_not_in_quorum(self):
+        self._relate(osd_units=3)
+        self.ceph.is_quorum.return_value = False
+        ceph_hooks.notify_osds()
+        self.relation_set.assert_not_called()
+        self.radosgw_relation.assert_not_called()
+
+    def test_notify_osds_scale(self):
+        # Benchmark, the work done has to grow linearly with the number of
+        # related units rather than with the product of OSD and client units.
+        calls = []
+        for osd_units in (30, 300):
+            self._relate(osd_units=osd_units, rgw_units=osd_units // 10)
+            for name in self.TO_PATCH:
+                getattr(self, name).reset_mock(
+                    return_value=False, side_effect=False)
+            ceph_hooks.notify_osds()
+            calls.append(self._external_calls())
+        self.assertLess(calls[1], calls[0] * 11)
+
+
 class RelatedUnitsTestCase(unittest.TestCase):
 
     _units = {
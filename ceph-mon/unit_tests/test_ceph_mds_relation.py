@@ -5,6 +5,7 @@ from unittest import mock
 from unittest.mock import patch
 import unittest
 from ops.testing import Harness
+from charmhelpers.core import unitdata
 
 import ceph_mds
 import charm
@@ -19,6 +20,10 @@ class TestCephShared(unittest.TestCase):
         super().setUp()
         self.harness = Harness(charm.CephMonCharm)
         self.addCleanup(self.harness.cleanup)
+        kv = mock.patch("ceph_client.kv",
+                        return_value=unitdata.Storage(":memory:"))
+        kv.start()
+        self.addCleanup(kv.stop)
 
     def test_init(self, _hooks):
         self.harness.begin()
@@ -67,14 +67,14 @@ class TestCephOps(unittest.TestCase):
         self.assertEqual(json.loads(rc), {'exit-code': 0})
 
     @patch('charmhelpers.contrib.storage.linux.ceph.cmp_pkgrevno')
-    @patch.object(broker, 'pool_exists')
+    @patch.object(broker, 'ceph_check_output')
     @patch.object(broker.ReplicatedPool, 'create')
     @patch.object(broker, 'log', lambda *args, **kwargs: None)
     def test_process_requests_create_replicated_pool(self,
                                                      mock_replicated_pool,
-                                                     mock_pool_exists,
+                                                     mock_check_output,
                                                      mock_cmp_pkgrevno):
-        mock_pool_exists.return_value = False
+        mock_check_output.return_value = b'{"osds": [], "pools": []}'
         mock_cmp_pkgrevno.return_value = 1
         reqs = json.dumps({'api-version': 1,
                            'ops': [{
@@ -83,20 +83,24 @@ class TestCephOps(unittest.TestCase):
                                'replicas': 3
                            }]})
         rc = broker.process_requests(reqs)
-        mock_pool_exists.assert_called_with(service='admin', name='foo')
+        mock_check_output.assert_called_once_with(
+            {'prefix': 'osd dump', 'format': 'json'}, service='admin')
         mock_replicated_pool.assert_called_with()
         self.assertEqual(json.loads(rc), {'exit-code': 0})
 
     @patch('charmhelpers.contrib.storage.linux.ceph.cmp_pkgrevno')
-    @patch.object(broker, 'pool_exists')
+    @patch.object(broker, 'ceph_check_output')
     @patch.object(broker.ErasurePool, 'create')
-    @patch.object(broker, 'erasure_profile_exists')
     @patch.object(broker, 'log', lambda *args, **kwargs: None)
-    def test_process_requests_create_erasure_pool(self, mock_profile_exists,
-                                                  mock_erasure_pool,
-                                                  mock_pool_exists,
+    def test_process_requests_create_erasure_pool(self, mock_erasure_pool,
+                                                  mock_check_output,
                                                   mock_cmp_pkgrevno):
-        mock_pool_exists.return_value = False
+        def _check_output(command, service):
+            if command['prefix'] == 'osd erasure-code-profile ls':
+                return b'["default"]'
+            return b'{"osds": [], "pools": []}'
+
+        mock_check_output.side_effect = _check_output
         mock_cmp_pkgrevno.return_value = 1
         reqs = json.dumps({'api-version': 1,
                            'ops': [{
@@ -106,8 +110,9 @@ class TestCephOps(unittest.TestCase):
                                'erasure-profile': 'default'
                            }]})
         rc = broker.process_requests(reqs)
-        mock_profile_exists.assert_called_with(service='admin', name='default')
-        mock_pool_exists.assert_called_with(service='admin', name='foo')
+        mock_check_output.assert_any_call(
+            {'prefix': 'osd erasure-code-profile ls', 'format': 'json'},
+            service='admin')
         mock_erasure_pool.assert_called_with()
         self.assertEqual(json.loads(rc), {'exit-code': 0})
 
@@ -13,6 +13,7 @@ develop a new k8s charm using the Operator Framework:
 """
 
 import ipaddress
+import json
 import logging
 import os
 from pathlib import Path
@@ -43,6 +44,50 @@ import charms_ceph.selog as selog
 
 logger = logging.getLogger(__name__)
 
+ALLOWED_SQUASH_ACCESS = {"root", "root_squash", "rootsquash", "rootid",
+                         "root_id_squash", "rootidsquash", "all",
+                         "all_squash", "allsquash", "all_anomnymous",
+                         "allanonymous", "no_root_squash", "none",
+                         "noidsquash"}
+
+BULK_SHARE_OPS = ("create", "grant", "revoke")
+
+
+def _share_spec_error(spec):
+    """Check a share change of the bulk-shares action.
+
+    :returns: Why the change is invalid, or None if it is valid.
+    :rtype: Optional[str]
+    """
+    if not isinstance(spec, dict):
+        return "expected an object"
+    op = spec.get('op')
+    if op not in BULK_SHARE_OPS:
+        return f"unknown op: {op}"
+    name = spec.get('name')
+    if name is not None and not isinstance(name, str):
+        return "name must be a string"
+    if op == 'create':
+        size = spec.get('size')
+        if size is not None and (isinstance(size, bool) or
+                                 not isinstance(size, int)):
+            return "size must be an integer"
+        squash_access = spec.get('squash-access')
+        if squash_access is not None and not isinstance(squash_access, str):
+            return "squash-access must be a string"
+        if (squash_access and
+                squash_access.lower() not in ALLOWED_SQUASH_ACCESS):
+            return f"invalid squash-access value: {squash_access}"
+        ips = spec.get('allowed-ips')
+        if ips is not None and not isinstance(ips, (str, list)):
+            return "allowed-ips must be a string or a list"
+    else:
+        if not name:
+            return f"{op} needs the name of the share"
+        if not spec.get('client') or not isinstance(spec['client'], str):
+            return f"{op} needs a client"
+    return None
+
 
 class CephClientAdapter(ops_openstack.adapters.OpenStackOperRelationAdapter):
     """Adapter for ceph client interface."""
@@ -216,6 +261,7 @@ class CephNFSCharm(
             is_started=False,
             is_cluster_setup=False
         )
+        self._ganesha_client = None
         self.ceph_client = ceph_client.CephClientRequires(
             self,
             'ceph-client')
@@ -259,6 +305,9 @@ class CephNFSCharm(
         self.framework.observe(
             self.on.create_share_action,
             self.create_share_action)
+        self.framework.observe(
+            self.on.bulk_shares_action,
+            self.bulk_shares_action)
         self.framework.observe(
             self.on.list_shares_action,
             self.list_shares_action)
@@ -306,7 +355,11 @@ class CephNFSCharm(
 
     @property
     def ganesha_client(self):
-        return GaneshaNFS(self.client_name, self.pool_name)
+        # One client per hook, so that its export index is read only once.
+        if self._ganesha_client is None:
+            self._ganesha_client = GaneshaNFS(self.client_name,
+                                              self.pool_name)
+        return self._ganesha_client
 
     def request_ceph_pool(self, event):
         """Request pools from Ceph cluster."""
@@ -485,13 +538,7 @@ class CephNFSCharm(
         allowed_ips = event.params.get('allowed-ips')
         allowed_ips = [ip.strip() for ip in allowed_ips.split(',')]
         squash_access = event.params.get('squash-access') or "none"
-        allowed_squash_access = {"root", "root_squash", "rootsquash", "rootid",
-                                 "root_id_squash", "rootidsquash", "all",
-                                 "all_squash", "allsquash", "all_anomnymous",
-                                 "allanonymous", "no_root_squash", "none",
-                                 "noidsquash"}
-        squash_access_norm = squash_access.lower()
-        if squash_access_norm not in allowed_squash_access:
+        if squash_access.lower() not in ALLOWED_SQUASH_ACCESS:
             event.fail(f"Invalid squash-access value: {squash_access}")
             return
         export_path = self.ganesha_client.create_share(
@@ -507,6 +554,46 @@ class CephNFSCharm(
             "path": export_path,
             "ip": self.access_address()})
 
+    def bulk_shares_action(self, event):
+        if not self.model.unit.is_leader():
+            event.fail("Share changes need to be run "
+                       "from the application leader")
+            return
+        try:
+            specs = json.loads(event.params.get('shares'))
+        except ValueError as e:
+            event.fail(f"Invalid shares: {e}")
+            return
+        if not isinstance(specs, list):
+            event.fail("Invalid shares: expected a list")
+            return
+        # Nothing is applied unless all the changes are valid.
+        for index, spec in enumerate(specs):
+            error = _share_spec_error(spec)
+            if error is not None:
+                event.fail(f"Invalid shares: change {index}: {error}")
+                return
+        for spec in specs:
+            ips = spec.get('allowed-ips')
+            if isinstance(ips, str):
+                spec['allowed-ips'] = [ip.strip() for ip in ips.split(',')]
+        selog.log('Changing shares in bulk',
+                  event='authn_nfs_share',
+                  detail='nfs_share_bulk')
+        results = self.ganesha_client.bulk_update(specs)
+        # Ganesha reads all the exports again on reload, so it's reloaded
+        # once instead of being told about each of them.
+        self.peers.trigger_reload()
+        failed = [r for r in results if 'error' in r]
+        event.set_results({
+            "message": f"{len(results) - len(failed)} of {len(results)} "
+                       "share changes applied",
+            "results": {str(index): result
+                        for index, result in enumerate(results)},
+            "ip": self.access_address()})
+        if failed:
+            event.fail(f"{len(failed)} share changes failed")
+
     def list_shares_action(self, event):
         exports = self.ganesha_client.list_shares()
         event.set_results({
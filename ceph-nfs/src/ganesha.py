@@ -5,17 +5,28 @@
 import json
 import logging
 import manager
+import re
 import subprocess
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Set
 import tempfile
 import uuid
 
+try:
+    import rados
+except ImportError:
+    rados = None
+
 logger = logging.getLogger(__name__)
 
 
 # TODO: Add ACL with kerberos
 
 
+class CephCommandError(Exception):
+    """A command sent through the cluster connection failed."""
+    pass
+
+
 class Export(object):
     """Object that encodes and decodes Ganesha export blocks"""
 
@@ -100,6 +111,302 @@ class Export(object):
                     {'Access_Type': mode, 'Clients': ', '.join(clients)})
 
 
+class ExportStore(object):
+    """Keeps the metadata of every export in the omap of the index object.
+
+    Ganesha reads the data of the index object, which holds the URL of
+    each export object. The omap of the index object holds the options of
+    every export as JSON, keyed by share name, so a share can be looked up
+    with a single RADOS operation. The whole index is read at most once,
+    and is then cached.
+    """
+
+    # Omap keys of the exports are prefixed, to keep them apart from the
+    # version key.
+    share_prefix = 'share.'
+    version_key = 'version'
+    epoch_key = 'epoch'
+    version = 1
+    page_size = 1024
+    max_attempts = 100
+
+    def __init__(self, ioctx, pool: str, index: str):
+        self.ioctx = ioctx
+        self.pool = pool
+        self.index = index
+        self._exports = None
+
+    @staticmethod
+    def object_name(export_id: int) -> str:
+        return 'ganesha-export-{}'.format(export_id)
+
+    def url(self, export_id: int) -> str:
+        return '%url rados://{}/{}'.format(self.pool,
+                                           self.object_name(export_id))
+
+    def _read(self, name: str) -> bytes:
+        size, _ = self.ioctx.stat(name)
+        if not size:
+            return b''
+        return self.ioctx.read(name, length=size)
+
+    def read_object(self, name: str) -> str:
+        """Read the whole content of a RADOS object."""
+        return self._read(name).decode('utf-8')
+
+    def allocate_id(self, counter: str, count: int = 1) -> int:
+        """Allocate IDs out of a counter object.
+
+        The counter is incremented with a compare-and-swap on the version
+        of the object, so concurrent allocations never get the same ID.
+
+        :param counter: Name of the counter object
+        :param count: Number of consecutive IDs to allocate
+        :returns: The first allocated ID
+        :rtype: int
+        """
+        for _ in range(self.max_attempts):
+            next_id = int(self.read_object(counter))
+            version = self.ioctx.get_last_version()
+            op = self.ioctx.create_write_op()
+            try:
+                op.assert_version(version)
+                op.write_full(str(next_id + count).encode('utf-8'))
+                self.ioctx.operate_write_op(op, counter)
+                return next_id
+            except rados.OSError:
+                logging.debug("Export ID {} taken, retrying".format(next_id))
+            finally:
+                op.release()
+        raise RuntimeError('Failed to allocate an export ID')
+
+    def _get_omap(self, keys: List[str]) -> Dict[str, str]:
+        op = self.ioctx.create_read_op()
+        try:
+            it, _ = self.ioctx.get_omap_vals_by_keys(op, tuple(keys))
+            self.ioctx.operate_read_op(op, self.index)
+            return {k: v.decode('utf-8') for k, v in it}
+        finally:
+            op.release()
+
+    def _list_omap(self) -> Dict[str, str]:
+        ret, start = {}, ''
+        while True:
+            op = self.ioctx.create_read_op()
+            try:
+                it, _ = self.ioctx.get_omap_vals(op, start, '',
+                                                 self.page_size)
+                self.ioctx.operate_read_op(op, self.index)
+                page = [(k, v.decode('utf-8')) for k, v in it]
+            finally:
+                op.release()
+
+            ret.update(page)
+            if len(page) < self.page_size:
+                return ret
+            start = page[-1][0]
+
+    def _set_omap(self, values: Dict[str, str]):
+        op = self.ioctx.create_write_op()
+        try:
+            self.ioctx.set_omap(op, tuple(values), tuple(values.values()))
+            self.ioctx.operate_write_op(op, self.index)
+        finally:
+            op.release()
+
+    def _migrate(self):
+        """Build the omap from the export objects listed in the index."""
+        logging.info("Building the export metadata of the index")
+        values = {self.version_key: str(self.version)}
+        for url in self.read_object(self.index).splitlines():
+            url = url.replace('%url rados://{}/'.format(self.pool), '')
+            if not url.strip():
+                continue
+            try:
+                export = Export.from_export(self.read_object(url.strip()))
+            except RuntimeError:
+                logging.warning("Encountered an independently created export")
+                continue
+            values[self.share_prefix + export.name] = json.dumps(
+                export.export_options)
+        self._set_omap(values)
+        return values
+
+    def list(self) -> List['Export']:
+        if self._exports is None:
+            values = self._list_omap()
+            if self.version_key not in values:
+                values = self._migrate()
+            self._exports = {
+                key[len(self.share_prefix):]: Export(json.loads(value))
+                for key, value in values.items()
+                if key.startswith(self.share_prefix)}
+        return list(self._exports.values())
+
+    def get(self, name: str) -> Optional['Export']:
+        if self._exports is None:
+            key = self.share_prefix + name
+            values = self._get_omap([key, self.version_key])
+            if self.version_key not in values:
+                # The index predates the omap, and has to be built first.
+                self.list()
+            elif key not in values:
+                return None
+            else:
+                return Export(json.loads(values[key]))
+        return self._exports.get(name)
+
+    def put(self, export: 'Export', new: bool = False) -> bool:
+        """Write an export object, and its metadata in the index.
+
+        New exports are added to the index with a single atomic operation,
+        which fails if a share with the same name was added meanwhile.
+
+        :param export: The export to write
+        :param new: Whether the export has to be added to the index
+        :returns: Whether the export was written
+        :rtype: bool
+        """
+        key = self.share_prefix + export.name
+        name = self.object_name(export.export_id)
+        self.ioctx.write_full(name, export.to_export().encode('utf-8'))
+        op = self.ioctx.create_write_op()
+        try:
+            if new:
+                op.omap_cmp(key, '', rados.LIBRADOS_CMPXATTR_OP_EQ)
+                op.append(('\n' + self.url(export.export_id)).encode('utf-8'))
+            self.ioctx.set_omap(op, (key,),
+                                (json.dumps(export.export_options),))
+            self.ioctx.operate_write_op(op, self.index)
+        except rados.OSError:
+            if not new:
+                raise
+            logging.warning("Share {} was created concurrently"
+                            .format(export.name))
+            self.ioctx.remove_object(name)
+            return False
+        finally:
+            op.release()
+        if self._exports is not None:
+            self._exports[export.name] = export
+        return True
+
+    def put_many(self, exports: List['Export'],
+                 new: Set[str] = frozenset()) -> List[bool]:
+        """Write several export objects, and their metadata in the index.
+
+        The export objects are written concurrently, and the index with a
+        single operation. If any of the new exports was created meanwhile,
+        the exports are written one by one instead.
+
+        :param exports: The exports to write
+        :param new: Names of the exports that have to be added to the index
+        :returns: Whether each export was written
+        :rtype: List[bool]
+        """
+        if not exports:
+            return []
+        completions = [
+            (self.ioctx.aio_write_full(self.object_name(export.export_id),
+                                       export.to_export().encode('utf-8')),
+             export)
+            for export in exports]
+        for completion, export in completions:
+            completion.wait_for_complete()
+            if completion.get_return_value() < 0:
+                raise RuntimeError('Failed to write export {}'
+                                   .format(export.export_id))
+
+        keys = [self.share_prefix + export.name for export in exports]
+        op = self.ioctx.create_write_op()
+        try:
+            urls = []
+            for key, export in zip(keys, exports):
+                if export.name in new:
+                    op.omap_cmp(key, '', rados.LIBRADOS_CMPXATTR_OP_EQ)
+                    urls.append('\n' + self.url(export.export_id))
+            if urls:
+                op.append(''.join(urls).encode('utf-8'))
+            self.ioctx.set_omap(op, tuple(keys), tuple(
+                json.dumps(export.export_options) for export in exports))
+            self.ioctx.operate_write_op(op, self.index)
+        except rados.OSError:
+            if not new:
+                raise
+            logging.warning("Shares were created concurrently, writing "
+                            "the exports one by one")
+            return [self.put(export, new=export.name in new)
+                    for export in exports]
+        finally:
+            op.release()
+        if self._exports is not None:
+            self._exports.update(
+                (export.name, export) for export in exports)
+        return [True] * len(exports)
+
+    def remove(self, export: 'Export'):
+        """Remove an export object, and its metadata from the index.
+
+        The URL of the export is blanked out in place in the index data.
+        Offsets in the index only change when it's compacted, which bumps
+        the index epoch, so removals only conflict with compactions.
+        """
+        url = self.url(export.export_id).encode('utf-8')
+        for _ in range(self.max_attempts):
+            epoch = self._get_omap([self.epoch_key]).get(self.epoch_key, '')
+            data = self._read(self.index)
+            match = re.search(b'^' + re.escape(url) + b'$', data,
+                              re.MULTILINE)
+            op = self.ioctx.create_write_op()
+            try:
+                op.omap_cmp(self.epoch_key, epoch,
+                            rados.LIBRADOS_CMPXATTR_OP_EQ)
+                self.ioctx.remove_omap_keys(
+                    op, (self.share_prefix + export.name,))
+                if match is not None:
+                    op.write(b' ' * len(url), match.start())
+                self.ioctx.operate_write_op(op, self.index)
+                break
+            except rados.OSError:
+                logging.debug("Index compacted, retrying")
+            finally:
+                op.release()
+        else:
+            raise RuntimeError('Failed to remove export from index')
+
+        try:
+            self.ioctx.remove_object(self.object_name(export.export_id))
+        except rados.ObjectNotFound:
+            pass
+        if self._exports is not None:
+            self._exports.pop(export.name, None)
+        # Compact the index once it's mostly blanks.
+        blank = sum(len(line) for line in data.split(b'\n')
+                    if not line.strip())
+        if blank + len(url) > len(data) // 2:
+            self._compact()
+
+    def _compact(self):
+        """Drop the blanked out URLs from the index data."""
+        epoch = self._get_omap([self.epoch_key]).get(self.epoch_key, '')
+        data = self._read(self.index)
+        version = self.ioctx.get_last_version()
+        op = self.ioctx.create_write_op()
+        try:
+            op.omap_cmp(self.epoch_key, epoch, rados.LIBRADOS_CMPXATTR_OP_EQ)
+            op.assert_version(version)
+            op.write_full(b'\n'.join(line for line in data.split(b'\n')
+                                     if line.strip()))
+            self.ioctx.set_omap(op, (self.epoch_key,),
+                                (str(int(epoch or 0) + 1),))
+            self.ioctx.operate_write_op(op, self.index)
+        except rados.OSError:
+            # The index changed meanwhile; compact it some other time.
+            pass
+        finally:
+            op.release()
+
+
 class GaneshaNFS(object):
     export_index = "ganesha-export-index"
     export_counter = "ganesha-export-counter"
@@ -107,6 +414,34 @@ class GaneshaNFS(object):
     def __init__(self, client_name, ceph_pool):
         self.client_name = client_name
         self.ceph_pool = ceph_pool
+        self._cluster = None
+        self._store = None
+
+    def _connect(self) -> 'rados.Rados':
+        """Connect to the cluster and open the export store, once.
+
+        :returns: The cluster connection
+        :rtype: rados.Rados
+        """
+        if self._store is None:
+            cluster = rados.Rados(rados_id=self.client_name,
+                                  conffile='/etc/ceph/ceph.conf')
+            cluster.connect()
+            try:
+                ioctx = cluster.open_ioctx(self.ceph_pool)
+            except Exception:
+                cluster.shutdown()
+                raise
+            self._cluster = cluster
+            self._store = ExportStore(ioctx, self.ceph_pool,
+                                      self.export_index)
+        return self._cluster
+
+    @property
+    def store(self) -> ExportStore:
+        """The export store, connecting to the cluster on first use."""
+        self._connect()
+        return self._store
 
     def create_share(self, name: str = None, size: int = None,
                      access_ips: List[str] = None,
@@ -121,37 +456,52 @@ class GaneshaNFS(object):
         if name is None:
             name = str(uuid.uuid4())
         else:
-            existing_shares = [
-                share for share in self.list_shares() if share.name == name
-            ]
-            if existing_shares:
-                return existing_shares[0].path
+            existing_share = self.get_share(name)
+            if existing_share is not None:
+                return existing_share.path
+        size_in_bytes = None
         if size is not None:
             size_in_bytes = size * 1024 * 1024 * 1024
+
+        try:
+            path = self._create_subvolume(name, size_in_bytes)
+            secret = self._auth_key('ganesha-{}'.format(name))
+        except CephCommandError as e:
+            logging.error("Failed to create share {}: {}".format(name, e))
+            return
+        self.export_path = path
+        export = self._new_export(
+            self._get_next_export_id(), name, path, secret, access_ips,
+            squash_access)
+        export_template = export.to_export()
+        logging.debug("Export template::\n{}".format(export_template))
+        tmp_file = self._tmpfile(export_template)
+        if not self.store.put(export, new=True):
+            return self.get_share(name).path
+        self._ganesha_add_export(self.export_path, tmp_file.name)
+        return self.export_path
+
+    def _new_export(self, export_id: int, name: str, path: str, secret: str,
+                    access_ips: List[str] = None,
+                    squash_access: str = 'None') -> Export:
+        """Build the export of a CephFS share."""
         if access_ips is None:
             access_ips = ['0.0.0.0']
         # Ganesha deals with networks just fine, except when the network is
         # 0.0.0.0/0, then it has to be 0.0.0.0 which works as expected :-/
         if '0.0.0.0/0' in access_ips:
             access_ips[access_ips.index('0.0.0.0/0')] = '0.0.0.0'
-
-        access_id = 'ganesha-{}'.format(name)
-        path = self._create_cephfs_share(name, size_in_bytes)
-        if not path:
-            return
-        self.export_path = path
-        export_id = self._get_next_export_id()
-        export = Export(
+        return Export(
             {
                 'EXPORT': {
                     'Export_Id': export_id,
-                    'Path': self.export_path,
+                    'Path': path,
                     'FSAL': {
                         'Name': 'Ceph',
-                        'User_Id': access_id,
-                        'Secret_Access_Key': self._ceph_auth_key(access_id)
+                        'User_Id': 'ganesha-{}'.format(name),
+                        'Secret_Access_Key': secret
                     },
-                    'Pseudo': self.export_path,
+                    'Pseudo': path,
                     'Squash': squash_access,
                     'CLIENT': [
                         {
@@ -162,31 +512,95 @@ class GaneshaNFS(object):
                 }
             }
         )
-        export_template = export.to_export()
-        logging.debug("Export template::\n{}".format(export_template))
-        tmp_file = self._tmpfile(export_template)
-        self._rados_put('ganesha-export-{}'.format(export_id), tmp_file.name)
-        self._ganesha_add_export(self.export_path, tmp_file.name)
-        self._add_share_to_index(export_id)
-        return self.export_path
 
-    def list_shares(self) -> List[Export]:
-        share_urls = [
-            url.replace('%url rados://{}/'.format(self.ceph_pool), '')
-            for url
-            in self._rados_get('ganesha-export-index').splitlines()]
-        exports_raw = [
-            self._rados_get(url)
-            for url in share_urls
-            if url.strip()
-        ]
-        exports = []
-        for export_raw in exports_raw:
+    def bulk_update(self, specs: List[Dict]) -> List[Dict]:
+        """Create shares, and grant or revoke access to them, in bulk.
+
+        The CephFS commands are sent through the cluster connection of the
+        export store, instead of forking the ceph CLI for each of them, and
+        all the exports are written with a single operation on the index.
+        Ganesha isn't told about each export, it has to be reloaded once
+        afterwards.
+
+        Creations are applied first, so access can be granted to a share
+        created by the same request.
+
+        :param specs: Dicts with the 'op' (create, grant or revoke) and
+                      the 'name' of the share, plus 'size', 'allowed-ips'
+                      and 'squash-access' for creations, or 'client' for
+                      access changes
+        :returns: The result of each spec, with an 'error' if it failed
+        :rtype: List[Dict]
+        """
+        results = [{'name': spec.get('name'), 'op': spec.get('op')}
+                   for spec in specs]
+        created, pending = [], {}
+        for result, spec in zip(results, specs):
+            if spec.get('op') != 'create':
+                continue
+            name = spec.get('name') or str(uuid.uuid4())
+            result['name'] = name
+            existing = self.get_share(name)
+            if existing is not None or any(name == c[1] for c in created):
+                result['message'] = 'Share exists'
+                continue
+            size = spec.get('size')
             try:
-                exports.append(Export.from_export(export_raw))
-            except RuntimeError:
-                logging.warning("Encountered an independently created export")
-        return exports
+                path = self._create_subvolume(
+                    name, size and size * 1024 * 1024 * 1024)
+                secret = self._auth_key('ganesha-{}'.format(name))
+            except CephCommandError as e:
+                logging.error("Failed to create share {}: {}".format(name, e))
+                result['error'] = str(e)
+                continue
+            created.append((result, name, path, secret, spec))
+
+        if created:
+            first_id = self.store.allocate_id(self.export_counter,
+                                              count=len(created))
+            for export_id, (result, name, path, secret, spec) in enumerate(
+                    created, first_id):
+                pending[name] = self._new_export(
+                    export_id, name, path, secret, spec.get('allowed-ips'),
+                    spec.get('squash-access') or 'None')
+
+        for result, spec in zip(results, specs):
+            op, name = spec.get('op'), spec.get('name')
+            if op == 'create':
+                continue
+            if op not in ('grant', 'revoke'):
+                result['error'] = 'Unknown operation {}'.format(op)
+                continue
+            share = pending.get(name) or self.get_share(name)
+            if share is None:
+                result['error'] = 'Share does not exist'
+                continue
+            if op == 'grant':
+                share.add_client(spec.get('client'))
+            else:
+                share.remove_client(spec.get('client'))
+            pending[name] = share
+
+        exports = list(pending.values())
+        new = {name for _, name, _, _, _ in created}
+        written = self.store.put_many(exports, new=new)
+        lost = {export.name for export, ok in zip(exports, written) if not ok}
+        for result in results:
+            if 'error' in result or 'message' in result:
+                continue
+            if result['name'] not in lost:
+                result['message'] = 'Done'
+            elif result['op'] == 'create':
+                result['message'] = 'Share exists'
+            else:
+                result['error'] = 'Share was created concurrently'
+        for result in results:
+            if result['op'] == 'create' and 'error' not in result:
+                result['path'] = self.get_share(result['name']).path
+        return results
+
+    def list_shares(self) -> List[Export]:
+        return self.store.list()
 
     def resize_share(self, name: str, size: int):
         size_in_bytes = size * 1024 * 1024 * 1024
@@ -194,18 +608,14 @@ class GaneshaNFS(object):
                                      str(size_in_bytes), '--no_shrink')
 
     def delete_share(self, name: str, purge=False):
-        share = [share for share in self.list_shares() if share.name == name]
-        if share:
-            share = share[0]
-        else:
+        share = self.get_share(name)
+        if share is None:
             return
         logging.info("About to remove export {} ({})"
                      .format(share.name, share.export_id))
         self._ganesha_remove_export(share.export_id)
-        logging.debug("Removing export from index")
-        self._remove_share_from_index(share.export_id)
-        logging.debug("Removing export file from RADOS")
-        self._rados_rm('ganesha-export-{}'.format(share.export_id))
+        logging.debug("Removing export from index and RADOS")
+        self.store.remove(share)
         if purge:
             self._delete_cephfs_share(name)
 
@@ -217,8 +627,7 @@ class GaneshaNFS(object):
         export_template = share.to_export()
         logging.debug("Export template::\n{}".format(export_template))
         tmp_file = self._tmpfile(export_template)
-        self._rados_put('ganesha-export-{}'.format(share.export_id),
-                        tmp_file.name)
+        self.store.put(share)
         self._ganesha_update_export(share.export_id, tmp_file.name)
 
     def revoke_access(self, name: str, client: str):
@@ -229,14 +638,11 @@ class GaneshaNFS(object):
         export_template = share.to_export()
         logging.debug("Export template::\n{}".format(export_template))
         tmp_file = self._tmpfile(export_template)
-        self._rados_put('ganesha-export-{}'.format(share.export_id),
-                        tmp_file.name)
+        self.store.put(share)
         self._ganesha_update_export(share.export_id, tmp_file.name)
 
     def get_share(self, name: str) -> Optional[Export]:
-        share = [share for share in self.list_shares() if share.name == name]
-        if share:
-            return share[0]
+        return self.store.get(name)
 
     def update_share(self, id):
         pass
@@ -282,39 +688,41 @@ class GaneshaNFS(object):
             'ganesha-{name}'.format(name=name))
         self._ceph_subvolume_command('rm', 'ceph-fs', name)
 
-    def _create_cephfs_share(self, name: str, size_in_bytes: int = None):
-        """Create an authorise a CephFS share.
-
-        :param name: String name of the share to create
-        :param size_in_bytes: Integer size in bytes of the size to create
+    def _create_subvolume(self, name: str, size_in_bytes: int = None) -> str:
+        """Create and authorise a CephFS share through the cluster connection.
 
         :returns: export path
-        :rtype: union[str, bool]
+        :rtype: str
+        :raises: CephCommandError
         """
-        try:
-            if size_in_bytes is not None:
-                self._ceph_subvolume_command('create', 'ceph-fs',
-                                             name, str(size_in_bytes))
-            else:
-                self._ceph_subvolume_command('create', 'ceph-fs', name)
-        except subprocess.CalledProcessError:
-            logging.error("failed to create subvolume")
-            return False
-
-        try:
-            self._ceph_subvolume_command(
-                'authorize', 'ceph-fs', name,
-                'ganesha-{name}'.format(name=name))
-        except subprocess.CalledProcessError:
-            logging.error("failed to authorize subvolume")
-            return False
-
-        try:
-            output = self._ceph_subvolume_command('getpath', 'ceph-fs', name)
-            return output.decode('utf-8').strip()
-        except subprocess.CalledProcessError:
-            logging.error("failed to get path")
-            return False
+        kwargs = {'vol_name': 'ceph-fs', 'sub_name': name}
+        if size_in_bytes is not None:
+            kwargs['size'] = size_in_bytes
+        self._cluster_command('mgr', 'fs subvolume create', **kwargs)
+        self._cluster_command('mgr', 'fs subvolume authorize',
+                              auth_id='ganesha-{}'.format(name),
+                              vol_name='ceph-fs', sub_name=name)
+        output = self._cluster_command('mgr', 'fs subvolume getpath',
+                                       vol_name='ceph-fs', sub_name=name)
+        return output.decode('utf-8').strip()
+
+    def _cluster_command(self, target: str, prefix: str, **kwargs) -> bytes:
+        """Run a mon or mgr command through the connection of the store.
+
+        :param target: 'mon' or 'mgr'
+        :param prefix: The command, e.g. 'fs subvolume create'
+        :returns: The output of the command
+        :rtype: bytes
+        :raises: CephCommandError
+        """
+        cluster = self._connect()
+        send = {'mon': cluster.mon_command,
+                'mgr': cluster.mgr_command}[target]
+        ret, output, status = send(json.dumps(dict(prefix=prefix, **kwargs)),
+                                   b'')
+        if ret != 0:
+            raise CephCommandError('{} failed: {}'.format(prefix, status))
+        return output
 
     def _ceph_subvolume_command(
         self, *cmd: List[str]
@@ -326,14 +734,16 @@ class GaneshaNFS(object):
         """Run a ceph fs command"""
         return self._ceph_command('fs', *cmd)
 
-    def _ceph_auth_key(self, access_id: str) -> str:
+    def _auth_key(self, access_id: str) -> str:
         """Retrieve the CephX key associated with this id
 
         :returns: The access key
         :rtype: str
+        :raises: CephCommandError
         """
-        output = self._ceph_command(
-            'auth', 'get', 'client.{}'.format(access_id), '--format=json')
+        output = self._cluster_command(
+            'mon', 'auth get', entity='client.{}'.format(access_id),
+            format='json')
         return json.loads(output.decode('UTF-8'))[0]['key']
 
     def _ceph_command(self, *cmd: List[str]) -> subprocess.CompletedProcess:
@@ -345,93 +755,15 @@ class GaneshaNFS(object):
         return subprocess.check_output(cmd, stderr=subprocess.DEVNULL)
 
     def _get_next_export_id(self) -> int:
-        """Retrieve the next available export ID, and update the rados key
+        """Allocate the next available export ID
 
         :returns: The export ID
-        :rtype: str
+        :rtype: int
         """
-        next_id = int(self._rados_get(self.export_counter))
-        file = self._tmpfile(next_id + 1)
-        self._rados_put(self.export_counter, file.name)
-        return next_id
+        return self.store.allocate_id(self.export_counter)
 
     def _tmpfile(self, value: str) -> tempfile._TemporaryFileWrapper:
         file = tempfile.NamedTemporaryFile(mode='w+')
         file.write(str(value))
         file.seek(0)
         return file
-
-    def _rados_get(self, name: str) -> str:
-        """Retrieve the content of the RADOS object with a given name
-
-        :param name: Name of the RADOS object to retrieve
-
-        :returns: Contents of the RADOS object
-        :rtype: str
-        """
-        cmd = [
-            'rados', '-p', self.ceph_pool, '--id', self.client_name,
-            'get', name, '/dev/stdout'
-        ]
-        logging.debug("About to call: {}".format(cmd))
-        output = subprocess.check_output(cmd)
-        return output.decode('utf-8')
-
-    def _rados_put(self, name: str, source: str):
-        """Store the contents of the source file in a named RADOS object.
-
-        :param name: Name of the RADOS object to retrieve
-        :param source: Path to a file to upload to RADOS.
-
-        :returns: None
-        """
-        cmd = [
-            'rados', '-p', self.ceph_pool, '--id', self.client_name,
-            'put', name, source
-        ]
-        logging.debug("About to call: {}".format(cmd))
-        subprocess.check_call(cmd)
-
-    def _rados_rm(self, name: str):
-        """Remove a named RADOS object.
-
-        :param name: Name of the RADOS object to remove
-        :param source: Path to a file to upload to RADOS.
-
-        :returns: None
-        """
-        cmd = [
-            'rados', '-p', self.ceph_pool, '--id', self.client_name,
-            'rm', name
-        ]
-        logging.debug("About to call: {}".format(cmd))
-        subprocess.check_call(cmd)
-
-    def _add_share_to_index(self, export_id: int):
-        """Add an export RADOS object's URL to the RADOS URL index."""
-        index_data = self._rados_get(self.export_index)
-        url = '%url rados://{}/ganesha-export-{}'.format(
-            self.ceph_pool, export_id
-        )
-        rados_urls = index_data.split('\n')
-        if url not in rados_urls:
-            rados_urls.append(url)
-            tmpfile = self._tmpfile('\n'.join(rados_urls))
-            self._rados_put(self.export_index, tmpfile.name)
-
-    def _remove_share_from_index(self, export_id: int):
-        """Remove an export RADOS object's URL from the RADOS URL index."""
-        index_data = self._rados_get(self.export_index)
-        if not index_data:
-            return
-
-        unwanted_url = "%url rados://{0}/{1}".format(
-            self.ceph_pool,
-            'ganesha-export-{}'.format(export_id))
-        logging.debug("Looking for '{}' in index".format(unwanted_url))
-        rados_urls = index_data.split('\n')
-        logging.debug("Index URLs: {}".format(rados_urls))
-        index = [url.strip() for url in rados_urls if url != unwanted_url]
-        logging.debug("Index URLs without unwanted: {}".format(index))
-        tmpfile = self._tmpfile('\n'.join(index))
-        self._rados_put(self.export_index, tmpfile.name)
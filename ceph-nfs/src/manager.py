@@ -17,7 +17,9 @@
 # https://github.com/openstack/manila/blob/a3aaea91494665a25bdccebf69d9e85e8475983d/manila/share/drivers/ganesha/manager.py#L205
 #
 # The key differences is the lack of other Ganesha control code
-# and the removal of oslo's JSON helpers.
+# and the removal of oslo's JSON helpers. The parser has since been
+# rewritten to go over the config in a single pass, without converting it
+# to JSON first.
 
 
 import io
@@ -28,98 +30,128 @@ import sys
 
 IWIDTH = 4
 
-
-def _conf2json(conf):
-    """Convert Ganesha config to JSON."""
-
-    # tokenize config string
-    token_list = [io.StringIO()]
-    state = {
-        'in_quote': False,
-        'in_comment': False,
-        'escape': False,
-    }
-
-    cbk = []
-    for char in conf:
-        if state['in_quote']:
-            if not state['escape']:
-                if char == '"':
-                    state['in_quote'] = False
-                    cbk.append(lambda: token_list.append(io.StringIO()))
-                elif char == '\\':
-                    cbk.append(lambda: state.update({'escape': True}))
-        else:
-            if char == "#":
-                state['in_comment'] = True
-            if state['in_comment']:
-                if char == "\n":
-                    state['in_comment'] = False
+_WORD = r'[^\s;{}="\#]+'
+_QUOTED = r'"[^"\\]*(?:\\.[^"\\]*)*"'
+# Tokens of the Ganesha config, each after any blanks and comments. Options
+# with a single value, and block openings, are matched whole, as they make
+# up most of the config. Otherwise the tokens are quoted strings (with
+# backslash escapes), syntactically significant characters, words, and
+# opening quotes without their closing one. Only the end of the config
+# matches none of them.
+_TOKEN_RE = re.compile(r"""
+    \s*(?:\#[^\n]*\s*)*
+    (?: ({word})\s*=\s*({word}|{quoted})\s*;
+      | ({word})\s*=?\s*\{{
+      | ({quoted})
+      | ([;{{}}=])
+      | ({word})
+      | (")
+      | \Z)
+""".format(word=_WORD, quoted=_QUOTED), re.VERBOSE | re.DOTALL)
+_NUMBER_RE = re.compile(r'-?[1-9]\d*(\.\d+)?\Z')
+
+
+def _decode(tok):
+    # Quoted strings are unescaped, and numbers are converted.
+    if tok[0] == '"':
+        return json.loads(tok) if '\\' in tok else tok[1:-1]
+    if tok[0] in '-123456789' and _NUMBER_RE.match(tok):
+        return float(tok) if '.' in tok else int(tok)
+    return tok
+
+
+def _add(block, repeated, key, value):
+    # Blocks or options that occur more than once in the same block are
+    # collected into a list.
+    if key not in block:
+        block[key] = value
+    elif key in repeated:
+        block[key].append(value)
+    else:
+        block[key] = [block[key], value]
+        repeated.add(key)
+
+
+def _join(key, values):
+    # Consecutive values of an option are joined, e.g.
+    # "Clients = 10.0.0.1, 10.0.0.2;".
+    if len(values) == 1:
+        return values[0]
+    if all(isinstance(v, str) for v in values):
+        return ''.join(values)
+    raise RuntimeError("Invalid value of {}".format(key))
+
+
+def _parse(conf):
+    """Parse Ganesha config into a (nested) dictionary in a single pass."""
+    root = {}
+    # The blocks being parsed, with the keys that are repeated in each.
+    stack = [(root, set())]
+    # The key being parsed, and its values once past the "=" sign.
+    key = values = None
+    for (opt_key, opt_value, block_key, quoted, punct, word,
+         unterminated) in _TOKEN_RE.findall(conf):
+        if opt_key or block_key:
+            if key is not None:
+                raise RuntimeError("Expected '=' after {}".format(key))
+            if opt_key:
+                _add(*stack[-1], opt_key, _decode(opt_value))
             else:
-                if char == '"':
-                    token_list.append(io.StringIO())
-                    state['in_quote'] = True
-        state['escape'] = False
-        if not state['in_comment']:
-            token_list[-1].write(char)
-        while cbk:
-            cbk.pop(0)()
-
-    if state['in_quote']:
-        raise RuntimeError("Unterminated quoted string")
-
-    # jsonify tokens
-    js_token_list = ["{"]
-    for tok in token_list:
-        tok = tok.getvalue()
-
-        if tok[0] == '"':
-            js_token_list.append(tok)
+                block = {}
+                _add(*stack[-1], block_key, block)
+                stack.append((block, set()))
             continue
 
-        for pat, s in [
-                # add omitted "=" signs to block openings
-                (r'([^=\s])\s*{', '\\1={'),
-                # delete trailing semicolons in blocks
-                (r';\s*}', '}'),
-                # add omitted semicolons after blocks
-                (r'}\s*([^}\s])', '};\\1'),
-                # separate syntactically significant characters
-                (r'([;{}=])', ' \\1 ')]:
-            tok = re.sub(pat, s, tok)
-
-        # map tokens to JSON equivalents
-        for word in tok.split():
-            if word == "=":
-                word = ":"
-            elif word == ";":
-                word = ','
-            elif word in ['{', '}'] or  \
-                    re.search(r'\A-?[1-9]\d*(\.\d+)?\Z', word):
-                pass
+        if not punct:
+            if word or quoted:
+                value = _decode(word or quoted)
+            elif unterminated:
+                raise RuntimeError("Unterminated quoted string")
+            else:
+                continue
+            if values is not None:
+                values.append(value)
+            elif key is None:
+                key = value
             else:
-                word = json.dumps(word)
-            js_token_list.append(word)
-    js_token_list.append("}")
-
-    # group quoted strings
-    token_grp_list = []
-    for tok in js_token_list:
-        if tok[0] == '"':
-            if not (token_grp_list and isinstance(token_grp_list[-1], list)):
-                token_grp_list.append([])
-            token_grp_list[-1].append(tok)
-        else:
-            token_grp_list.append(tok)
-
-    # process quoted string groups by joining them
-    js_token_list2 = []
-    for x in token_grp_list:
-        if isinstance(x, list):
-            x = ''.join(['"'] + [tok[1:-1] for tok in x] + ['"'])
-        js_token_list2.append(x)
-
-    return ''.join(js_token_list2)
+                raise RuntimeError("Expected '=' after {}".format(key))
+            continue
+
+        if values:
+            # The option ends at a ";", or at the end of its block.
+            if punct not in ';}':
+                raise RuntimeError("Unexpected {!r}".format(punct))
+            _add(*stack[-1], key, _join(key, values))
+            key = values = None
+        elif values is not None and punct != '{':
+            raise RuntimeError("Missing value of {}".format(key))
+
+        if punct == '{':
+            # Block openings can omit the "=" sign.
+            if key is None:
+                raise RuntimeError("Unexpected '{'")
+            block = {}
+            _add(*stack[-1], key, block)
+            stack.append((block, set()))
+            key = values = None
+        elif punct == '=':
+            if key is None:
+                raise RuntimeError("Unexpected '='")
+            values = []
+        elif key is not None:
+            raise RuntimeError("Expected '=' after {}".format(key))
+        elif punct == '}':
+            if len(stack) == 1:
+                raise RuntimeError("Unbalanced '}'")
+            stack.pop()
+
+    if values:
+        _add(*stack[-1], key, _join(key, values))
+    elif key is not None:
+        raise RuntimeError("Expected '=' after {}".format(key))
+    if len(stack) != 1:
+        raise RuntimeError("Unterminated block")
+    return root
 
 
 def _dump_to_conf(confdict, out=sys.stdout, indent=0):
@@ -160,36 +192,12 @@ def parseconf(conf):
     Both native format and JSON are supported.
     Convert config to a (nested) dictionary.
     """
-    def list_to_dict(src_list):
-        # Convert a list of key-value pairs stored as tuples to a dict.
-        # For tuples with identical keys, preserve all the values in a
-        # list. e.g., argument [('k', 'v1'), ('k', 'v2')] to function
-        # returns {'k': ['v1', 'v2']}.
-        dst_dict = {}
-        for i in src_list:
-            if isinstance(i, tuple):
-                k, v = i
-                if isinstance(v, list):
-                    v = list_to_dict(v)
-                if k in dst_dict:
-                    dst_dict[k] = [dst_dict[k]]
-                    dst_dict[k].append(v)
-                else:
-                    dst_dict[k] = v
-        return dst_dict
-
     try:
         # allow config to be specified in JSON --
         # for sake of people who might feel Ganesha config foreign.
         d = json.loads(conf)
     except ValueError:
-        # Customize JSON decoder to convert Ganesha config to a list
-        # of key-value pairs stored as tuples. This allows multiple
-        # occurrences of a config block to be later converted to a
-        # dict key-value pair, with block name being the key and a
-        # list of block contents being the value.
-        li = json.loads(_conf2json(conf), object_pairs_hook=lambda x: x)
-        d = list_to_dict(li)
+        d = _parse(conf)
     return d
 
 
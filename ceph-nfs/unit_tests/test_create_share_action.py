@@ -1,3 +1,4 @@
+import json
 import sys
 import unittest
 
@@ -101,3 +102,68 @@ class TestCreateShareAction(unittest.TestCase):
             access_ips=['10.0.0.1', '10.0.0.2'],
             squash_access='root')
         event.set_results.assert_called_once()
+
+
+class TestBulkSharesAction(unittest.TestCase):
+
+    def setUp(self):
+        self.harness = Harness(charm.CephNFSCharm)
+        self.addCleanup(self.harness.cleanup)
+
+    def _run(self, specs, results=()):
+        self.harness.begin()
+        self.harness.set_leader(True)
+        mock_ganesha = MagicMock()
+        mock_ganesha.bulk_update.return_value = list(results)
+        with patch('charm.GaneshaNFS', return_value=mock_ganesha):
+            self.harness.charm.peers.trigger_reload = MagicMock()
+            self.harness.charm.access_address = MagicMock(
+                return_value='1.2.3.4')
+            event = MockActionEvent({'shares': json.dumps(specs)})
+            self.harness.charm.bulk_shares_action(event)
+        return event, mock_ganesha
+
+    def test_invalid_specs_fail_up_front(self):
+        cases = [
+            (['share'], 'expected an object'),
+            ([{'op': 'delete', 'name': 'a'}], 'unknown op: delete'),
+            ([{'op': 'create', 'name': 'a', 'size': '10'}],
+             'size must be an integer'),
+            ([{'op': 'create', 'name': 'a', 'squash-access': 1}],
+             'squash-access must be a string'),
+            ([{'op': 'create', 'name': 'a', 'squash-access': 'bad'}],
+             'invalid squash-access value: bad'),
+            ([{'op': 'grant', 'name': 'a'}], 'grant needs a client'),
+            ([{'op': 'revoke', 'client': '10.0.0.1'}],
+             'revoke needs the name of the share'),
+        ]
+        for specs, error in cases:
+            with self.subTest(error=error):
+                self.setUp()
+                # A valid change before the invalid one isn't applied.
+                event, mock_ganesha = self._run(
+                    [{'op': 'create', 'name': 'ok'}] + specs)
+                event.fail.assert_called_once_with(
+                    'Invalid shares: change 1: ' + error)
+                mock_ganesha.bulk_update.assert_not_called()
+
+    def test_valid_specs(self):
+        results = [
+            {'name': 'a', 'op': 'create', 'message': 'Done',
+             'path': '/volumes/_nogroup/a/abc'},
+            {'name': 'a', 'op': 'grant', 'message': 'Done'}]
+        event, mock_ganesha = self._run([
+            {'op': 'create', 'name': 'a', 'size': 10,
+             'allowed-ips': '10.0.0.1, 10.0.0.2', 'squash-access': 'root'},
+            {'op': 'grant', 'name': 'a', 'client': '10.0.0.3'}], results)
+        event.fail.assert_not_called()
+        mock_ganesha.bulk_update.assert_called_once_with([
+            {'op': 'create', 'name': 'a', 'size': 10,
+             'allowed-ips': ['10.0.0.1', '10.0.0.2'],
+             'squash-access': 'root'},
+            {'op': 'grant', 'name': 'a', 'client': '10.0.0.3'}])
+        # Action results are maps, so the list is keyed by position.
+        event.set_results.assert_called_once_with({
+            'message': '2 of 2 share changes applied',
+            'results': {'0': results[0], '1': results[1]},
+            'ip': '1.2.3.4'})
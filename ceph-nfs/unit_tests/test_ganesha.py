@@ -1,3 +1,4 @@
+import json
 import unittest
 import ganesha
 
@@ -82,35 +83,198 @@ class ExportTest(unittest.TestCase):
             ])
 
 
+class MockOp(object):
+
+    def __init__(self):
+        self.omap = {}
+        self.omap_removed = ()
+        self.cmps = []
+        self.version = None
+        self.data = None
+        self.writes = []
+        self.appended = b''
+
+    def omap_cmp(self, key, val, cmp_op):
+        self.cmps.append((key, val))
+
+    def assert_version(self, version):
+        self.version = version
+
+    def append(self, data):
+        self.appended += data
+
+    def write(self, data, offset):
+        self.writes.append((data, offset))
+
+    def write_full(self, data):
+        self.data = data
+
+    def release(self):
+        pass
+
+
+class MockIoctx(object):
+    """Objects with data and an omap, with the semantics of RADOS."""
+
+    def __init__(self, objects=None, omap=None):
+        self.objects = dict(objects or {})
+        self.omap = dict(omap or {})
+        self.versions = {}
+        self.last_version = None
+        self.reads = 0
+
+    def stat(self, name):
+        return len(self.objects[name]), 0
+
+    def read(self, name, length):
+        self.last_version = self.versions.get(name, 1)
+        return self.objects[name][:length]
+
+    def get_last_version(self):
+        return self.last_version
+
+    def write_full(self, name, data):
+        self.objects[name] = data
+        self.versions[name] = self.versions.get(name, 1) + 1
+
+    def aio_write_full(self, name, data):
+        self.write_full(name, data)
+        return unittest.mock.Mock(**{'get_return_value.return_value': 0})
+
+    def remove_object(self, name):
+        del self.objects[name]
+
+    def create_read_op(self):
+        return MockOp()
+
+    create_write_op = create_read_op
+
+    def get_omap_vals_by_keys(self, op, keys):
+        # Like in librados, the results are filled in by the operation.
+        out = []
+        op.fill = lambda: out.extend(
+            (k, self.omap[k].encode('utf-8'))
+            for k in keys if k in self.omap)
+        return out, 0
+
+    def get_omap_vals(self, op, start_after, prefix, max_return):
+        out = []
+
+        def _fill():
+            keys = [k for k in sorted(self.omap) if k > start_after]
+            out.extend((k, self.omap[k].encode('utf-8'))
+                       for k in keys[:max_return])
+        op.fill = _fill
+        return out, 0
+
+    def operate_read_op(self, op, name):
+        self.reads += 1
+        op.fill()
+
+    def set_omap(self, op, keys, values):
+        op.omap.update(zip(keys, values))
+
+    def remove_omap_keys(self, op, keys):
+        op.omap_removed = keys
+
+    def operate_write_op(self, op, name):
+        for key, val in op.cmps:
+            if self.omap.get(key, '') != val:
+                raise OSError()
+        if op.version not in (None, self.versions.get(name, 1)):
+            raise OSError()
+
+        self.omap.update(op.omap)
+        for key in op.omap_removed:
+            self.omap.pop(key, None)
+        if op.data is not None:
+            self.objects[name] = op.data
+        data = bytearray(self.objects.get(name, b'') + op.appended)
+        for buf, offset in op.writes:
+            data[offset:offset + len(buf)] = buf
+        self.objects[name] = bytes(data)
+        self.versions[name] = self.versions.get(name, 1) + 1
+
+
+class MockRados(object):
+    ObjectNotFound = KeyError
+    OSError = OSError
+    LIBRADOS_CMPXATTR_OP_EQ = 1
+
+
+EXAMPLE_URL = '%url rados://mypool/ganesha-export-1000'
+
+
 class TestGaneshaNFS(unittest.TestCase):
 
-    @unittest.mock.patch.object(ganesha.GaneshaNFS, '_ceph_subvolume_command')
-    @unittest.mock.patch.object(ganesha.GaneshaNFS, '_ganesha_add_export')
-    @unittest.mock.patch.object(ganesha.GaneshaNFS, '_get_next_export_id')
-    @unittest.mock.patch.object(ganesha.GaneshaNFS, 'list_shares')
-    @unittest.mock.patch.object(ganesha.GaneshaNFS, '_ceph_auth_key')
-    @unittest.mock.patch.object(ganesha.GaneshaNFS, '_rados_get')
-    @unittest.mock.patch.object(ganesha.GaneshaNFS, '_rados_put')
-    @unittest.mock.patch.object(ganesha.Export, 'to_export')
-    def test_create_share(self, mock_export,
-                          mock_rados_put,
-                          mock_rados_get,
-                          mock_auth_key,
-                          mock_list_shares,
-                          mock_export_id,
-                          mock_add_export,
-                          mock_subvolume_command):
-        mock_subvolume_command.return_value = b'mock-volume'
-        mock_list_shares.return_value = []
-        mock_export_id.return_value = 1
-        mock_auth_key.return_value = b'mock-auth-key'
+    def setUp(self):
+        patcher = unittest.mock.patch.object(ganesha, 'rados', MockRados)
+        patcher.start()
+        self.addCleanup(patcher.stop)
 
+    def _client(self, objects=None, omap=None):
         inst = ganesha.GaneshaNFS('ceph-client', 'mypool')
-        inst.create_share('test-create-share', size=3, access_ips=None)
+        inst._store = ganesha.ExportStore(MockIoctx(objects, omap),
+                                          'mypool', 'ganesha-export-index')
+        return inst
+
+    def _client_with_share(self):
+        inst = self._client({
+            'ganesha-export-index': EXAMPLE_URL.encode('utf-8'),
+            'ganesha-export-1000': EXAMPLE_EXPORT.encode('utf-8'),
+            'ganesha-export-counter': b'1001'})
+        inst.list_shares()
+        inst._store = ganesha.ExportStore(inst.store.ioctx, 'mypool',
+                                          'ganesha-export-index')
+        return inst
+
+    @unittest.mock.patch.object(ganesha.GaneshaNFS, '_ganesha_add_export')
+    def test_create_share(self, mock_add_export):
+        inst = self._client_with_share()
+        cluster = unittest.mock.Mock()
+        inst._cluster = cluster
+
+        def _command(cmd, inbuf):
+            cmd = json.loads(cmd)
+            if cmd['prefix'] == 'fs subvolume getpath':
+                return 0, b'/volumes/_nogroup/share/abc', ''
+            if cmd['prefix'] == 'auth get':
+                return 0, b'[{"key": "mock-auth-key"}]', ''
+            return 0, b'', ''
+
+        cluster.mgr_command.side_effect = _command
+        cluster.mon_command.side_effect = _command
+        ioctx = inst.store.ioctx
+        path = inst.create_share('share', size=3, access_ips=None)
+
+        cluster.mgr_command.assert_any_call(json.dumps({
+            'prefix': 'fs subvolume create', 'vol_name': 'ceph-fs',
+            'sub_name': 'share', 'size': 3 * 1024 * 1024 * 1024}), b'')
+        cluster.mon_command.assert_called_once_with(json.dumps({
+            'prefix': 'auth get', 'entity': 'client.ganesha-share',
+            'format': 'json'}), b'')
+        self.assertEqual(path, '/volumes/_nogroup/share/abc')
+        self.assertEqual(ioctx.objects['ganesha-export-counter'], b'1002')
+        self.assertEqual(
+            ioctx.objects['ganesha-export-index'].decode('utf-8').split('\n'),
+            [EXAMPLE_URL, '%url rados://mypool/ganesha-export-1001'])
+        export = ganesha.Export.from_export(
+            ioctx.objects['ganesha-export-1001'].decode('utf-8'))
+        self.assertEqual(export.export_id, 1001)
+        self.assertEqual(export.export['FSAL']['Secret_Access_Key'],
+                         'mock-auth-key')
+        self.assertEqual(inst.get_share('share').path, path)
+
+        # Creating it again returns the existing share.
+        cluster.mgr_command.reset_mock()
+        self.assertEqual(inst.create_share('share', size=3), path)
+        cluster.mgr_command.assert_not_called()
 
-        mock_subvolume_command.assert_any_call('create', 'ceph-fs',
-                                               'test-create-share',
-                                               str(3 * 1024 * 1024 * 1024))
+        # A failed creation creates no export.
+        cluster.mgr_command.side_effect = (
+            lambda cmd, inbuf: (-1, b'', 'no space'))
+        self.assertIsNone(inst.create_share('other', size=3))
+        self.assertIsNone(inst.get_share('other'))
 
     @unittest.mock.patch.object(ganesha.GaneshaNFS, '_ceph_subvolume_command')
     def test_resize_share(self, mock_subvolume_command):
@@ -121,15 +285,172 @@ class TestGaneshaNFS(unittest.TestCase):
                                                str(5 * 1024 * 1024 * 1024),
                                                '--no_shrink')
 
-    @unittest.mock.patch.object(ganesha.GaneshaNFS, '_rados_get')
-    def test_list_shares(self, mock_rados_get):
-        mock_rados_get.side_effect = ['%url rados://mypool/test_ganesha_share',
-                                      EXAMPLE_EXPORT]
-        inst = ganesha.GaneshaNFS('ceph-client', 'mypool')
+    def test_list_shares(self):
+        inst = self._client({
+            'ganesha-export-index': ('\n' + EXAMPLE_URL).encode('utf-8'),
+            'ganesha-export-1000': EXAMPLE_EXPORT.encode('utf-8')})
         exports = inst.list_shares()
-        mock_rados_get.assert_any_call('ganesha-export-index')
-        mock_rados_get.assert_any_call('test_ganesha_share')
+        self.assertEqual(len(exports), 1)
         for export in exports:
             self.assertEqual('test_ganesha_share', export.name)
             self.assertEqual(export.clients_by_mode['r'], [])
             self.assertEqual(['0.0.0.0'], export.clients_by_mode['rw'])
+
+        # The export metadata is now kept in the omap of the index.
+        omap = inst.store.ioctx.omap
+        self.assertEqual(sorted(omap),
+                         ['share.test_ganesha_share', 'version'])
+
+        # Listing again is served from the cache.
+        reads = inst.store.ioctx.reads
+        inst.list_shares()
+        self.assertEqual(inst.store.ioctx.reads, reads)
+
+    def test_get_share(self):
+        inst = self._client_with_share()
+        share = inst.get_share('test_ganesha_share')
+        self.assertEqual(share.export_id, 1000)
+        self.assertIsNone(inst.get_share('missing'))
+        self.assertEqual(inst.store.ioctx.reads, 3)
+
+    @unittest.mock.patch.object(ganesha.GaneshaNFS, '_ganesha_update_export')
+    def test_grant_access(self, mock_update_export):
+        inst = self._client_with_share()
+        self.assertIsNone(inst.grant_access('test_ganesha_share',
+                                            '10.0.0.0/8'))
+        mock_update_export.assert_called_once()
+
+        export = ganesha.Export.from_export(
+            inst.store.ioctx.objects['ganesha-export-1000'].decode('utf-8'))
+        self.assertEqual(export.clients_by_mode['rw'],
+                         ['0.0.0.0', '10.0.0.0/8'])
+        self.assertEqual(
+            inst.get_share('test_ganesha_share').clients_by_mode['rw'],
+            ['0.0.0.0', '10.0.0.0/8'])
+        self.assertEqual(inst.grant_access('missing', '10.0.0.0/8'),
+                         'Share does not exist')
+
+    @unittest.mock.patch.object(ganesha.GaneshaNFS, '_ganesha_remove_export')
+    def test_delete_share(self, mock_remove_export):
+        inst = self._client_with_share()
+        inst.delete_share('test_ganesha_share')
+        mock_remove_export.assert_called_once_with(1000)
+
+        ioctx = inst.store.ioctx
+        self.assertNotIn('ganesha-export-1000', ioctx.objects)
+        self.assertEqual(ioctx.objects['ganesha-export-index'], b'')
+        self.assertEqual(sorted(ioctx.omap), ['epoch', 'version'])
+        self.assertIsNone(inst.get_share('test_ganesha_share'))
+
+    def _export(self, export_id, name):
+        export = ganesha.Export.from_export(EXAMPLE_EXPORT)
+        export.export['Export_Id'] = export_id
+        export.export['Path'] = '/volumes/_nogroup/{}/abc'.format(name)
+        return export
+
+    def test_remove_blanks_url(self):
+        inst = self._client({'ganesha-export-index': b''},
+                            {'version': '1'})
+        store = inst.store
+        for i in range(4):
+            self.assertTrue(store.put(self._export(i, 's%d' % i), new=True))
+
+        ioctx = store.ioctx
+        index = ioctx.objects['ganesha-export-index']
+        store.remove(self._export(1, 's1'))
+        # The URL is blanked out, and the other offsets are kept.
+        url = store.url(1).encode('utf-8')
+        self.assertEqual(ioctx.objects['ganesha-export-index'],
+                         index.replace(url, b' ' * len(url)))
+        self.assertNotIn('share.s1', ioctx.omap)
+
+        # Once most of the index is blank, it's compacted.
+        store.remove(self._export(2, 's2'))
+        self.assertNotIn('epoch', ioctx.omap)
+        store.remove(self._export(0, 's0'))
+        self.assertEqual(ioctx.objects['ganesha-export-index'],
+                         store.url(3).encode('utf-8'))
+        self.assertEqual(ioctx.omap['epoch'], '1')
+        self.assertEqual([e.name for e in store.list()], ['s3'])
+
+    def test_put_existing_name(self):
+        inst = self._client({'ganesha-export-index': b''},
+                            {'version': '1'})
+        store = inst.store
+        self.assertTrue(store.put(self._export(1, 'share'), new=True))
+        # Another unit picked the same name.
+        self.assertFalse(store.put(self._export(2, 'share'), new=True))
+        self.assertNotIn('ganesha-export-2', store.ioctx.objects)
+        self.assertEqual(store.get('share').export_id, 1)
+
+    def test_allocate_id(self):
+        inst = self._client({'ganesha-export-counter': b'1000'})
+        ioctx = inst.store.ioctx
+        write_full = MockIoctx.write_full
+        calls = []
+
+        def _operate(op, name):
+            if not calls:
+                # Another unit allocates an ID concurrently.
+                write_full(ioctx, name, b'1001')
+            calls.append(name)
+            MockIoctx.operate_write_op(ioctx, op, name)
+
+        ioctx.operate_write_op = _operate
+        self.assertEqual(inst._get_next_export_id(), 1001)
+        self.assertEqual(ioctx.objects['ganesha-export-counter'], b'1002')
+        self.assertEqual(len(calls), 2)
+
+    def test_bulk_update(self):
+        inst = self._client_with_share()
+        cluster = unittest.mock.Mock()
+        inst._cluster = cluster
+
+        def _command(cmd, inbuf):
+            cmd = json.loads(cmd)
+            if cmd['prefix'] == 'fs subvolume getpath':
+                return 0, '/volumes/_nogroup/{}/abc'.format(
+                    cmd['sub_name']).encode('utf-8'), ''
+            if cmd['prefix'] == 'fs subvolume create' and \
+                    cmd['sub_name'] == 'bad':
+                return -1, b'', 'no space'
+            if cmd['prefix'] == 'auth get':
+                return 0, b'[{"key": "mock-auth-key"}]', ''
+            return 0, b'', ''
+
+        cluster.mgr_command.side_effect = _command
+        cluster.mon_command.side_effect = _command
+        ioctx = inst.store.ioctx
+        results = inst.bulk_update([
+            {'op': 'grant', 'name': 'a', 'client': '10.0.0.0/8'},
+            {'op': 'create', 'name': 'a', 'size': 1},
+            {'op': 'create', 'name': 'b', 'allowed-ips': ['0.0.0.0/0']},
+            {'op': 'create', 'name': 'test_ganesha_share'},
+            {'op': 'create', 'name': 'bad'},
+            {'op': 'revoke', 'name': 'test_ganesha_share',
+             'client': '0.0.0.0'},
+            {'op': 'revoke', 'name': 'missing', 'client': '0.0.0.0'},
+        ])
+        self.assertEqual([r.get('error') for r in results], [
+            None, None, None, None, 'fs subvolume create failed: no space',
+            None, 'Share does not exist'])
+        self.assertEqual(results[1]['path'], '/volumes/_nogroup/a/abc')
+        self.assertEqual(results[3]['message'], 'Share exists')
+        cluster.mgr_command.assert_any_call(json.dumps({
+            'prefix': 'fs subvolume create', 'vol_name': 'ceph-fs',
+            'sub_name': 'a', 'size': 1024 * 1024 * 1024}), b'')
+
+        # Both new shares got their IDs out of a single allocation, and
+        # were added to the index together.
+        self.assertEqual(ioctx.objects['ganesha-export-counter'], b'1003')
+        self.assertEqual(
+            ioctx.objects['ganesha-export-index'].decode('utf-8').split('\n'),
+            [EXAMPLE_URL, '%url rados://mypool/ganesha-export-1001',
+             '%url rados://mypool/ganesha-export-1002'])
+        share = inst.get_share('a')
+        self.assertEqual(share.export_id, 1001)
+        self.assertEqual(share.clients_by_mode['rw'],
+                         ['0.0.0.0', '10.0.0.0/8'])
+        self.assertEqual(share.export['FSAL']['User_Id'], 'ganesha-a')
+        self.assertEqual(
+            inst.get_share('test_ganesha_share').clients_by_mode['rw'], [])
@@ -0,0 +1,79 @@
+import unittest
+
+import manager
+
+
+EXAMPLE_EXPORT = """## This export is managed by the CephNFS charm ##
+EXPORT {
+    # Each EXPORT must have a unique Export_Id.
+    Export_Id = 1000;
+    Path = '/volumes/_nogroup/share/e12a49ef-1b2b-40b3-ba6c';
+    FSAL {
+        Name = "Ceph";
+        User_Id = "ganesha-share";
+        Secret_Access_Key = "AQCT9+9h4cwJOxAAue2fFvvGTWziUiR9koCHEw==";
+    }
+    Pseudo = '/volumes/_nogroup/share/e12a49ef-1b2b-40b3-ba6c';
+    SecType = "sys";
+    CLIENT {
+        Access_Type = "rw";
+        Clients = 0.0.0.0;
+    }
+    # User id squashing, one of None, Root, All
+    Squash = "None";
+}
+"""
+
+
+class ParseConfTest(unittest.TestCase):
+
+    def test_parse(self):
+        conf = manager.parseconf(EXAMPLE_EXPORT)
+        export = conf['EXPORT']
+        self.assertEqual(export['Export_Id'], 1000)
+        self.assertEqual(export['FSAL'], {
+            'Name': 'Ceph',
+            'User_Id': 'ganesha-share',
+            'Secret_Access_Key': 'AQCT9+9h4cwJOxAAue2fFvvGTWziUiR9koCHEw=='})
+        self.assertEqual(export['CLIENT'],
+                         {'Access_Type': 'rw', 'Clients': '0.0.0.0'})
+        self.assertEqual(export['Squash'], 'None')
+
+    def test_parse_values(self):
+        conf = manager.parseconf(
+            'A = { Clients = 10.0.0.1, 10.0.0.2; S = "a\\"b" "c"; N = 0;\n'
+            '  F = 1.5; # comment "\n  B { X = -2 } }\n')
+        self.assertEqual(conf, {'A': {
+            'Clients': '10.0.0.1,10.0.0.2', 'S': 'a"bc', 'N': '0',
+            'F': 1.5, 'B': {'X': -2}}})
+
+    def test_parse_repeated(self):
+        conf = manager.parseconf(
+            'E { C { X = 1; } C { X = 2 } C { X = 3 } }')
+        self.assertEqual(conf, {'E': {'C': [{'X': 1}, {'X': 2}, {'X': 3}]}})
+
+    def test_parse_json(self):
+        self.assertEqual(manager.parseconf('{"EXPORT": {"Path": "/a"}}'),
+                         {'EXPORT': {'Path': '/a'}})
+
+    def test_parse_errors(self):
+        for conf in ['E { P = "a; }', 'E { P = 1; ', 'E { P = 1; } }',
+                     'E { P Q = 1; }', 'E { P = ; }', 'E { = 1 }']:
+            with self.assertRaises(RuntimeError, msg=conf):
+                manager.parseconf(conf)
+
+    def test_round_trip(self):
+        conf = manager.parseconf(EXAMPLE_EXPORT)
+        dumped = manager.mkconf(conf)
+        self.assertEqual(manager.parseconf(dumped), conf)
+        self.assertEqual(manager.mkconf(manager.parseconf(dumped)), dumped)
+
+    def test_parse_many_exports(self):
+        # Benchmark, see the time of this test with "stestr run --slowest".
+        count = 5000
+        conf = manager.mkconf(manager.parseconf(EXAMPLE_EXPORT))
+        exports = [manager.parseconf(conf) for _ in range(count)]
+        self.assertEqual(len(exports), count)
+        self.assertEqual(
+            manager.parseconf(conf * count)['EXPORT'],
+            [exports[0]['EXPORT']] * count)
@@ -16,6 +16,7 @@
 
 """Charm the application."""
 
+import concurrent.futures
 import ipaddress
 import json
 import logging
@@ -23,6 +24,7 @@ import os
 import random
 import socket
 import subprocess
+import time
 
 import interface_ceph_client.ceph_client as ceph_client
 import interface_ceph_iscsi_admin_access.admin_access as admin_access
@@ -37,6 +39,14 @@ PROXY_FILE = '/lib/systemd/system/nvmf_proxy.service'
 PROXY_WORKING_DIR = '/var/lib/nvme-of/'
 PROXY_CMDS_FILE = os.path.join(PROXY_WORKING_DIR, 'cmds')
 
+# Requests to the proxy are retransmitted if no response arrives in time.
+# The proxy answers retransmits of a request without running it again.
+PROXY_TIMEOUT = 10
+PROXY_ATTEMPTS = 3
+
+# Maximum number of peers contacted at the same time.
+FANOUT_WORKERS = 16
+
 SYSTEMD_TEMPLATE = """
 [Unit]
 Description={description}
@@ -68,7 +78,8 @@ class CephNVMECharm(ops.CharmBase):
         self.client = ceph_client.CephClientRequires(self, 'ceph-client')
         self.admin_access = admin_access.CephISCSIAdminAccessProvides(
             self, 'admin-access')
-        self.rpc = utils.RPC()
+        # Random ids keep retransmits of requests from different hooks apart.
+        self.rpc = utils.RPC(first_id=random.randrange(1, 1 << 31))
         obs = self.framework.observe
         obs(self.on.start, self._on_start)
         obs(self.on.install, self._on_install)
@@ -95,10 +106,7 @@ class CephNVMECharm(ops.CharmBase):
             return
 
         msg = self.rpc.leave(subsystems=self._msgloop({'method': 'list'}))
-        sock = self._rpc_sock()
-
-        for addr, *_ in peers:
-            self._msgloop(msg, addr=addr, sock=sock)
+        self._fanout([(addr, msg) for addr, *_ in peers])
 
     def on_admin_access(self, event):
         passwd = self.config.get('dashboard-password')
@@ -126,7 +134,7 @@ class CephNVMECharm(ops.CharmBase):
         """Create a socket to communicate with the proxy."""
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         sock.bind(('0.0.0.0', 0))
-        sock.settimeout(30)
+        sock.settimeout(PROXY_TIMEOUT)
         return sock
 
     def _msgloop(self, msg, addr=None, sock=None):
@@ -135,20 +143,73 @@ class CephNVMECharm(ops.CharmBase):
         if sock is None:
             sock = self._rpc_sock()
 
+        if 'id' not in msg:
+            msg = dict(msg, id=self.rpc.next_id())
+
         binmsg = json.dumps(msg).encode('utf8')
         if addr is None:
             addr = self.bind_addr()
-        sock.sendto(binmsg, (addr, self.config['proxy-port']))
 
         try:
-            return json.loads(sock.recv(4096))
-        except TimeoutError:
+            for _ in range(PROXY_ATTEMPTS):
+                sock.sendto(binmsg, (addr, self.config['proxy-port']))
+                try:
+                    return self._recv_response(sock, msg['id'])
+                except TimeoutError:
+                    logger.warning('retrying request: %s', msg['method'])
+
             return {'error': {'code': -2,
                               'message': 'timed out waiting for a response'}}
         finally:
             if orig_sock is None:
                 sock.close()
 
+    @staticmethod
+    def _recv_response(sock, msg_id):
+        """Receive the response to a request, skipping stale ones.
+
+        A socket may be reused for several requests, so it can still hold
+        late replies to previous ones. Those are dropped by matching the
+        id echoed by the proxy. Responses without one come from proxies
+        that predate it, and are taken as is."""
+        while True:
+            resp = json.loads(sock.recv(4096))
+            if not isinstance(resp, dict) or 'result' not in resp:
+                return resp
+            elif resp.get('id') == msg_id:
+                return resp['result']
+
+            logger.debug('dropping stale response: %s', resp)
+
+    def _fanout(self, requests):
+        """Send RPC messages to several proxies at the same time.
+
+        Takes a list of (addr, msg) pairs, and returns a list with the
+        (response, latency) pair of each of them, in the same order.
+        Every request has its own socket, and thus its own deadline and
+        retransmits, so a slow peer doesn't hold up the rest."""
+        def _call(request):
+            addr, msg = request
+            start = time.monotonic()
+            resp = self._msgloop(msg, addr=addr)
+            return resp, time.monotonic() - start
+
+        if len(requests) <= 1:
+            return [_call(request) for request in requests]
+
+        workers = min(len(requests), FANOUT_WORKERS)
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            return list(executor.map(_call, requests))
+
+    @staticmethod
+    def _peer_result(peer, method, response, latency):
+        """Build an entry of the per-peer table in the action results."""
+        result = 'ok'
+        if 'error' in response:
+            result = 'error: %s' % str(response['error'])
+        return {'peer': peer, 'method': method, 'result': result,
+                'latency': '%.3f' % latency}
+
     @property
     def app_name(self):
         return self.model.unit.app.name
@@ -256,44 +317,59 @@ class CephNVMECharm(ops.CharmBase):
         return lst[0:idx] + lst[idx + 1:]
 
     @staticmethod
-    def _event_set_create_results(event, response, units):
-        event.set_results({'nqn': response['nqn'],
-                           'address': response['addr'],
-                           'port': response['port'],
-                           'units': units})
-
-    def _handle_ha_create(self, response, peers, msg, sock, event):
+    def _event_set_create_results(event, response, units, peers=None):
+        results = {'nqn': response['nqn'],
+                   'address': response['addr'],
+                   'port': response['port'],
+                   'units': units}
+        if peers is not None:
+            # Action results are maps of strings, so the per-peer table
+            # is published as peers.<n>.{peer,method,result,latency}.
+            results['peers'] = {str(i): entry for i, entry in
+                                enumerate(peers)}
+        event.set_results(results)
+
+    def _handle_ha_create(self, response, peers, msg, event):
         valid = [{'addr': response['addr'], 'port': response['port'],
                   'rpc_addr': '127.0.0.1'}]
+        names = [self.model.unit.name]
+        table = []
 
         # Tell the other peers to create the bdev, subsystem and namespace.
-        for peer, (addr, _, xaddr) in peers:
-            msg['params']['addr'] = xaddr
-            peer_resp = self._msgloop(msg, addr=addr, sock=sock)
+        requests = [(addr, self.rpc.create(**dict(msg['params'], addr=xaddr)))
+                    for _, (addr, _, xaddr) in peers]
+        replies = self._fanout(requests)
+        for (peer, (addr, *_)), (peer_resp, latency) in zip(peers, replies):
+            table.append(self._peer_result(peer, 'create',
+                                           peer_resp, latency))
             if 'error' in peer_resp:
                 logger.warning('peer %s failed to create bdev: %s' %
                                (peer, peer_resp['error']))
             else:
                 valid.append({'addr': peer_resp['addr'], 'rpc_addr': addr,
                               'port': peer_resp['port']})
+                names.append(peer)
 
         # Now make each peer refer to the others.
         added = 0
         if len(valid) > 1:
-            for i, peer in enumerate(valid):
-                join_msg = self.rpc.join(nqn=response['nqn'],
-                                         addresses=self._exclude(valid, i))
-                peer_resp = self._msgloop(join_msg, addr=peer['rpc_addr'],
-                                          sock=sock)
+            requests = [(peer['rpc_addr'],
+                         self.rpc.join(nqn=response['nqn'],
+                                       addresses=self._exclude(valid, i)))
+                        for i, peer in enumerate(valid)]
+            replies = self._fanout(requests)
+            for name, (peer_resp, latency) in zip(names, replies):
+                table.append(self._peer_result(name, 'join',
+                                               peer_resp, latency))
                 if 'error' in peer_resp:
                     logger.warning('peer %s failed to refer to us: %s' %
-                                   (peer, peer_resp['error']))
+                                   (name, peer_resp['error']))
                 else:
                     added += 1
 
         if not added:
             logger.warning('failed to create additional endpoints for HA')
-        self._event_set_create_results(event, response, added or 1)
+        self._event_set_create_results(event, response, added or 1, table)
 
     def _select_addr(self, subnet=None):
         if subnet is None:
@@ -341,13 +417,12 @@ class CephNVMECharm(ops.CharmBase):
         # The initial unit allocates the NQN on the fly, while the rest
         # of the peers need to have it set.
         msg['params']['nqn'] = res['nqn']
-        self._handle_ha_create(res, peers, msg, sock, event)
+        self._handle_ha_create(res, peers, msg, event)
 
-    def _leave_endpoint(self, sock, nqn, elem):
+    def _leave_endpoint(self, nqn, elem):
         msg = self.rpc.leave(addr=elem['addr'], port=elem['port'], nqn=nqn)
-        for addr, *_ in self._peer_addrs():
-            # We don't care about the response here.
-            self._msgloop(msg, addr=addr, sock=sock)
+        # We don't care about the responses here.
+        self._fanout([(addr, msg) for addr, *_ in self._peer_addrs()])
 
     def on_delete_endpoint_action(self, event):
         """Handle endpoint deletion."""
@@ -358,7 +433,7 @@ class CephNVMECharm(ops.CharmBase):
             event.fail('NQN is not present on this unit')
             return
 
-        self._leave_endpoint(sock, nqn, elem)
+        self._leave_endpoint(nqn, elem)
         res = self._msgloop(self.rpc.remove(nqn=nqn), sock=sock)
         if 'error' in res:
             event.fail('failed to remove endpoint: %s' % str(res['error']))
@@ -397,48 +472,67 @@ class CephNVMECharm(ops.CharmBase):
 
     def _handle_join_peers(self, msg, nqn, peers, num_max, event):
         sock = self._rpc_sock()
-        bdev_spec = None
-        joined = 0
+        table = []
+
+        # Find out which peers handle the NQN.
+        addrs = [addr for addr, *_ in peers]
+        found = []
+        replies = self._fanout([(addr, msg) for addr in addrs])
+        for addr, (resp, latency) in zip(addrs, replies):
+            table.append(self._peer_result(addr, 'find', resp, latency))
+            # Empty response means this peer doesn't handle the NQN.
+            if resp and 'error' not in resp:
+                found.append((addr, resp))
+
+        if not found:
+            return 0, None, table
+
+        # Create the endpoint.
+        try:
+            bdev_spec = self._create_bdev_on_join(nqn, found[0][1],
+                                                  sock, event)
+        except Exception as exc:
+            event.fail(str(exc))
+            return 0, None, table
 
-        for addr, *_ in peers:
-            resp = self._msgloop(msg, addr=addr, sock=sock)
-            if not resp:
-                # Empty response means this peer doesn't handle the NQN.
-                continue
+        joined = 0
+        alist = [{'addr': bdev_spec['addr'], 'port': bdev_spec['port']}]
+        while found and joined < num_max:
+            batch, found = found[:num_max - joined], found[num_max - joined:]
+
+            # Tell our peers to join us.
+            ok = []
+            replies = self._fanout([(addr, self.rpc.join(nqn=nqn,
+                                                         addresses=alist))
+                                    for addr, _ in batch])
+            for (addr, resp), (rv, latency) in zip(batch, replies):
+                table.append(self._peer_result(addr, 'join', rv, latency))
+                if 'error' in rv:
+                    logger.warning('peer %s failed to refer to us: %s' %
+                                   (addr, rv['error']))
+                else:
+                    ok.append((addr, resp))
+
+            # On success, join our peers.
+            leaves = []
+            replies = self._fanout([
+                ('127.0.0.1', self.rpc.join(
+                    nqn=nqn, addresses=[{'addr': addr,
+                                         'port': resp['port']}]))
+                for addr, resp in ok])
+            for (addr, _), (rv, _) in zip(ok, replies):
+                if 'error' in rv:
+                    logger.warning('could not join peer %s: %s' %
+                                   (addr, rv['error']))
+                    leaves.append((addr, self.rpc.leave(
+                        nqn=nqn, addr=bdev_spec['addr'],
+                        port=bdev_spec['port'])))
+                else:
+                    joined += 1
 
-            if bdev_spec is None:
-                # Create the endpoint if we haven't already.
-                try:
-                    bdev_spec = self._create_bdev_on_join(nqn, resp,
-                                                          sock, event)
-                except Exception as exc:
-                    event.fail(str(exc))
-                    return 0, bdev_spec
-
-            # Tell our peer to join us.
-            alist = [{'addr': bdev_spec['addr'], 'port': bdev_spec['port']}]
-            join_msg = self.rpc.join(nqn=nqn, addresses=alist)
-            rv = self._msgloop(join_msg, addr=addr, sock=sock)
-            if 'error' in rv:
-                logger.warning('peer %s failed to refer to us: %s' %
-                               (addr, rv['error']))
-                continue
-
-            # On success, join our peer.
-            alist[0] = {'addr': addr, 'port': resp['port']}
-            rv = self._msgloop(join_msg, addr='127.0.0.1', sock=sock)
-            if 'error' in rv:
-                logger.warning('could not join peer %s: %s' %
-                               (addr, rv['error']))
-                leave_msg = self.rpc.leave(
-                    nqn=nqn, addr=bdev_spec['addr'], port=bdev_spec['port'])
-                self._msgloop(leave_msg, addr=addr, sock=sock)
-            else:
-                joined += 1
-                if joined >= num_max:
-                    break
+            self._fanout(leaves)
 
-        return joined, bdev_spec
+        return joined, bdev_spec, table
 
     def on_join_endpoint_action(self, event):
         """Join an endpoint."""
@@ -458,7 +552,8 @@ class CephNVMECharm(ops.CharmBase):
             return
 
         msg = self.rpc.find(nqn=nqn)
-        joined, bdev = self._handle_join_peers(msg, nqn, peers, num_max, event)
+        joined, bdev, table = self._handle_join_peers(msg, nqn, peers,
+                                                      num_max, event)
 
         if not joined:
             if bdev is None:
@@ -467,7 +562,7 @@ class CephNVMECharm(ops.CharmBase):
             logger.warning('endpoint created but could not join any units')
             self._msgloop(self.rpc.remove(nqn=bdev['nqn']))
             return
-        self._event_set_create_results(event, bdev, joined)
+        self._event_set_create_results(event, bdev, joined, table)
 
     def on_list_endpoints_action(self, event):
         elems = self._msgloop({'method': 'list'}, addr='127.0.0.1')
@@ -541,7 +636,7 @@ class CephNVMECharm(ops.CharmBase):
             # For every endpoint that we support:
             # - Tell others that we're leaving
             # - Destroy the subsystem and remove the entry from the global map.
-            self._leave_endpoint(sock, elem['nqn'], elem)
+            self._leave_endpoint(elem['nqn'], elem)
             self._msgloop(self.rpc.remove(nqn=elem['nqn']), sock=sock)
 
         if self._pause(event):
@@ -15,13 +15,19 @@
 # limitations under the License.
 
 import argparse
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
 import errno
+import functools
 import json
 import logging
 import os
 import shutil
 import socket
 import sys
+import threading
 import time
 import uuid
 
@@ -33,6 +39,16 @@ import utils
 NQN_BASE = 'nqn.2014-08.org.nvmexpress:uuid:'
 NQN_DISCOVERY = 'nqn.2014-08.org.nvmexpress.discovery'
 
+# Methods that only read state, and can be served from a snapshot.
+READ_ONLY_METHODS = frozenset(('find', 'list', 'host_list'))
+
+# Number of threads running requests against SPDK and the global map.
+PROXY_WORKERS = 8
+
+# How long, and how many, responses are kept to answer retransmits.
+RESPONSE_CACHE_TTL = 120
+RESPONSE_CACHE_SIZE = 1024
+
 logger = logging.getLogger(__name__)
 
 
@@ -46,23 +62,32 @@ class ProxyError(Exception):
 
 
 class ProxyCommand:
+    """Base class for commands.
+
+    A command is made of steps: a generator that yields the RPCs to send
+    to SPDK, receives their replies and returns the result. This lets the
+    proxy either run a command on its own or interleave the RPCs of many
+    commands (see Proxy.replay)."""
+
     def __init__(self, msg, fatal=False):
         self.msg = msg
         self.fatal = fatal
 
+    def steps(self, proxy):
+        return (yield self.msg)
+
     def __call__(self, proxy):
-        return proxy.msgloop(self.msg)
+        return proxy.run_steps(self.steps(proxy))
 
 
-class ProxyCreateEndpoint:
+class ProxyCreateEndpoint(ProxyCommand):
     def __init__(self, msg, bdev_name, cluster):
         self.msg = msg
         self.bdev_name = bdev_name
         self.cluster = cluster
 
     @staticmethod
-    def _check_reply(msg, proxy):
-        reply = proxy.msgloop(msg)
+    def _check_reply(msg, reply, proxy):
         if proxy.is_error(reply):
             raise ValueError('%s failed: %s' % (msg['method'], reply))
         return reply
@@ -79,10 +104,10 @@ class ProxyCreateEndpoint:
         params['adrfam'] = str(adrfam)
         params['trsvcid'] = str(port)
         payload = proxy.rpc.nvmf_subsystem_add_listener(**kwargs)
-        self._check_reply(payload, proxy)
+        self._check_reply(payload, (yield payload), proxy)
         cleanup.append(proxy.rpc.nvmf_subsystem_remove_listener(**kwargs))
 
-    def __call__(self, proxy):
+    def steps(self, proxy):
         cleanup = []
         rpc = proxy.rpc
         nqn = self.msg['nqn']
@@ -91,12 +116,12 @@ class ProxyCreateEndpoint:
                 name=self.bdev_name, pool_name=self.msg['pool_name'],
                 rbd_name=self.msg['rbd_name'],
                 cluster_name=self.cluster, block_size=4096)
-            self._check_reply(payload, proxy)
+            self._check_reply(payload, (yield payload), proxy)
             cleanup.append(rpc.bdev_rbd_delete(name=self.bdev_name))
 
             payload = rpc.nvmf_create_subsystem(
                 nqn=nqn, ana_reporting=True, max_namespaces=2)
-            self._check_reply(payload, proxy)
+            self._check_reply(payload, (yield payload), proxy)
             cleanup.append(rpc.nvmf_delete_subsystem(nqn=nqn))
 
             # Add namespace before listener so the subsystem is not yet
@@ -105,21 +130,21 @@ class ProxyCreateEndpoint:
             payload = rpc.nvmf_subsystem_add_ns(
                 nqn=nqn,
                 namespace=proxy.ns_dict(self.bdev_name, nqn))
-            self._check_reply(payload, proxy)
+            reply = self._check_reply(payload, (yield payload), proxy)
 
-            self._add_listener(
+            yield from self._add_listener(
                 proxy, cleanup,
                 nqn=nqn,
                 listen_address=dict(trtype='tcp', traddr=self.msg['addr'],
                                     trsvcid=self.msg.get('port')))
-            return payload
+            return reply
         except Exception:
             for call in reversed(cleanup):
-                proxy.msgloop(call)
+                yield call
             raise
 
 
-class ProxyAddHost:
+class ProxyAddHost(ProxyCommand):
     def __init__(self, msg, dhchap_key):
         self.msg = msg
         self.dhchap_key = dhchap_key
@@ -127,7 +152,7 @@ class ProxyAddHost:
     @staticmethod
     def cleanup(proxy, path, response, fname=None):
         if fname is not None:
-            proxy.msgloop(proxy.rpc.keyring_file_remove_key(name=fname))
+            yield proxy.rpc.keyring_file_remove_key(name=fname)
         try:
             os.remove(path)
         except FileNotFoundError:
@@ -135,9 +160,9 @@ class ProxyAddHost:
 
         raise ProxyError(response['error'])
 
-    def __call__(self, proxy):
+    def steps(self, proxy):
         if not self.dhchap_key:
-            return proxy.msgloop(self.msg)
+            return (yield self.msg)
 
         params = self.msg['params']
         fname = proxy.key_file_name(params['nqn'], params['host'])
@@ -157,38 +182,38 @@ class ProxyAddHost:
             raise ProxyError('host already present with a different key')
 
         payload = proxy.rpc.keyring_file_add_key(name=fname, path=path)
-        rv = proxy.msgloop(payload)
+        rv = yield payload
         if proxy.is_error(rv) and rv['error'].get('code') != -errno.EEXIST:
-            self.cleanup(proxy, path, rv)
+            yield from self.cleanup(proxy, path, rv)
 
         payload = self.msg.copy()
         payload['params']['dhchap_key'] = fname
-        rv = proxy.msgloop(payload)
+        rv = yield payload
         if proxy.is_error(rv) and contents is None:
-            self.cleanup(proxy, path, rv, fname)
+            yield from self.cleanup(proxy, path, rv, fname)
 
         return rv
 
 
-class ProxyRemoveHost:
+class ProxyRemoveHost(ProxyCommand):
     def __init__(self, msg):
         self.msg = msg
 
-    def __call__(self, proxy):
+    def steps(self, proxy):
         nqn, host = self.msg['nqn'], self.msg['host']
         if host == 'any':
             payload = proxy.rpc.nvmf_subsystem_allow_any_host(
                 nqn=nqn, allow_any_host=False)
-            return proxy.msgloop(payload)
+            return (yield payload)
 
         payload = proxy.rpc.nvmf_subsystem_remove_host(nqn=nqn, host=host)
-        rv = proxy.msgloop(payload)
+        rv = yield payload
         if proxy.is_error(rv):
             return rv
 
         fname = proxy.key_file_name(nqn, host)
         payload = proxy.rpc.keyring_file_remove_key(name=fname)
-        if not proxy.is_error(proxy.msgloop(payload)):
+        if not proxy.is_error((yield payload)):
             try:
                 os.remove(os.path.join(proxy.key_dir, fname))
             except FileNotFoundError:
@@ -197,13 +222,37 @@ class ProxyRemoveHost:
         return rv
 
 
+class _ReplayTask:
+    """A command being replayed, and what to start once it succeeds."""
+
+    def __init__(self, cmd, steps, followers):
+        self.cmd = cmd
+        self.steps = steps
+        self.followers = followers
+        self.msg = None
+
+
+class _ProxyProtocol(asyncio.DatagramProtocol):
+    def __init__(self, proxy):
+        self.proxy = proxy
+
+    def connection_made(self, transport):
+        self.proxy.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.proxy.dispatch(data, addr)
+
+
 class Proxy:
     def __init__(self, config_path, rpc_path, map_cls=radosmap.RadosMap):
         with open(config_path) as file:
             config = json.loads(file.read())
 
         self.rpc = utils.RPC()
-        self.buffer = bytearray(4096 * 10)
+        self.rpc_lock = threading.Lock()
+        self.snapshot_lock = threading.Lock()
+        self.snapshot = None
+        self.generation = 0
         self.node_id = config['node-id']
         self.receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.receiver.bind(('0.0.0.0', config['proxy-port']))
@@ -213,9 +262,11 @@ class Proxy:
         self.key_dir = os.path.join(wdir, 'keys')
         self.local_state = self._read_local_state(wdir)
 
-        cmds = list(self._prepare_cmds(config, map_cls))
+        start = time.time()
+        groups = self._prepare_cmds(config, map_cls)
+        transport = next(groups)[0]
         try:
-            self._process_cmd(cmds[0])
+            self._process_cmd(transport)
         except ProxyError:
             # The first command is always 'nvmf_create_transport'
             # Since we're using TCP and support for it is always
@@ -225,7 +276,7 @@ class Proxy:
             # changed since the proxy was running, we need to
             # reinitialize SPDK as well.
             self.msgloop(self.rpc.spdk_kill_instance(sig_name='SIGHUP'))
-            self._process_cmd(cmds[0])
+            self._process_cmd(transport)
 
         # Start with a fresh key directory.
         try:
@@ -234,14 +285,11 @@ class Proxy:
             pass
 
         os.mkdir(self.key_dir)
-        for cmd in cmds[1:]:
-            try:
-                self._process_cmd(cmd)
-            except Exception:
-                # Check if the failure is fatal.
-                if not getattr(cmd, 'fatal', True):
-                    continue
-                raise
+        groups = list(groups)
+        ncmds, nrounds = self.replay(groups)
+        logger.info('ready after %.2fs: replayed %d commands for %d '
+                    'subsystems in %d round trips', time.time() - start,
+                    ncmds, len(groups) - 1, nrounds)
 
     def _connect(self, rpc_path, timeout=5 * 60):
         self.rpc_sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
@@ -252,6 +300,7 @@ class Proxy:
         while True:
             if os.access(rpc_path, os.F_OK) or time.time() > end:
                 self.rpc_sock.connect(rpc_path)
+                self.rpc_client = utils.RPCClient(self.rpc_sock)
                 return
 
             time.sleep(0.1)
@@ -301,15 +350,20 @@ class Proxy:
         return obj
 
     def _prepare_cmds(self, config, map_cls):
+        """Generate the commands that restore the state of the gateway.
+
+        The commands come in groups: the first command of a group must
+        succeed before the rest of it is run, and groups are independent
+        of one another."""
         self.gmapper = map_cls(config['pool'], logger)
-        yield ProxyCommand(self.rpc.nvmf_create_transport(trtype='tcp'))
+        yield [ProxyCommand(self.rpc.nvmf_create_transport(trtype='tcp'))]
 
         xaddr = utils.get_external_addr()
-        yield ProxyCommand(self.rpc.nvmf_subsystem_add_listener(
+        yield [ProxyCommand(self.rpc.nvmf_subsystem_add_listener(
             nqn=NQN_DISCOVERY,
             listen_address=dict(trtype='tcp', traddr=xaddr,
                                 adrfam=utils.get_adrfam(xaddr)[1],
-                                trsvcid=str(config['discovery-port']))))
+                                trsvcid=str(config['discovery-port']))))]
 
         if not self.local_state.get('clusters'):
             return
@@ -337,31 +391,29 @@ class Proxy:
             msg = {'nqn': nqn, 'pool_name': bdev_info['pool'],
                    'rbd_name': bdev_info['image'],
                    'addr': this_unit[0], 'port': this_unit[1]}
-            yield ProxyCreateEndpoint(msg, bdev_name, cluster['name'])
+            group = [ProxyCreateEndpoint(msg, bdev_name, cluster['name'])]
 
             del units[self.node_id]
             for unit in units.values():
                 payload = rpc.nvmf_discovery_add_referral(
                     subnqn=nqn, address=dict(
                         trtype='tcp', traddr=unit[0], trsvcid=str(unit[1])))
-                yield ProxyCommand(payload)
-
-            hosts = elem.get('hosts')
-            if hosts is None:
-                continue
+                group.append(ProxyCommand(payload))
 
-            for host in hosts:
+            for host in elem.get('hosts') or ():
                 h, k = host['host'], host.get('dhchap_key')
                 if h == 'any':
                     if not k:
                         continue
                     payload = rpc.nvmf_subsystem_allow_any_host(
                         nqn=nqn, allow_any_host=True)
-                    yield ProxyCommand(payload)
+                    group.append(ProxyCommand(payload))
                     continue
 
                 payload = rpc.nvmf_subsystem_add_host(nqn=nqn, host=h)
-                yield ProxyAddHost(payload, k)
+                group.append(ProxyAddHost(payload, k))
+
+            yield group
 
     def get_spdk_subsystems(self):
         """Return a dictionary describing the subsystems for the gateway."""
@@ -382,7 +434,9 @@ class Proxy:
         return ret
 
     def _process_cmd(self, cmd):
-        obj = cmd(self)
+        return self._check_result(cmd(self))
+
+    def _check_result(self, obj):
         if not isinstance(obj, dict):
             logger.error('invalid response received (%s - %s)',
                          type(obj), obj)
@@ -397,14 +451,105 @@ class Proxy:
     def is_error(msg):
         return not isinstance(msg, dict) or 'error' in msg
 
-    def msgloop(self, msg):
-        """Send an RPC to SPDK and receive the response."""
-        self.rpc_sock.sendall(json.dumps(msg).encode('utf8'))
-        nbytes = self.rpc_sock.recv_into(self.buffer)
+    def run_steps(self, steps):
+        """Run the steps of a command, one RPC at a time."""
         try:
-            return json.loads(self.buffer[:nbytes])
+            msg = next(steps)
+            while True:
+                msg = steps.send(self.msgloop(msg))
+        except StopIteration as exc:
+            return exc.value
+
+    def _advance(self, task, reply=None):
+        """Move a replayed command to its next RPC.
+
+        Returns True if the command has more RPCs to send, and False once
+        it has finished successfully. Errors are raised if fatal."""
+        try:
+            try:
+                if task.msg is None:
+                    task.msg = next(task.steps)
+                else:
+                    task.msg = task.steps.send(reply)
+                return True
+            except StopIteration as exc:
+                self._check_result(exc.value)
+                return False
         except Exception:
-            return None
+            # Check if the failure is fatal.
+            if getattr(task.cmd, 'fatal', True):
+                raise
+            logger.warning('skipping failed command: %s', task.cmd.msg)
+            task.followers = ()
+            return False
+
+    def replay(self, groups):
+        """Run groups of commands, pipelining their RPCs.
+
+        Within a group, the first command must succeed before the rest
+        are started. Everything else is independent, so each round sends
+        the next RPC of every running command to SPDK in a single batch.
+
+        Returns the number of commands run and of round trips made."""
+        active, ncmds, nrounds = [], 0, 0
+
+        def _start(cmd, followers=()):
+            nonlocal ncmds
+            ncmds += 1
+            task = _ReplayTask(cmd, cmd.steps(self), followers)
+            _step(task)
+
+        def _step(task, reply=None):
+            if self._advance(task, reply):
+                active.append(task)
+                return
+
+            for cmd in task.followers:
+                _start(cmd)
+
+        for group in groups:
+            if group:
+                _start(group[0], group[1:])
+
+        while active:
+            tasks, active = active, []
+            replies = self.msgloop_many([task.msg for task in tasks])
+            nrounds += 1
+            for task, reply in zip(tasks, replies):
+                _step(task, reply)
+
+        return ncmds, nrounds
+
+    def msgloop(self, msg):
+        """Send an RPC to SPDK and receive the response."""
+        with self.rpc_lock:
+            return self.rpc_client.call(msg)
+
+    def msgloop_many(self, msgs):
+        """Send several RPCs to SPDK at once and receive the responses."""
+        with self.rpc_lock:
+            return self.rpc_client.call_many(msgs)
+
+    def get_subsystems_snapshot(self):
+        """Get the SPDK subsystems as of the last change made to them.
+
+        The returned dictionary is shared and must not be modified."""
+        with self.snapshot_lock:
+            snapshot, generation = self.snapshot, self.generation
+
+        if snapshot is None:
+            snapshot = self.get_spdk_subsystems()
+            with self.snapshot_lock:
+                # Don't keep the result if a change raced with the query.
+                if generation == self.generation:
+                    self.snapshot = snapshot
+
+        return snapshot
+
+    def _invalidate_snapshot(self):
+        with self.snapshot_lock:
+            self.snapshot = None
+            self.generation += 1
 
     def _get_method_handlers(self, method):
         expand = getattr(self, '_expand_' + method, None)
@@ -415,31 +560,17 @@ class Proxy:
 
         return expand, post
 
-    def handle_request(self, msg, addr):
-        """Handle a request from a particular client."""
-        obj = json.loads(msg)
-        method = obj['method'].strip()
-        if method == 'stop':
-            logger.debug('stopping proxy as requested')
-            return True
-
+    def handle_request(self, method, params):
+        """Run a request to completion and return its response."""
         handler, post = self._get_method_handlers(method)
-        if handler is None:
-            logger.error('invalid method: %s', method)
-            self.receiver.sendto(('{"error": "invalid method: %s"}' %
-                                 method).encode('utf8'), addr)
-            return
-
-        logger.info('processing request: %s', obj)
-        obj = obj.get('params')
-        cmds = list(handler(obj))
+        cmds = list(handler(params))
         for cmd in cmds:
             self._process_cmd(cmd)
 
         resp = {}
         if post is not None:
-            resp = post(obj) or {}
-        self.receiver.sendto(_json_dumps(resp).encode('utf8'), addr)
+            resp = post(params) or {}
+        return resp
 
     @staticmethod
     def _make_exc_msg(exc):
@@ -448,23 +579,144 @@ class Proxy:
 
         return {"code": -2, "type": str(type(exc)), "message": str(exc)}
 
-    def serve(self):
-        """Main server loop."""
-        while True:
-            inaddr = None
+    @staticmethod
+    def _lock_keys(method, params):
+        # Requests are serialized on the NQNs they modify. Cluster
+        # additions modify the local state, and are serialized on their own.
+        if method == 'cluster_add':
+            return ['']
+        elif method == 'leave':
+            elems = params.get('subsystems') or [params]
+            return sorted(set(elem['nqn'] for elem in elems))
+
+        nqn = params.get('nqn') if isinstance(params, dict) else None
+        return [nqn] if nqn else []
+
+    def dispatch(self, data, addr):
+        """Start handling a request from a particular client."""
+        try:
+            obj = json.loads(data)
+            method = obj['method'].strip()
+        except Exception as exc:
+            logger.exception('invalid request: ')
+            self._respond({'error': self._make_exc_msg(exc)}, addr)
+            return
+
+        if method == 'stop':
+            logger.warning('got a request to stop proxy')
+            if not self.stopped.done():
+                self.stopped.set_result(None)
+            return
+
+        key = None
+        if obj.get('id') is not None:
+            key = (addr, obj['id'])
+            if key in self.responses:
+                # A retransmit. Answer it if the request is done, otherwise
+                # the response will be sent once it is.
+                _, data = self.responses[key]
+                logger.info('got a retransmit of request %s', key)
+                if data is not None:
+                    self.transport.sendto(data, addr)
+                return
+
+            self.responses[key] = (time.monotonic(), None)
+
+        task = asyncio.ensure_future(self._handle(method, obj, addr, key))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _handle(self, method, obj, addr, key):
+        logger.info('processing request from %s: %s', addr, obj)
+        try:
+            resp = await self._run_request(method, obj.get('params'))
+        except Exception as exc:
+            logger.exception('caught exception: ')
+            resp = {'error': self._make_exc_msg(exc)}
+
+        data = self._respond(resp, addr, obj.get('id'))
+        if key is not None:
+            self.responses[key] = (time.monotonic(), data)
+            self._expire_responses()
+
+    def _respond(self, resp, addr, msg_id=None):
+        # Responses to requests with an id echo it, so that clients can
+        # tell them apart from late replies to their previous requests.
+        if msg_id is not None:
+            resp = {'id': msg_id, 'result': resp}
+        data = _json_dumps(resp).encode('utf8')
+        self.transport.sendto(data, addr)
+        return data
+
+    def _expire_responses(self):
+        limit = time.monotonic() - RESPONSE_CACHE_TTL
+        while self.responses:
+            key, (stamp, data) = next(iter(self.responses.items()))
+            if (len(self.responses) <= RESPONSE_CACHE_SIZE and
+                    stamp >= limit):
+                break
+            self.responses.pop(key)
+
+    async def _run_request(self, method, params):
+        handler, _ = self._get_method_handlers(method)
+        if handler is None:
+            logger.error('invalid method: %s', method)
+            return {'error': 'invalid method: %s' % method}
+
+        loop = asyncio.get_running_loop()
+        call = functools.partial(self.handle_request, method, params)
+        if method in READ_ONLY_METHODS:
+            return await loop.run_in_executor(self.executor, call)
+
+        async with contextlib.AsyncExitStack() as stack:
+            for key in self._lock_keys(method, params):
+                await stack.enter_async_context(self._lock(key))
             try:
-                nbytes, inaddr = self.receiver.recvfrom_into(self.buffer)
-                logger.info('got a request from address ', inaddr)
-                rv = self.handle_request(self.buffer[:nbytes], inaddr)
-                if rv:
-                    logger.warning('got a request to stop proxy')
-                    return
-            except Exception as exc:
-                logger.exception('caught exception: ')
-                if inaddr is not None:
-                    err = {"error": self._make_exc_msg(exc)}
-                    self.receiver.sendto(json.dumps(err).encode('utf8'),
-                                         inaddr)
+                return await loop.run_in_executor(self.executor, call)
+            finally:
+                self._invalidate_snapshot()
+
+    @contextlib.asynccontextmanager
+    async def _lock(self, key):
+        """Hold the lock of an NQN, dropping it once nobody uses it."""
+        lock = self.locks.get(key)
+        if lock is None:
+            lock = self.locks[key] = asyncio.Lock()
+        self.lock_users[key] += 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self.lock_users[key] -= 1
+            if not self.lock_users[key]:
+                del self.lock_users[key]
+                del self.locks[key]
+
+    async def _serve(self):
+        loop = asyncio.get_running_loop()
+        self.stopped = loop.create_future()
+        self.tasks = set()
+        self.locks = {}
+        self.lock_users = collections.Counter()
+        self.responses = collections.OrderedDict()
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=PROXY_WORKERS)
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: _ProxyProtocol(self), sock=self.receiver)
+        try:
+            await self.stopped
+        finally:
+            transport.close()
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def serve(self):
+        """Main server loop.
+
+        Requests are handled concurrently. Read-only requests are served
+        from a snapshot of the SPDK subsystems, while requests that modify
+        state are serialized per NQN. Requests carrying an id are answered
+        only once; retransmits get the same response."""
+        asyncio.run(self._serve())
 
     # RPC handlers.
 
@@ -525,14 +777,15 @@ class Proxy:
         sub = subsystems[nqn]
         trid = sub['listen_addresses'][0]
 
-        def _update_map(gmap):
-            elem = {'name': msg['bdev_name'], 'units': {},
-                    'hosts': [{'host': 'any', 'key': False}]}
-            sub = gmap['subsys'].setdefault(nqn, elem)
-            sub['units'].update({self.node_id: [trid['traddr'],
-                                                str(trid['trsvcid'])]})
+        def _update_subsys(elem):
+            if elem is None:
+                elem = {'name': msg['bdev_name'], 'units': {},
+                        'hosts': [{'host': 'any', 'key': False}]}
+            elem['units'].update({self.node_id: [trid['traddr'],
+                                                 str(trid['trsvcid'])]})
+            return elem
 
-        self.gmapper.update_map(_update_map)
+        self.gmapper.update_subsys(nqn, _update_subsys)
         return {'nqn': nqn, 'addr': trid['traddr'], 'port': trid['trsvcid']}
 
     def _expand_remove(self, msg):
@@ -549,14 +802,14 @@ class Proxy:
         yield ProxyCommand(payload)
 
     def _post_remove(self, msg):
-        def _update_map(gmap):
-            elem = gmap['subsys'].get(msg['nqn'])
+        def _update_subsys(elem):
             if elem is None:
                 return
 
             elem['units'].pop(self.node_id)
+            return elem
 
-        self.gmapper.update_map(_update_map)
+        self.gmapper.update_subsys(msg['nqn'], _update_subsys)
 
     def _expand_cluster_add(self, msg):
         for cluster in self.local_state.get('clusters', ()):
@@ -591,16 +844,16 @@ class Proxy:
             yield ProxyCommand(payload)
 
     def _post_find(self, msg):
-        subsys = self.get_spdk_subsystems().get(msg['nqn'])
+        subsys = self.get_subsystems_snapshot().get(msg['nqn'])
         return self._subsystem_to_dict(subsys) if subsys else {}
 
     def _post_list(self, msg):
-        subsystems = self.get_spdk_subsystems()
+        subsystems = self.get_subsystems_snapshot()
         return [{'nqn': nqn, **self._subsystem_to_dict(subsys)}
                 for nqn, subsys in subsystems.items()]
 
     def _post_host_list(self, msg):
-        subsys = self.get_spdk_subsystems().get(msg['nqn'])
+        subsys = self.get_subsystems_snapshot().get(msg['nqn'])
         if subsys is None:
             return {'error': 'nqn not found'}
         elif subsys.get('allow_any_host'):
@@ -632,49 +885,50 @@ class Proxy:
             yield ProxyAddHost(payload, msg.get('dhchap_key'))
 
     def _post_host_add(self, msg):
-        def _update_map(gmap):
-            elem = gmap['subsys'].get(msg['nqn'])
+        def _update_subsys(elem):
             if elem is None:
-                self.logger.warning('host_add: NQN %s not found' % msg['nqn'])
+                logger.warning('host_add: NQN %s not found' % msg['nqn'])
                 return
 
             hosts = elem['hosts']
             host = msg['host']
             if host == 'any':
                 hosts[0]['key'] = True
-                return
+                return elem
 
             for h in hosts:
                 if h['host'] == host:
                     h['key'] = msg.get('dhchap_key')
-                    return
+                    return elem
 
             hosts.append({'host': host, 'key': msg.get('dhchap_key')})
+            return elem
 
-        self.gmapper.update_map(_update_map)
+        self.gmapper.update_subsys(msg['nqn'], _update_subsys)
 
     def _expand_host_del(self, msg):
         yield ProxyRemoveHost(msg)
 
     def _post_host_del(self, msg):
-        def _update_map(gmap):
-            elem = gmap['subsys'].get(msg['nqn'])
+        def _update_subsys(elem):
             if elem is None:
-                self.logger.warning('host_del: NQN %s not found' % msg['nqn'])
+                logger.warning('host_del: NQN %s not found' % msg['nqn'])
                 return
 
             hosts = elem['hosts']
-            h = msg['host']
-            if h == 'any':
+            host = msg['host']
+            if host == 'any':
                 hosts[0]['key'] = False
-                return
+                return elem
 
             for i, h in enumerate(hosts):
-                if h['host'] == h:
+                if h['host'] == host:
                     elem['hosts'] = hosts[:i] + hosts[i + 1:]
-                    return
+                    return elem
+
+            logger.warning('host %s not found' % host)
 
-            self.logger.warning('host %s not found' % h)
+        self.gmapper.update_subsys(msg['nqn'], _update_subsys)
 
 
 def main():
@@ -14,14 +14,33 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import copy
 import json
+import threading
 
 try:
     import rados
 except ImportError:
     rados = None
 
-VERSION = 1
+VERSION = 2
+
+# The global map is stored as the omap of this object, with one key per
+# subsystem, so that updates to different subsystems don't conflict.
+# Version 1 of the map was a single JSON blob in the object's data. The
+# blob is left in place when migrating, so that gateways still running a
+# version 1 charm during a refresh can read it, but it is no longer
+# updated: subsystems shouldn't be changed until every unit is refreshed.
+MAP_OBJECT = 'global-map'
+
+# Omap key holding the map version. NQNs always start with 'nqn.'.
+VERSION_KEY = 'version'
+
+# Number of omap entries fetched per read.
+OMAP_PAGE_SIZE = 1024
+
+# Maximum number of attempts for a compare-and-swap update.
+MAX_UPDATE_ATTEMPTS = 100
 
 
 class RadosMap:
@@ -30,6 +49,10 @@ class RadosMap:
         self.logger = logger
         self.cluster = None
         self.ioctx = None
+        self.watch = None
+        self.lock = threading.Lock()
+        self.cache = None
+        self.generation = 0
 
     def add_cluster(self, app_name, key, mon_host):
         if self.ioctx is not None:
@@ -41,54 +64,159 @@ class RadosMap:
         rd.connect()
         try:
             self.ioctx = rd.open_ioctx(self.pool_name)
+            self.cluster = rd
+            self._setup()
         except Exception:
+            self.ioctx = self.cluster = None
             rd.shutdown()
             raise
 
-        self.cluster = rd
         self.logger.info('connected to cluster')
 
-    def get_global_map(self):
-        size = 8192   # default size
-        num = 0
+    def _setup(self):
+        wx = self.ioctx.create_write_op()
+        try:
+            wx.new(0)
+            self.ioctx.operate_write_op(wx, MAP_OBJECT)
+        finally:
+            wx.release()
+
+        self._migrate()
+        try:
+            self.watch = self.ioctx.watch(MAP_OBJECT, self._on_notify)
+        except Exception:
+            # Without a watch, the cache cannot be kept coherent, so the
+            # map is read from the cluster every time.
+            self.logger.exception('failed to watch the global map')
+
+    def _migrate(self):
+        # Move the subsystems of a version 1 map into the omap.
+        for _ in range(MAX_UPDATE_ATTEMPTS):
+            if self._read_keys((VERSION_KEY,)):
+                return
+
+            size, _ = self.ioctx.stat(MAP_OBJECT)
+            data = self.ioctx.read(MAP_OBJECT, length=size) if size else b''
+            version = self.ioctx.get_last_version()
+            prev = json.loads(data.decode('utf8')) if data else {}
+            subsys = prev.get('subsys', {})
+
+            wx = self.ioctx.create_write_op()
+            try:
+                wx.omap_cmp(VERSION_KEY, '', rados.LIBRADOS_CMPXATTR_OP_EQ)
+                keys = (VERSION_KEY,) + tuple(subsys)
+                values = (str(VERSION),) + tuple(
+                    json.dumps(elem) for elem in subsys.values())
+                self.ioctx.set_omap(wx, keys, values)
+                if size:
+                    wx.assert_version(version)
+                self.ioctx.operate_write_op(wx, MAP_OBJECT)
+                self.logger.info('migrated %d subsystems to the global map '
+                                 'version %d' % (len(subsys), VERSION))
+            except rados.OSError:
+                # Someone else migrated the map concurrently.
+                pass
+            finally:
+                wx.release()
+
+        raise RuntimeError('failed to migrate global map')
+
+    def _on_notify(self, notify_id, notifier_id, watch_id, data):
+        if notifier_id == self.cluster.get_instance_id():
+            return
+
+        with self.lock:
+            self.cache = None
+            self.generation += 1
+
+    def _read_keys(self, keys):
+        rx = self.ioctx.create_read_op()
+        try:
+            it, _ = self.ioctx.get_omap_vals_by_keys(rx, keys)
+            self.ioctx.operate_read_op(rx, MAP_OBJECT)
+            return {k: v.decode('utf8') for k, v in it}
+        finally:
+            rx.release()
+
+    def _read_all(self):
+        ret, start = {}, ''
         while True:
-            num += 1
-            if num > 100:
-                raise RuntimeError('failed to get global map')
+            rx = self.ioctx.create_read_op()
             try:
-                data = self.ioctx.read('global-map', length=size)
-                return json.loads(data.decode('utf8'))
-            except json.decoder.JSONDecodeError:
-                size += 4096
-                continue
-            except rados.ObjectNotFound:
-                return {'version': 0, 'subsys': {}}
+                it, _ = self.ioctx.get_omap_vals(rx, start, '',
+                                                 OMAP_PAGE_SIZE)
+                self.ioctx.operate_read_op(rx, MAP_OBJECT)
+                page = [(k, v.decode('utf8')) for k, v in it]
+            finally:
+                rx.release()
+
+            ret.update(page)
+            if len(page) < OMAP_PAGE_SIZE:
+                return ret
+            start = page[-1][0]
+
+    def get_global_map(self):
+        with self.lock:
+            cache, generation = self.cache, self.generation
 
-    def update_map(self, fn):
+        if cache is None:
+            entries = self._read_all()
+            entries.pop(VERSION_KEY, None)
+            cache = {'version': VERSION,
+                     'subsys': {nqn: json.loads(elem)
+                                for nqn, elem in entries.items()}}
+            with self.lock:
+                # Only keep the map if no change was notified meanwhile.
+                if self.watch is not None and generation == self.generation:
+                    self.cache = cache
+
+        return copy.deepcopy(cache)
+
+    def update_subsys(self, nqn, fn):
+        """Update the entry of a subsystem in the global map.
+
+        The function is called with the current entry (or None), and
+        returns the entry to store, or None to leave it as it is. The
+        update is applied only if the entry hasn't changed since it was
+        read, and is retried otherwise."""
         if self.ioctx is None:
             raise RuntimeError('cannot update map if not connected to cluster')
 
-        while True:
-            prev = self.get_global_map()
+        for _ in range(MAX_UPDATE_ATTEMPTS):
+            prev = self._read_keys((nqn,)).get(nqn, '')
             try:
-                wx = self.ioctx.create_write_op()
-                if not prev['version']:
-                    wx.new(1)
-                    prev['version'] = VERSION
-                else:
-                    wx.assert_version(self.ioctx.get_last_version())
-
-                try:
-                    fn(prev)
-                except Exception as exc:
-                    self.logger.exception('exception caught when updating '
-                                          'global map: %s' % str(exc))
-                    return
-
-                wx.write_full(json.dumps(prev).encode('utf8'))
-                self.ioctx.operate_write_op(wx, 'global-map')
+                elem = fn(json.loads(prev) if prev else None)
+            except Exception as exc:
+                self.logger.exception('exception caught when updating '
+                                      'global map: %s' % str(exc))
                 return
-            except (rados.ObjectExists, rados.OSError):
-                pass
+
+            if elem is None:
+                return
+
+            data = json.dumps(elem)
+            wx = self.ioctx.create_write_op()
+            try:
+                wx.omap_cmp(nqn, prev, rados.LIBRADOS_CMPXATTR_OP_EQ)
+                self.ioctx.set_omap(wx, (nqn,), (data,))
+                self.ioctx.operate_write_op(wx, MAP_OBJECT)
+            except rados.OSError:
+                # The entry changed since it was read.
+                continue
             finally:
                 wx.release()
+
+            with self.lock:
+                if self.cache is not None:
+                    self.cache['subsys'][nqn] = elem
+
+            self._notify(nqn)
+            return
+
+        raise RuntimeError('failed to update global map')
+
+    def _notify(self, nqn):
+        try:
+            self.ioctx.notify(MAP_OBJECT, nqn)
+        except Exception:
+            self.logger.exception('failed to notify global map change')
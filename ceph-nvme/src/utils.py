@@ -14,9 +14,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
 import json
 import logging
 import os
+import re
 import shutil
 import socket
 import subprocess
@@ -31,13 +33,17 @@ logger = logging.getLogger(__name__)
 class RPC:
     """See https://spdk.io/doc/jsonrpc_proxy.html
        for the format used in RPC."""
-    id_ = 1
+    def __init__(self, first_id=1):
+        self.id_ = first_id
+
+    def next_id(self):
+        id_ = self.id_
+        self.id_ = (id_ + 1) % (1 << 31)
+        return id_
 
     def __getattr__(self, name):
         def _inner(**kwargs):
-            id_ = self.id_
-            self.id_ = (id_ + 1) % 100
-            base = {'id': id_, 'method': name}
+            base = {'id': self.next_id(), 'method': name}
             if kwargs:
                 base['params'] = kwargs
             return base
@@ -45,6 +51,134 @@ class RPC:
         return _inner
 
 
+class RPCClient:
+    """Streaming JSON-RPC client for the SPDK socket.
+
+    Replies are framed incrementally out of a growable receive buffer, so
+    they may have any size and span any number of reads. Each reply is
+    matched to its request by id, which allows several requests to be
+    outstanding at the same time."""
+    _TOKENS = re.compile(rb'[][{}"]')
+    _STRING_TOKENS = re.compile(rb'["\\]')
+
+    def __init__(self, sock, bufsize=64 * 1024):
+        self.sock = sock
+        self.buffer = bytearray(bufsize)
+        self.view = memoryview(self.buffer)
+        # Data received but not yet parsed is in buffer[start:end]
+        self.start = self.end = 0
+        # Framing state of the data in buffer[start:scan]
+        self.scan = 0
+        self.depth = 0
+        self.in_string = False
+        # Ids of the requests sent, and their replies as they arrive.
+        self.pending = collections.OrderedDict()
+        self.replies = {}
+
+    def send(self, *msgs):
+        """Send one or more requests without waiting for their replies."""
+        for msg in msgs:
+            self.pending[msg.get('id')] = None
+        self.sock.sendall(b''.join(json.dumps(msg).encode('utf8')
+                                   for msg in msgs))
+
+    def call(self, msg):
+        """Send a request and wait for its reply."""
+        self.send(msg)
+        return self.wait(msg.get('id'))
+
+    def call_many(self, msgs):
+        """Send several requests at once and return their replies."""
+        self.send(*msgs)
+        return [self.wait(msg.get('id')) for msg in msgs]
+
+    def wait(self, id_):
+        """Wait for the reply to a request. None if it was not valid JSON."""
+        while id_ not in self.replies:
+            self._recv_reply()
+        return self.replies.pop(id_)
+
+    def _recv_reply(self):
+        end = self._frame()
+        while end is None:
+            self._fill()
+            end = self._frame()
+
+        try:
+            reply = json.loads(self.buffer[self.start:end])
+        except ValueError:
+            reply = None
+
+        self.start = self.scan = end
+        if self.start == self.end:
+            self.start = self.end = self.scan = 0
+
+        id_ = reply.get('id') if isinstance(reply, dict) else None
+        if id_ not in self.pending:
+            # Replies come in order, so attribute it to the oldest request.
+            id_ = next(iter(self.pending))
+        del self.pending[id_]
+        self.replies[id_] = reply
+
+    def _frame(self):
+        """Return the end of the first complete JSON value, if any."""
+        buf, pos, end = self.buffer, self.scan, self.end
+        while True:
+            if self.in_string:
+                match = self._STRING_TOKENS.search(buf, pos, end)
+                if match is None:
+                    pos = end
+                    break
+                elif match.group() == b'"':
+                    self.in_string = False
+                    pos = match.end()
+                elif match.end() < end:
+                    # Skip the escaped character.
+                    pos = match.end() + 1
+                else:
+                    pos = match.start()
+                    break
+                continue
+
+            match = self._TOKENS.search(buf, pos, end)
+            if match is None:
+                pos = end
+                break
+
+            pos = match.end()
+            token = match.group()
+            if token == b'"':
+                self.in_string = True
+            elif token in b'[{':
+                self.depth += 1
+            else:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.scan = pos
+                    return pos
+
+        self.scan = pos
+        return None
+
+    def _fill(self):
+        """Receive more data, making room in the buffer if needed."""
+        if self.end == len(self.buffer):
+            size = self.end - self.start
+            if self.start:
+                self.buffer[:size] = self.view[self.start:self.end]
+            else:
+                self.view.release()
+                self.buffer.extend(bytes(len(self.buffer)))
+                self.view = memoryview(self.buffer)
+            self.scan -= self.start
+            self.start, self.end = 0, size
+
+        nbytes = self.sock.recv_into(self.view[self.end:])
+        if not nbytes:
+            raise ConnectionError('RPC socket closed')
+        self.end += nbytes
+
+
 def default_cpuset(cpus):
     """By default, use half of the available cores."""
     rlen = -(len(cpus) // -2)
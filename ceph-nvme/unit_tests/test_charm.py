@@ -15,6 +15,7 @@
 # limitations under the License.
 
 import json
+import threading
 import unittest
 import unittest.mock as mock
 
@@ -30,16 +31,19 @@ class MockSocket:
         self.sendto.side_effect = self._sendto
         self.recv = mock.MagicMock()
         self.recv.side_effect = self._recv
-        self.response = None
+        # Requests to several peers may be in flight at the same time.
+        self.local = threading.local()
+        self.lock = threading.Lock()
         self.skip_first = skip_first
         self.cached_resp = cached_resp
 
     def _sendto(self, msg, *args):
-        self.response = self._compute_response(msg)
+        with self.lock:
+            self.local.response = self._compute_response(msg)
 
     def _recv(self, *args):
-        ret = self.response
-        self.response = None
+        ret = self.local.response
+        self.local.response = None
         return ret
 
     def close(self):
@@ -89,11 +93,15 @@ class TestCharm(unittest.TestCase):
                 'auth': 'some-auth',
             })
 
-    def _check_calls(self, call_args_list, expected):
+    def _check_calls(self, call_args_list, expected, unordered=0):
         calls = [(json.loads(call.args[0])['method'], call.args[1][0])
                  for call in call_args_list]
 
         self.assertEqual(len(calls), len(expected))
+        if unordered:
+            # The last calls were sent concurrently.
+            calls[-unordered:] = sorted(calls[-unordered:],
+                                        key=lambda c: c[1] == '1.1.1.1')
         for i, (method, local) in enumerate(expected):
             self.assertEqual(calls[i][0], method)
             self.assertEqual(calls[i][1] != '1.1.1.1', local)
@@ -142,16 +150,22 @@ class TestCharm(unittest.TestCase):
         charm.on_create_endpoint_action(event)
         event.set_results.assert_called_with(
             {'nqn': 'nqn.1', 'address': '3.3.3.3',
-             'port': 1, 'units': 2})
+             'port': 1, 'units': 2, 'peers': mock.ANY})
+
+        peers = event.set_results.call_args.args[0]['peers']
+        self.assertEqual([(peers[str(i)]['method'], peers[str(i)]['result'])
+                          for i in range(len(peers))],
+                         [('create', 'ok'), ('join', 'ok'), ('join', 'ok')])
 
         # We expect the following calls:
         # local-create
         # remote-create
         # local-join
-        # remote-join
+        # remote-join (concurrently with the local one)
         expected = [('create', True), ('create', False),
                     ('join', True), ('join', False)]
-        self._check_calls(rpc_sock.sendto.call_args_list, expected)
+        self._check_calls(rpc_sock.sendto.call_args_list, expected,
+                          unordered=2)
 
     @mock.patch.object(charm.subprocess, 'check_output')
     def test_create_no_ha(self, check_output):
@@ -205,7 +219,7 @@ class TestCharm(unittest.TestCase):
         charm.on_join_endpoint_action(event)
         event.set_results.assert_called_with(
             {'nqn': 'nqn.1', 'address': '3.3.3.3',
-             'port': 1, 'units': 1})
+             'port': 1, 'units': 1, 'peers': mock.ANY})
 
         # We expect the following calls:
         # local-find
@@ -303,3 +317,15 @@ class TestCharm(unittest.TestCase):
         # remote-leave
         expected = [('list', True), ('leave', False)]
         self._check_calls(rpc_sock.sendto.call_args_list, expected)
+
+    def test_recv_response_skips_stale(self):
+        sock = mock.MagicMock()
+        sock.recv.side_effect = [
+            json.dumps({'id': 1, 'result': {'nqn': 'nqn.1'}}).encode('utf8'),
+            json.dumps({'id': 2, 'result': {}}).encode('utf8')]
+        self.assertEqual(charm.CephNVMECharm._recv_response(sock, 2), {})
+        self.assertEqual(sock.recv.call_count, 2)
+
+        # Proxies that don't echo the id.
+        sock.recv.side_effect = [b'[]']
+        self.assertEqual(charm.CephNVMECharm._recv_response(sock, 3), [])
@@ -1,4 +1,7 @@
+import json
 import logging
+import socket
+import threading
 import unittest
 import unittest.mock as mock
 
@@ -17,36 +20,100 @@ class MockRados:
             self.open_ioctx = _throw
         else:
             self.open_ioctx = mock.MagicMock()
+            self.open_ioctx.return_value = MockIoctx()
 
         self.shutdown = mock.MagicMock()
+        self.get_instance_id = lambda: 1
 
 
-class MockIoctx:
-    def __init__(self, result):
-        self.result = result
-
-    def read(self, name, length):
-        if not isinstance(self.result, bytes):
-            raise self.result()
-
-        return self.result
+class ReadOp:
+    def release(self):
+        pass
 
 
 class WriteOp:
     def __init__(self):
-        self.new = mock.MagicMock()
-        self.assert_version = mock.MagicMock()
-        self.write_full = mock.MagicMock()
+        self.cmps = []
+        self.omap = {}
+        self.version = None
+
+    def new(self, exclusive):
+        pass
+
+    def omap_cmp(self, key, val, cmp_op):
+        self.cmps.append((key, val))
+
+    def assert_version(self, version):
+        self.version = version
 
     def release(self):
         pass
 
 
+class MockIoctx:
+    """An object with data and an omap, with the semantics of RADOS."""
+
+    def __init__(self, data=b'', omap=None):
+        self.data = data
+        self.omap = dict(omap or {})
+        self.version = 1
+        self.reads = 0
+        self.watch = mock.MagicMock()
+        self.notify = mock.MagicMock()
+
+    def create_read_op(self):
+        return ReadOp()
+
+    def create_write_op(self):
+        return WriteOp()
+
+    def get_omap_vals_by_keys(self, op, keys):
+        # Like in librados, the results are filled in by the operation.
+        out = []
+        op.fill = lambda: out.extend(
+            (k, self.omap[k].encode('utf8')) for k in keys if k in self.omap)
+        return out, 0
+
+    def get_omap_vals(self, op, start_after, prefix, max_return):
+        out = []
+        keys = lambda: [k for k in sorted(self.omap) if k > start_after]   # noqa
+        op.fill = lambda: out.extend(
+            (k, self.omap[k].encode('utf8')) for k in keys()[:max_return])
+        return out, 0
+
+    def operate_read_op(self, op, oid):
+        self.reads += 1
+        op.fill()
+
+    def set_omap(self, op, keys, values):
+        op.omap.update(zip(keys, values))
+
+    def operate_write_op(self, op, oid):
+        for key, val in op.cmps:
+            if self.omap.get(key, '') != val:
+                raise OSError()
+        if op.version not in (None, self.version):
+            raise OSError()
+
+        self.omap.update(op.omap)
+        self.version += 1
+
+    def stat(self, oid):
+        return len(self.data), 0
+
+    def read(self, oid, length):
+        return self.data[:length]
+
+    def get_last_version(self):
+        return self.version
+
+
 class RadosObjects:
     ObjectNotFound = KeyError
     ObjectExists = ValueError
     OSError = OSError
     Rados = MockRados
+    LIBRADOS_CMPXATTR_OP_EQ = 1
 
 
 class TestRadosMap(unittest.TestCase):
@@ -54,12 +121,20 @@ class TestRadosMap(unittest.TestCase):
         self.logger = logging.getLogger(__name__)
         radosmap.rados = RadosObjects
 
+    def _map(self, ioctx):
+        rd = radosmap.RadosMap('some-pool', self.logger)
+        rd.cluster = MockRados()
+        rd.ioctx = ioctx
+        return rd
+
     def test_rados_connect(self):
         rd = radosmap.RadosMap('some-pool', self.logger)
         MockRados.THROW = False
         rd.add_cluster('ceph-nvme', 'some-key', '0.0.0.0')
         rd.cluster.connect.assert_called_once()
         rd.cluster.open_ioctx.assert_called_once()
+        rd.ioctx.watch.assert_called_once_with('global-map', rd._on_notify)
+        self.assertEqual(rd.ioctx.omap, {'version': str(radosmap.VERSION)})
 
     def test_rados_connfailed(self):
         rd = radosmap.RadosMap('some-pool', self.logger)
@@ -67,40 +142,81 @@ class TestRadosMap(unittest.TestCase):
         with self.assertRaises(Exception):
             rd.add_cluster('ceph-nvme', 'some-key', '0.0.0.0')
 
-    def test_global_map(self):
-        rd = radosmap.RadosMap('some-pool', self.logger)
-        rd.ioctx = MockIoctx(b'{"version":%d,"subsys":{}}' % radosmap.VERSION)
+    def test_migrate(self):
+        blob = {'version': 1, 'subsys': {'nqn.1': {'units': {}}}}
+        data = json.dumps(blob).encode('utf8')
+        rd = self._map(MockIoctx(data))
+        rd._setup()
+        # The version 1 map is still readable by older gateways.
+        self.assertEqual(rd.ioctx.data, data)
+        self.assertEqual(rd.get_global_map(),
+                         {'version': radosmap.VERSION,
+                          'subsys': {'nqn.1': {'units': {}}}})
+
+        # Migrating again is a no-op.
+        rd._setup()
+        self.assertEqual(len(rd.ioctx.omap), 2)
+
+    def test_global_map_cached(self):
+        rd = self._map(MockIoctx(omap={'version': '2', 'nqn.1': '{}'}))
+        rd.watch = mock.MagicMock()
         ret = rd.get_global_map()
-        self.assertNotEqual(ret['version'], 0)
-
-    def test_global_map_nonexistent(self):
-        rd = radosmap.RadosMap('some-pool', self.logger)
-        rd.ioctx = MockIoctx(radosmap.rados.ObjectNotFound)
-        ret = rd.get_global_map()
-        self.assertEqual(ret['version'], 0)
-
-    def test_global_map_fail(self):
-        rd = radosmap.RadosMap('some-pool', self.logger)
-        rd.ioctx = MockIoctx(b'{')
-        with self.assertRaises(RuntimeError):
-            rd.get_global_map()
-
-    def test_update_map_first(self):
-        rd = radosmap.RadosMap('some-pool', self.logger)
-        rd.get_global_map = lambda: {'version': 0, 'subsys': {}}
-        rd.ioctx = mock.MagicMock()
-        rd.ioctx.operate_write_op = mock.MagicMock()
-        wop = WriteOp()
-        rd.ioctx.create_write_op = lambda: wop
-
-        def _update(gmap):
-            gmap['subsys']['nqn.1'] = {}
-
-        rd.update_map(_update)
-        rd.ioctx.operate_write_op.assert_called_with(wop, 'global-map')
-        wop.write_full.assert_called_with(
-            radosmap.json.dumps({'version': radosmap.VERSION,
-                                 'subsys': {'nqn.1': {}}}).encode('utf8'))
+        self.assertEqual(ret['subsys'], {'nqn.1': {}})
+
+        # Changes to the returned map don't affect the cache.
+        ret['subsys'].clear()
+        self.assertEqual(rd.get_global_map()['subsys'], {'nqn.1': {}})
+        self.assertEqual(rd.ioctx.reads, 1)
+
+        # Notifications from other gateways invalidate the cache.
+        rd.ioctx.omap['nqn.2'] = '{}'
+        rd._on_notify(0, 2, 0, b'nqn.2')
+        self.assertEqual(sorted(rd.get_global_map()['subsys']),
+                         ['nqn.1', 'nqn.2'])
+        self.assertEqual(rd.ioctx.reads, 2)
+
+    def test_global_map_paged(self):
+        omap = {'nqn.%d' % i: '{}' for i in range(5)}
+        rd = self._map(MockIoctx(omap=omap))
+        with mock.patch.object(radosmap, 'OMAP_PAGE_SIZE', new=2):
+            ret = rd.get_global_map()
+
+        self.assertEqual(sorted(ret['subsys']), sorted(omap))
+        self.assertEqual(rd.ioctx.reads, 3)
+
+    def test_update_subsys(self):
+        rd = self._map(MockIoctx(omap={'version': '2'}))
+
+        def _update(elem):
+            self.assertIsNone(elem)
+            return {'units': {'nx': ['1.1.1.1', '4420']}}
+
+        rd.update_subsys('nqn.1', _update)
+        self.assertEqual(json.loads(rd.ioctx.omap['nqn.1']),
+                         {'units': {'nx': ['1.1.1.1', '4420']}})
+        rd.ioctx.notify.assert_called_once_with('global-map', 'nqn.1')
+
+    def test_update_subsys_conflict(self):
+        rd = self._map(MockIoctx(omap={'nqn.1': '{"hosts": []}'}))
+        calls = []
+
+        def _update(elem):
+            calls.append(elem)
+            if len(calls) == 1:
+                # Another gateway changes the entry in the meantime.
+                rd.ioctx.omap['nqn.1'] = '{"hosts": ["h1"]}'
+            elem['hosts'].append('h2')
+            return elem
+
+        rd.update_subsys('nqn.1', _update)
+        self.assertEqual(calls[1], {'hosts': ['h1', 'h2']})
+        self.assertEqual(json.loads(rd.ioctx.omap['nqn.1']),
+                         {'hosts': ['h1', 'h2']})
+
+    def test_update_subsys_noop(self):
+        rd = self._map(MockIoctx(omap={'nqn.1': '{}'}))
+        rd.update_subsys('nqn.1', lambda elem: None)
+        rd.ioctx.notify.assert_not_called()
 
 
 class TestUtils(unittest.TestCase):
@@ -141,3 +257,74 @@ class TestUtils(unittest.TestCase):
         xaddr = src_utils.get_external_addr()
         _, fam = src_utils.get_adrfam(xaddr)
         self.assertTrue(fam == 'IPv4' or fam == 'IPv6')
+
+
+class TestRPCClient(unittest.TestCase):
+    def setUp(self):
+        self.sock, self.peer = socket.socketpair()
+        self.client = src_utils.RPCClient(self.sock, bufsize=16)
+
+    def tearDown(self):
+        self.sock.close()
+        self.peer.close()
+
+    def _recv_requests(self, num):
+        decoder = json.JSONDecoder()
+        data, reqs = '', []
+        while len(reqs) < num:
+            data += self.peer.recv(4096).decode('utf8')
+            while data:
+                try:
+                    obj, end = decoder.raw_decode(data)
+                except ValueError:
+                    break
+                reqs.append(obj)
+                data = data[end:]
+        return reqs
+
+    def test_large_reply(self):
+        rpc = src_utils.RPC()
+        msg = rpc.nvmf_get_subsystems()
+        result = [{'nqn': 'nqn.%d' % i, 'name': 'a "{quoted}" \\ [name]'}
+                  for i in range(1000)]
+        data = json.dumps({'id': msg['id'], 'result': result}).encode()
+
+        def _serve():
+            self._recv_requests(1)
+            # Send the reply in small pieces.
+            for i in range(0, len(data), 1000):
+                self.peer.sendall(data[i:i + 1000])
+
+        thread = threading.Thread(target=_serve)
+        thread.start()
+        reply = self.client.call(msg)
+        thread.join()
+        self.assertEqual(reply['result'], result)
+
+    def test_pipelined_replies(self):
+        rpc = src_utils.RPC()
+        msgs = [rpc.method(x=i) for i in range(10)]
+        self.client.send(*msgs)
+        reqs = self._recv_requests(10)
+        self.assertEqual(reqs, msgs)
+
+        # Reply in reverse order, all in a single write.
+        self.peer.sendall(b''.join(
+            json.dumps({'id': req['id'], 'result': req['params']['x']})
+            .encode() for req in reversed(reqs)))
+        replies = [self.client.wait(msg['id']) for msg in msgs]
+        self.assertEqual([r['result'] for r in replies], list(range(10)))
+
+    def test_reply_without_id(self):
+        rpc = src_utils.RPC()
+        msgs = [rpc.method_1(), rpc.method_2()]
+        self.client.send(*msgs)
+        self.peer.sendall(b'{"error": "bad request"}\n{"result": [1,]}')
+        self.assertEqual(self.client.wait(msgs[0]['id']),
+                         {'error': 'bad request'})
+        self.assertIsNone(self.client.wait(msgs[1]['id']))
+
+    def test_closed_socket(self):
+        self.peer.close()
+        with self.assertRaises(ConnectionError):
+            self.client.call({'id': 1, 'method': 'x'})
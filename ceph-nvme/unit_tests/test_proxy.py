@@ -14,6 +14,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
+import collections
 import json
 import multiprocessing
 import os
@@ -38,12 +40,10 @@ class MockGmap:
     def get_global_map(self):
         return self.gmap
 
-    def update_map(self, fn):
-        tmp = self.gmap.copy()
-        fn(tmp)
-        self.gmap = tmp
-        if not isinstance(tmp, dict):
-            raise TypeError()
+    def update_subsys(self, nqn, fn):
+        elem = fn(self.gmap['subsys'].get(nqn))
+        if elem is not None:
+            self.gmap['subsys'][nqn] = elem
 
 
 class TestBase(unittest.TestCase):
@@ -115,9 +115,11 @@ class TestBase(unittest.TestCase):
         self.spdk.join()
 
     def msgloop(self, msg):
-        msg = json.dumps(msg).encode('utf8')
-        self.local_sock.sendto(msg, self.proxy_addr)
-        return json.loads(self.local_sock.recv(2048))
+        self.local_sock.sendto(json.dumps(msg).encode('utf8'),
+                               self.proxy_addr)
+        rv = json.loads(self.local_sock.recv(2048))
+        self.assertEqual(rv['id'], msg['id'])
+        return rv['result']
 
 
 class TestProxy(TestBase):
@@ -226,3 +228,129 @@ class TestProxyEmptyLocalFile(TestBase):
         rv = self.msgloop(self.rpc.list())
         self.assertNotIn('error', rv)
         self.assertEqual(len(rv), 0)
+
+
+class MockGmapBulk(MockGmap):
+    BASE = {'subsys': {
+        'nqn.%d' % i:
+            {'name': 'rbd://{"pool":"p1","image":"i%d","cluster":"ceph"}' % i,
+             'hosts': [{'host': 'nqn.h%d' % i, 'dhchap_key': 'key-%d' % i},
+                       {'host': 'nqn.g%d' % i}],
+             'units': {'nx': ['127.0.0.1', str(9000 + i)],
+                       'ny': ['127.0.0.2', str(9000 + i)]}}
+        for i in range(8)}}
+
+
+class TestProxyBulkReplay(TestBase):
+    GMAP_CLS = MockGmapBulk
+    LOCAL_PORT = 65003
+    LOCAL_STATE = {'clusters': [{'name': 'ceph', 'user': 'u1', 'key': 'K',
+                                 'mon_host': '1.1.1.1'}]}
+
+    def test_proxy_bulk_replay(self):
+        rv = self.msgloop(self.rpc.list())
+        self.assertNotIn('error', rv)
+        self.assertEqual(sorted(elem['nqn'] for elem in rv),
+                         sorted(MockGmapBulk.BASE['subsys']))
+        for elem in rv:
+            port = str(9000 + int(elem['nqn'].split('.')[1]))
+            self.assertEqual(port, elem['port'])
+
+        rv = self.msgloop(self.rpc.host_list(nqn='nqn.3'))
+        self.assertEqual(sorted(elem['host'] for elem in rv),
+                         ['nqn.g3', 'nqn.h3'])
+
+
+class TestProxyRetransmit(TestBase):
+    GMAP_CLS = MockGmap
+    LOCAL_PORT = 65004
+
+    def test_retransmit(self):
+        msg = self.rpc.cluster_add(
+            name='ceph', user='client', key='ABC123', mon_host='1.1.1.1')
+        self.assertNotIn('error', self.msgloop(msg))
+
+        msg = self.rpc.create(
+            nqn='nqn.1', cluster='ceph', pool_name='mypool',
+            rbd_name='myimage', addr='0.0.0.0')
+        rv = self.msgloop(msg)
+        self.assertNotIn('error', rv)
+
+        # A retransmit is answered with the same response.
+        self.assertEqual(rv, self.msgloop(msg))
+
+        # A new request fails, since the endpoint already exists.
+        msg = self.rpc.create(
+            nqn='nqn.1', cluster='ceph', pool_name='mypool',
+            rbd_name='myimage', addr='0.0.0.0')
+        self.assertIn('error', self.msgloop(msg))
+
+        # Reads see the changes.
+        rv = self.msgloop(self.rpc.list())
+        self.assertEqual(['nqn.1'], [elem['nqn'] for elem in rv])
+
+    def test_concurrent_reads(self):
+        for _ in range(16):
+            msg = json.dumps(self.rpc.list()).encode('utf8')
+            self.local_sock.sendto(msg, self.proxy_addr)
+
+        for _ in range(16):
+            rv = json.loads(self.local_sock.recv(2048))
+            self.assertEqual(len(rv['result']), 0)
+
+
+class TestProxyReplay(unittest.TestCase):
+    def _make_proxy(self, failing):
+        obj = proxy.Proxy.__new__(proxy.Proxy)
+        obj.sent = []
+
+        def _msgloop_many(msgs):
+            obj.sent.extend(msg['method'] for msg in msgs)
+            return [{'error': 'failed'} if msg['method'] == failing
+                    else {'result': True} for msg in msgs]
+
+        obj.msgloop_many = _msgloop_many
+        return obj
+
+    def test_replay_skips_non_fatal_error(self):
+        rpc = proxy.utils.RPC()
+        obj = self._make_proxy('nvmf_discovery_add_referral')
+        group = [proxy.ProxyCommand(rpc.nvmf_create_subsystem(nqn='n1')),
+                 proxy.ProxyCommand(rpc.nvmf_discovery_add_referral(
+                     subnqn='n1', address={})),
+                 proxy.ProxyCommand(rpc.nvmf_subsystem_add_host(
+                     nqn='n1', host='h1'))]
+        self.assertEqual(obj.replay([group]), (3, 2))
+        self.assertEqual(obj.sent, ['nvmf_create_subsystem',
+                                    'nvmf_discovery_add_referral',
+                                    'nvmf_subsystem_add_host'])
+
+    def test_replay_raises_fatal_error(self):
+        rpc = proxy.utils.RPC()
+        obj = self._make_proxy('nvmf_discovery_add_referral')
+        group = [proxy.ProxyCommand(rpc.nvmf_discovery_add_referral(
+            subnqn='n1', address={}), fatal=True)]
+        with self.assertRaises(proxy.ProxyError):
+            obj.replay([group])
+
+
+class TestProxyLocks(unittest.TestCase):
+    def test_locks_pruned(self):
+        obj = proxy.Proxy.__new__(proxy.Proxy)
+        obj.locks = {}
+        obj.lock_users = collections.Counter()
+        order = []
+
+        async def _hold(tag):
+            async with obj._lock('nqn.1'):
+                order.append(tag)
+                await asyncio.sleep(0)
+                order.append(tag)
+
+        async def _run():
+            await asyncio.gather(_hold(1), _hold(2))
+
+        asyncio.run(_run())
+        self.assertEqual(order, [1, 1, 2, 2])
+        self.assertEqual(obj.locks, {})
+        self.assertFalse(obj.lock_users)
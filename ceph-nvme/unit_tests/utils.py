@@ -24,6 +24,8 @@ class MockSPDK:
         new_sock, _ = sock.accept()
         sock.close()
         self.sock = new_sock
+        self.pending = ''
+        self.decoder = json.JSONDecoder()
         self.logger = logging.getLogger('spdk')
         self._init_vars()
 
@@ -167,19 +169,33 @@ class MockSPDK:
             return False
 
         buf = self.sock.recv(2048)
-        obj = json.loads(buf)
+        if not buf:
+            raise ConnectionError()
 
+        # Several requests may arrive at once, or be split across reads.
+        self.pending += buf.decode('utf8')
+        while self.pending:
+            try:
+                obj, end = self.decoder.raw_decode(self.pending)
+            except ValueError:
+                break
+
+            self.pending = self.pending[end:].lstrip()
+            self.sock.sendall(json.dumps(self.handle(obj)).encode('utf8'))
+
+        return True
+
+    def handle(self, obj):
         name = obj['method']
         method = getattr(self, name, None)
         if method is None:
-            err = {'error': 'method %s not found' % name}
-            self.sock.sendall(json.dumps(err).encode('utf8'))
-            return True
+            return {'id': obj.get('id'),
+                    'error': 'method %s not found' % name}
 
         try:
             ret = {'result': method(**obj.get('params', {}))}
         except Exception as exc:
             ret = {'error': str(exc)}
 
-        self.sock.sendall(json.dumps(ret).encode('utf8'))
-        return True
+        ret['id'] = obj.get('id')
+        return ret
@@ -4,6 +4,7 @@
 # All Rights Reserved
 # Author: Alex Kavanagh <alex.kavanagh@canonical.com>
 
+import json
 import os
 import sys
 from datetime import datetime, timedelta
@@ -18,11 +19,26 @@ STATE_CRITICAL = 2
 STATE_UNKNOWN = 3
 
 
+def check_lines(lines):
+    """Check the status file written by older collectors, a line per OSD.
+
+    The check command of the collect phase isn't consistent across
+    releases, but what is consistent is that it fails, and so the start
+    of the line is 'Failed'.
+    """
+    state = STATE_OK
+    for line in lines:
+        print(line, end='')
+        if line.startswith('Failed'):
+            state = STATE_CRITICAL
+    return state
+
+
 def run_main():
-    """Process the CRON_CHECK_TMP_FILE and see if any line is not OK.
+    """Process the CRON_CHECK_TMP_FILE and see if any OSD is not OK.
 
-    If a line is not OK, the main returns STATE_CRITICAL.
-    If there are no lines, or the file doesn't exist, it returns STATE_UNKNOWN
+    If an OSD is not OK, the main returns STATE_CRITICAL.
+    If there are no OSDs, or the file doesn't exist, it returns STATE_UNKNOWN
     Otherwise it returns STATE_OK.
 
     :returns: nagios state 0,2 or 3
@@ -45,25 +61,30 @@ def run_main():
 
     try:
         with open(_tmp_file, 'rt') as f:
-            lines = f.readlines()
+            content = f.read()
     except Exception as e:
         print("Something went wrong reading the file: {}".format(str(e)))
         return STATE_UNKNOWN
 
-    if not lines:
-        print("checked status file is empty: {}".format(_tmp_file))
+    try:
+        osds = json.loads(content)['osds']
+    except (ValueError, KeyError, TypeError):
+        # The file was written by an older collector.
+        lines = content.splitlines(True)
+        if not lines:
+            print("checked status file is empty: {}".format(_tmp_file))
+            return STATE_UNKNOWN
+        return check_lines(lines)
+
+    if not osds:
+        print("No OSDs found in the status file: {}".format(_tmp_file))
         return STATE_UNKNOWN
 
-    # finally, check that the file contains all ok lines.  Unfortunately, it's
-    # not consistent across releases, but what is consistent is that the check
-    # command in the collect phase does fail, and so the start of the line is
-    # 'Failed'
     state = STATE_OK
-    for line in lines:
-        print(line, end='')
-        if line.startswith('Failed'):
+    for osd in osds:
+        print(osd['message'])
+        if not osd['ok']:
             state = STATE_CRITICAL
-
     return state
 
 
@@ -4,8 +4,15 @@
 # All Rights Reserved
 # Author: Alex Kavanagh <alex.kavanagh@canonical.com>
 
+import argparse
+import glob
+import json
 import os
+import socket
+import struct
 import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pwd import getpwnam
 
 # fasteners only exists in Bionic, so this will fail on xenial and trusty
@@ -18,6 +25,10 @@ SYSTEMD_SYSTEM = '/run/systemd/system'
 LOCKFILE = '/var/lock/check-osds.lock'
 CRON_CHECK_TMPFILE = 'ceph-osd-checks'
 NAGIOS_HOME = '/var/lib/nagios'
+OSD_DATA_GLOB = '/var/lib/ceph/osd/ceph-*/whoami'
+ASOK_PATH = '/var/run/ceph/ceph-osd.{}.asok'
+ASOK_TIMEOUT = 10
+ASOK_WORKERS = 8
 
 
 def init_is_systemd():
@@ -39,38 +50,146 @@ def lsb_release():
 
 def get_osd_units():
     """Returns a list of strings, one for each unit that is live"""
-    cmd = '/bin/cat /var/lib/ceph/osd/ceph-*/whoami'
-    try:
-        output = (subprocess
-                  .check_output([cmd], shell=True).decode('utf-8')
-                  .split('\n'))
-        return [u for u in output if u]
-    except subprocess.CalledProcessError:
-        return []
-
-
-def do_status():
-    if init_is_systemd():
-        cmd = "/usr/local/lib/nagios/plugins/check_systemd.py ceph-osd@{}"
-    else:
-        cmd = "/sbin/status ceph-osd id={}"
-
-    lines = []
-
-    for unit in get_osd_units():
+    units = []
+    for path in sorted(glob.glob(OSD_DATA_GLOB)):
+        try:
+            with open(path, 'rt') as f:
+                unit = f.read().strip()
+        except OSError:
+            continue
+        if unit:
+            units.append(unit)
+    return units
+
+
+def systemd_status(units):
+    """Query the state of the ceph-osd systemd units in one go.
+
+    :param units: OSD ids
+    :returns: Mapping of OSD id to a dict with the result of the check
+    """
+    names = ['ceph-osd@{}.service'.format(unit) for unit in units]
+    output = (subprocess
+              .check_output(['systemctl', 'show',
+                             '--property=Id,ActiveState,SubState'] + names)
+              .decode('utf-8'))
+    # The properties of each unit are separated by an empty line.
+    states = {}
+    for block in output.strip().split('\n\n'):
+        props = dict(line.split('=', 1)
+                     for line in block.splitlines() if '=' in line)
+        states[props.get('Id')] = props
+
+    status = {}
+    for unit, name in zip(units, names):
+        props = states.get(name, {})
+        ok = props.get('ActiveState') == 'active'
+        status[unit] = {
+            'ok': ok,
+            'message': '{}: ceph-osd@{} is {} ({})'.format(
+                'OK' if ok else 'CRITICAL', unit,
+                props.get('ActiveState', 'unknown'),
+                props.get('SubState', 'unknown')),
+        }
+    return status
+
+
+def upstart_status(units):
+    """Query the state of the ceph-osd upstart jobs, one at a time."""
+    status = {}
+    for unit in units:
         try:
             output = (subprocess
-                      .check_output(cmd.format(unit).split(),
+                      .check_output(['/sbin/status', 'ceph-osd',
+                                     'id={}'.format(unit)],
                                     stderr=subprocess.STDOUT)
                       .decode('utf-8'))
+            status[unit] = {'ok': True, 'message': output.strip()}
+        except subprocess.CalledProcessError as e:
+            status[unit] = {
+                'ok': False,
+                'message': ("check command raised: {}"
+                            .format(e.output.decode('utf-8').strip()))}
+    return status
+
+
+def asok_status(unit):
+    """Ask an OSD for its state over its admin socket.
+
+    :returns: The state of the OSD, e.g. 'active'
+    :raises: OSError, ValueError
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(ASOK_TIMEOUT)
+        sock.connect(ASOK_PATH.format(unit))
+        sock.sendall(json.dumps({'prefix': 'status'}).encode('utf-8') +
+                     b'\0')
+        # The reply is its length, as a 32 bit big endian integer, and the
+        # JSON encoded result.
+        data = b''
+        while len(data) < 4:
+            chunk = sock.recv(4 - len(data))
+            if not chunk:
+                raise ValueError('Short reply from the admin socket')
+            data += chunk
+        length, = struct.unpack('>I', data)
+        data = b''
+        while len(data) < length:
+            chunk = sock.recv(length - len(data))
+            if not chunk:
+                raise ValueError('Short reply from the admin socket')
+            data += chunk
+    return json.loads(data.decode('utf-8')).get('state')
+
+
+def add_asok_status(status):
+    """Add the state of the running OSDs, from their admin sockets."""
+    units = [unit for unit, result in status.items() if result['ok']]
+
+    def _check(unit):
+        try:
+            return unit, asok_status(unit), None
+        except (OSError, ValueError) as e:
+            return unit, None, e
+
+    with ThreadPoolExecutor(max_workers=ASOK_WORKERS) as executor:
+        for unit, state, error in executor.map(_check, units):
+            result = status[unit]
+            result['asok_state'] = state
+            if error is not None:
+                result['ok'] = False
+                result['message'] = ('CRITICAL: ceph-osd@{} admin socket '
+                                     'failed: {}'.format(unit, error))
+            elif state != 'active':
+                result['ok'] = False
+                result['message'] = ('CRITICAL: ceph-osd@{} is {}'
+                                     .format(unit, state))
+
+
+def do_status(admin_socket=False):
+    units = get_osd_units()
+    if init_is_systemd():
+        try:
+            status = systemd_status(units) if units else {}
         except subprocess.CalledProcessError as e:
-            output = ("Failed: check command raised: {}"
-                      .format(e.output.decode('utf-8')))
-        lines.append(output)
+            status = {unit: {'ok': False,
+                             'message': 'systemctl raised: {}'.format(e)}
+                      for unit in units}
+    else:
+        status = upstart_status(units)
+
+    if admin_socket:
+        add_asok_status(status)
+
+    result = {
+        'timestamp': time.time(),
+        'osds': [dict(id=unit, **status[unit]) for unit in units],
+    }
 
     _tmp_file = os.path.join(NAGIOS_HOME, CRON_CHECK_TMPFILE)
-    with open(_tmp_file, 'wt') as f:
-        f.writelines(lines)
+    with open(_tmp_file + '.new', 'wt') as f:
+        json.dump(result, f)
+    os.rename(_tmp_file + '.new', _tmp_file)
 
     # In cis hardened environments check_ceph_osd_services cannot
     # read _tmp_file due to restrained permissions (#LP1879667).
@@ -83,18 +202,28 @@ def do_status():
         os.chown(_tmp_file, nagios_uid, nagios_gid)
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Collect the state of the local OSD services')
+    parser.add_argument('--admin-socket', action='store_true',
+                        help='Also ask the running OSDs for their state '
+                             'over their admin sockets')
+    return parser.parse_args()
+
+
 def run_main():
+    args = parse_args()
     # on bionic we can interprocess lock; we don't do it for older platforms
     if fasteners is not None:
         lock = fasteners.InterProcessLock(LOCKFILE)
 
         if lock.acquire(blocking=False):
             try:
-                do_status()
+                do_status(args.admin_socket)
             finally:
                 lock.release()
     else:
-        do_status()
+        do_status(args.admin_socket)
 
 
 if __name__ == '__main__':
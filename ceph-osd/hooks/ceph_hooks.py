@@ -95,6 +95,8 @@ from utils import (
     get_blacklist,
     get_journal_devices,
     should_enable_discard,
+    get_device_inventory,
+    flush_device_inventory,
     _upgrade_keyring,
 )
 from charmhelpers.contrib.openstack.alternatives import install_alternative
@@ -105,7 +107,6 @@ from charmhelpers.contrib.network.ip import (
 )
 import charmhelpers.contrib.storage.linux.ceph as ch_ceph
 from charmhelpers.contrib.storage.linux.utils import (
-    is_device_mounted,
     is_block_device,
 )
 from charmhelpers.contrib.charmsupport import nrpe
@@ -175,9 +176,19 @@ def check_for_upgrade():
             log("{} to {} is a valid upgrade path. Proceeding.".format(
                 old_version, new_version))
 
+        if not is_osd_upgrade_parallelism_valid():
+            log('Invalid osd-upgrade-parallelism, it must be at least 1',
+                level=ERROR)
+            return
+
         emit_cephconf(upgrading=True)
-        ceph.roll_osd_cluster(new_version=new_version,
-                              upgrade_key='osd-upgrade')
+        ceph.roll_osd_cluster(
+            new_version=new_version,
+            upgrade_key='osd-upgrade',
+            max_hosts_per_wave=max(
+                hookenv.config('max-hosts-per-upgrade-wave') or 0,
+                0) or None,
+            parallelism=hookenv.config('osd-upgrade-parallelism'))
         emit_cephconf(upgrading=False)
         notify_mon_of_upgrade(new_version)
     elif (old_version == new_version and
@@ -462,6 +473,28 @@ def is_tune_osd_memory_target_valid() -> bool:
     return not value or bool(re.match(r"\d+(?:GB|%)$", value))
 
 
+def is_osd_provisioning_concurrency_valid() -> bool:
+    """
+    Check if the osd-provisioning-concurrency value is valid
+
+    :returns: True if valid, else False
+    :rtype: bool
+    """
+    value = config('osd-provisioning-concurrency')
+    return isinstance(value, int) and value >= 1
+
+
+def is_osd_upgrade_parallelism_valid() -> bool:
+    """
+    Check if the osd-upgrade-parallelism value is valid
+
+    :returns: True if valid, else False
+    :rtype: bool
+    """
+    value = config('osd-upgrade-parallelism')
+    return isinstance(value, int) and value >= 1
+
+
 def get_osd_memory_target():
     """
     Processes the config value of tune-osd-memory-target.
@@ -614,6 +647,16 @@ def config_changed():
         log('Invalid OSD disk format configuration specified', level=ERROR)
         sys.exit(1)
 
+    if not is_osd_provisioning_concurrency_valid():
+        log('Invalid osd-provisioning-concurrency, it must be at least 1',
+            level=ERROR)
+        sys.exit(1)
+
+    if not is_osd_upgrade_parallelism_valid():
+        log('Invalid osd-upgrade-parallelism, it must be at least 1',
+            level=ERROR)
+        sys.exit(1)
+
     if config('prefer-ipv6'):
         assert_charm_supports_ipv6()
 
@@ -674,17 +717,16 @@ def prepare_disks_and_activate():
     devices = [dev for dev in devices if dev.startswith('/dev')]
     # filter osd-devices that does not exist on this unit
     devices = [dev for dev in devices if os.path.exists(dev)]
-    # filter osd-devices that are already mounted
-    devices = [dev for dev in devices if not is_device_mounted(dev)]
-    # filter osd-devices that are active bluestore devices
+    # filter osd-devices that are already mounted, active bluestore
+    # devices or used as dmcrypt devices
+    inventory = get_device_inventory()
     devices = [dev for dev in devices
-               if not ceph.is_active_bluestore_device(dev)]
-    # filter osd-devices that are used as dmcrypt devices
-    devices = [dev for dev in devices
-               if not ceph.is_mapped_luks_device(dev)]
+               if not (inventory.is_mounted(dev) or
+                       inventory.is_active_bluestore(dev) or
+                       inventory.is_mapped_luks(dev))]
 
     log('Checking for pristine devices: "{}"'.format(devices), level=DEBUG)
-    if not all(ceph.is_pristine_disk(dev) for dev in devices):
+    if not all(inventory.probe_pristine(devices).values()):
         status_set('blocked',
                    'Non-pristine devices detected, consult '
                    '`list-disks`, `zap-disk` and `blacklist-*` actions.')
@@ -694,18 +736,21 @@ def prepare_disks_and_activate():
         log('ceph bootstrapped, rescanning disks')
         emit_cephconf()
         ceph.udevadm_settle()
-        for dev in get_devices():
-            ceph.osdize(dev, config('osd-format'),
-                        osd_journal,
-                        config('ignore-device-errors'),
-                        config('osd-encrypt'),
-                        config('osd-encrypt-keymanager'))
-            # Make it fast!
-            if config('autotune'):
-                log('The autotune config is deprecated and planned '
-                    'for removal in the next release.', level=WARNING)
+        devices = get_devices()
+        ceph.osdize_devs(devices, config('osd-format'),
+                         osd_journal,
+                         config('ignore-device-errors'),
+                         config('osd-encrypt'),
+                         config('osd-encrypt-keymanager'),
+                         max_workers=config('osd-provisioning-concurrency'))
+        # Make it fast!
+        if config('autotune'):
+            log('The autotune config is deprecated and planned '
+                'for removal in the next release.', level=WARNING)
+            for dev in devices:
                 ceph.tune_dev(dev)
-        ceph.start_osds(get_devices())
+        ceph.start_osds(devices)
+        flush_device_inventory()
 
     # Notify MON cluster as to how many OSD's this unit bootstrapped
     # into the cluster
@@ -907,16 +952,17 @@ def update_nrpe_config():
 
     # BUG#1810749 - the nagios user can't access /var/lib/ceph/.. and that's a
     # GOOD THING, as it keeps ceph secure from Nagios.  However, to check
-    # whether ceph is okay, the check_systemd.py or 'status ceph-osd' still
-    # needs to be called with the contents of ../osd/ceph-*/whoami files.  To
-    # get around this conundrum, instead a cron.d job that runs as root will
-    # perform the checks every minute, and write to a temporary file the
-    # results, and the nrpe check will grep this file and error out (return 2)
-    # if the first 3 characters of a line are not 'OK:'.
+    # whether ceph is okay, systemd (or 'status ceph-osd') still needs to be
+    # asked about the OSDs in the ../osd/ceph-*/whoami files, and so do their
+    # admin sockets.  To get around this conundrum, instead a cron.d job that
+    # runs as root will perform the checks every minute, and write the results
+    # to a temporary file as JSON, and the nrpe check will read this file and
+    # error out (return 2) if any OSD is not OK.
 
     cmd = ('MAILTO=""\n'
            '* * * * * root '
            '/usr/local/lib/nagios/plugins/collect_ceph_osd_services.py'
+           ' --admin-socket'
            ' 2>&1 | logger -t check-osd\n')
     with open(CRON_CEPH_CHECK_FILE, "wt") as f:
         f.write(cmd)
@@ -971,6 +1017,16 @@ def assess_status():
         status_set('blocked', 'tune-osd-memory-target config value is invalid')
         return
 
+    if not is_osd_provisioning_concurrency_valid():
+        status_set('blocked',
+                   'osd-provisioning-concurrency config value is invalid')
+        return
+
+    if not is_osd_upgrade_parallelism_valid():
+        status_set('blocked',
+                   'osd-upgrade-parallelism config value is invalid')
+        return
+
     # check to see if the unit is paused.
     application_version_set(get_upstream_version(VERSION_PACKAGE))
     if is_unit_upgrading_set():
@@ -1029,18 +1085,17 @@ def assess_status():
                 status_set('active',
                            'Unit is ready ({} OSD)'.format(len(running_osds)))
     else:
-        pristine = True
         # Check unmounted disks that should be configured but don't check
         # journals or already processed devices
         config_devices = (set(get_devices()) & set(ceph.unmounted_disks()))
         osd_journals = set(get_journal_devices())
         touched_devices = set(kv().get('osd-devices', []))
-        for dev in config_devices - osd_journals - touched_devices:
-            if (not ceph.is_active_bluestore_device(dev) and
-                    not ceph.is_pristine_disk(dev) and
-                    not ceph.is_mapped_luks_device(dev)):
-                pristine = False
-                break
+        inventory = get_device_inventory()
+        candidates = [dev for dev in
+                      config_devices - osd_journals - touched_devices
+                      if not (inventory.is_active_bluestore(dev) or
+                              inventory.is_mapped_luks(dev))]
+        pristine = all(inventory.probe_pristine(candidates).values())
         if pristine:
             status_set('active',
                        'Unit is ready ({} OSD)'.format(len(running_osds)))
@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import glob
 import json
 import re
 import os
@@ -20,12 +21,15 @@ import subprocess
 import sys
 import time
 
+from concurrent.futures import ThreadPoolExecutor
+
 sys.path.append('lib')
 import charms_ceph.utils as ceph
 
 from charmhelpers.core.hookenv import (
     unit_get,
     cached,
+    flush,
     config,
     network_get_primary_address,
     log,
@@ -70,6 +74,9 @@ except ImportError:
     import dns.resolver
 
 
+# Maximum number of devices probed concurrently for pristinity.
+PRISTINE_PROBE_WORKERS = 16
+
 _bootstrap_keyring = "/var/lib/ceph/bootstrap-osd/ceph.keyring"
 _upgrade_keyring = "/var/lib/ceph/osd/ceph.client.osd-upgrade.keyring"
 _removal_keyring = "/var/lib/ceph/osd/ceph.client.osd-removal.keyring"
@@ -739,3 +746,130 @@ def find_filestore_osds():
             found.append(dir)
 
     return found
+
+
+class DeviceInventory(object):
+    """The state of the block devices of the unit, collected in one pass.
+
+    A single lsblk, a single lvs and a read of /proc/mounts replace the
+    lsblk, pvdisplay, vgs, lvs and cryptsetup calls that the equivalent
+    charms_ceph helpers run for each device. Devices are looked up by
+    their real path, so any of their aliases can be used.
+    """
+
+    def __init__(self):
+        self.mounted = set()
+        self.mapped_luks = set()
+        self.active_bluestore = set()
+        self._pristine = {}
+
+        mounts = self._mount_sources()
+        for node in self._lsblk():
+            self._scan(node, mounts)
+        self._scan_lvm()
+
+    @staticmethod
+    def _mount_sources():
+        try:
+            with open('/proc/mounts') as f:
+                return {os.path.realpath(line.split()[0])
+                        for line in f if line.startswith('/dev/')}
+        except OSError:
+            return set()
+
+    @staticmethod
+    def _lsblk():
+        try:
+            out = _check_output(['lsblk', '-J', '-p', '-o',
+                                 'NAME,TYPE,FSTYPE,MOUNTPOINT'])
+        except DeviceError as e:
+            log('Failed to list block devices: {}'.format(e), level=WARNING)
+            return []
+        return json.loads(out).get('blockdevices', [])
+
+    def _scan(self, node, mounts):
+        """Record the state of a device and of its holders.
+
+        :returns: Whether the device or any of its holders is mounted
+        :rtype: bool
+        """
+        name = os.path.realpath(node['name'])
+        children = node.get('children', [])
+        mounted = bool(node.get('mountpoint')) or name in mounts
+        for child in children:
+            mounted = self._scan(child, mounts) or mounted
+        if mounted:
+            self.mounted.add(name)
+        if children and node.get('fstype') == 'crypto_LUKS':
+            self.mapped_luks.add(name)
+        return mounted
+
+    def _scan_lvm(self):
+        try:
+            out = _check_output(['lvs', '--reportformat', 'json', '-o',
+                                 'lv_name,vg_name,devices'],
+                                stderr=subprocess.DEVNULL)
+        except (DeviceError, OSError) as e:
+            log('Failed to list logical volumes: {}'.format(e), level=DEBUG)
+            return
+        targets = [os.readlink(link)
+                   for link in glob.glob('/var/lib/ceph/osd/ceph-*/block')
+                   if os.path.islink(link)]
+        for report in json.loads(out).get('report', []):
+            for lv in report.get('lv', []):
+                if not any(t.endswith(lv['lv_name']) for t in targets):
+                    continue
+                # The devices of a volume are listed as "/dev/sdb(0)",
+                # separated by commas.
+                for device in lv.get('devices', '').split(','):
+                    device = device.split('(')[0]
+                    if device:
+                        self.active_bluestore.add(
+                            os.path.realpath(device))
+
+    def is_mounted(self, dev):
+        return os.path.realpath(dev) in self.mounted
+
+    def is_mapped_luks(self, dev):
+        return os.path.realpath(dev) in self.mapped_luks
+
+    def is_active_bluestore(self, dev):
+        return os.path.realpath(dev) in self.active_bluestore
+
+    def probe_pristine(self, devices):
+        """Check whether devices are pristine, reading them concurrently.
+
+        :param devices: Paths of the block devices to check
+        :type devices: List[str]
+        :returns: Whether each device is pristine
+        :rtype: Dict[str, bool]
+        """
+        pending = [dev for dev in devices if dev not in self._pristine]
+        if len(pending) > 1:
+            workers = min(len(pending), PRISTINE_PROBE_WORKERS)
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                self._pristine.update(
+                    zip(pending, pool.map(ceph.is_pristine_disk, pending)))
+        else:
+            self._pristine.update(
+                (dev, ceph.is_pristine_disk(dev)) for dev in pending)
+        return {dev: self._pristine[dev] for dev in devices}
+
+    def is_pristine(self, dev):
+        return self.probe_pristine([dev])[dev]
+
+
+@cached
+def get_device_inventory():
+    """Return the inventory of the block devices of the unit.
+
+    The inventory is collected once per hook; call
+    flush_device_inventory once devices have changed.
+
+    :rtype: DeviceInventory
+    """
+    return DeviceInventory()
+
+
+def flush_device_inventory():
+    flush('get_device_inventory')
@@ -20,6 +20,7 @@ from subprocess import check_call, check_output, CalledProcessError
 from tempfile import NamedTemporaryFile
 
 from charms_ceph.utils import (
+    ceph_check_output,
     get_cephfs,
     get_osd_weight
 )
@@ -102,6 +103,182 @@ CEPH_BUCKET_TYPES = [
 ]
 
 
+# Map of broker op compression keys to the option names reported for a pool
+# in ``ceph osd dump``.
+POOL_COMPRESSION_OPTIONS = {
+    'compression-algorithm': 'compression_algorithm',
+    'compression-mode': 'compression_mode',
+    'compression-required-ratio': 'compression_required_ratio',
+    'compression-min-blob-size': 'compression_min_blob_size',
+    'compression-min-blob-size-hdd': 'compression_min_blob_size_hdd',
+    'compression-min-blob-size-ssd': 'compression_min_blob_size_ssd',
+    'compression-max-blob-size': 'compression_max_blob_size',
+    'compression-max-blob-size-hdd': 'compression_max_blob_size_hdd',
+    'compression-max-blob-size-ssd': 'compression_max_blob_size_ssd',
+}
+
+
+class BrokerClusterState(object):
+    """Cluster state shared by all the ops of a single broker request.
+
+    A client asking for many pools used to cause a ``rados lspools`` and
+    ``ceph osd ls`` per pool, plus a quota and compression update even
+    when nothing had changed.  This object fetches the OSD map once, on
+    first use, and is kept up to date as the ops of the request mutate
+    the cluster, so that each op only issues the commands it really needs.
+
+    Capability updates for services whose groups gained a pool are
+    deferred and applied once per service by ``flush``.
+    """
+
+    def __init__(self, service):
+        """Initialize the state.
+
+        :param service: The Ceph user name to run commands under.
+        :type service: str
+        """
+        self.service = service
+        self._osd_dump = None
+        self._pools = None
+        self._erasure_profiles = None
+        self._pending_permissions = collections.OrderedDict()
+
+    @property
+    def osd_dump(self):
+        """The OSD map, as returned by ``ceph osd dump``.
+
+        :rtype: Dict[str, Any]
+        :raises: CalledProcessError, ValueError
+        """
+        if self._osd_dump is None:
+            self._osd_dump = json.loads(ceph_check_output(
+                {'prefix': 'osd dump', 'format': 'json'},
+                service=self.service).decode('UTF-8'))
+        return self._osd_dump
+
+    @property
+    def pools(self):
+        """Pools known to exist, keyed by name.
+
+        Pools created while processing the request map to ``None`` as their
+        details are not part of the OSD map that was fetched.
+
+        :rtype: Dict[str, Optional[Dict[str, Any]]]
+        """
+        if self._pools is None:
+            self._pools = {pool['pool_name']: pool
+                           for pool in self.osd_dump.get('pools', [])}
+        return self._pools
+
+    @property
+    def osds(self):
+        """IDs of all the OSDs in the cluster.
+
+        :rtype: List[int]
+        """
+        return [osd['osd'] for osd in self.osd_dump.get('osds', [])]
+
+    def pool_exists(self, name):
+        """Check whether a pool exists.
+
+        :param name: Name of pool.
+        :type name: str
+        :rtype: bool
+        """
+        return name in self.pools
+
+    def pool_created(self, name):
+        """Record that a pool has been created.
+
+        :param name: Name of pool.
+        :type name: str
+        """
+        self.pools[name] = None
+
+    def pool_deleted(self, name):
+        """Record that a pool has been deleted.
+
+        :param name: Name of pool.
+        :type name: str
+        """
+        if self._pools is not None:
+            self._pools.pop(name, None)
+
+    def pool_renamed(self, old_name, new_name):
+        """Record that a pool has been renamed.
+
+        :param old_name: Current name of pool.
+        :type old_name: str
+        :param new_name: New name of pool.
+        :type new_name: str
+        """
+        if self._pools is not None and old_name in self._pools:
+            self._pools[new_name] = self._pools.pop(old_name)
+
+    def pool_needs_update(self, request):
+        """Check whether the quota or compression of a pool need updating.
+
+        :param request: The create-pool broker op.
+        :type request: Dict[str, Any]
+        :returns: False if the pool already has the requested properties.
+        :rtype: bool
+        """
+        pool = self.pools.get(request.get('name'))
+        if not pool:
+            return True
+        for key, attr in (('max-bytes', 'quota_max_bytes'),
+                          ('max-objects', 'quota_max_objects')):
+            value = request.get(key)
+            if value and int(value) != int(pool.get(attr, 0)):
+                return True
+        options = pool.get('options', {})
+        for key, option in POOL_COMPRESSION_OPTIONS.items():
+            value = request.get(key)
+            if value and str(value) != str(options.get(option)):
+                return True
+        return False
+
+    def erasure_profile_exists(self, name):
+        """Check whether an erasure profile exists.
+
+        :param name: Name of profile.
+        :type name: str
+        :rtype: bool
+        :raises: CalledProcessError, ValueError
+        """
+        if self._erasure_profiles is None:
+            self._erasure_profiles = set(json.loads(ceph_check_output(
+                {'prefix': 'osd erasure-code-profile ls', 'format': 'json'},
+                service=self.service).decode('UTF-8')))
+        return name in self._erasure_profiles
+
+    def erasure_profile_created(self, name):
+        """Record that an erasure profile has been created.
+
+        :param name: Name of profile.
+        :type name: str
+        """
+        if self._erasure_profiles is not None:
+            self._erasure_profiles.add(name)
+
+    def defer_service_permissions(self, service, namespace=None):
+        """Schedule an update of the key permissions for a service.
+
+        :param service: Name of the service.
+        :type service: str
+        :param namespace: Namespace of the group that changed.
+        :type namespace: Optional[str]
+        """
+        self._pending_permissions[(service, namespace)] = True
+
+    def flush(self):
+        """Apply the deferred key permission updates."""
+        while self._pending_permissions:
+            (service, namespace), _ = self._pending_permissions.popitem(
+                last=False)
+            update_service_permissions(service, namespace=namespace)
+
+
 def decode_req_encode_rsp(f):
     """Decorator to decode incoming requests and encode responses."""
 
@@ -149,11 +326,12 @@ def process_requests(reqs):
     return resp
 
 
-def handle_create_erasure_profile(request, service):
+def handle_create_erasure_profile(request, service, state=None):
     """Create an erasure profile.
 
     :param request: dict of request operations and params
     :param service: The ceph client to run the command under.
+    :param state: Cluster state shared by the ops of the broker request.
     :returns: dict. exit-code and reason if not 0
     """
     # "isa" | "lrc" | "shec" | "clay" or it defaults to "jerasure"
@@ -195,6 +373,8 @@ def handle_create_erasure_profile(request, service):
                            crush_locality=crush_locality,
                            device_class=device_class,
                            erasure_plugin_technique=erasure_technique)
+    if state:
+        state.erasure_profile_created(name)
 
     return {'exit-code': 0}
 
@@ -261,8 +441,12 @@ def update_service_permissions(service, service_obj=None, namespace=None):
         log("Error updating key capabilities: {}".format(e))
 
 
-def add_pool_to_group(pool, group, namespace=None):
-    """Add a named pool to a named group"""
+def add_pool_to_group(pool, group, namespace=None, state=None):
+    """Add a named pool to a named group.
+
+    When ``state`` is given the key permission updates of the services in
+    the group are deferred until the whole broker request is processed.
+    """
     group_name = group
     if namespace:
         group_name = "{}-{}".format(namespace, group_name)
@@ -271,7 +455,10 @@ def add_pool_to_group(pool, group, namespace=None):
         group["pools"].append(pool)
     save_group(group, group_name=group_name)
     for service in group['services']:
-        update_service_permissions(service, namespace=namespace)
+        if state:
+            state.defer_service_permissions(service, namespace=namespace)
+        else:
+            update_service_permissions(service, namespace=namespace)
 
 
 def pool_permission_list_for_service(service):
@@ -398,11 +585,12 @@ def get_group_key(group_name):
     return 'cephx.groups.{}'.format(group_name)
 
 
-def handle_erasure_pool(request, service):
+def handle_erasure_pool(request, service, state=None):
     """Create a new erasure coded pool.
 
     :param request: dict of request operations and params.
     :param service: The ceph client to run the command under.
+    :param state: Cluster state shared by the ops of the broker request.
     :returns: dict. exit-code and reason if not 0.
     """
     pool_name = request.get('name')
@@ -417,10 +605,16 @@ def handle_erasure_pool(request, service):
         # Add the pool to the group named "group_name"
         add_pool_to_group(pool=pool_name,
                           group=group_name,
-                          namespace=group_namespace)
+                          namespace=group_namespace,
+                          state=state)
 
+    if state:
+        profile_exists = state.erasure_profile_exists(erasure_profile)
+    else:
+        profile_exists = erasure_profile_exists(service=service,
+                                                name=erasure_profile)
     # TODO: Default to 3/2 erasure coding. I believe this requires min 5 osds
-    if not erasure_profile_exists(service=service, name=erasure_profile):
+    if not profile_exists:
         # TODO: Fail and tell them to create the profile or default
         msg = ("erasure-profile {} does not exist.  Please create it with: "
                "create-erasure-profile".format(erasure_profile))
@@ -436,20 +630,16 @@ def handle_erasure_pool(request, service):
         return {'exit-code': 1, 'stderr': msg}
 
     # Ok make the erasure pool
-    if not pool_exists(service=service, name=pool_name):
-        log("Creating pool '{}' (erasure_profile={})"
-            .format(pool.name, erasure_profile), level=INFO)
-        pool.create()
-
-    # Set/update properties that are allowed to change after pool creation.
-    pool.update()
+    _create_or_update_pool(pool, request, service, state,
+                           "erasure_profile={}".format(erasure_profile))
 
 
-def handle_replicated_pool(request, service):
+def handle_replicated_pool(request, service, state=None):
     """Create a new replicated pool.
 
     :param request: dict of request operations and params.
     :param service: The ceph client to run the command under.
+    :param state: Cluster state shared by the ops of the broker request.
     :returns: dict. exit-code and reason if not 0.
     """
     pool_name = request.get('name')
@@ -462,7 +652,7 @@ def handle_replicated_pool(request, service):
     replicas = request.get('replicas')
     if pg_num:
         # Cap pg_num to max allowed just in case.
-        osds = get_osds(service)
+        osds = state.osds if state else get_osds(service)
         if osds:
             pg_num = min(pg_num, (len(osds) * 100 // replicas))
             request.update({'pg_num': pg_num})
@@ -472,7 +662,8 @@ def handle_replicated_pool(request, service):
         # Add the pool to the group named "group_name"
         add_pool_to_group(pool=pool_name,
                           group=group_name,
-                          namespace=group_namespace)
+                          namespace=group_namespace,
+                          state=state)
 
     try:
         pool = ReplicatedPool(service=service,
@@ -482,13 +673,42 @@ def handle_replicated_pool(request, service):
         log(msg, level=ERROR)
         return {'exit-code': 1, 'stderr': msg}
 
-    if not pool_exists(service=service, name=pool_name):
-        log("Creating pool '{}' (replicas={})".format(pool.name, replicas),
+    _create_or_update_pool(pool, request, service, state,
+                           "replicas={}".format(replicas))
+
+
+def _create_or_update_pool(pool, request, service, state, description):
+    """Create a pool if missing and update its changeable properties.
+
+    :param pool: The pool to create or update.
+    :type pool: BasePool
+    :param request: dict of request operations and params.
+    :param service: The ceph client to run the command under.
+    :param state: Cluster state shared by the ops of the broker request.
+    :param description: Pool details to log on creation.
+    """
+    pool_name = request.get('name')
+    if state:
+        exists = state.pool_exists(pool_name)
+    else:
+        exists = pool_exists(service=service, name=pool_name)
+
+    if not exists:
+        log("Creating pool '{}' ({})".format(pool_name, description),
             level=INFO)
+        # NOTE: create() also applies the changeable properties.
         pool.create()
-    else:
-        log("Pool '{}' already exists - skipping create".format(pool.name),
+        if state:
+            state.pool_created(pool_name)
+        return
+
+    log("Pool '{}' already exists - skipping create".format(pool_name),
+        level=DEBUG)
+    if state and not state.pool_needs_update(request):
+        log("Pool '{}' is up to date - skipping update".format(pool_name),
             level=DEBUG)
+        pool.validate()
+        return
 
     # Set/update properties that are allowed to change after pool creation.
     pool.update()
@@ -904,25 +1124,46 @@ def process_requests_v1(reqs):
     Takes a list of requests (dicts) and processes each one. If an error is
     found, processing stops and the client is notified in the response.
 
+    The ops share a ``BrokerClusterState`` so that the cluster is queried
+    once per request rather than once per op.
+
     Returns a response dict containing the exit code (non-zero if any
     operation failed along with an explanation).
     """
+    # Use admin client since we do not have other client key locations
+    # setup to use them for these operations.
+    state = BrokerClusterState(service='admin')
+    try:
+        return _process_requests_v1(reqs, state)
+    finally:
+        state.flush()
+
+
+def _process_requests_v1(reqs, state):
+    """Process v1 requests against a shared cluster state.
+
+    :param reqs: List of broker ops.
+    :type reqs: List[Dict[str, Any]]
+    :param state: Cluster state shared by the ops of the broker request.
+    :type state: BrokerClusterState
+    :returns: dict. exit-code and reason if not 0
+    """
     ret = None
     log("Processing {} ceph broker requests".format(len(reqs)), level=INFO)
     for req in reqs:
         op = req.get('op')
         log("Processing op='{}'".format(op), level=DEBUG)
-        # Use admin client since we do not have other client key locations
-        # setup to use them for these operations.
-        svc = 'admin'
+        svc = state.service
         if op == "create-pool":
             pool_type = req.get('pool-type')  # "replicated" | "erasure"
 
             # Default to replicated if pool_type isn't given
             if pool_type == 'erasure':
-                ret = handle_erasure_pool(request=req, service=svc)
+                ret = handle_erasure_pool(request=req, service=svc,
+                                          state=state)
             else:
-                ret = handle_replicated_pool(request=req, service=svc)
+                ret = handle_replicated_pool(request=req, service=svc,
+                                             state=state)
         elif op == "create-cephfs":
             ret = handle_create_cephfs(request=req, service=svc)
         elif op == "create-cache-tier":
@@ -930,15 +1171,18 @@ def process_requests_v1(reqs):
         elif op == "remove-cache-tier":
             ret = handle_remove_cache_tier(request=req, service=svc)
         elif op == "create-erasure-profile":
-            ret = handle_create_erasure_profile(request=req, service=svc)
+            ret = handle_create_erasure_profile(request=req, service=svc,
+                                                state=state)
         elif op == "delete-pool":
             pool = req.get('name')
             ret = delete_pool(service=svc, name=pool)
+            state.pool_deleted(pool)
         elif op == "rename-pool":
             old_name = req.get('name')
             new_name = req.get('new-name')
             ret = rename_pool(service=svc, old_name=old_name,
                               new_name=new_name)
+            state.pool_renamed(old_name, new_name)
         elif op == "snapshot-pool":
             pool = req.get('name')
             snapshot_name = req.get('snapshot-name')
@@ -874,6 +874,32 @@ class CephHooksTestCase(unittest.TestCase):
                 expected_valid
             )
 
+    @patch.object(ceph_hooks, "config")
+    def test_is_osd_provisioning_concurrency_valid(self, mock_config):
+        # value, is_valid
+        scenarios = [(1, True), (4, True), (0, False), (-1, False),
+                     (None, False)]
+        for value, expected_valid in scenarios:
+            mock_config.side_effect = {
+                'osd-provisioning-concurrency': value}.get
+            self.assertEqual(
+                ceph_hooks.is_osd_provisioning_concurrency_valid(),
+                expected_valid
+            )
+
+    @patch.object(ceph_hooks, "config")
+    def test_is_osd_upgrade_parallelism_valid(self, mock_config):
+        # value, is_valid
+        scenarios = [(1, True), (4, True), (0, False), (-1, False),
+                     (None, False)]
+        for value, expected_valid in scenarios:
+            mock_config.side_effect = {
+                'osd-upgrade-parallelism': value}.get
+            self.assertEqual(
+                ceph_hooks.is_osd_upgrade_parallelism_valid(),
+                expected_valid
+            )
+
     @patch.object(ceph_hooks, "config")
     @patch.object(ceph_hooks, "get_total_ram")
     @patch.object(ceph_hooks, "kv")
@@ -416,6 +416,60 @@ cset.uuid		57add9da-e5de-47c6-8f39-3e16aafb8d31
 }'''
         self.assertEqual(utils.get_parent_device('/dev/loop1p1'), '/dev/loop1')
 
+    @patch.object(utils.ceph, 'is_pristine_disk')
+    @patch.object(utils.os, 'readlink')
+    @patch.object(utils.os.path, 'islink')
+    @patch.object(utils.glob, 'glob')
+    @patch.object(utils.DeviceInventory, '_mount_sources')
+    @patch.object(utils.subprocess, 'check_output')
+    def test_device_inventory(self, check_output, _mount_sources, _glob,
+                              islink, readlink, is_pristine_disk):
+        lsblk = b'''
+{"blockdevices": [
+  {"name": "/dev/sda", "type": "disk", "fstype": null, "mountpoint": null,
+   "children": [
+     {"name": "/dev/sda1", "type": "part", "fstype": "ext4",
+      "mountpoint": "/"}]},
+  {"name": "/dev/sdb", "type": "disk", "fstype": "LVM2_member",
+   "mountpoint": null,
+   "children": [
+     {"name": "/dev/mapper/ceph--a-osd--block--a", "type": "lvm",
+      "fstype": null, "mountpoint": null}]},
+  {"name": "/dev/sdc", "type": "disk", "fstype": "crypto_LUKS",
+   "mountpoint": null,
+   "children": [
+     {"name": "/dev/mapper/crypt-c", "type": "crypt", "fstype": null,
+      "mountpoint": null}]},
+  {"name": "/dev/sdd", "type": "disk", "fstype": "crypto_LUKS",
+   "mountpoint": null},
+  {"name": "/dev/sde", "type": "disk", "fstype": null, "mountpoint": null},
+  {"name": "/dev/sdf", "type": "disk", "fstype": null, "mountpoint": null}
+]}'''
+        lvs = b'''
+{"report": [{"lv": [
+  {"lv_name": "osd-block-a", "vg_name": "ceph-a", "devices": "/dev/sdb(0)"},
+  {"lv_name": "other", "vg_name": "vg", "devices": "/dev/sdd(0),/dev/sde(0)"}
+]}]}'''
+        check_output.side_effect = lambda cmd, **kwargs: (
+            lsblk if cmd[0] == 'lsblk' else lvs)
+        _mount_sources.return_value = {'/dev/sde'}
+        _glob.return_value = ['/var/lib/ceph/osd/ceph-0/block']
+        islink.return_value = True
+        readlink.return_value = '/dev/ceph-a/osd-block-a'
+        is_pristine_disk.side_effect = lambda dev: dev == '/dev/sdf'
+
+        inventory = utils.DeviceInventory()
+        self.assertEqual(inventory.mounted, {'/dev/sda', '/dev/sda1',
+                                             '/dev/sde'})
+        self.assertEqual(inventory.active_bluestore, {'/dev/sdb'})
+        self.assertEqual(inventory.mapped_luks, {'/dev/sdc'})
+        self.assertEqual(check_output.call_count, 2)
+
+        self.assertEqual(inventory.probe_pristine(['/dev/sdd', '/dev/sdf']),
+                         {'/dev/sdd': False, '/dev/sdf': True})
+        self.assertTrue(inventory.is_pristine('/dev/sdf'))
+        self.assertEqual(is_pristine_disk.call_count, 2)
+
     @patch.object(utils.ceph, 'ceph_user')
     @patch.object(utils.subprocess, 'check_call')
     @patch.object(utils.os.path, 'exists')
@@ -0,0 +1,99 @@
+# Copyright 2024 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+from unittest.mock import patch
+
+sys.path.append('files/nagios')
+import check_ceph_osd_services  # noqa: E402
+
+
+class CheckOSDServicesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.path = os.path.join(tmpdir.name,
+                                 check_ceph_osd_services.CRON_CHECK_TMPFILE)
+        for attr, value in (('NAGIOS_HOME', tmpdir.name),
+                            ('sys.stdout', io.StringIO())):
+            patcher = patch('check_ceph_osd_services.' + attr, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _run_main(self, content):
+        with open(self.path, 'wt') as f:
+            f.write(content)
+        state = check_ceph_osd_services.run_main()
+        return state, check_ceph_osd_services.sys.stdout.getvalue()
+
+    def _osds(self, *osds):
+        return json.dumps({'timestamp': time.time(), 'osds': [
+            {'id': str(i), 'ok': ok, 'message': message}
+            for i, (ok, message) in enumerate(osds)]})
+
+    def test_json_ok(self):
+        state, output = self._run_main(self._osds(
+            (True, 'OK: ceph-osd@0 is active (running)'),
+            (True, 'OK: ceph-osd@1 is active (running)')))
+        self.assertEqual(state, check_ceph_osd_services.STATE_OK)
+        self.assertEqual(output, 'OK: ceph-osd@0 is active (running)\n'
+                                 'OK: ceph-osd@1 is active (running)\n')
+
+    def test_json_critical(self):
+        state, output = self._run_main(self._osds(
+            (True, 'OK: ceph-osd@0 is active (running)'),
+            (False, 'CRITICAL: ceph-osd@1 is booting')))
+        self.assertEqual(state, check_ceph_osd_services.STATE_CRITICAL)
+        self.assertIn('CRITICAL: ceph-osd@1 is booting', output)
+
+    def test_json_no_osds(self):
+        state, _ = self._run_main(self._osds())
+        self.assertEqual(state, check_ceph_osd_services.STATE_UNKNOWN)
+
+    def test_lines_ok(self):
+        state, output = self._run_main(
+            'ceph-osd (ceph/0) start/running, process 1234\n')
+        self.assertEqual(state, check_ceph_osd_services.STATE_OK)
+        self.assertEqual(output,
+                         'ceph-osd (ceph/0) start/running, process 1234\n')
+
+    def test_lines_critical(self):
+        state, _ = self._run_main(
+            'ceph-osd (ceph/0) start/running, process 1234\n'
+            'Failed: check command raised: stop/waiting\n')
+        self.assertEqual(state, check_ceph_osd_services.STATE_CRITICAL)
+
+    def test_empty_file(self):
+        state, _ = self._run_main('')
+        self.assertEqual(state, check_ceph_osd_services.STATE_UNKNOWN)
+
+    def test_missing_file(self):
+        self.assertEqual(check_ceph_osd_services.run_main(),
+                         check_ceph_osd_services.STATE_UNKNOWN)
+
+    def test_stale_file(self):
+        with open(self.path, 'wt') as f:
+            f.write(self._osds((True, 'OK')))
+        stamp = time.time() - 3600
+        os.utime(self.path, (stamp, stamp))
+        self.assertEqual(check_ceph_osd_services.run_main(),
+                         check_ceph_osd_services.STATE_CRITICAL)
@@ -0,0 +1,149 @@
+# Copyright 2024 Canonical Ltd
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#  http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import unittest
+
+from unittest.mock import patch
+
+sys.path.append('files/nagios')
+import collect_ceph_osd_services  # noqa: E402
+
+
+SYSTEMCTL_SHOW = b"""Id=ceph-osd@0.service
+ActiveState=active
+SubState=running
+
+Id=ceph-osd@1.service
+ActiveState=failed
+SubState=failed
+"""
+
+
+class SystemdStatusTestCase(unittest.TestCase):
+
+    @patch.object(collect_ceph_osd_services.subprocess, 'check_output')
+    def test_systemd_status(self, check_output):
+        check_output.return_value = SYSTEMCTL_SHOW
+        status = collect_ceph_osd_services.systemd_status(['0', '1', '2'])
+        check_output.assert_called_once_with(
+            ['systemctl', 'show', '--property=Id,ActiveState,SubState',
+             'ceph-osd@0.service', 'ceph-osd@1.service',
+             'ceph-osd@2.service'])
+        self.assertEqual(status, {
+            '0': {'ok': True,
+                  'message': 'OK: ceph-osd@0 is active (running)'},
+            '1': {'ok': False,
+                  'message': 'CRITICAL: ceph-osd@1 is failed (failed)'},
+            '2': {'ok': False,
+                  'message': 'CRITICAL: ceph-osd@2 is unknown (unknown)'},
+        })
+
+
+class AsokStatusTestCase(unittest.TestCase):
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.path = os.path.join(tmpdir.name, 'ceph-osd.{}.asok')
+        patcher = patch.object(collect_ceph_osd_services, 'ASOK_PATH',
+                               self.path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.requests = []
+
+    def _serve(self, chunks):
+        """Answer a single request on the admin socket of OSD 0."""
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.addCleanup(server.close)
+        server.bind(self.path.format(0))
+        server.listen(1)
+
+        def _run():
+            conn, _ = server.accept()
+            with conn:
+                request = b''
+                while not request.endswith(b'\0'):
+                    request += conn.recv(1024)
+                self.requests.append(json.loads(request[:-1]))
+                for chunk in chunks:
+                    conn.sendall(chunk)
+
+        thread = threading.Thread(target=_run)
+        thread.start()
+        self.addCleanup(thread.join)
+
+    def test_asok_status(self):
+        reply = json.dumps({'state': 'active'}).encode('utf-8')
+        data = struct.pack('>I', len(reply)) + reply
+        # The reply arrives a byte at a time.
+        self._serve([data[i:i + 1] for i in range(len(data))])
+        self.assertEqual(collect_ceph_osd_services.asok_status(0), 'active')
+        self.assertEqual(self.requests, [{'prefix': 'status'}])
+
+    def test_asok_status_short_length(self):
+        self._serve([b'\0\0'])
+        with self.assertRaises(ValueError):
+            collect_ceph_osd_services.asok_status(0)
+
+    def test_asok_status_truncated(self):
+        self._serve([struct.pack('>I', 100), b'{"state": '])
+        with self.assertRaises(ValueError):
+            collect_ceph_osd_services.asok_status(0)
+
+    def test_asok_status_no_socket(self):
+        with self.assertRaises(OSError):
+            collect_ceph_osd_services.asok_status(1)
+
+
+class AddAsokStatusTestCase(unittest.TestCase):
+
+    @patch.object(collect_ceph_osd_services, 'asok_status')
+    def test_add_asok_status(self, asok_status):
+        def _asok_status(unit):
+            if unit == '1':
+                raise OSError('Connection refused')
+            if unit == '2':
+                raise ValueError('Short reply from the admin socket')
+            return {'0': 'active', '3': 'booting'}[unit]
+
+        asok_status.side_effect = _asok_status
+        status = {unit: {'ok': True, 'message': 'OK'}
+                  for unit in ('0', '1', '2', '3')}
+        status['4'] = {'ok': False, 'message': 'CRITICAL'}
+        collect_ceph_osd_services.add_asok_status(status)
+
+        self.assertEqual(status['0'], {'ok': True, 'message': 'OK',
+                                       'asok_state': 'active'})
+        self.assertEqual(status['1'], {
+            'ok': False, 'asok_state': None,
+            'message': 'CRITICAL: ceph-osd@1 admin socket failed: '
+                       'Connection refused'})
+        self.assertEqual(status['2'], {
+            'ok': False, 'asok_state': None,
+            'message': 'CRITICAL: ceph-osd@2 admin socket failed: '
+                       'Short reply from the admin socket'})
+        self.assertEqual(status['3'], {
+            'ok': False, 'asok_state': 'booting',
+            'message': 'CRITICAL: ceph-osd@3 is booting'})
+        # OSDs that aren't running aren't asked.
+        self.assertEqual(status['4'], {'ok': False, 'message': 'CRITICAL'})
+        self.assertEqual(sorted(c[0][0] for c in asok_status.call_args_list),
+                         ['0', '1', '2', '3'])
@@ -13,11 +13,12 @@ class UpgradeRollingTestCase(CharmTestCase):
     @patch('ceph_hooks.os.path.exists')
     @patch('ceph_hooks.ceph.resolve_ceph_version')
     @patch('ceph_hooks.emit_cephconf')
+    @patch('ceph_hooks.config')
     @patch('ceph_hooks.hookenv')
     @patch('ceph_hooks.ceph.roll_osd_cluster')
     @patch('utils.find_filestore_osds')
     def test_check_for_upgrade(self, find_filestore_osds,
-                               roll_osd_cluster, hookenv,
+                               roll_osd_cluster, hookenv, config,
                                emit_cephconf, version, exists,
                                dirs_need_ownership_update,
                                notify_mon_of_upgrade):
@@ -32,10 +33,13 @@ class UpgradeRollingTestCase(CharmTestCase):
         self.test_config.set('key', 'key')
 
         hookenv.config.side_effect = self.test_config
+        config.side_effect = self.test_config
         check_for_upgrade()
 
         roll_osd_cluster.assert_called_with(new_version='hammer',
-                                            upgrade_key='osd-upgrade')
+                                            upgrade_key='osd-upgrade',
+                                            max_hosts_per_wave=None,
+                                            parallelism=4)
         emit_cephconf.assert_has_calls([call(upgrading=True),
                                         call(upgrading=False)])
         exists.assert_called_with(
@@ -47,12 +51,13 @@ class UpgradeRollingTestCase(CharmTestCase):
     @patch('ceph_hooks.os.path.exists')
     @patch('ceph_hooks.ceph.resolve_ceph_version')
     @patch('ceph_hooks.emit_cephconf')
+    @patch('ceph_hooks.config')
     @patch('ceph_hooks.hookenv')
     @patch('ceph_hooks.ceph.roll_osd_cluster')
     @patch('utils.find_filestore_osds')
     def test_resume_failed_upgrade(self, find_filestore_osds,
                                    roll_osd_cluster,
-                                   hookenv, emit_cephconf, version,
+                                   hookenv, config, emit_cephconf, version,
                                    exists,
                                    dirs_need_ownership_update,
                                    notify_mon_of_upgrade):
@@ -60,17 +65,30 @@ class UpgradeRollingTestCase(CharmTestCase):
         exists.return_value = True
         version_pre_and_post = 'jewel'
         version.side_effect = [version_pre_and_post, version_pre_and_post]
+        self.test_config.set('max-hosts-per-upgrade-wave', 2)
+        self.test_config.set('osd-upgrade-parallelism', 1)
+        hookenv.config.side_effect = self.test_config
+        config.side_effect = self.test_config
 
         check_for_upgrade()
 
         roll_osd_cluster.assert_called_with(new_version='jewel',
-                                            upgrade_key='osd-upgrade')
+                                            upgrade_key='osd-upgrade',
+                                            max_hosts_per_wave=2,
+                                            parallelism=1)
         emit_cephconf.assert_has_calls([call(upgrading=True),
                                         call(upgrading=False)])
         exists.assert_called_with(
             "/var/lib/ceph/osd/ceph.client.osd-upgrade.keyring")
         notify_mon_of_upgrade.assert_called_once_with(version_pre_and_post)
 
+        # An invalid parallelism refuses the upgrade
+        roll_osd_cluster.reset_mock()
+        version.side_effect = [version_pre_and_post, version_pre_and_post]
+        self.test_config.set('osd-upgrade-parallelism', 0)
+        check_for_upgrade()
+        roll_osd_cluster.assert_not_called()
+
     @patch('ceph_hooks.os.path.exists')
     @patch('ceph_hooks.ceph.resolve_ceph_version')
     @patch('ceph_hooks.hookenv')
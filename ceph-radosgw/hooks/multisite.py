@@ -13,6 +13,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import copy
 import json
 import functools
 import subprocess
@@ -72,6 +73,47 @@ def _call(cmd):
     return subprocess.call(cmd)
 
 
+# Snapshot of the realm, zonegroup and zone topology seen by this unit.
+# Hooks and actions each run in a process of their own so entries only live
+# for the duration of a single hook; every helper changing the topology drops
+# the whole snapshot.
+_topology = {}
+
+
+def invalidate_topology():
+    """Drop the cached multisite topology snapshot"""
+    _topology.clear()
+
+
+def _invalidates_topology(f):
+    """Decorator for helpers which modify the multisite topology"""
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        try:
+            return f(*args, **kwargs)
+        finally:
+            invalidate_topology()
+    return wrapper
+
+
+def _topology_query(*args):
+    """Run a read-only radosgw-admin query through the topology snapshot
+
+    The decoded result is kept until the snapshot is invalidated, callers
+    get their own copy so they are free to modify it.
+
+    :param args: radosgw-admin arguments following the --id option
+    :type args: str
+    :return: decoded JSON output of the query
+    :rtype: Union[dict, list]
+    :raises: subprocess.CalledProcessError, TypeError
+    """
+    if args not in _topology:
+        cmd = [RGW_ADMIN, '--id={}'.format(_key_name())] + list(args)
+        _topology[args] = json.loads(_check_output(cmd))
+    return copy.deepcopy(_topology[args])
+
+
 def _key_name():
     """Determine the name of the cephx key for the local unit"""
     if utils.request_per_unit_key():
@@ -89,12 +131,8 @@ def _list(key):
     :return: List of specified entities found
     :rtype: list
     """
-    cmd = [
-        RGW_ADMIN, '--id={}'.format(_key_name()),
-        key, 'list'
-    ]
     try:
-        result = json.loads(_check_output(cmd))
+        result = _topology_query(key, 'list')
         hookenv.log("Results: {}".format(
             result),
             level=hookenv.DEBUG)
@@ -150,6 +188,7 @@ def list_zones(retry_on_empty=False):
     _zones = _list('zone')
     if retry_on_empty and not _zones:
         hookenv.log("No zones found", level=hookenv.DEBUG)
+        invalidate_topology()
         raise ValueError("No zones found")
     return _zones
 
@@ -169,14 +208,10 @@ def list_buckets(zone, zonegroup):
     :returns: List of buckets found
     :rtype: list
     """
-    cmd = [
-        RGW_ADMIN, '--id={}'.format(_key_name()),
-        'bucket', 'list',
-        '--rgw-zone={}'.format(zone),
-        '--rgw-zonegroup={}'.format(zonegroup),
-    ]
     try:
-        return json.loads(_check_output(cmd))
+        return _topology_query('bucket', 'list',
+                               '--rgw-zone={}'.format(zone),
+                               '--rgw-zonegroup={}'.format(zonegroup))
     except subprocess.CalledProcessError:
         hookenv.log("Bucket queried for incorrect zone({})-zonegroup({}) "
                     "pair".format(zone, zonegroup), level=hookenv.ERROR)
@@ -185,6 +220,7 @@ def list_buckets(zone, zonegroup):
         return None
 
 
+@_invalidates_topology
 def create_realm(name, default=False):
     """
     Create a new RADOS Gateway Realm.
@@ -209,6 +245,7 @@ def create_realm(name, default=False):
         return None
 
 
+@_invalidates_topology
 def set_default_realm(name):
     """
     Set the default RADOS Gateway Realm
@@ -224,6 +261,7 @@ def set_default_realm(name):
     _check_call(cmd)
 
 
+@_invalidates_topology
 def create_zonegroup(name, endpoints, default=False, master=False, realm=None):
     """
     Create a new RADOS Gateway zone Group
@@ -259,6 +297,7 @@ def create_zonegroup(name, endpoints, default=False, master=False, realm=None):
         return None
 
 
+@_invalidates_topology
 def modify_zonegroup(name, endpoints=None, default=False,
                      master=False, realm=None):
     """Modify an existing RADOS Gateway zonegroup
@@ -298,6 +337,7 @@ def modify_zonegroup(name, endpoints=None, default=False,
         return None
 
 
+@_invalidates_topology
 def create_zone(name, endpoints, default=False, master=False, zonegroup=None,
                 access_key=None, secret=None, readonly=False):
     """
@@ -344,6 +384,7 @@ def create_zone(name, endpoints, default=False, master=False, zonegroup=None,
         return None
 
 
+@_invalidates_topology
 def modify_zone(name, endpoints=None, default=False, master=False,
                 access_key=None, secret=None, readonly=False,
                 realm=None, zonegroup=None):
@@ -404,19 +445,16 @@ def get_zone_info(name, zonegroup=None):
     :type zonegroup: str
     :rtype: dict
     """
-    cmd = [
-        RGW_ADMIN, '--id={}'.format(_key_name()),
-        'zone', 'get',
-        '--rgw-zone={}'.format(name),
-    ]
+    args = ['zone', 'get', '--rgw-zone={}'.format(name)]
     if zonegroup:
-        cmd.append('--rgw-zonegroup={}'.format(zonegroup))
+        args.append('--rgw-zonegroup={}'.format(zonegroup))
     try:
-        return json.loads(_check_output(cmd))
+        return _topology_query(*args)
     except TypeError:
         return None
 
 
+@_invalidates_topology
 def remove_zone_from_zonegroup(zone, zonegroup):
     """Remove RADOS Gateway zone from provided parent zonegroup
 
@@ -445,6 +483,7 @@ def remove_zone_from_zonegroup(zone, zonegroup):
             .format(zone, zonegroup, result)) from exc
 
 
+@_invalidates_topology
 def add_zone_to_zonegroup(zone, zonegroup):
     """Add RADOS Gateway zone to provided zonegroup
 
@@ -470,6 +509,7 @@ def add_zone_to_zonegroup(zone, zonegroup):
             .format(zone, zonegroup, result)) from exc
 
 
+@_invalidates_topology
 def update_period(fatal=True, zonegroup=None, zone=None, realm=None):
     """Update RADOS Gateway configuration period
 
@@ -498,6 +538,7 @@ def update_period(fatal=True, zonegroup=None, zone=None, realm=None):
         _call(cmd)
 
 
+@_invalidates_topology
 def tidy_defaults():
     """
     Purge any default zonegroup and zone definitions
@@ -543,6 +584,7 @@ def get_user_creds(username):
             result['keys'][0]['secret_key'])
 
 
+@_invalidates_topology
 def suspend_user(username):
     """
     Suspend a RADOS Gateway user
@@ -566,6 +608,7 @@ def suspend_user(username):
         level=hookenv.DEBUG)
 
 
+@_invalidates_topology
 def create_user(username, system_user=False):
     """
     Create a RADOS Gateway user
@@ -605,6 +648,7 @@ def create_system_user(username):
     return create_user(username, system_user=True)
 
 
+@_invalidates_topology
 def pull_realm(url, access_key, secret):
     """
     Pull in a RADOS Gateway Realm from a master RGW instance
@@ -631,6 +675,7 @@ def pull_realm(url, access_key, secret):
         return None
 
 
+@_invalidates_topology
 def pull_period(url, access_key, secret):
     """
     Pull in a RADOS Gateway period from a master RGW instance
@@ -657,6 +702,7 @@ def pull_period(url, access_key, secret):
         return None
 
 
+@_invalidates_topology
 def rename_zone(name, new_name, zonegroup):
     """Rename an existing RADOS Gateway zone
 
@@ -680,6 +726,7 @@ def rename_zone(name, new_name, zonegroup):
     return 0 if result == 0 else None
 
 
+@_invalidates_topology
 def rename_zonegroup(name, new_name):
     """Rename an existing RADOS Gateway zonegroup
 
@@ -709,13 +756,9 @@ def get_zonegroup_info(zonegroup):
     :type zonegroup: str
     :rtype: dict
     """
-    cmd = [
-        RGW_ADMIN, '--id={}'.format(_key_name()),
-        'zonegroup', 'get',
-        '--rgw-zonegroup={}'.format(zonegroup),
-    ]
     try:
-        return json.loads(_check_output(cmd))
+        return _topology_query('zonegroup', 'get',
+                               '--rgw-zonegroup={}'.format(zonegroup))
     except TypeError:
         return None
 
@@ -1001,6 +1044,7 @@ def get_sync_group(group_id, bucket=None):
         return None
 
 
+@_invalidates_topology
 def create_sync_group(group_id, status, bucket=None):
     """Create a sync policy group.
 
@@ -1036,6 +1080,7 @@ def create_sync_group(group_id, status, bucket=None):
         return None
 
 
+@_invalidates_topology
 def remove_sync_group(group_id, bucket=None):
     """Remove a sync group with the given group ID and optional bucket.
 
@@ -1113,6 +1158,7 @@ def is_sync_group_update_needed(group_id, flow_id, pipe_id, source_zone,
     return False
 
 
+@_invalidates_topology
 def create_sync_group_flow(group_id, flow_id, flow_type, source_zone,
                            dest_zone):
     """Create a new sync group data flow with the given parameters.
@@ -1154,6 +1200,7 @@ def create_sync_group_flow(group_id, flow_id, flow_type, source_zone,
         return None
 
 
+@_invalidates_topology
 def remove_sync_group_flow(group_id, flow_id, flow_type, source_zone=None,
                            dest_zone=None):
     """Remove a sync group data flow.
@@ -1190,6 +1237,7 @@ def remove_sync_group_flow(group_id, flow_id, flow_type, source_zone=None,
         return None
 
 
+@_invalidates_topology
 def create_sync_group_pipe(group_id, pipe_id, source_zones, dest_zones,
                            source_bucket='*', dest_bucket='*', bucket=None):
     """Create a sync group pipe between source and destination zones.
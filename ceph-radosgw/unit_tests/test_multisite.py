@@ -53,6 +53,7 @@ class TestMultisiteHelpers(CharmTestCase):
         super(TestMultisiteHelpers, self).setUp(multisite, self.TO_PATCH)
         self.socket.gethostname.return_value = 'testhost'
         self.utils.request_per_unit_key.return_value = True
+        multisite.invalidate_topology()
 
     def _testdata(self, funcname):
         return os.path.join(os.path.dirname(__file__),
@@ -236,6 +237,26 @@ class TestMultisiteHelpers(CharmTestCase):
             result = multisite.list_zones()
             self.assertTrue('brundall-east' in result)
 
+    def test_topology_snapshot(self):
+        with open(self._testdata('test_list_zones'), 'rb') as f:
+            self.subprocess.check_output.return_value = f.read()
+        zones = multisite.list_zones()
+        zones.append('mutated')
+        self.assertEqual(multisite.list_zones(), zones[:-1])
+        multisite.get_zonegroup_info('brundall')
+        multisite.get_zonegroup_info('brundall')
+        self.assertEqual(self.subprocess.check_output.call_count, 2)
+        # Anything changing the topology drops the snapshot.
+        multisite.update_period()
+        multisite.list_zones()
+        self.assertEqual(self.subprocess.check_output.call_count, 3)
+        multisite.list_zones()
+        self.assertEqual(self.subprocess.check_output.call_count, 3)
+        # So do changes to the sync policy.
+        multisite.remove_sync_group('default')
+        multisite.list_zones()
+        self.assertEqual(self.subprocess.check_output.call_count, 5)
+
     def test_update_period(self):
         multisite.update_period()
         self.subprocess.check_call.assert_called_once_with([
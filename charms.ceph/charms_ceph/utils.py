@@ -12,21 +12,33 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import atexit
 import collections
+import errno
 import glob
+import grp
 import itertools
 import json
 import os
+import pwd
 import pyudev
 import random
 import re
 import socket
+import struct
 import subprocess
 import sys
+import threading
 import time
 import uuid
 import functools
 
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    FIRST_EXCEPTION,
+    ThreadPoolExecutor,
+    wait,
+)
 from contextlib import contextmanager
 from datetime import datetime
 
@@ -80,6 +92,11 @@ from charmhelpers.contrib.openstack.utils import (
 from charmhelpers.contrib.storage.linux import lvm
 from charmhelpers.core.unitdata import kv
 
+try:
+    import rados
+except ImportError:
+    rados = None
+
 CEPH_BASE_DIR = os.path.join(os.sep, 'var', 'lib', 'ceph')
 OSD_BASE_DIR = os.path.join(CEPH_BASE_DIR, 'osd')
 HDPARM_FILE = os.path.join(os.sep, 'etc', 'hdparm.conf')
@@ -547,6 +564,248 @@ class CrushLocation(object):
         return self.name < other.name
 
 
+# librados handles shared by all of the ceph commands run by this process,
+# i.e. by the current hook or action, keyed by cephx id or entity name.
+# None records that no session could be established and that the ceph CLI
+# has to be used.
+_ceph_sessions = {}
+_ceph_sessions_lock = threading.Lock()
+
+
+def _close_ceph_sessions():
+    """Shut down the librados handles opened by this process."""
+    for cluster in _ceph_sessions.values():
+        if cluster is not None:
+            cluster.shutdown()
+    _ceph_sessions.clear()
+
+
+def ceph_session(service=None, keyring=None):
+    """Get the librados handle of this process for a cephx id.
+
+    The handle is connected on first use and kept until the process exits,
+    saving the interpreter start-up and cephx authentication each ceph CLI
+    invocation pays for.
+
+    :param service: The cephx id to connect as, defaults to ``admin``.  A
+                    full entity name such as ``mon.`` is used as is.
+    :type service: Optional[str]
+    :param keyring: Keyring to authenticate with instead of the default
+                    one of the cephx id.
+    :type keyring: Optional[str]
+    :returns: A connected handle, None if the python rados bindings are
+              missing or the cluster could not be reached.
+    :rtype: Optional[rados.Rados]
+    """
+    if rados is None:
+        return None
+    service = service or 'admin'
+    with _ceph_sessions_lock:
+        if service not in _ceph_sessions:
+            if not _ceph_sessions:
+                atexit.register(_close_ceph_sessions)
+            kwargs = {'conffile': '/etc/ceph/ceph.conf'}
+            if '.' in service:
+                kwargs['name'] = service
+            else:
+                kwargs['rados_id'] = service
+            if keyring:
+                kwargs['conf'] = {'keyring': keyring}
+            try:
+                cluster = rados.Rados(**kwargs)
+                cluster.connect(timeout=30)
+            except Exception as e:
+                log("Unable to connect to the cluster as {}, falling back "
+                    "to the ceph CLI: {}".format(service, e), level=WARNING)
+                cluster = None
+            _ceph_sessions[service] = cluster
+        return _ceph_sessions[service]
+
+
+def _ceph_cli_args(command, service=None, keyring=None, user=None):
+    """Build the ceph CLI invocation of a command in the JSON form.
+
+    The arguments of the command follow its prefix in the order of the
+    dict, lists are expanded and ``format`` becomes ``--format``, so that
+    the CLI and the librados session always run the same command.
+
+    :param command: The command in the JSON form used by the monitors.
+    :type command: Dict[str, Any]
+    :param service: The cephx id to run as, or the full entity name when
+                    a keyring is given.
+    :type service: Optional[str]
+    :param keyring: The keyring to authenticate with.
+    :type keyring: Optional[str]
+    :param user: The system user to run the CLI as.
+    :type user: Optional[str]
+    :rtype: List[str]
+    """
+    cmd = ['sudo', '-u', user] if user else []
+    cmd.append('ceph')
+    if keyring:
+        cmd.extend(['--name', service, '--keyring', keyring])
+    elif service:
+        cmd.extend(['--id', service])
+    cmd.extend(command['prefix'].split())
+    for name, value in command.items():
+        if name in ('prefix', 'format'):
+            continue
+        cmd.extend(value if isinstance(value, (list, tuple)) else [value])
+    if 'format' in command:
+        cmd.append('--format={}'.format(command['format']))
+    return [str(arg) for arg in cmd]
+
+
+def _ceph_session_command(cmd, command, service, target, stderr,
+                          universal_newlines, keyring=None):
+    """Run a command over the librados session, mimicking the ceph CLI.
+
+    :returns: The output of the command, None if there is no session.
+    :rtype: Optional[Union[bytes, str]]
+    :raises: subprocess.CalledProcessError
+    """
+    cluster = ceph_session(service, keyring)
+    if cluster is None:
+        return None
+    try:
+        if target == 'mgr':
+            ret, outbuf, outs = cluster.mgr_command(json.dumps(command), b'')
+        else:
+            ret, outbuf, outs = cluster.mon_command(json.dumps(command), b'')
+    except rados.Error as e:
+        log("'{}' failed over the librados session, falling back to the "
+            "ceph CLI: {}".format(command['prefix'], e), level=WARNING)
+        return None
+
+    # The CLI prints the status string on stderr, prefixed with the name of
+    # the error if the command failed.
+    output = outbuf.decode('UTF-8')
+    if ret:
+        outs = 'Error {}: {}'.format(
+            errno.errorcode.get(-ret, ret), outs).rstrip() + '\n'
+    if stderr == subprocess.STDOUT and outs:
+        output += outs
+    if ret:
+        raise subprocess.CalledProcessError(-ret, cmd, output=output)
+    return output if universal_newlines else output.encode('UTF-8')
+
+
+def ceph_check_output(command, service=None, target='mon', keyring=None,
+                      user=None, **kwargs):
+    """Drop-in replacement of subprocess.check_output for ceph commands.
+
+    The command is sent over the librados session of this process when one
+    is available and run with the ceph CLI otherwise.
+
+    :param command: The command in the JSON form used by the monitors,
+                    e.g. ``{'prefix': 'osd tree', 'format': 'json'}``.
+                    The CLI invocation is built from it.
+    :type command: Dict[str, Any]
+    :param service: The cephx id to run as.
+    :type service: Optional[str]
+    :param target: Daemon handling the command, ``mon`` or ``mgr``.
+    :type target: str
+    :param keyring: The keyring to authenticate with, ``service`` is then
+                    the full entity name, e.g. ``mon.``.
+    :type keyring: Optional[str]
+    :param user: The system user the CLI runs as.
+    :type user: Optional[str]
+    :param kwargs: Arguments for subprocess.check_output, only ``stderr``
+                   and ``universal_newlines`` are honoured by the session.
+    :returns: The output of the command.
+    :rtype: Union[bytes, str]
+    :raises: subprocess.CalledProcessError
+    """
+    cmd = _ceph_cli_args(command, service, keyring, user)
+    output = _ceph_session_command(
+        cmd, command, service, target, kwargs.get('stderr'),
+        kwargs.get('universal_newlines', False), keyring)
+    if output is None:
+        output = subprocess.check_output(cmd, **kwargs)
+    return output
+
+
+def ceph_check_call(command, service=None, target='mon', keyring=None,
+                    user=None):
+    """Drop-in replacement of subprocess.check_call for ceph commands.
+
+    See ceph_check_output for the parameters.
+
+    :raises: subprocess.CalledProcessError
+    """
+    cmd = _ceph_cli_args(command, service, keyring, user)
+    if _ceph_session_command(cmd, command, service, target, None,
+                             False, keyring) is None:
+        subprocess.check_call(cmd)
+    return 0
+
+
+def _admin_socket_command(asok, prefix):
+    """Run a command on a local ceph daemon through its admin socket.
+
+    Talks the admin socket protocol directly rather than going through
+    ``ceph --admin-daemon``: a JSON request terminated by a NUL byte,
+    answered by a 32 bit big endian length followed by the response.
+
+    :param asok: Path of the admin socket.
+    :type asok: str
+    :param prefix: The command to run, e.g. ``mon_status``.
+    :type prefix: str
+    :returns: The decoded JSON response.
+    :rtype: Any
+    :raises: OSError, ValueError
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(30)
+        sock.connect(asok)
+        sock.sendall(json.dumps({'prefix': prefix}).encode('UTF-8') + b'\0')
+        response = b''
+        length = None
+        while length is None or len(response) < length:
+            chunk = sock.recv(65536)
+            if not chunk:
+                raise ValueError("Truncated response from {}".format(asok))
+            response += chunk
+            if length is None and len(response) >= 4:
+                length = struct.unpack('>I', response[:4])[0]
+                response = response[4:]
+    return json.loads(response.decode('UTF-8'))
+
+
+def _mon_status():
+    """Get the status of the local monitor.
+
+    :returns: The status, None if the monitor could not be queried.
+    :rtype: Optional[dict]
+    """
+    asok = "/var/run/ceph/ceph-mon.{}.asok".format(socket.gethostname())
+    if not os.path.exists(asok):
+        return None
+    try:
+        return _admin_socket_command(asok, 'mon_status')
+    except (OSError, ValueError) as e:
+        log("Unable to query {}, falling back to the ceph CLI: {}"
+            .format(asok, e), level=DEBUG)
+    cmd = [
+        "sudo",
+        "-u",
+        ceph_user(),
+        "ceph",
+        "--admin-daemon",
+        asok,
+        "mon_status"
+    ]
+    try:
+        return json.loads(str(subprocess
+                              .check_output(cmd)
+                              .decode('UTF-8')))
+    except subprocess.CalledProcessError:
+        return None
+    except ValueError:
+        # Non JSON response from mon_status
+        return None
+
+
 def get_osd_weight(osd_id):
     """Returns the weight of the specified OSD.
 
@@ -555,8 +814,7 @@ def get_osd_weight(osd_id):
     :raises: CalledProcessError if our Ceph command fails.
     """
     try:
-        tree = str(subprocess
-                   .check_output(['ceph', 'osd', 'tree', '--format=json'])
+        tree = str(ceph_check_output({'prefix': 'osd tree', 'format': 'json'})
                    .decode('UTF-8'))
         try:
             json_tree = json.loads(tree)
@@ -627,10 +885,9 @@ def get_osd_tree(service):
              Also raises CalledProcessError if our Ceph command fails
     """
     try:
-        tree = str(subprocess
-                   .check_output(['ceph', '--id', service,
-                                  'osd', 'tree', '--format=json'])
-                   .decode('UTF-8'))
+        tree = str(ceph_check_output(
+            {'prefix': 'osd tree', 'format': 'json'}, service=service)
+            .decode('UTF-8'))
         try:
             json_tree = json.loads(tree)
             roots = _flatten_roots(json_tree["nodes"])
@@ -788,73 +1045,30 @@ def error_out(msg):
 
 
 def is_quorum():
-    asok = "/var/run/ceph/ceph-mon.{}.asok".format(socket.gethostname())
-    cmd = [
-        "sudo",
-        "-u",
-        ceph_user(),
-        "ceph",
-        "--admin-daemon",
-        asok,
-        "mon_status"
-    ]
-    if os.path.exists(asok):
-        try:
-            result = json.loads(str(subprocess
-                                    .check_output(cmd)
-                                    .decode('UTF-8')))
-        except subprocess.CalledProcessError:
-            return False
-        except ValueError:
-            # Non JSON response from mon_status
-            return False
-        if result['state'] in QUORUM:
-            return True
-        else:
-            return False
-    else:
+    result = _mon_status()
+    if result is None:
         return False
+    return result['state'] in QUORUM
 
 
 def is_leader():
-    asok = "/var/run/ceph/ceph-mon.{}.asok".format(socket.gethostname())
-    cmd = [
-        "sudo",
-        "-u",
-        ceph_user(),
-        "ceph",
-        "--admin-daemon",
-        asok,
-        "mon_status"
-    ]
-    if os.path.exists(asok):
-        try:
-            result = json.loads(str(subprocess
-                                    .check_output(cmd)
-                                    .decode('UTF-8')))
-        except subprocess.CalledProcessError:
-            return False
-        except ValueError:
-            # Non JSON response from mon_status
-            return False
-        if result['state'] == LEADER:
-            return True
-        else:
-            return False
-    else:
+    result = _mon_status()
+    if result is None:
         return False
+    return result['state'] == LEADER
 
 
 def manager_available():
     # if manager daemon isn't on this release, just say it is Fine
     if cmp_pkgrevno('ceph', '11.0.0') < 0:
         return True
-    cmd = ["sudo", "-u", "ceph", "ceph", "mgr", "dump", "-f", "json"]
     try:
-        result = json.loads(subprocess.check_output(cmd).decode('UTF-8'))
+        result = json.loads(ceph_check_output(
+            {'prefix': 'mgr dump', 'format': 'json'},
+            user='ceph').decode('UTF-8'))
         return result['available']
     except subprocess.CalledProcessError as e:
-        log("'{}' failed: {}".format(" ".join(cmd), str(e)))
+        log("'{}' failed: {}".format(" ".join(e.cmd), str(e)))
         return False
     except Exception:
         return False
@@ -1173,9 +1387,19 @@ mds_caps = collections.OrderedDict([
     ('mon', ['allow rwx']),
 ])
 
+# RADOS object the nodes of a rolling upgrade watch, the node that finished
+# upgrading notifies it so that the next one starts without waiting for its
+# next poll of the upgrade keys.
+UPGRADE_NOTIFY_POOL = '.mgr'
+UPGRADE_NOTIFY_NAMESPACE = 'charm-upgrade'
+UPGRADE_NOTIFY_OBJECT = 'upgrade'
+
 osd_upgrade_caps = collections.OrderedDict([
     ('mon', ['allow command "config-key"',
              'allow command "osd tree"',
+             'allow command "osd crush rule dump"',
+             'allow command "osd pool ls"',
+             'allow command "pg stat"',
              'allow command "config-key list"',
              'allow command "config-key put"',
              'allow command "config-key get"',
@@ -1184,7 +1408,11 @@ osd_upgrade_caps = collections.OrderedDict([
              'allow command "osd in"',
              'allow command "osd rm"',
              'allow command "auth del"',
-             ])
+             ]),
+    ('mgr', ['allow r']),
+    ('osd', ['allow rw pool={} namespace={} object_prefix {}'.format(
+        UPGRADE_NOTIFY_POOL, UPGRADE_NOTIFY_NAMESPACE,
+        UPGRADE_NOTIFY_OBJECT)]),
 ])
 
 rbd_mirror_caps = collections.OrderedDict([
@@ -1201,28 +1429,27 @@ def get_rbd_mirror_key(name):
     return get_named_key(name=name, caps=rbd_mirror_caps)
 
 
+def _mon_keyring():
+    """Path of the keyring of the local monitor, i.e. of ``mon.``."""
+    return '/var/lib/ceph/mon/ceph-{}/keyring'.format(socket.gethostname())
+
+
 def create_named_keyring(entity, name, caps=None):
     caps = caps or _default_caps
-    cmd = [
-        "sudo",
-        "-u",
-        ceph_user(),
-        'ceph',
-        '--name', 'mon.',
-        '--keyring',
-        '/var/lib/ceph/mon/ceph-{}/keyring'.format(
-            socket.gethostname()
-        ),
-        'auth', 'get-or-create', '{entity}.{name}'.format(entity=entity,
-                                                          name=name),
-    ]
+    key_name = '{entity}.{name}'.format(entity=entity, name=name)
+    if ceph_auth_caps_match(key_name, caps):
+        return ceph_auth_get(key_name)
+
+    command = {'prefix': 'auth get-or-create', 'entity': key_name,
+               'caps': []}
     for subsystem, subcaps in caps.items():
-        cmd.extend([subsystem, '; '.join(subcaps)])
-    log("Calling check_output: {}".format(cmd), level=DEBUG)
-    return (parse_key(str(subprocess
-                          .check_output(cmd)
-                          .decode('UTF-8'))
-                      .strip()))  # IGNORE:E1103
+        command['caps'].extend([subsystem, '; '.join(subcaps)])
+    log("Calling check_output: {}".format(command), level=DEBUG)
+    flush_ceph_auth_cache()
+    return (parse_key(str(ceph_check_output(
+        command, service='mon.', keyring=_mon_keyring(), user=ceph_user())
+        .decode('UTF-8'))
+        .strip()))  # IGNORE:E1103
 
 
 def get_upgrade_key():
@@ -1247,23 +1474,14 @@ def get_named_key(name, caps=None, pool_list=None):
 
     key = ceph_auth_get(key_name)
     if key:
-        if is_internal_client(name):
+        if (is_internal_client(name) and
+                not ceph_auth_caps_match(key_name, caps)):
             upgrade_key_caps(key_name, caps)
         return key
 
     log("Creating new key for {}".format(name), level=DEBUG)
-    cmd = [
-        "sudo",
-        "-u",
-        ceph_user(),
-        'ceph',
-        '--name', 'mon.',
-        '--keyring',
-        '/var/lib/ceph/mon/ceph-{}/keyring'.format(
-            socket.gethostname()
-        ),
-        'auth', 'get-or-create', key_name,
-    ]
+    command = {'prefix': 'auth get-or-create', 'entity': key_name,
+               'caps': []}
     # Add capabilities
     for subsystem, subcaps in caps.items():
         if subsystem == 'osd':
@@ -1272,34 +1490,80 @@ def get_named_key(name, caps=None, pool_list=None):
                 # "pool=rgw pool=rbd pool=something"
                 pools = " ".join(['pool={0}'.format(i) for i in pool_list])
                 subcaps[0] = subcaps[0] + " " + pools
-        cmd.extend([subsystem, '; '.join(subcaps)])
-    ceph_auth_get.cache_clear()
+        command['caps'].extend([subsystem, '; '.join(subcaps)])
+    flush_ceph_auth_cache()
+
+    log("Calling check_output: {}".format(command), level=DEBUG)
+    return parse_key(str(ceph_check_output(
+        command, service='mon.', keyring=_mon_keyring(), user=ceph_user())
+        .decode('UTF-8'))
+        .strip())  # IGNORE:E1103
+
+
+@functools.lru_cache()
+def ceph_auth_list():
+    """Retrieve all cephx entities along with their key and caps.
+
+    The monitors are queried once per process, i.e. once per hook; the
+    result is dropped by ``flush_ceph_auth_cache`` whenever a key is
+    created, has its caps changed or is rotated.
+
+    :returns: Map of entity name to its ``key`` and ``caps``, or None if the
+              entities could not be listed.
+    :rtype: Optional[Dict[str, Dict]]
+    """
+    try:
+        output = ceph_check_output(
+            {'prefix': 'auth ls', 'format': 'json'},
+            service='mon.', keyring=_mon_keyring(),
+            user=ceph_user()).decode('UTF-8')
+        return {entity['entity']: entity
+                for entity in json.loads(output)['auth_dump']}
+    except (subprocess.CalledProcessError, ValueError, KeyError) as e:
+        log("Unable to list cephx entities, falling back to querying "
+            "them one by one: {}".format(e), level=DEBUG)
+        return None
 
-    log("Calling check_output: {}".format(cmd), level=DEBUG)
-    return parse_key(str(subprocess
-                         .check_output(cmd)
-                         .decode('UTF-8'))
-                     .strip())  # IGNORE:E1103
+
+def ceph_auth_caps_match(key_name, caps):
+    """Check whether a cephx entity exists with exactly the provided caps.
+
+    :param key_name: Name of the entity, e.g. client.crash
+    :type key_name: str
+    :param caps: Map of subsystem to the list of its caps.
+    :type caps: Dict[str, List[str]]
+    :rtype: bool
+    """
+    entity = (ceph_auth_list() or {}).get(key_name)
+    if not entity:
+        return False
+    wanted = {subsystem: '; '.join(subcaps)
+              for subsystem, subcaps in caps.items()}
+    return entity.get('caps') == wanted
+
+
+def flush_ceph_auth_cache():
+    """Forget the cephx keys and caps cached by this process.
+
+    Must be called after creating a key, changing its caps or rotating it
+    outside of this module.
+    """
+    ceph_auth_list.cache_clear()
+    ceph_auth_get.cache_clear()
 
 
 @functools.lru_cache()
 def ceph_auth_get(key_name):
+    entities = ceph_auth_list()
+    if entities is not None:
+        entity = entities.get(key_name)
+        return entity['key'] if entity else None
     try:
         # Does the key already exist?
-        output = str(subprocess.check_output(
-            [
-                'sudo',
-                '-u', ceph_user(),
-                'ceph',
-                '--name', 'mon.',
-                '--keyring',
-                '/var/lib/ceph/mon/ceph-{}/keyring'.format(
-                    socket.gethostname()
-                ),
-                'auth',
-                'get',
-                key_name,
-            ]).decode('UTF-8')).strip()
+        output = str(ceph_check_output(
+            {'prefix': 'auth get', 'entity': key_name},
+            service='mon.', keyring=_mon_keyring(),
+            user=ceph_user()).decode('UTF-8')).strip()
         return parse_key(output)
     except subprocess.CalledProcessError:
         # Couldn't get the key
@@ -1311,9 +1575,7 @@ def upgrade_key_caps(key, caps, pool_list=None):
     if not is_leader():
         # Not the MON leader OR not clustered
         return
-    cmd = [
-        "sudo", "-u", ceph_user(), 'ceph', 'auth', 'caps', key
-    ]
+    command = {'prefix': 'auth caps', 'entity': key, 'caps': []}
     for subsystem, subcaps in caps.items():
         if subsystem == 'osd':
             if pool_list:
@@ -1321,8 +1583,9 @@ def upgrade_key_caps(key, caps, pool_list=None):
                 # "pool=rgw pool=rbd pool=something"
                 pools = " ".join(['pool={0}'.format(i) for i in pool_list])
                 subcaps[0] = subcaps[0] + " " + pools
-        cmd.extend([subsystem, '; '.join(subcaps)])
-    subprocess.check_call(cmd)
+        command['caps'].extend([subsystem, '; '.join(subcaps)])
+    flush_ceph_auth_cache()
+    ceph_check_call(command, user=ceph_user())
 
 
 @cached
@@ -1603,81 +1866,200 @@ def osdize_dev(dev, osd_format, osd_journal, ignore_errors=False,
     db = kv()
     osd_devices = db.get('osd-devices', [])
     try:
-        if dev in osd_devices:
-            log('Device {} already processed by charm,'
-                ' skipping'.format(dev))
+        if not _osdize_dev_wanted(dev, osd_devices):
             return
 
-        if not os.path.exists(dev):
-            log('Path {} does not exist - bailing'.format(dev))
-            return
+        status_set('maintenance', 'Initializing device {}'.format(dev))
+        _osdize_dev_create(dev, osd_format, osd_journal, ignore_errors,
+                           encrypt, key_manager, osd_id, bluestore_skip)
 
-        if not is_block_device(dev):
-            log('Path {} is not a block device - bailing'.format(dev))
-            return
+        # NOTE: Record processing of device only on success to ensure that
+        #       the charm only tries to initialize a device of OSD usage
+        #       once during its lifetime.
+        osd_devices.append(dev)
+    finally:
+        db.set('osd-devices', osd_devices)
+        db.flush()
 
-        if is_osd_disk(dev):
-            log('Looks like {} is already an'
-                ' OSD data or journal, skipping.'.format(dev))
-            if is_device_mounted(dev):
-                osd_devices.append(dev)
-            return
 
-        if is_device_mounted(dev):
-            log('Looks like {} is in use, skipping.'.format(dev))
-            return
+# Seconds between updates of the unit status while OSDs are created.
+OSDIZE_STATUS_INTERVAL = 30
 
-        if is_active_bluestore_device(dev):
-            log('{} is in use as an active bluestore block device,'
-                ' skipping.'.format(dev))
-            osd_devices.append(dev)
-            return
 
-        if is_mapped_luks_device(dev):
-            log('{} is a mapped LUKS device,'
-                ' skipping.'.format(dev))
-            return
+def osdize_devs(devs, osd_format, osd_journal, ignore_errors=False,
+                encrypt=False, key_manager=CEPH_KEY_MANAGER,
+                bluestore_skip=None, max_workers=1):
+    """
+    Prepare block devices for use as Ceph OSDs, several at a time.
 
-        if cmp_pkgrevno('ceph', '12.2.4') >= 0:
-            cmd = _ceph_volume(dev,
-                               osd_journal,
-                               encrypt,
-                               key_manager,
-                               osd_id,
-                               bluestore_skip)
-        else:
-            cmd = _ceph_disk(dev,
-                             osd_format,
-                             osd_journal,
-                             encrypt)
+    Each device is prepared as with osdize_dev, with up to max_workers
+    devices being prepared at the same time. Allocations on the shared
+    bluestore DB and WAL devices are still made one at a time. The unit
+    status shows the progress, and the time spent on each device.
 
-        try:
-            status_set('maintenance', 'Initializing device {}'.format(dev))
-            log("osdize cmd: {}".format(cmd))
-            subprocess.check_call(cmd)
-        except subprocess.CalledProcessError:
-            try:
-                lsblk_output = subprocess.check_output(
-                    ['lsblk', '-P']).decode('UTF-8')
-            except subprocess.CalledProcessError as e:
-                log("Couldn't get lsblk output: {}".format(e), ERROR)
-            if ignore_errors:
-                log('Unable to initialize device: {}'.format(dev), WARNING)
-                if lsblk_output:
-                    log('lsblk output: {}'.format(lsblk_output), DEBUG)
-            else:
-                log('Unable to initialize device: {}'.format(dev), ERROR)
-                if lsblk_output:
-                    log('lsblk output: {}'.format(lsblk_output), WARNING)
-                raise
+    :param: devs: Full paths to the block devices to use
+    :param: max_workers: Maximum number of devices prepared at once
+    :raises subprocess.CalledProcessError: in the event that any supporting
+                                           subprocess operation failed,
+                                           once the devices being prepared
+                                           are done
+    :raises ValueError: if an invalid key_manager is provided
+    """
+    if key_manager not in KEY_MANAGERS:
+        raise ValueError('Unsupported key manager: {}'.format(key_manager))
 
-        # NOTE: Record processing of device only on success to ensure that
-        #       the charm only tries to initialize a device of OSD usage
-        #       once during its lifetime.
-        osd_devices.append(dev)
+    for dev in devs:
+        if not dev.startswith('/dev'):
+            osdize(dev, osd_format, osd_journal, ignore_errors, encrypt,
+                   key_manager, bluestore_skip=bluestore_skip)
+
+    # The unit data is only used from this thread.
+    db = kv()
+    osd_devices = db.get('osd-devices', [])
+    try:
+        queue = [dev for dev in devs
+                 if dev.startswith('/dev') and
+                 _osdize_dev_wanted(dev, osd_devices)]
     finally:
         db.set('osd-devices', osd_devices)
         db.flush()
+    if not queue:
+        return
+
+    max_workers = max(1, max_workers)
+    total, done, failure = len(queue), 0, None
+    queue.reverse()
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while queue or running:
+            while queue and failure is None and len(running) < max_workers:
+                dev = queue.pop()
+                future = executor.submit(
+                    _osdize_dev_create, dev, osd_format, osd_journal,
+                    ignore_errors, encrypt, key_manager, None,
+                    bluestore_skip)
+                running[future] = (dev, time.time())
+            if not running:
+                break
+
+            finished, _ = wait(running, timeout=OSDIZE_STATUS_INTERVAL,
+                               return_when=FIRST_COMPLETED)
+            for future in finished:
+                dev, start = running.pop(future)
+                try:
+                    future.result()
+                except Exception as e:
+                    log('Failed to initialize device {} after {:.0f}s'
+                        .format(dev, time.time() - start), level=ERROR)
+                    failure = failure or e
+                    continue
+                log('Initialized device {} in {:.0f}s'
+                    .format(dev, time.time() - start))
+                done += 1
+                osd_devices.append(dev)
+                db.set('osd-devices', osd_devices)
+                db.flush()
+
+            now = time.time()
+            status_set('maintenance', 'Initializing devices ({}/{} done){}'
+                       .format(done, total, ''.join(
+                           ', {} {:.0f}s'.format(dev, now - start)
+                           for dev, start in running.values())))
+
+    if failure is not None:
+        raise failure
+
+
+def _osdize_dev_wanted(dev, osd_devices):
+    """
+    Check whether a block device has to be prepared for use as an OSD.
+
+    Devices that are found to be OSDs already are added to osd_devices.
+
+    :param: dev: Full path to block device to use
+    :param: osd_devices: Devices already processed by the charm
+    :returns: bool: Whether to prepare the device
+    """
+    if dev in osd_devices:
+        log('Device {} already processed by charm,'
+            ' skipping'.format(dev))
+        return False
+
+    if not os.path.exists(dev):
+        log('Path {} does not exist - bailing'.format(dev))
+        return False
+
+    if not is_block_device(dev):
+        log('Path {} is not a block device - bailing'.format(dev))
+        return False
+
+    if is_osd_disk(dev):
+        log('Looks like {} is already an'
+            ' OSD data or journal, skipping.'.format(dev))
+        if is_device_mounted(dev):
+            osd_devices.append(dev)
+        return False
+
+    if is_device_mounted(dev):
+        log('Looks like {} is in use, skipping.'.format(dev))
+        return False
+
+    if is_active_bluestore_device(dev):
+        log('{} is in use as an active bluestore block device,'
+            ' skipping.'.format(dev))
+        osd_devices.append(dev)
+        return False
+
+    if is_mapped_luks_device(dev):
+        log('{} is a mapped LUKS device,'
+            ' skipping.'.format(dev))
+        return False
+
+    return True
+
+
+def _osdize_dev_create(dev, osd_format, osd_journal, ignore_errors=False,
+                       encrypt=False, key_manager=CEPH_KEY_MANAGER,
+                       osd_id=None, bluestore_skip=None):
+    """
+    Create an OSD on a block device.
+
+    This doesn't use the unit data, so it can run in any thread.
+
+    :raises subprocess.CalledProcessError: in the event that any supporting
+                                           subprocess operation failed
+    """
+    if cmp_pkgrevno('ceph', '12.2.4') >= 0:
+        cmd = _ceph_volume(dev,
+                           osd_journal,
+                           encrypt,
+                           key_manager,
+                           osd_id,
+                           bluestore_skip)
+    else:
+        cmd = _ceph_disk(dev,
+                         osd_format,
+                         osd_journal,
+                         encrypt)
+
+    try:
+        log("osdize cmd: {}".format(cmd))
+        subprocess.check_call(cmd)
+    except subprocess.CalledProcessError:
+        try:
+            lsblk_output = subprocess.check_output(
+                ['lsblk', '-P']).decode('UTF-8')
+        except subprocess.CalledProcessError as e:
+            log("Couldn't get lsblk output: {}".format(e), ERROR)
+        if ignore_errors:
+            log('Unable to initialize device: {}'.format(dev), WARNING)
+            if lsblk_output:
+                log('lsblk output: {}'.format(lsblk_output), DEBUG)
+        else:
+            log('Unable to initialize device: {}'.format(dev), ERROR)
+            if lsblk_output:
+                log('lsblk output: {}'.format(lsblk_output), WARNING)
+            raise
 
 
 def _ceph_disk(dev, osd_format, osd_journal, encrypt=False):
@@ -1717,6 +2099,11 @@ def _ceph_disk(dev, osd_format, osd_journal, encrypt=False):
     return cmd
 
 
+# Serializes the allocation of volumes on the shared bluestore DB and WAL
+# devices.
+_utility_device_lock = threading.Lock()
+
+
 def _ceph_volume(dev, osd_journal, encrypt=False, key_manager=CEPH_KEY_MANAGER,
                  osd_id=None, bluestore_skip=None):
     """
@@ -1765,17 +2152,20 @@ def _ceph_volume(dev, osd_journal, encrypt=False, key_manager=CEPH_KEY_MANAGER,
         devices = get_devices('bluestore-{}'.format(extra_volume))
         if devices:
             cmd.append('--block.{}'.format(extra_volume))
-            least_used = find_least_used_utility_device(devices,
-                                                        lvs=True)
-            cmd.append(_allocate_logical_volume(
-                dev=least_used,
-                lv_type=extra_volume,
-                osd_fsid=osd_fsid,
-                size='{}M'.format(calculate_volume_size(extra_volume)),
-                shared=True,
-                encrypt=encrypt,
-                key_manager=key_manager)
-            )
+            # NOTE: OSDs may be created concurrently, so the least used
+            #       device has to be picked and allocated from in one go.
+            with _utility_device_lock:
+                least_used = find_least_used_utility_device(devices,
+                                                            lvs=True)
+                cmd.append(_allocate_logical_volume(
+                    dev=least_used,
+                    lv_type=extra_volume,
+                    osd_fsid=osd_fsid,
+                    size='{}M'.format(calculate_volume_size(extra_volume)),
+                    shared=True,
+                    encrypt=encrypt,
+                    key_manager=key_manager)
+                )
 
     return cmd
 
@@ -2087,8 +2477,7 @@ def get_cephfs(service):
         # This command wasn't introduced until 0.86 Ceph
         return []
     try:
-        output = str(subprocess
-                     .check_output(["ceph", '--id', service, "fs", "ls"])
+        output = str(ceph_check_output({'prefix': 'fs ls'}, service=service)
                      .decode('UTF-8'))
         if not output:
             return []
@@ -2192,6 +2581,8 @@ def roll_monitor_cluster(new_version, upgrade_key):
                           service='mon',
                           my_name=my_name,
                           version=new_version)
+        log_upgrade_timings(upgrade_key, 'mon', new_version,
+                            mon_sorted_list[:position + 1])
         # NOTE(jamespage):
         # Wait until all monitors have upgraded before bootstrapping
         # the ceph-mgr daemons due to use of new mgr keyring profiles
@@ -2323,13 +2714,19 @@ def upgrade_monitor(new_version, kick_function=None, restart_daemons=True):
         sys.exit(1)
 
 
-def lock_and_roll(upgrade_key, service, my_name, version):
+# Default number of OSDs whose ownership is migrated at the same time.
+OSD_UPGRADE_PARALLELISM = 4
+
+
+def lock_and_roll(upgrade_key, service, my_name, version,
+                  parallelism=OSD_UPGRADE_PARALLELISM):
     """Create a lock on the Ceph monitor cluster and upgrade.
 
     :param upgrade_key: str. The cephx key to use
     :param service: str. The cephx id to use
     :param my_name: str. The current hostname
     :param version: str. The version we are upgrading to
+    :param parallelism: int. Number of OSDs upgraded at the same time
     """
     start_timestamp = time.time()
 
@@ -2353,7 +2750,8 @@ def lock_and_roll(upgrade_key, service, my_name, version):
 
     # This should be quick
     if service == 'osd':
-        upgrade_osd(version, kick_function=dog.kick_the_dog)
+        upgrade_osd(version, kick_function=dog.kick_the_dog,
+                    parallelism=parallelism)
     elif service == 'mon':
         upgrade_monitor(version, kick_function=dog.kick_the_dog)
     else:
@@ -2372,6 +2770,231 @@ def lock_and_roll(upgrade_key, service, my_name, version):
                                                         my_name,
                                                         version),
                     stop_timestamp)
+    notify_upgrade_waiters(upgrade_key)
+    log("Upgrade of {} {} to {} took {:.0f} seconds".format(
+        service, my_name, version, stop_timestamp - start_timestamp))
+
+
+def _upgrade_notify_ioctx(cluster):
+    """Open the I/O context of the upgrade notification object.
+
+    :param cluster: A connected librados handle.
+    :type cluster: rados.Rados
+    :rtype: rados.Ioctx
+    """
+    ioctx = cluster.open_ioctx(UPGRADE_NOTIFY_POOL)
+    ioctx.set_namespace(UPGRADE_NOTIFY_NAMESPACE)
+    return ioctx
+
+
+def notify_upgrade_waiters(upgrade_key):
+    """Wake up the nodes waiting on the upgrade keys.
+
+    Failures are only logged, waiters still poll the keys.
+
+    :param upgrade_key: str. The cephx key to use
+    """
+    cluster = ceph_session(upgrade_key)
+    if cluster is None:
+        return
+    try:
+        ioctx = _upgrade_notify_ioctx(cluster)
+        try:
+            ioctx.notify(UPGRADE_NOTIFY_OBJECT, timeout_ms=5000)
+        finally:
+            ioctx.close()
+    except Exception as e:
+        log("Unable to notify the nodes waiting to upgrade: {}".format(e),
+            level=WARNING)
+
+
+class UpgradeKeyWatcher(object):
+    """Watch the keys of a rolling upgrade in the monitor config-key store.
+
+    Checking a key through the ceph CLI forks a process and opens a new
+    monitor session each time, which is why waiters sleep between 5 and 30
+    seconds between checks.  When the python rados bindings are available
+    the librados session of the upgrade key is used instead, and the keys
+    are checked every ``poll_interval`` seconds over it.
+
+    The config-key store offers no change notification, so the watcher
+    also watches the upgrade notification object that lock_and_roll
+    notifies once a node is done, and checks the keys again as soon as a
+    notification arrives.  Polling remains as the fallback for missed
+    notifications and for keys without the caps on that object, which is
+    why the interval is kept at 10 seconds or more.
+    """
+
+    def __init__(self, upgrade_key, poll_interval=10):
+        """Initialise a new UpgradeKeyWatcher
+
+        :param upgrade_key: The cephx key to use.
+        :type upgrade_key: str
+        :param poll_interval: Seconds between checks when connected.
+        :type poll_interval: int
+        """
+        self.upgrade_key = upgrade_key
+        self.poll_interval = poll_interval
+        self.cluster = ceph_session(upgrade_key)
+        self.notified = threading.Event()
+        self.ioctx = None
+        self.watch = None
+        if self.cluster is not None:
+            self._watch()
+
+    def _watch(self):
+        """Watch the upgrade notification object, creating it if needed."""
+        try:
+            self.ioctx = _upgrade_notify_ioctx(self.cluster)
+            with rados.WriteOpCtx() as op:
+                op.new(rados.LIBRADOS_CREATE_IDEMPOTENT)
+                self.ioctx.operate_write_op(op, UPGRADE_NOTIFY_OBJECT)
+            self.watch = self.ioctx.watch(
+                UPGRADE_NOTIFY_OBJECT,
+                lambda *args: self.notified.set())
+        except Exception as e:
+            log("Unable to watch for upgrade notifications, polling the "
+                "upgrade keys only: {}".format(e), level=WARNING)
+            self._unwatch()
+
+    def _unwatch(self):
+        """Stop watching the upgrade notification object."""
+        if self.watch is not None:
+            self.watch.close()
+            self.watch = None
+        if self.ioctx is not None:
+            self.ioctx.close()
+            self.ioctx = None
+
+    @property
+    def interval(self):
+        """Seconds to wait between checks, None for the WatchDog default.
+
+        :rtype: Optional[int]
+        """
+        if self.cluster is None:
+            return None
+        return self.poll_interval
+
+    def wait(self, timeout):
+        """Wait for an upgrade notification, at most timeout seconds.
+
+        :param timeout: Seconds to wait.
+        :type timeout: float
+        """
+        if self.watch is None:
+            time.sleep(timeout)
+            return
+        self.notified.wait(timeout)
+        self.notified.clear()
+
+    def _mon_command(self, prefix, key):
+        """Run a config-key command over the monitor session.
+
+        :returns: The return code and output of the command.
+        :rtype: Tuple[int, bytes]
+        """
+        ret, out, err = self.cluster.mon_command(
+            json.dumps({'prefix': prefix, 'key': key}), b'')
+        if ret and ret != -errno.ENOENT:
+            log("{} {} failed: {} {}".format(prefix, key, ret, err),
+                level=WARNING)
+        return ret, out
+
+    def get(self, key):
+        """Get the value of a key.
+
+        :param key: The key to get.
+        :type key: str
+        :returns: The value of the key, None if not found.
+        :rtype: Optional[str]
+        """
+        if self.cluster is not None:
+            ret, out = self._mon_command('config-key get', key)
+            if not ret:
+                return out.decode('UTF-8')
+            if ret == -errno.ENOENT:
+                return None
+        return monitor_key_get(self.upgrade_key, key)
+
+    def exists(self, key):
+        """Check if a key exists.
+
+        :param key: The key to check.
+        :type key: str
+        :rtype: bool
+        """
+        if self.cluster is not None:
+            ret, _ = self._mon_command('config-key exists', key)
+            if not ret:
+                return True
+            if ret == -errno.ENOENT:
+                return False
+        return monitor_key_exists(self.upgrade_key, key)
+
+    def close(self):
+        """Stop watching, the session itself is kept for the process."""
+        self._unwatch()
+        self.cluster = None
+
+
+def get_upgrade_timings(upgrade_key, service, version, nodes):
+    """Return the start and done times of the upgrade of the given nodes.
+
+    :param upgrade_key: str. The cephx key to use
+    :param service: str. The service being upgraded, e.g. 'osd'
+    :param version: str. The version upgraded to
+    :param nodes: The names of the nodes
+    :type nodes: List[str]
+    :returns: Per node, the start and done timestamps and the duration in
+              seconds, None where unknown.
+    :rtype: collections.OrderedDict
+    """
+    watcher = UpgradeKeyWatcher(upgrade_key)
+
+    def _get_time(node, event):
+        value = watcher.get("{}_{}_{}_{}".format(
+            service, node, version, event))
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+
+    timings = collections.OrderedDict()
+    try:
+        for node in nodes:
+            start = _get_time(node, 'start')
+            done = _get_time(node, 'done')
+            duration = None
+            if start is not None and done is not None:
+                duration = done - start
+            timings[node] = {'start': start, 'done': done,
+                             'duration': duration}
+    finally:
+        watcher.close()
+    return timings
+
+
+def log_upgrade_timings(upgrade_key, service, version, nodes):
+    """Log how long the upgrade of each of the given nodes took.
+
+    :param upgrade_key: str. The cephx key to use
+    :param service: str. The service being upgraded, e.g. 'osd'
+    :param version: str. The version upgraded to
+    :param nodes: The names of the nodes, in upgrade order
+    :type nodes: List[str]
+    """
+    try:
+        timings = get_upgrade_timings(upgrade_key, service, version, nodes)
+    except Exception as e:
+        log("Unable to get the upgrade timings: {}".format(e),
+            level=WARNING)
+        return
+    log("Upgrade timings of {} to {}: {}".format(
+        service, version, ', '.join(
+            '{} {}'.format(node, 'unknown' if t['duration'] is None
+                           else '{:.0f}s'.format(t['duration']))
+            for node, t in timings.items())))
 
 
 def wait_on_previous_node(upgrade_key, service, previous_node, version):
@@ -2386,23 +3009,30 @@ def wait_on_previous_node(upgrade_key, service, previous_node, version):
     """
     log("Previous node is: {}".format(previous_node))
 
+    watcher = UpgradeKeyWatcher(upgrade_key)
+    try:
+        _wait_on_previous_node(watcher, service, previous_node, version)
+    finally:
+        watcher.close()
+
+
+def _wait_on_previous_node(watcher, service, previous_node, version):
     previous_node_started_f = (
-        lambda: monitor_key_exists(
-            upgrade_key,
+        lambda: watcher.exists(
             "{}_{}_{}_start".format(service, previous_node, version)))
     previous_node_finished_f = (
-        lambda: monitor_key_exists(
-            upgrade_key,
+        lambda: watcher.exists(
             "{}_{}_{}_done".format(service, previous_node, version)))
     previous_node_alive_time_f = (
-        lambda: monitor_key_get(
-            upgrade_key,
+        lambda: watcher.get(
             "{}_{}_{}_alive".format(service, previous_node, version)))
 
     # wait for 30 minutes until the previous node starts.  We don't proceed
     # unless we get a start condition.
     try:
-        WatchDog.wait_until(previous_node_started_f, timeout=30 * 60)
+        WatchDog.wait_until(previous_node_started_f, timeout=30 * 60,
+                            interval=watcher.interval,
+                            wait_function=watcher.wait)
     except WatchDog.WatchDogTimeoutException:
         log("Waited for previous node to start for 30 minutes. "
             "It didn't start, so may have a serious issue. Continuing with "
@@ -2423,7 +3053,9 @@ def wait_on_previous_node(upgrade_key, service, previous_node, version):
                             complete_function=previous_node_finished_f,
                             wait_time=30 * 60,
                             compatibility_wait_time=10 * 60,
-                            max_kick_interval=5 * 60)
+                            max_kick_interval=5 * 60,
+                            interval=watcher.interval,
+                            wait_function=watcher.wait)
     except WatchDog.WatchDogDeadException:
         # previous node was kicking, but timed out; log this condition and move
         # on.
@@ -2435,6 +3067,7 @@ def wait_on_previous_node(upgrade_key, service, previous_node, version):
             "Continuing with upgrade of this node."
             .format(waited, previous_node, now, previous_node_started_at),
             level=WARNING)
+        return
     except WatchDog.WatchDogTimeoutException:
         # previous node never kicked, or simply took too long; log this
         # condition and move on.
@@ -2446,6 +3079,15 @@ def wait_on_previous_node(upgrade_key, service, previous_node, version):
             "Continuing with upgrade of this node."
             .format(waited, previous_node, now, previous_node_started_at),
             level=WARNING)
+        return
+
+    try:
+        done_at = float(watcher.get(
+            "{}_{}_{}_done".format(service, previous_node, version)))
+    except (TypeError, ValueError):
+        return
+    log("Previous node {} finished upgrading at {}, noticed {:.1f} seconds "
+        "later".format(previous_node, done_at, time.time() - done_at))
 
 
 class WatchDog(object):
@@ -2512,29 +3154,41 @@ class WatchDog(object):
         self.last_kick_at = now
 
     @staticmethod
-    def wait_until(wait_f, timeout=10 * 60):
+    def wait_until(wait_f, timeout=10 * 60, interval=None,
+                   wait_function=None):
         """Wait for timeout seconds until the passed function return True.
 
         :param wait_f: The function to call that will end the wait.
         :type wait_f: Callable[[], Boolean]
         :param timeout: The time to wait in seconds.
         :type timeout: int
+        :param interval: The time to wait between calls in seconds, a random
+            time between 5 and 30 seconds if None.
+        :type interval: Optional[int]
+        :param wait_function: The function that waits between calls, which
+            may return early, time.sleep if None.
+        :type wait_function: Optional[Callable[[float], None]]
         """
         start_time = time.time()
         while not wait_f():
             now = time.time()
             if now > start_time + timeout:
                 raise WatchDog.WatchDogTimeoutException()
-            wait_time = random.randrange(5, 30)
-            log('wait_until: waiting for {} seconds'.format(wait_time))
-            time.sleep(wait_time)
+            if interval is None:
+                wait_time = random.randrange(5, 30)
+                log('wait_until: waiting for {} seconds'.format(wait_time))
+            else:
+                wait_time = interval
+            (wait_function or time.sleep)(wait_time)
 
     @staticmethod
     def timed_wait(kicked_at_function,
                    complete_function,
                    wait_time=30 * 60,
                    compatibility_wait_time=10 * 60,
-                   max_kick_interval=5 * 60):
+                   max_kick_interval=5 * 60,
+                   interval=None,
+                   wait_function=None):
         """Wait a maximum time with an intermediate 'kick' time.
 
         This function will wait for max_kick_interval seconds unless the
@@ -2581,6 +3235,12 @@ class WatchDog(object):
         :param max_kick_interval: The maximum time allowed between kicks before
             the wait is over, in seconds:
         :type max_kick_interval: int
+        :param interval: The time to wait between checks in seconds, a random
+            time between 5 and 30 seconds if None.
+        :type interval: Optional[int]
+        :param wait_function: The function that waits between checks, which
+            may return early, time.sleep if None.
+        :type wait_function: Optional[Callable[[float], None]]
         :raises: WatchDog.WatchDogTimeoutException,
                  WatchDog.WatchDogDeadException
         """
@@ -2602,9 +3262,12 @@ class WatchDog(object):
                     raise WatchDog.WatchDogDeadException()
             if (now - start_time > wait_time):
                 raise WatchDog.WatchDogTimeoutException()
-            delay_time = random.randrange(5, 30)
-            log('waiting for {} seconds'.format(delay_time))
-            time.sleep(delay_time)
+            if interval is None:
+                delay_time = random.randrange(5, 30)
+                log('waiting for {} seconds'.format(delay_time))
+            else:
+                delay_time = interval
+            (wait_function or time.sleep)(delay_time)
 
 
 def get_upgrade_position(osd_sorted_list, match_name):
@@ -2625,27 +3288,189 @@ def get_upgrade_position(osd_sorted_list, match_name):
                      .format(match_name))
 
 
+# CRUSH bucket types that may be used as a failure domain, from the
+# narrowest to the widest.
+CRUSH_FAILURE_DOMAINS = [
+    'osd',
+    'host',
+    'chassis',
+    'rack',
+    'row',
+    'pdu',
+    'pod',
+    'room',
+    'datacenter',
+    'zone',
+    'region',
+    'root',
+]
+
+
+def get_strictest_failure_domain(service):
+    """Return the narrowest failure domain used by the rules of any pool.
+
+    Hosts that share a bucket of this type can be taken down together
+    without any pool losing more than one failure domain.  For example,
+    with pools replicating across racks and across rows the outcome is
+    rack; add a pool replicating across hosts and the outcome is host.
+
+    Host is returned when the failure domain is narrower than a host, so
+    that at worst a single host is upgraded at a time.
+
+    Every OSD unit derives its upgrade wave from this on its own, so
+    errors are raised rather than replaced by a default that other units
+    may not share.
+
+    :param service: The cephx id to run the commands under.
+    :type service: str
+    :returns: A CRUSH bucket type, e.g. ``host`` or ``rack``.
+    :rtype: str
+    :raises: subprocess.CalledProcessError, ValueError
+    """
+    rules = json.loads(ceph_check_output(
+        {'prefix': 'osd crush rule dump', 'format': 'json'},
+        service=service).decode('UTF-8'))
+    pools = json.loads(ceph_check_output(
+        {'prefix': 'osd pool ls', 'detail': 'detail', 'format': 'json'},
+        service=service).decode('UTF-8'))
+
+    rule_domains = {}
+    for rule in rules:
+        domains = [CRUSH_FAILURE_DOMAINS.index(step['type'])
+                   for step in rule.get('steps', [])
+                   if step.get('op', '').startswith('choose') and
+                   step.get('type') in CRUSH_FAILURE_DOMAINS]
+        if domains:
+            rule_domains[rule['rule_id']] = min(domains)
+
+    host = CRUSH_FAILURE_DOMAINS.index('host')
+    strictest = None
+    for pool in pools:
+        domain = rule_domains.get(pool.get('crush_rule'), host)
+        if strictest is None or domain < strictest:
+            strictest = domain
+    if strictest is None or strictest < host:
+        strictest = host
+    return CRUSH_FAILURE_DOMAINS[strictest]
+
+
+def get_upgrade_waves(osd_sorted_list, failure_domain='host',
+                      max_hosts_per_wave=None):
+    """Split the OSD hosts into waves that can be upgraded together.
+
+    Each wave holds hosts of a single bucket of the failure domain type,
+    at most ``max_hosts_per_wave`` of them.  Hosts that are not placed in a
+    bucket of that type get a wave of their own.
+
+    :param osd_sorted_list: OSD hosts sorted by name
+    :type osd_sorted_list: List[CrushLocation]
+    :param failure_domain: CRUSH bucket type to group hosts by
+    :type failure_domain: str
+    :param max_hosts_per_wave: Maximum number of hosts per wave, unlimited
+                               if None
+    :type max_hosts_per_wave: Optional[int]
+    :returns: Waves of hosts, in upgrade order
+    :rtype: List[List[CrushLocation]]
+    """
+    buckets = collections.OrderedDict()
+    for location in osd_sorted_list:
+        bucket = None
+        if failure_domain != 'host':
+            bucket = getattr(location, failure_domain, None)
+        buckets.setdefault(bucket or location.name, []).append(location)
+
+    waves = []
+    for bucket in sorted(buckets):
+        hosts = buckets[bucket]
+        size = max_hosts_per_wave or len(hosts)
+        for i in range(0, len(hosts), size):
+            waves.append(hosts[i:i + size])
+    return waves
+
+
+def get_upgrade_wave(waves, match_name):
+    """Return the upgrade wave for the given OSD host.
+
+    :param waves: Waves of hosts, as returned by get_upgrade_waves
+    :type waves: List[List[CrushLocation]]
+    :param match_name: The OSD host name to match
+    :type match_name: str
+    :returns: The position of the wave
+    :rtype: int
+    :raises: ValueError if name is not found
+    """
+    for index, wave in enumerate(waves):
+        if any(item.name == match_name for item in wave):
+            return index
+    raise ValueError("OSD name '{}' not found in get_upgrade_wave list"
+                     .format(match_name))
+
+
+def wait_for_pgs_active_clean(service, timeout=30 * 60):
+    """Wait until all the placement groups are active+clean.
+
+    A placement group counts as clean in any state that includes both
+    active and clean, e.g. active+clean+scrubbing. If the placement groups
+    do not become clean within the timeout, including when their state
+    cannot be retrieved, this is logged and the wait ends.
+
+    :param service: The cephx id to run the command under.
+    :type service: str
+    :param timeout: The time to wait in seconds.
+    :type timeout: int
+    """
+    def _pgs_active_clean():
+        try:
+            stat = json.loads(ceph_check_output(
+                {'prefix': 'pg stat', 'format': 'json'},
+                service=service, target='mgr').decode('UTF-8'))
+        except (subprocess.CalledProcessError, ValueError) as e:
+            log("Unable to get the placement group states: {}".format(e),
+                level=WARNING)
+            return False
+        summary = stat.get('pg_summary', stat)
+        clean = sum(state['num'] for state in summary['num_pg_by_state']
+                    if {'active', 'clean'} <= set(state['name'].split('+')))
+        log("{} of {} placement groups are active+clean"
+            .format(clean, summary['num_pgs']), level=DEBUG)
+        return clean == summary['num_pgs']
+
+    try:
+        WatchDog.wait_until(_pgs_active_clean, timeout=timeout)
+    except WatchDog.WatchDogTimeoutException:
+        log("Placement groups did not become active+clean within {} mins. "
+            "Continuing with upgrade of this node.".format(timeout // 60),
+            level=WARNING)
+
+
 # Edge cases:
 # 1. Previous node dies on upgrade, can we retry?
 # 2. This assumes that the OSD failure domain is not set to OSD.
 #    It rolls an entire server at a time.
-def roll_osd_cluster(new_version, upgrade_key):
+def roll_osd_cluster(new_version, upgrade_key, max_hosts_per_wave=None,
+                     parallelism=OSD_UPGRADE_PARALLELISM):
     """This is tricky to get right so here's what we're going to do.
 
-    There's 2 possible cases: Either I'm first in line or not.
-    If I'm not first in line I'll wait a random time between 5-30 seconds
-    and test to see if the previous OSD is upgraded yet.
+    The OSD hosts are split into waves of hosts that share a bucket of the
+    strictest failure domain used by the pools, e.g.:
+
+        Pool 1: Failure domain = rack
+        Pool 2: Failure domain = row
 
-    TODO: If you're not in the same failure domain it's safe to upgrade
-     1. Examine all pools and adopt the most strict failure domain policy
-        Example: Pool 1: Failure domain = rack
-        Pool 2: Failure domain = host
-        Pool 3: Failure domain = row
+        outcome: all the hosts of a rack are upgraded together.
 
-        outcome: Failure domain = host
+    There's 2 possible cases: Either I'm in the first wave or not.
+    If I'm not in the first wave I'll wait for every node of the previous
+    wave to be upgraded and for the placement groups to be active+clean
+    again before upgrading.
 
     :param new_version: str of the version to upgrade to
     :param upgrade_key: the cephx key name to use when upgrading
+    :param max_hosts_per_wave: Maximum number of hosts to upgrade at the
+                               same time, unlimited if None
+    :type max_hosts_per_wave: Optional[int]
+    :param parallelism: Number of OSDs of this host upgraded at the same time
+    :type parallelism: int
     """
     log('roll_osd_cluster called with {}'.format(new_version))
     my_name = socket.gethostname()
@@ -2655,39 +3480,78 @@ def roll_osd_cluster(new_version, upgrade_key):
     log("osd_sorted_list: {}".format(osd_sorted_list))
 
     try:
-        position = get_upgrade_position(osd_sorted_list, my_name)
-        log("upgrade position: {}".format(position))
+        failure_domain = get_strictest_failure_domain(upgrade_key)
+    except (subprocess.CalledProcessError, ValueError) as e:
+        # Guessing here could give this unit a different plan than the
+        # others and take down hosts of several failure domains at once.
+        log("Unable to determine the failure domain of pools: {}".format(e),
+            level=ERROR)
+        if (isinstance(e, subprocess.CalledProcessError) and
+                e.returncode == errno.EACCES):
+            # The key predates the caps needed by the rolling upgrade,
+            # it's only reissued once ceph-mon runs the new charm.
+            status_set('blocked',
+                       '{} key lacks the osd crush rule dump, osd pool ls, '
+                       'pg stat and mgr caps: upgrade ceph-mon first'
+                       .format(upgrade_key))
+        else:
+            status_set('blocked', 'failed to upgrade osd')
+        return
+
+    try:
+        waves = get_upgrade_waves(osd_sorted_list, failure_domain,
+                                  max_hosts_per_wave)
+        position = get_upgrade_wave(waves, my_name)
+        log("upgrade wave: {} of {} (failure domain: {})".format(
+            position, len(waves), failure_domain))
         if position == 0:
             # I'm first!  Roll
             # First set a key to inform others I'm about to roll
             lock_and_roll(upgrade_key=upgrade_key,
                           service='osd',
                           my_name=my_name,
-                          version=new_version)
+                          version=new_version,
+                          parallelism=parallelism)
         else:
-            # Check if the previous node has finished
+            # Check if the nodes of the previous wave have finished
+            previous_nodes = [item.name for item in waves[position - 1]]
             status_set('waiting',
                        'Waiting on {} to finish upgrading'.format(
-                           osd_sorted_list[position - 1].name))
-            wait_on_previous_node(
-                upgrade_key=upgrade_key,
-                service='osd',
-                previous_node=osd_sorted_list[position - 1].name,
-                version=new_version)
+                           ', '.join(previous_nodes)))
+            for previous_node in previous_nodes:
+                wait_on_previous_node(
+                    upgrade_key=upgrade_key,
+                    service='osd',
+                    previous_node=previous_node,
+                    version=new_version)
+            status_set('waiting',
+                       'Waiting on placement groups to be active+clean')
+            wait_for_pgs_active_clean(upgrade_key)
             lock_and_roll(upgrade_key=upgrade_key,
                           service='osd',
                           my_name=my_name,
-                          version=new_version)
+                          version=new_version,
+                          parallelism=parallelism)
+        log_upgrade_timings(
+            upgrade_key, 'osd', new_version,
+            [item.name for wave in waves[:position] for item in wave] +
+            [my_name])
     except ValueError:
         log("Failed to find name {} in list {}".format(
             my_name, osd_sorted_list))
         status_set('blocked', 'failed to upgrade osd')
 
 
-def upgrade_osd(new_version, kick_function=None):
+def upgrade_osd(new_version, kick_function=None,
+                parallelism=OSD_UPGRADE_PARALLELISM):
     """Upgrades the current OSD
 
     :param new_version: str. The new version to upgrade to
+    :param kick_function: (Optional) called regularly to tell the other
+                          nodes this node is still making progress
+    :param parallelism: Number of OSDs whose ownership is updated at the
+                        same time
+    :type parallelism: int
     """
     if kick_function is None:
         kick_function = noop
@@ -2743,17 +3607,16 @@ def upgrade_osd(new_version, kick_function=None):
 
         # Fast service restart wasn't an option because each of the OSD
         # directories need the ownership updated for all the files on
-        # the OSD. Walk through the OSDs one-by-one upgrading the OSD.
+        # the OSD. Upgrade up to 'parallelism' OSDs at a time.
+        osds = []
         for osd_dir in _get_child_dirs(OSD_BASE_DIR):
-            kick_function()
             try:
-                osd_num = _get_osd_num_from_dirname(osd_dir)
-                _upgrade_single_osd(osd_num, osd_dir)
+                osds.append((_get_osd_num_from_dirname(osd_dir), osd_dir))
             except ValueError as ex:
                 # Directory could not be parsed - junk directory?
                 log('Could not parse OSD directory %s: %s' % (osd_dir, ex),
                     WARNING)
-                continue
+        _upgrade_osds(osds, kick_function, parallelism)
 
     except (subprocess.CalledProcessError, IOError) as err:
         log("Stopping Ceph and upgrading packages failed "
@@ -2762,11 +3625,69 @@ def upgrade_osd(new_version, kick_function=None):
         sys.exit(1)
 
 
-def _upgrade_single_osd(osd_num, osd_dir):
+def _upgrade_osds(osds, kick_function, parallelism):
+    """Upgrades OSD directories, several at a time.
+
+    The kick_function is called from this thread while the OSDs are being
+    upgraded, as long as their ownership migration makes progress.
+
+    :param osds: the num and directory of each OSD to upgrade
+    :type osds: List[Tuple[str, str]]
+    :param kick_function: called regularly to report progress
+    :type kick_function: Callable[[], None]
+    :param parallelism: the maximum number of OSDs to upgrade at a time
+    :type parallelism: int
+    :raises CalledProcessError: if an error occurs in a command issued as part
+                                of the upgrade process
+    :raises IOError: if an error occurs reading/writing to a file as part
+                     of the upgrade process
+    """
+    if not osds:
+        return
+    status_set('maintenance', 'Updating ownership of {} OSDs to {}'.format(
+        len(osds), ceph_user()))
+    # Number of inodes checked so far, per OSD.
+    progress = dict.fromkeys((osd_num for osd_num, _ in osds), 0)
+
+    def _progress(osd_num):
+        def _f(count):
+            progress[osd_num] = count
+        return _f
+
+    # OSDs are only handed to the executor when a worker is free, so none
+    # is stopped and restarted any more once an upgrade failed.
+    max_workers = max(1, min(parallelism, len(osds)))
+    queue = list(reversed(osds))
+    running = {}
+    last_progress = None
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while queue or running:
+            while queue and len(running) < max_workers:
+                osd_num, osd_dir = queue.pop()
+                future = executor.submit(_upgrade_single_osd, osd_num,
+                                         osd_dir,
+                                         progress=_progress(osd_num))
+                running[future] = osd_num
+            done, _ = wait(running, timeout=10,
+                           return_when=FIRST_EXCEPTION)
+            for future in done:
+                # Re-raises the error of a failed OSD upgrade
+                future.result()
+                log('OSD {} upgraded'.format(running.pop(future)), DEBUG)
+            checked = sum(progress.values())
+            if done or checked != last_progress:
+                log('Checked ownership of {} inodes, {} OSDs left to upgrade'
+                    .format(checked, len(running) + len(queue)), DEBUG)
+                kick_function()
+            last_progress = checked
+
+
+def _upgrade_single_osd(osd_num, osd_dir, progress=None):
     """Upgrades the single OSD directory.
 
     :param osd_num: the num of the OSD
     :param osd_dir: the directory of the OSD to upgrade
+    :param progress: (Optional) passed on to update_owner_tree
     :raises CalledProcessError: if an error occurs in a command issued as part
                                 of the upgrade process
     :raises IOError: if an error occurs reading/writing to a file as part
@@ -2775,7 +3696,7 @@ def _upgrade_single_osd(osd_num, osd_dir):
     with maintain_osd_state(osd_num):
         stop_osd(osd_num)
         disable_osd(osd_num)
-        update_owner(osd_dir)
+        update_owner_tree(osd_dir, progress=progress)
         enable_osd(osd_num)
         start_osd(osd_num)
 
@@ -2904,6 +3825,73 @@ def update_owner(path, recurse_dirs=True):
         secs=elapsed_time.total_seconds(), path=path), DEBUG)
 
 
+def _query_osd_state(osd_num):
+    """Query the state of an OSD through its admin socket.
+
+    :param osd_num: the OSD id to get state for
+    :returns: The OSD state, None if the admin socket could not be queried.
+    :rtype: Optional[str]
+    """
+    asok = "/var/run/ceph/ceph-osd.{}.asok".format(osd_num)
+    try:
+        result = _admin_socket_command(asok, 'status')
+    except (OSError, ValueError) as e:
+        log("Failed to get OSD {} state: {}".format(osd_num, e), level=ERROR)
+        return None
+    return result['state']
+
+
+def update_owner_tree(path, progress=None):
+    """Changes the ownership of a tree to the ceph daemon user.
+
+    Unlike update_owner, which runs a 'chown -R', the tree is walked and only
+    the inodes that are not already owned by the ceph daemon user and group
+    are changed. Symbolic links are changed but not followed.
+
+    :param path: the root of the tree to change ownership for
+    :param progress: (Optional) called with the number of inodes checked so
+                     far, every 1000 inodes and at the end of the walk
+    :type progress: Optional[Callable[[int], None]]
+    :returns: the number of inodes whose ownership was changed
+    :rtype: int
+    :raises OSError: if an inode cannot be read or changed
+    """
+    user = ceph_user()
+    uid = pwd.getpwnam(user).pw_uid
+    gid = grp.getgrnam(user).gr_gid
+    log('Changing ownership of {path} to {user}:{user}'.format(
+        path=path, user=user), DEBUG)
+    start = datetime.now()
+
+    checked = changed = 0
+    stat = os.lstat(path)
+    if (stat.st_uid, stat.st_gid) != (uid, gid):
+        os.lchown(path, uid, gid)
+        changed += 1
+    checked += 1
+    dirs = [path] if os.path.isdir(path) else []
+    while dirs:
+        with os.scandir(dirs.pop()) as entries:
+            for entry in entries:
+                stat = entry.stat(follow_symlinks=False)
+                if (stat.st_uid, stat.st_gid) != (uid, gid):
+                    os.lchown(entry.path, uid, gid)
+                    changed += 1
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.path)
+                checked += 1
+                if progress and checked % 1000 == 0:
+                    progress(checked)
+    if progress:
+        progress(checked)
+
+    log('Took {secs} seconds to change the ownership of {changed} of '
+        '{checked} inodes in path: {path}'.format(
+            secs=(datetime.now() - start).total_seconds(), changed=changed,
+            checked=checked, path=path), DEBUG)
+    return changed
+
+
 def get_osd_state(osd_num, osd_goal_state=None, timeout=600,
                   retry_interval=10):
     """Get OSD state or loop until OSD state matches OSD goal state.
@@ -2932,23 +3920,10 @@ def get_osd_state(osd_num, osd_goal_state=None, timeout=600,
                 level=WARNING)
             return
 
-        asok = "/var/run/ceph/ceph-osd.{}.asok".format(osd_num)
-        cmd = [
-            'ceph',
-            'daemon',
-            asok,
-            'status'
-        ]
-        try:
-            result = json.loads(str(subprocess
-                                    .check_output(cmd)
-                                    .decode('UTF-8')))
-        except (subprocess.CalledProcessError, ValueError) as e:
-            log("Failed to get OSD {} state: {} (elapsed: {:.1f}s)".format(
-                osd_num, e, elapsed_time), level=ERROR)
+        osd_state = _query_osd_state(osd_num)
+        if osd_state is None:
             time.sleep(retry_interval)
             continue
-        osd_state = result['state']
         log("OSD {} state: {}, goal state: {}".format(
             osd_num, osd_state, osd_goal_state), level=DEBUG)
         if not osd_goal_state:
@@ -2958,26 +3933,75 @@ def get_osd_state(osd_num, osd_goal_state=None, timeout=600,
         time.sleep(retry_interval)
 
 
-def get_all_osd_states(osd_goal_states=None):
+# Maximum number of OSD admin sockets queried at the same time.
+OSD_STATE_WORKERS = 16
+
+
+def get_all_osd_states(osd_goal_states=None, timeout=600,
+                       min_retry_interval=0.5, max_retry_interval=10):
     """Get all OSD states or loop until all OSD states match OSD goal states.
 
     If osd_goal_states is None, just return a dictionary of current OSD states.
     If osd_goal_states is not None, loop until the current OSD states match
     the OSD goal states.
 
+    The admin sockets of the OSDs that have not reached their goal are
+    queried in parallel. The time between two rounds starts at
+    min_retry_interval and doubles up to max_retry_interval while no OSD
+    changes state.
+
     :param osd_goal_states: (Optional) dict indicating states to wait for
                             Defaults to None
-    :returns: Returns a dictionary of current OSD states.
+    :param timeout: Maximum time in seconds to wait (default: 600)
+    :param min_retry_interval: Minimum time in seconds between retries
+    :param max_retry_interval: Maximum time in seconds between retries
+    :returns: Returns a dictionary of current OSD states, None for the OSDs
+              that did not reach their goal state in time.
     :rtype: dict
     """
-    osd_states = {}
+    pending = collections.OrderedDict()
     for osd_num in get_local_osd_ids():
-        if not osd_goal_states:
-            osd_states[osd_num] = get_osd_state(osd_num)
-        else:
-            osd_states[osd_num] = get_osd_state(
-                osd_num,
-                osd_goal_state=osd_goal_states[osd_num])
+        pending[osd_num] = (osd_goal_states or {}).get(osd_num)
+    osd_states = dict.fromkeys(pending)
+    if not pending:
+        return osd_states
+
+    start_time = time.time()
+    retry_interval = min_retry_interval
+    workers = min(len(pending), OSD_STATE_WORKERS)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            results = zip(list(pending),
+                          executor.map(_query_osd_state, list(pending)))
+            elapsed_time = time.time() - start_time
+            changed = False
+            for osd_num, osd_state in results:
+                if osd_state is None:
+                    continue
+                goal_state = pending[osd_num]
+                log("OSD {} state: {}, goal state: {}".format(
+                    osd_num, osd_state, goal_state), level=DEBUG)
+                changed = changed or osd_state != osd_states[osd_num]
+                osd_states[osd_num] = osd_state
+                if not goal_state or osd_state == goal_state:
+                    if goal_state:
+                        log("OSD {} reached state {} after {:.1f}s".format(
+                            osd_num, osd_state, elapsed_time))
+                    del pending[osd_num]
+            if not pending:
+                break
+            if elapsed_time > timeout:
+                for osd_num, goal_state in pending.items():
+                    log("Timeout waiting for OSD {} to reach state {}. "
+                        "Elapsed time: {:.1f}s".format(
+                            osd_num, goal_state or "any", elapsed_time),
+                        level=WARNING)
+                    osd_states[osd_num] = None
+                break
+            if changed:
+                retry_interval = min_retry_interval
+            time.sleep(retry_interval)
+            retry_interval = min(retry_interval * 2, max_retry_interval)
     return osd_states
 
 
@@ -3012,16 +4036,149 @@ def maintain_all_osd_states():
         get_all_osd_states(osd_goal_states=osd_states)
 
 
-def list_pools(client='admin'):
+# Map of ``osd pool get`` parameters to their ``osd pool ls detail`` keys.
+POOL_DETAIL_PARAMS = {
+    'size': 'size',
+    'min_size': 'min_size',
+    'pg_num': 'pg_num',
+    'pgp_num': 'pg_placement_num',
+    'pg_autoscale_mode': 'pg_autoscale_mode',
+    'erasure_code_profile': 'erasure_code_profile',
+}
+
+# Pool type of erasure coded pools in ``osd pool ls detail``.
+POOL_TYPE_ERASURE = 3
+
+
+class PoolInventory(object):
+    """The details of all the pools of the cluster.
+
+    Everything is read with a single ``osd pool ls detail`` call rather than
+    with a call per pool and parameter.
+    """
+
+    def __init__(self, client='admin'):
+        """Initialise a new PoolInventory and read the pool details.
+
+        :param client: (Optional) client id for Ceph key to use
+                       Defaults to ``admin``
+        :type client: str
+        :raises: subprocess.CalledProcessError
+        """
+        self.client = client
+        output = ceph_check_output(
+            {'prefix': 'osd pool ls', 'detail': 'detail', 'format': 'json'},
+            service=client,
+            universal_newlines=True, stderr=subprocess.STDOUT)
+        self.pools = collections.OrderedDict(
+            (pool['pool_name'], pool) for pool in json.loads(output))
+        self.created_at = time.time()
+
+    @property
+    def age(self):
+        """The time since the pool details were read, in seconds.
+
+        :rtype: float
+        """
+        return time.time() - self.created_at
+
+    def get_param(self, pool, param):
+        """Get parameter from pool.
+
+        :param pool: Name of pool to get variable from
+        :type pool: str
+        :param param: Name of variable to get, one of POOL_DETAIL_PARAMS
+        :type param: str
+        :returns: Value of variable on pool or None
+        :rtype: str or None
+        """
+        value = self.pools.get(pool, {}).get(POOL_DETAIL_PARAMS[param])
+        if value is None or value == '':
+            return None
+        return str(value)
+
+    def get_erasure_profile(self, pool):
+        """Get erasure code profile for pool.
+
+        :param pool: Name of pool to get variable from
+        :type pool: str
+        :returns: Erasure code profile of pool or None
+        :rtype: str or None
+        """
+        if self.pools.get(pool, {}).get('type') != POOL_TYPE_ERASURE:
+            return None
+        return self.get_param(pool, 'erasure_code_profile')
+
+    def get_quota(self, pool):
+        """Get pool quota.
+
+        :param pool: Name of pool to get variable from
+        :type pool: str
+        :returns: Dictionary with the quotas that are set
+        :rtype: dict
+        """
+        result = {}
+        for quota in ('max_objects', 'max_bytes'):
+            value = self.pools.get(pool, {}).get('quota_' + quota)
+            if value:
+                result[quota] = str(value)
+        return result
+
+    def get_applications(self, pool=''):
+        """Get pool applications.
+
+        :param pool: (Optional) Name of pool to get applications for
+                     Defaults to get for all pools
+        :type pool: str
+        :returns: Dictionary with pool name as key, or the applications of
+                  the pool if one is given.
+        :rtype: dict
+        """
+        if pool:
+            return self.pools.get(pool, {}).get('application_metadata', {})
+        return {name: detail.get('application_metadata', {})
+                for name, detail in self.pools.items()}
+
+
+_pool_inventories = {}
+
+
+def get_pool_inventory(client='admin', max_age=None):
+    """Get the pool inventory, reusing a recent one if allowed.
+
+    :param client: (Optional) client id for Ceph key to use
+                   Defaults to ``admin``
+    :type client: str
+    :param max_age: (Optional) Maximum age in seconds of a previously read
+                    inventory to return. The pools are always read again
+                    if None.
+    :type max_age: Optional[float]
+    :returns: The pool inventory
+    :rtype: PoolInventory
+    :raises: subprocess.CalledProcessError
+    """
+    inventory = _pool_inventories.get(client)
+    if inventory is None or max_age is None or inventory.age > max_age:
+        inventory = PoolInventory(client)
+        _pool_inventories[client] = inventory
+    return inventory
+
+
+def list_pools(client='admin', max_age=None):
     """This will list the current pools that Ceph has
 
     :param client: (Optional) client id for Ceph key to use
                    Defaults to ``admin``
     :type client: str
+    :param max_age: (Optional) answer from a pool inventory up to this many
+                    seconds old. See get_pool_inventory.
+    :type max_age: Optional[float]
     :returns: Returns a list of available pools.
     :rtype: list
     :raises: subprocess.CalledProcessError if the subprocess fails to run.
     """
+    if max_age is not None:
+        return list(get_pool_inventory(client, max_age).pools)
     try:
         pool_list = []
         pools = subprocess.check_output(['rados', '--id', client, 'lspools'],
@@ -3035,7 +4192,7 @@ def list_pools(client='admin'):
         raise
 
 
-def get_pool_param(pool, param, client='admin'):
+def get_pool_param(pool, param, client='admin', max_age=None):
     """Get parameter from pool.
 
     :param pool: Name of pool to get variable from
@@ -3045,13 +4202,20 @@ def get_pool_param(pool, param, client='admin'):
     :param client: (Optional) client id for Ceph key to use
                    Defaults to ``admin``
     :type client: str
+    :param max_age: (Optional) answer from a pool inventory up to this many
+                    seconds old if the parameter is one of
+                    POOL_DETAIL_PARAMS. See get_pool_inventory.
+    :type max_age: Optional[float]
     :returns: Value of variable on pool or None
     :rtype: str or None
     :raises: subprocess.CalledProcessError
     """
+    if max_age is not None and param in POOL_DETAIL_PARAMS:
+        return get_pool_inventory(client, max_age).get_param(pool, param)
     try:
-        output = subprocess.check_output(
-            ['ceph', '--id', client, 'osd', 'pool', 'get', pool, param],
+        output = ceph_check_output(
+            {'prefix': 'osd pool get', 'pool': pool, 'var': param},
+            service=client,
             universal_newlines=True, stderr=subprocess.STDOUT)
     except subprocess.CalledProcessError as cp:
         if cp.returncode == 2 and 'ENOENT: option' in cp.output:
@@ -3061,7 +4225,7 @@ def get_pool_param(pool, param, client='admin'):
         return output.split(':')[1].lstrip().rstrip()
 
 
-def get_pool_erasure_profile(pool, client='admin'):
+def get_pool_erasure_profile(pool, client='admin', max_age=None):
     """Get erasure code profile for pool.
 
     :param pool: Name of pool to get variable from
@@ -3069,10 +4233,15 @@ def get_pool_erasure_profile(pool, client='admin'):
     :param client: (Optional) client id for Ceph key to use
                    Defaults to ``admin``
     :type client: str
+    :param max_age: (Optional) answer from a pool inventory up to this many
+                    seconds old. See get_pool_inventory.
+    :type max_age: Optional[float]
     :returns: Erasure code profile of pool or None
     :rtype: str or None
     :raises: subprocess.CalledProcessError
     """
+    if max_age is not None:
+        return get_pool_inventory(client, max_age).get_erasure_profile(pool)
     try:
         return get_pool_param(pool, 'erasure_code_profile', client=client)
     except subprocess.CalledProcessError as cp:
@@ -3082,7 +4251,7 @@ def get_pool_erasure_profile(pool, client='admin'):
         raise
 
 
-def get_pool_quota(pool, client='admin'):
+def get_pool_quota(pool, client='admin', max_age=None):
     """Get pool quota.
 
     :param pool: Name of pool to get variable from
@@ -3090,12 +4259,18 @@ def get_pool_quota(pool, client='admin'):
     :param client: (Optional) client id for Ceph key to use
                    Defaults to ``admin``
     :type client: str
+    :param max_age: (Optional) answer from a pool inventory up to this many
+                    seconds old. See get_pool_inventory.
+    :type max_age: Optional[float]
     :returns: Dictionary with quota variables
     :rtype: dict
     :raises: subprocess.CalledProcessError
     """
-    output = subprocess.check_output(
-        ['ceph', '--id', client, 'osd', 'pool', 'get-quota', pool],
+    if max_age is not None:
+        return get_pool_inventory(client, max_age).get_quota(pool)
+    output = ceph_check_output(
+        {'prefix': 'osd pool get-quota', 'pool': pool},
+        service=client,
         universal_newlines=True, stderr=subprocess.STDOUT)
     rc = re.compile(r'\s+max\s+(\S+)\s*:\s+(\d+)')
     result = {}
@@ -3106,7 +4281,7 @@ def get_pool_quota(pool, client='admin'):
     return result
 
 
-def get_pool_applications(pool='', client='admin'):
+def get_pool_applications(pool='', client='admin', max_age=None):
     """Get pool applications.
 
     :param pool: (Optional) Name of pool to get applications for
@@ -3115,18 +4290,23 @@ def get_pool_applications(pool='', client='admin'):
     :param client: (Optional) client id for Ceph key to use
                    Defaults to ``admin``
     :type client: str
+    :param max_age: (Optional) answer from a pool inventory up to this many
+                    seconds old. See get_pool_inventory.
+    :type max_age: Optional[float]
     :returns: Dictionary with pool name as key
     :rtype: dict
     :raises: subprocess.CalledProcessError
     """
+    if max_age is not None:
+        return get_pool_inventory(client, max_age).get_applications(pool)
 
-    cmd = ['ceph', '--id', client, 'osd', 'pool', 'application', 'get']
+    command = {'prefix': 'osd pool application get', 'format': 'json'}
     if pool:
-        cmd.append(pool)
+        command['pool'] = pool
     try:
-        output = subprocess.check_output(cmd,
-                                         universal_newlines=True,
-                                         stderr=subprocess.STDOUT)
+        output = ceph_check_output(command, service=client,
+                                   universal_newlines=True,
+                                   stderr=subprocess.STDOUT)
     except subprocess.CalledProcessError as cp:
         if cp.returncode == 2 and 'ENOENT' in cp.output:
             return {}
@@ -3134,7 +4314,7 @@ def get_pool_applications(pool='', client='admin'):
     return json.loads(output)
 
 
-def list_pools_detail():
+def list_pools_detail(client='admin', max_age=None):
     """Get detailed information about pools.
 
     Structure:
@@ -3146,23 +4326,29 @@ def list_pools_detail():
      'pool_name_2': ...
      }
 
+    :param client: (Optional) client id for Ceph key to use
+                   Defaults to ``admin``
+    :type client: str
+    :param max_age: (Optional) use a pool inventory up to this many seconds
+                    old. See get_pool_inventory.
+    :type max_age: Optional[float]
     :returns: Dictionary with detailed pool information.
     :rtype: dict
     :raises: subproces.CalledProcessError
     """
     get_params = ['pg_num', 'size']
+    inventory = get_pool_inventory(client, max_age)
     result = {}
-    applications = get_pool_applications()
-    for pool in list_pools():
+    for pool in inventory.pools:
         result[pool] = {
-            'applications': applications.get(pool, {}),
+            'applications': inventory.get_applications(pool),
             'parameters': {},
-            'quota': get_pool_quota(pool),
+            'quota': inventory.get_quota(pool),
         }
         for param in get_params:
             result[pool]['parameters'].update({
-                param: get_pool_param(pool, param)})
-        erasure_profile = get_pool_erasure_profile(pool)
+                param: inventory.get_param(pool, param)})
+        erasure_profile = inventory.get_erasure_profile(pool)
         if erasure_profile:
             result[pool]['parameters'].update({
                 'erasure_code_profile': erasure_profile})
@@ -3271,9 +4457,9 @@ def get_ceph_pg_stat():
     :returns: dict
     """
     try:
-        tree = str(subprocess
-                   .check_output(['ceph', 'pg', 'stat', '--format=json'])
-                   .decode('UTF-8'))
+        tree = str(ceph_check_output(
+            {'prefix': 'pg stat', 'format': 'json'}, target='mgr')
+            .decode('UTF-8'))
         try:
             json_tree = json.loads(tree)
             if not json_tree['num_pg_by_state']:
@@ -3296,8 +4482,7 @@ def get_ceph_health():
              status, use get_ceph_health()['overall_status'].
     """
     try:
-        tree = str(subprocess
-                   .check_output(['ceph', 'status', '--format=json'])
+        tree = str(ceph_check_output({'prefix': 'status', 'format': 'json'})
                    .decode('UTF-8'))
         try:
             json_tree = json.loads(tree)
@@ -3518,13 +4703,13 @@ def enabled_manager_modules():
 
     :rtype: List[str]
     """
-    cmd = ['ceph', 'mgr', 'module', 'ls']
+    command = {'prefix': 'mgr module ls'}
     quincy_or_later = (
         _cmp_pkgrevno_with_dpkg_fallback('ceph-common', '17.1.0') >= 0)
     if quincy_or_later:
-        cmd.append('--format=json')
+        command['format'] = 'json'
     try:
-        modules = subprocess.check_output(cmd).decode('UTF-8')
+        modules = ceph_check_output(command).decode('UTF-8')
     except subprocess.CalledProcessError as e:
         log("Failed to list ceph modules: {}".format(e), WARNING)
         return []
@@ -3555,7 +4740,7 @@ def mgr_enable_module(module):
     :raises: subprocess.CalledProcessError
     """
     if not is_mgr_module_enabled(module):
-        subprocess.check_call(['ceph', 'mgr', 'module', 'enable', module])
+        ceph_check_call({'prefix': 'mgr module enable', 'module': module})
         return True
     return False
 
@@ -3572,7 +4757,7 @@ def mgr_disable_module(module):
     :raises: subprocess.CalledProcessError
     """
     if is_mgr_module_enabled(module):
-        subprocess.check_call(['ceph', 'mgr', 'module', 'disable', module])
+        ceph_check_call({'prefix': 'mgr module disable', 'module': module})
         return True
     return False
 
@@ -3592,7 +4777,8 @@ def ceph_config_set(name, value, who):
 
     :raises: subprocess.CalledProcessError
     """
-    subprocess.check_call(['ceph', 'config', 'set', who, name, value])
+    ceph_check_call({'prefix': 'config set', 'who': who, 'name': name,
+                     'value': value})
 
 
 mgr_config_set = functools.partial(ceph_config_set, who='mgr')
@@ -3609,8 +4795,8 @@ def ceph_config_get(name, who):
     :rtype: str
     :raises: subprocess.CalledProcessError
     """
-    return subprocess.check_output(
-        ['ceph', 'config', 'get', who, name]).decode('UTF-8')
+    return ceph_check_output(
+        {'prefix': 'config get', 'who': who, 'key': name}).decode('UTF-8')
 
 
 mgr_config_get = functools.partial(ceph_config_get, who='mgr')
@@ -22,6 +22,16 @@ import charms_ceph.broker
 
 from unittest.mock import call
 
+OSD_DUMP = json.dumps({
+    'osds': [{'osd': 0}, {'osd': 1}, {'osd': 2}],
+    'pools': [{
+        'pool_name': 'glance',
+        'quota_max_bytes': 4096,
+        'quota_max_objects': 0,
+        'options': {'compression_mode': 'aggressive'},
+    }],
+}).encode('UTF-8')
+
 
 class CephBrokerTestCase(unittest.TestCase):
     def setUp(self):
@@ -330,37 +340,39 @@ class CephBrokerTestCase(unittest.TestCase):
                          {'exit-code': 1,
                           'stderr': "Unknown operation 'invalid_op'"})
 
-    @patch.object(charms_ceph.broker, 'get_osds')
+    @patch.object(charms_ceph.broker, 'ceph_check_output')
     @patch.object(charms_ceph.broker, 'ReplicatedPool')
-    @patch.object(charms_ceph.broker, 'pool_exists')
     @patch.object(charms_ceph.broker, 'log')
     def test_process_requests_create_pool_w_pg_num(self, mock_log,
-                                                   mock_pool_exists,
                                                    mock_replicated_pool,
-                                                   mock_get_osds):
-        mock_pool_exists.return_value = False
-        mock_get_osds.return_value = [0, 1, 2]
+                                                   mock_check_output):
+        mock_check_output.return_value = OSD_DUMP
         op = {
             'op': 'create-pool',
             'name': 'foo',
             'replicas': 3,
-            'pg_num': 100,
+            'pg_num': 200,
         }
         reqs = json.dumps({'api-version': 1,
                            'ops': [op]})
         rc = charms_ceph.broker.process_requests(reqs)
-        mock_replicated_pool.assert_called_with(service='admin', op=op)
-        mock_pool_exists.assert_called_with(service='admin', name='foo')
+        # pg_num is capped to 100 PGs per OSD
+        mock_replicated_pool.assert_called_with(service='admin',
+                                                op=dict(op, pg_num=100))
+        mock_replicated_pool().create.assert_called_once_with()
+        mock_check_output.assert_called_once_with(
+            {'prefix': 'osd dump', 'format': 'json'}, service='admin')
         self.assertEqual(json.loads(rc), {'exit-code': 0})
 
+    @patch.object(charms_ceph.broker, 'ceph_check_output')
     @patch.object(charms_ceph.broker, 'ReplicatedPool')
-    @patch.object(charms_ceph.broker, 'pool_exists')
     @patch.object(charms_ceph.broker, 'log')
     @patch.object(charms_ceph.broker, 'add_pool_to_group')
     def test_process_requests_create_pool_w_group(self, add_pool_to_group,
-                                                  mock_log, mock_pool_exists,
-                                                  mock_replicated_pool):
-        mock_pool_exists.return_value = False
+                                                  mock_log,
+                                                  mock_replicated_pool,
+                                                  mock_check_output):
+        mock_check_output.return_value = OSD_DUMP
         op = {
             'op': 'create-pool',
             'name': 'foo',
@@ -372,39 +384,62 @@ class CephBrokerTestCase(unittest.TestCase):
         rc = charms_ceph.broker.process_requests(reqs)
         add_pool_to_group.assert_called_with(group='image',
                                              pool='foo',
-                                             namespace=None)
-        mock_pool_exists.assert_called_with(service='admin', name='foo')
+                                             namespace=None,
+                                             state=ANY)
         mock_replicated_pool.assert_called_with(service='admin', op=op)
         self.assertEqual(json.loads(rc), {'exit-code': 0})
 
+    @patch.object(charms_ceph.broker, 'ceph_check_output')
     @patch.object(charms_ceph.broker, 'ReplicatedPool')
-    @patch.object(charms_ceph.broker, 'pool_exists')
     @patch.object(charms_ceph.broker, 'log')
     def test_process_requests_create_pool_exists(self, mock_log,
-                                                 mock_pool_exists,
-                                                 mock_replicated_pool):
-        mock_pool_exists.return_value = True
+                                                 mock_replicated_pool,
+                                                 mock_check_output):
+        mock_check_output.return_value = OSD_DUMP
 
         op = {
             'op': 'create-pool',
-            'name': 'foo',
+            'name': 'glance',
             'replicas': 3,
+            'max-bytes': 1024,
         }
         reqs = json.dumps({'api-version': 1,
                            'ops': [op]})
         rc = charms_ceph.broker.process_requests(reqs)
-        mock_pool_exists.assert_called_with(service='admin',
-                                            name='foo')
-        self.assertFalse(mock_replicated_pool.create.called)
+        self.assertFalse(mock_replicated_pool().create.called)
+        mock_replicated_pool().update.assert_called_once_with()
         self.assertEqual(json.loads(rc), {'exit-code': 0})
 
+    @patch.object(charms_ceph.broker, 'ceph_check_output')
+    @patch.object(charms_ceph.broker, 'ReplicatedPool')
+    @patch.object(charms_ceph.broker, 'log')
+    def test_process_requests_create_pool_up_to_date(self, mock_log,
+                                                     mock_replicated_pool,
+                                                     mock_check_output):
+        mock_check_output.return_value = OSD_DUMP
+
+        op = {
+            'op': 'create-pool',
+            'name': 'glance',
+            'replicas': 3,
+            'max-bytes': 4096,
+            'compression-mode': 'aggressive',
+        }
+        reqs = json.dumps({'api-version': 1,
+                           'ops': [op]})
+        rc = charms_ceph.broker.process_requests(reqs)
+        self.assertFalse(mock_replicated_pool().create.called)
+        self.assertFalse(mock_replicated_pool().update.called)
+        mock_replicated_pool().validate.assert_called_once_with()
+        self.assertEqual(json.loads(rc), {'exit-code': 0})
+
+    @patch.object(charms_ceph.broker, 'ceph_check_output')
     @patch.object(charms_ceph.broker, 'ReplicatedPool')
-    @patch.object(charms_ceph.broker, 'pool_exists')
     @patch.object(charms_ceph.broker, 'log')
     def test_process_requests_create_pool_rid(self, mock_log,
-                                              mock_pool_exists,
-                                              mock_replicated_pool):
-        mock_pool_exists.return_value = False
+                                              mock_replicated_pool,
+                                              mock_check_output):
+        mock_check_output.return_value = OSD_DUMP
         op = {
             'op': 'create-pool',
             'name': 'foo',
@@ -415,19 +450,75 @@ class CephBrokerTestCase(unittest.TestCase):
                            'ops': [op]})
         rc = charms_ceph.broker.process_requests(reqs)
         mock_replicated_pool.assert_called_with(service='admin', op=op)
-        mock_pool_exists.assert_called_with(service='admin', name='foo')
         self.assertEqual(json.loads(rc)['exit-code'], 0)
         self.assertEqual(json.loads(rc)['request-id'], '1ef5aede')
 
-    @patch.object(charms_ceph.broker, 'erasure_profile_exists')
+    @patch.object(charms_ceph.broker, 'ceph_check_output')
+    @patch.object(charms_ceph.broker, 'ReplicatedPool')
+    @patch.object(charms_ceph.broker, 'log')
+    def test_process_requests_create_many_pools(self, mock_log,
+                                                mock_replicated_pool,
+                                                mock_check_output):
+        mock_check_output.return_value = OSD_DUMP
+        ops = [
+            {'op': 'create-pool', 'name': 'foo', 'replicas': 3},
+            {'op': 'create-pool', 'name': 'bar', 'replicas': 3},
+            {'op': 'create-pool', 'name': 'foo', 'replicas': 3},
+        ]
+        reqs = json.dumps({'api-version': 1,
+                           'ops': ops})
+        rc = charms_ceph.broker.process_requests(reqs)
+        # The cluster is only queried once for the whole request and the
+        # pool created by the first op is known to the last one.
+        mock_check_output.assert_called_once_with(
+            {'prefix': 'osd dump', 'format': 'json'}, service='admin')
+        self.assertEqual(mock_replicated_pool().create.call_count, 2)
+        mock_replicated_pool().update.assert_called_once_with()
+        self.assertEqual(json.loads(rc), {'exit-code': 0})
+
+    @patch.object(charms_ceph.broker, 'update_service_permissions')
+    @patch.object(charms_ceph.broker, 'monitor_key_set')
+    @patch.object(charms_ceph.broker, 'monitor_key_get')
+    @patch.object(charms_ceph.broker, 'ceph_check_output')
+    @patch.object(charms_ceph.broker, 'ReplicatedPool')
+    @patch.object(charms_ceph.broker, 'log')
+    def test_process_requests_defers_permissions(self, mock_log,
+                                                 mock_replicated_pool,
+                                                 mock_check_output,
+                                                 _monitor_key_get,
+                                                 _monitor_key_set,
+                                                 _update_service_permissions):
+        mock_check_output.return_value = OSD_DUMP
+        _monitor_key_get.return_value = ('{"pools": [], '
+                                         '"services": ["nova", "cinder"]}')
+        ops = [
+            {'op': 'create-pool', 'name': 'foo', 'replicas': 3,
+             'group': 'images'},
+            {'op': 'create-pool', 'name': 'bar', 'replicas': 3,
+             'group': 'images'},
+        ]
+        reqs = json.dumps({'api-version': 1,
+                           'ops': ops})
+        rc = charms_ceph.broker.process_requests(reqs)
+        _update_service_permissions.assert_has_calls([
+            call('nova', namespace=None),
+            call('cinder', namespace=None),
+        ])
+        self.assertEqual(_update_service_permissions.call_count, 2)
+        self.assertEqual(json.loads(rc), {'exit-code': 0})
+
+    @patch.object(charms_ceph.broker, 'ceph_check_output')
     @patch.object(charms_ceph.broker, 'ErasurePool')
-    @patch.object(charms_ceph.broker, 'pool_exists')
     @patch.object(charms_ceph.broker, 'log')
     def test_process_requests_create_erasure_pool(self, mock_log,
-                                                  mock_pool_exists,
                                                   mock_erasure_pool,
-                                                  mock_profile_exists):
-        mock_pool_exists.return_value = False
+                                                  mock_check_output):
+        def _check_output(command, service):
+            if command['prefix'] == 'osd erasure-code-profile ls':
+                return b'["default"]'
+            return OSD_DUMP
+
+        mock_check_output.side_effect = _check_output
         op = {
             'op': 'create-pool',
             'pool-type': 'erasure',
@@ -437,11 +528,31 @@ class CephBrokerTestCase(unittest.TestCase):
         reqs = json.dumps({'api-version': 1,
                            'ops': [op]})
         rc = charms_ceph.broker.process_requests(reqs)
-        mock_profile_exists.assert_called_with(service='admin', name='default')
+        mock_check_output.assert_any_call(
+            {'prefix': 'osd erasure-code-profile ls', 'format': 'json'},
+            service='admin')
         mock_erasure_pool.assert_called_with(service='admin', op=op)
-        mock_pool_exists.assert_called_with(service='admin', name='foo')
+        mock_erasure_pool().create.assert_called_once_with()
         self.assertEqual(json.loads(rc), {'exit-code': 0})
 
+    @patch.object(charms_ceph.broker, 'ceph_check_output')
+    @patch.object(charms_ceph.broker, 'ErasurePool')
+    @patch.object(charms_ceph.broker, 'log')
+    def test_process_requests_create_erasure_pool_no_profile(
+            self, mock_log, mock_erasure_pool, mock_check_output):
+        mock_check_output.return_value = b'["default"]'
+        op = {
+            'op': 'create-pool',
+            'pool-type': 'erasure',
+            'name': 'foo',
+            'erasure-profile': 'missing'
+        }
+        reqs = json.dumps({'api-version': 1,
+                           'ops': [op]})
+        rc = charms_ceph.broker.process_requests(reqs)
+        self.assertFalse(mock_erasure_pool.called)
+        self.assertEqual(json.loads(rc)['exit-code'], 1)
+
     @patch.object(charms_ceph.broker, 'pool_exists')
     @patch.object(charms_ceph.broker, 'BasePool')
     @patch.object(charms_ceph.broker, 'log', lambda *args, **kwargs: None)
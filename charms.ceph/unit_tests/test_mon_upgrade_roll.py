@@ -12,6 +12,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import errno
+import json
 import sys
 import time
 import unittest
@@ -65,8 +67,10 @@ class UpgradeRollingTestCase(unittest.TestCase):
     @patch('time.time')
     @patch.object(charms_ceph.utils, 'log')
     @patch.object(charms_ceph.utils, 'upgrade_monitor')
+    @patch.object(charms_ceph.utils, 'notify_upgrade_waiters')
     @patch.object(charms_ceph.utils, 'monitor_key_set')
-    def test_lock_and_roll(self, monitor_key_set, upgrade_monitor, log, time):
+    def test_lock_and_roll(self, monitor_key_set, notify_upgrade_waiters,
+                           upgrade_monitor, log, time):
         time.return_value = 1473279502.69
         monitor_key_set.monitor_key_set.return_value = None
         charms_ceph.utils.lock_and_roll(my_name='ip-192-168-1-2',
@@ -84,6 +88,7 @@ class UpgradeRollingTestCase(unittest.TestCase):
                 call('monitor_key_set '
                      'mon_ip-192-168-1-2_hammer_done 1473279502.69'),
             ])
+        notify_upgrade_waiters.assert_called_once_with('admin')
 
     @patch.object(charms_ceph.utils, 'cmp_pkgrevno')
     @patch.object(charms_ceph.utils, 'determine_packages')
@@ -428,3 +433,154 @@ class UpgradeRollingTestCase(unittest.TestCase):
         )
 
         self.assertGreaterEqual(tval[0], previous_node_start_time + 600)
+
+    @patch.object(charms_ceph.utils, 'log')
+    @patch.object(charms_ceph.utils, 'time')
+    @patch.object(charms_ceph.utils, 'atexit')
+    @patch.object(charms_ceph.utils, '_ceph_sessions', {})
+    @patch.object(charms_ceph.utils, 'rados')
+    def test_wait_on_previous_node_mon_session(self, rados, atexit,
+                                               mock_time, log):
+        keys = {}
+        now = [previous_node_start_time]
+
+        def fake_time():
+            now[0] += 1
+            # the previous node starts and then finishes a few seconds later
+            if now[0] > previous_node_start_time + 3:
+                keys['mon_ip-192-168-1-2_0.94.1_start'] = str(now[0])
+            if now[0] > previous_node_start_time + 6:
+                keys['mon_ip-192-168-1-2_0.94.1_done'] = str(now[0])
+            return now[0]
+
+        def mon_command(cmd, inbuf):
+            cmd = json.loads(cmd)
+            if cmd['key'] not in keys:
+                return -errno.ENOENT, b'', 'not found'
+            return 0, keys[cmd['key']].encode(), ''
+
+        mock_time.time.side_effect = fake_time
+        cluster = rados.Rados.return_value
+        cluster.mon_command.side_effect = mon_command
+        ioctx = cluster.open_ioctx.return_value
+        # Without the caps on the notification object keys are polled
+        ioctx.watch.side_effect = Exception('EPERM')
+
+        charms_ceph.utils.wait_on_previous_node(
+            previous_node="ip-192-168-1-2",
+            version='0.94.1',
+            service='mon',
+            upgrade_key='admin'
+        )
+        rados.Rados.assert_called_once_with(rados_id='admin',
+                                            conffile='/etc/ceph/ceph.conf')
+        # The session is shared with the rest of the process
+        cluster.shutdown.assert_not_called()
+        # Checked every 10 seconds over the single monitor session
+        mock_time.sleep.assert_called_with(10)
+        self.assertLess(now[0], previous_node_start_time + 20)
+        ioctx.close.assert_called_once_with()
+
+    @patch.object(charms_ceph.utils, 'log')
+    @patch.object(charms_ceph.utils, 'time')
+    @patch.object(charms_ceph.utils, 'atexit')
+    @patch.object(charms_ceph.utils, '_ceph_sessions', {})
+    @patch.object(charms_ceph.utils, 'rados')
+    def test_wait_on_previous_node_notified(self, rados, atexit,
+                                            mock_time, log):
+        keys = {'mon_ip-192-168-1-2_0.94.1_start': '100.0'}
+        callbacks = []
+
+        def mon_command(cmd, inbuf):
+            key = json.loads(cmd)['key']
+            if key not in keys:
+                if key == 'mon_ip-192-168-1-2_0.94.1_done':
+                    # the previous node finishes right after the check
+                    keys[key] = '110.0'
+                    callbacks[0](1, 2, 3, b'')
+                return -errno.ENOENT, b'', 'not found'
+            return 0, keys[key].encode(), ''
+
+        mock_time.time.return_value = 105.0
+        cluster = rados.Rados.return_value
+        cluster.mon_command.side_effect = mon_command
+        ioctx = cluster.open_ioctx.return_value
+        ioctx.watch.side_effect = (
+            lambda obj, callback: callbacks.append(callback) or MagicMock())
+
+        charms_ceph.utils.wait_on_previous_node(
+            previous_node="ip-192-168-1-2",
+            version='0.94.1',
+            service='mon',
+            upgrade_key='admin'
+        )
+        cluster.open_ioctx.assert_called_once_with('.mgr')
+        ioctx.set_namespace.assert_called_once_with('charm-upgrade')
+        ioctx.operate_write_op.assert_called_once_with(ANY, 'upgrade')
+        ioctx.watch.assert_called_once_with('upgrade', ANY)
+        # Woken up by the notification rather than the poll interval
+        mock_time.sleep.assert_not_called()
+        self.assertIn('mon_ip-192-168-1-2_0.94.1_done', keys)
+        ioctx.close.assert_called_once_with()
+
+    @patch.object(charms_ceph.utils, 'log')
+    @patch.object(charms_ceph.utils, 'atexit')
+    @patch.object(charms_ceph.utils, '_ceph_sessions', {})
+    @patch.object(charms_ceph.utils, 'rados')
+    def test_notify_upgrade_waiters(self, rados, atexit, log):
+        ioctx = rados.Rados.return_value.open_ioctx.return_value
+        charms_ceph.utils.notify_upgrade_waiters('osd-upgrade')
+        ioctx.set_namespace.assert_called_once_with('charm-upgrade')
+        ioctx.notify.assert_called_once_with('upgrade', timeout_ms=5000)
+        ioctx.close.assert_called_once_with()
+        log.assert_not_called()
+
+        # Failures are logged, the waiters still poll
+        ioctx.notify.side_effect = Exception('ETIMEDOUT')
+        charms_ceph.utils.notify_upgrade_waiters('osd-upgrade')
+        self.assertEqual(ioctx.close.call_count, 2)
+        log.assert_called_once_with(
+            'Unable to notify the nodes waiting to upgrade: ETIMEDOUT',
+            level=charms_ceph.utils.WARNING)
+
+    @patch.object(charms_ceph.utils, 'rados', None)
+    @patch.object(charms_ceph.utils, 'monitor_key_exists')
+    def test_upgrade_key_watcher_no_rados(self, monitor_key_exists):
+        monitor_key_exists.return_value = True
+        watcher = charms_ceph.utils.UpgradeKeyWatcher('admin')
+        self.assertIsNone(watcher.interval)
+        self.assertTrue(watcher.exists('foo'))
+        monitor_key_exists.assert_called_once_with('admin', 'foo')
+
+    @patch.object(charms_ceph.utils, 'rados', None)
+    @patch.object(charms_ceph.utils, 'monitor_key_get')
+    def test_get_upgrade_timings(self, monitor_key_get):
+        values = {
+            'osd_host-a_pacific_start': '100.0',
+            'osd_host-a_pacific_done': '160.5',
+            'osd_host-b_pacific_start': '170.0',
+        }
+        monitor_key_get.side_effect = lambda _, key: values.get(key)
+        timings = charms_ceph.utils.get_upgrade_timings(
+            'osd-upgrade', 'osd', 'pacific', ['host-a', 'host-b', 'host-c'])
+        self.assertEqual(list(timings), ['host-a', 'host-b', 'host-c'])
+        self.assertEqual(timings['host-a'],
+                         {'start': 100.0, 'done': 160.5, 'duration': 60.5})
+        self.assertEqual(timings['host-b'],
+                         {'start': 170.0, 'done': None, 'duration': None})
+        self.assertEqual(timings['host-c'],
+                         {'start': None, 'done': None, 'duration': None})
+
+    @patch.object(charms_ceph.utils, 'log')
+    @patch.object(charms_ceph.utils, 'get_upgrade_timings')
+    def test_log_upgrade_timings(self, get_upgrade_timings, log):
+        get_upgrade_timings.return_value = {
+            'host-a': {'start': 100.0, 'done': 160.5, 'duration': 60.5},
+            'host-b': {'start': 170.0, 'done': None, 'duration': None},
+        }
+        charms_ceph.utils.log_upgrade_timings(
+            'osd-upgrade', 'osd', 'pacific', ['host-a', 'host-b'])
+        get_upgrade_timings.assert_called_once_with(
+            'osd-upgrade', 'osd', 'pacific', ['host-a', 'host-b'])
+        log.assert_called_once_with(
+            'Upgrade timings of osd to pacific: host-a 60s, host-b unknown')
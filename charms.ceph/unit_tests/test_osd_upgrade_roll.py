@@ -12,13 +12,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
 import os
 import sys
 import time
 import subprocess
+import tempfile
 import unittest
 
-from unittest.mock import patch, call, mock_open
+from unittest.mock import patch, call, mock_open, ANY, MagicMock
 
 import charms_ceph.utils
 
@@ -62,9 +64,40 @@ def monitor_key_side_effect(*args):
         return previous_node_start_time
 
 
+OSD_TREE = [
+    charms_ceph.utils.CrushLocation(
+        name="ip-192-168-1-2",
+        identifier='a',
+        host='host-a',
+        rack='rack-a',
+        row='row-a',
+        datacenter='dc-1',
+        chassis='chassis-a',
+        root='ceph'),
+    charms_ceph.utils.CrushLocation(
+        name="ip-192-168-1-3",
+        identifier='b',
+        host='host-b',
+        rack='rack-a',
+        row='row-a',
+        datacenter='dc-1',
+        chassis='chassis-a',
+        root='ceph'),
+    charms_ceph.utils.CrushLocation(
+        name="ip-192-168-1-4",
+        identifier='c',
+        host='host-c',
+        rack='rack-b',
+        row='row-a',
+        datacenter='dc-1',
+        chassis='chassis-b',
+        root='ceph'),
+]
+
+
 class UpgradeRollingTestCase(unittest.TestCase):
 
-    @patch.object(charms_ceph.utils, 'get_osd_state')
+    @patch.object(charms_ceph.utils, '_query_osd_state')
     @patch.object(charms_ceph.utils, 'determine_packages')
     @patch.object(charms_ceph.utils, 'dirs_need_ownership_update')
     @patch.object(charms_ceph.utils, 'apt_install')
@@ -82,13 +115,13 @@ class UpgradeRollingTestCase(unittest.TestCase):
                                 add_source, apt_update, status_set, log,
                                 service_restart, chownr, apt_install,
                                 dirs_need_ownership_update,
-                                _determine_packages, get_osd_state):
+                                _determine_packages, _query_osd_state):
         config.side_effect = config_side_effect
         get_version.side_effect = [0.80, 0.94]
         systemd.return_value = False
         local_osds.return_value = [0, 1, 2]
         dirs_need_ownership_update.return_value = False
-        get_osd_state.side_effect = ['active'] * 6
+        _query_osd_state.return_value = 'active'
 
         charms_ceph.utils.upgrade_osd('hammer')
         service_restart.assert_called_with('ceph-osd-all')
@@ -101,12 +134,10 @@ class UpgradeRollingTestCase(unittest.TestCase):
                 call('Upgrading to: hammer')
             ]
         )
-        get_osd_state.assert_has_calls([
-            call(0), call(1), call(2),
-            call(0, osd_goal_state='active'),
-            call(1, osd_goal_state='active'),
-            call(2, osd_goal_state='active'),
-        ])
+        # States are read before the restart and until they are back
+        self.assertEqual(_query_osd_state.call_count, 6)
+        _query_osd_state.assert_has_calls([call(0), call(1), call(2)],
+                                          any_order=True)
         # Make sure on an Upgrade to Hammer that chownr was NOT called.
         assert not chownr.called
 
@@ -145,10 +176,10 @@ class UpgradeRollingTestCase(unittest.TestCase):
             call(os.path.join(charms_ceph.utils.CEPH_BASE_DIR, 'fs')),
         ])
         _upgrade_single_osd.assert_has_calls([
-            call('0', 'ceph-0'),
-            call('1', 'ceph-1'),
-            call('2', 'ceph-2'),
-        ])
+            call('0', 'ceph-0', progress=ANY),
+            call('1', 'ceph-1', progress=ANY),
+            call('2', 'ceph-2', progress=ANY),
+        ], any_order=True)
         status_set.assert_has_calls([
             call('maintenance', 'Upgrading OSD'),
             call('maintenance', 'Upgrading packages to jewel')
@@ -160,7 +191,7 @@ class UpgradeRollingTestCase(unittest.TestCase):
             ]
         )
 
-    @patch.object(charms_ceph.utils, 'get_osd_state')
+    @patch.object(charms_ceph.utils, '_query_osd_state')
     @patch.object(charms_ceph.utils, 'determine_packages')
     @patch.object(charms_ceph.utils, 'service_restart')
     @patch.object(charms_ceph.utils, '_upgrade_single_osd')
@@ -185,7 +216,7 @@ class UpgradeRollingTestCase(unittest.TestCase):
                                   dirs_need_ownership_update,
                                   _get_child_dirs, listdir, update_owner,
                                   _upgrade_single_osd, service_restart,
-                                  _determine_packages, get_osd_state):
+                                  _determine_packages, _query_osd_state):
         config.side_effect = config_side_effect
         get_version.side_effect = [10.2, 12.2]
         systemd.return_value = True
@@ -193,7 +224,7 @@ class UpgradeRollingTestCase(unittest.TestCase):
         listdir.return_value = ['osd', 'mon', 'fs']
         _get_child_dirs.return_value = ['ceph-0', 'ceph-1', 'ceph-2']
         dirs_need_ownership_update.return_value = False
-        get_osd_state.side_effect = ['active'] * 6
+        _query_osd_state.return_value = 'active'
 
         charms_ceph.utils.upgrade_osd('luminous')
         service_restart.assert_called_with('ceph-osd.target')
@@ -209,27 +240,27 @@ class UpgradeRollingTestCase(unittest.TestCase):
                 call('Upgrading to: luminous')
             ]
         )
-        get_osd_state.assert_has_calls([
-            call(0), call(1), call(2),
-            call(0, osd_goal_state='active'),
-            call(1, osd_goal_state='active'),
-            call(2, osd_goal_state='active'),
-        ])
+        # States are read before the restart and until they are back
+        self.assertEqual(_query_osd_state.call_count, 6)
+        _query_osd_state.assert_has_calls([call(0), call(1), call(2)],
+                                          any_order=True)
 
     @patch.object(charms_ceph.utils, 'get_osd_state')
     @patch.object(charms_ceph.utils, 'stop_osd')
     @patch.object(charms_ceph.utils, 'disable_osd')
-    @patch.object(charms_ceph.utils, 'update_owner')
+    @patch.object(charms_ceph.utils, 'update_owner_tree')
     @patch.object(charms_ceph.utils, 'enable_osd')
     @patch.object(charms_ceph.utils, 'start_osd')
-    def test_upgrade_single_osd(self, start_osd, enable_osd, update_owner,
-                                disable_osd, stop_osd, get_osd_state):
+    def test_upgrade_single_osd(self, start_osd, enable_osd,
+                                update_owner_tree, disable_osd, stop_osd,
+                                get_osd_state):
         get_osd_state.side_effect = ['active'] * 2
 
         charms_ceph.utils._upgrade_single_osd(1, '/var/lib/ceph/osd/ceph-1')
         stop_osd.assert_called_with(1)
         disable_osd.assert_called_with(1)
-        update_owner.assert_called_with('/var/lib/ceph/osd/ceph-1')
+        update_owner_tree.assert_called_with('/var/lib/ceph/osd/ceph-1',
+                                             progress=None)
         enable_osd.assert_called_with(1)
         start_osd.assert_called_with(1)
         get_osd_state.assert_has_calls([
@@ -237,6 +268,93 @@ class UpgradeRollingTestCase(unittest.TestCase):
             call(1, osd_goal_state='active'),
         ])
 
+    @patch.object(charms_ceph.utils, 'notify_upgrade_waiters')
+    @patch.object(charms_ceph.utils, 'status_set')
+    @patch.object(charms_ceph.utils, 'monitor_key_set')
+    @patch.object(charms_ceph.utils, 'upgrade_osd')
+    @patch.object(charms_ceph.utils, 'log')
+    def test_lock_and_roll_parallelism(self, log, upgrade_osd,
+                                       monitor_key_set, status_set,
+                                       notify_upgrade_waiters):
+        charms_ceph.utils.lock_and_roll(upgrade_key='osd-upgrade',
+                                        service='osd',
+                                        my_name='ip-192-168-1-2',
+                                        version='pacific',
+                                        parallelism=2)
+        upgrade_osd.assert_called_once_with('pacific', kick_function=ANY,
+                                            parallelism=2)
+
+    @patch.object(charms_ceph.utils, 'log')
+    @patch.object(charms_ceph.utils, 'status_set')
+    @patch.object(charms_ceph.utils, '_upgrade_single_osd')
+    def test_upgrade_osds(self, _upgrade_single_osd, status_set, log):
+        def _upgrade(osd_num, osd_dir, progress):
+            progress(int(osd_num) * 1000)
+
+        _upgrade_single_osd.side_effect = _upgrade
+        kick_function = MagicMock()
+        charms_ceph.utils._upgrade_osds(
+            [('0', 'ceph-0'), ('1', 'ceph-1'), ('2', 'ceph-2')],
+            kick_function, 2)
+        self.assertEqual(_upgrade_single_osd.call_count, 3)
+        kick_function.assert_called_with()
+        log.assert_any_call('Checked ownership of 3000 inodes, 0 OSDs left '
+                            'to upgrade', charms_ceph.utils.DEBUG)
+
+    @patch.object(charms_ceph.utils, 'log')
+    @patch.object(charms_ceph.utils, 'status_set')
+    @patch.object(charms_ceph.utils, '_upgrade_single_osd')
+    def test_upgrade_osds_failure(self, _upgrade_single_osd, status_set,
+                                  log):
+        _upgrade_single_osd.side_effect = subprocess.CalledProcessError(
+            1, 'systemctl')
+        with self.assertRaises(subprocess.CalledProcessError):
+            charms_ceph.utils._upgrade_osds([('0', 'ceph-0')],
+                                            MagicMock(), 4)
+
+        # The OSDs still queued are not upgraded after a failure.
+        _upgrade_single_osd.reset_mock()
+        _upgrade_single_osd.side_effect = None
+
+        def _upgrade(osd_num, osd_dir, progress):
+            if osd_num == '0':
+                raise subprocess.CalledProcessError(1, 'systemctl')
+
+        _upgrade_single_osd.side_effect = _upgrade
+        with self.assertRaises(subprocess.CalledProcessError):
+            charms_ceph.utils._upgrade_osds(
+                [('0', 'ceph-0'), ('1', 'ceph-1'), ('2', 'ceph-2')],
+                MagicMock(), 1)
+        _upgrade_single_osd.assert_called_once_with(
+            '0', 'ceph-0', progress=ANY)
+
+    @patch.object(charms_ceph.utils, 'log')
+    @patch.object(charms_ceph.utils.grp, 'getgrnam')
+    @patch.object(charms_ceph.utils.pwd, 'getpwnam')
+    @patch.object(charms_ceph.utils.os, 'lchown')
+    def test_update_owner_tree(self, lchown, getpwnam, getgrnam, log):
+        uid, gid = os.getuid(), os.getgid()
+        getpwnam.return_value.pw_uid = uid
+        getgrnam.return_value.gr_gid = gid + 1
+        with tempfile.TemporaryDirectory() as path:
+            os.makedirs(os.path.join(path, 'current', 'meta'))
+            open(os.path.join(path, 'current', 'meta', 'obj'), 'w').close()
+            os.symlink('/dev/null', os.path.join(path, 'block'))
+            progress = MagicMock()
+
+            # All inodes have the wrong group
+            self.assertEqual(
+                charms_ceph.utils.update_owner_tree(path, progress=progress),
+                5)
+            lchown.assert_any_call(os.path.join(path, 'block'), uid, gid + 1)
+            progress.assert_called_once_with(5)
+
+            # None need to be changed
+            lchown.reset_mock()
+            getgrnam.return_value.gr_gid = gid
+            self.assertEqual(charms_ceph.utils.update_owner_tree(path), 0)
+            lchown.assert_not_called()
+
     @patch.object(charms_ceph.utils, 'systemd')
     @patch.object(charms_ceph.utils, 'service_stop')
     def test_stop_osd(self, service_stop, systemd):
@@ -294,20 +412,20 @@ class UpgradeRollingTestCase(unittest.TestCase):
         update_owner.assert_called_with('/var/lib/ceph/osd/ceph-6/ready')
 
     @patch.object(charms_ceph.utils, 'time')
-    @patch('subprocess.check_output')
+    @patch.object(charms_ceph.utils, '_admin_socket_command')
     @patch.object(charms_ceph.utils, 'log')
-    def test_get_osd_state(self, log, check_output, time):
+    def test_get_osd_state(self, log, _admin_socket_command, time):
         """Test get_osd_state with retries and different scenarios."""
         time.time.side_effect = [0, 0, 10, 20, 30, 40]
 
-        check_output.side_effect = [
-            subprocess.CalledProcessError(returncode=2, cmd=["bad"]),
+        _admin_socket_command.side_effect = [
+            ConnectionRefusedError("refused"),
             ValueError("bad value"),
-            '{"state":"active"}'.encode()] * 2
+            {"state": "active"}] * 2
 
         osd_state = charms_ceph.utils.get_osd_state(2)
-        check_output.assert_called_with(
-            ['ceph', 'daemon', '/var/run/ceph/ceph-osd.2.asok', 'status'])
+        _admin_socket_command.assert_called_with(
+            '/var/run/ceph/ceph-osd.2.asok', 'status')
         self.assertTrue(any('Failed to get OSD 2 state' in str(c)
                             for c in log.call_args_list))
         self.assertTrue(any('OSD 2 state: active' in str(c)
@@ -315,92 +433,265 @@ class UpgradeRollingTestCase(unittest.TestCase):
         self.assertEqual(osd_state, 'active')
 
         log.reset_mock()
-        check_output.reset_mock()
+        _admin_socket_command.reset_mock()
         time.time.side_effect = [0, 0, 10]
-        check_output.side_effect = ['{"state":"active"}'.encode()]
+        _admin_socket_command.side_effect = [{"state": "active"}]
 
         osd_state = charms_ceph.utils.get_osd_state(2, osd_goal_state='active')
-        check_output.assert_called_with(
-            ['ceph', 'daemon', '/var/run/ceph/ceph-osd.2.asok', 'status'])
+        _admin_socket_command.assert_called_with(
+            '/var/run/ceph/ceph-osd.2.asok', 'status')
         self.assertTrue(any('OSD 2 state: active' in str(c)
                             for c in log.call_args_list))
         self.assertEqual(osd_state, 'active')
 
     @patch.object(charms_ceph.utils, 'socket')
+    @patch.object(charms_ceph.utils, 'get_strictest_failure_domain')
     @patch.object(charms_ceph.utils, 'get_osd_tree')
     @patch.object(charms_ceph.utils, 'log')
     @patch.object(charms_ceph.utils, 'lock_and_roll')
-    @patch.object(charms_ceph.utils, 'get_upgrade_position')
     def test_roll_osd_cluster_first(self,
-                                    get_upgrade_position,
                                     lock_and_roll,
                                     log,
                                     get_osd_tree,
+                                    get_strictest_failure_domain,
                                     socket):
         socket.gethostname.return_value = "ip-192-168-1-2"
-        get_osd_tree.return_value = ""
-        get_upgrade_position.return_value = 0
+        get_osd_tree.return_value = OSD_TREE[:1]
+        get_strictest_failure_domain.return_value = 'host'
 
         charms_ceph.utils.roll_osd_cluster(new_version='0.94.1',
                                            upgrade_key='osd-upgrade')
         log.assert_has_calls(
             [
                 call('roll_osd_cluster called with 0.94.1'),
-                call('osd_sorted_list: []'),
-                call('upgrade position: 0')
+                call('osd_sorted_list: {}'.format(OSD_TREE[:1])),
+                call('upgrade wave: 0 of 1 (failure domain: host)')
             ]
         )
         lock_and_roll.assert_called_with(my_name="ip-192-168-1-2",
                                          version="0.94.1",
                                          upgrade_key='osd-upgrade',
-                                         service='osd')
+                                         service='osd',
+                                         parallelism=4)
 
     @patch.object(charms_ceph.utils, 'get_osd_tree')
     @patch.object(charms_ceph.utils, 'socket')
     @patch.object(charms_ceph.utils, 'status_set')
     @patch.object(charms_ceph.utils, 'lock_and_roll')
-    @patch.object(charms_ceph.utils, 'get_upgrade_position')
+    @patch.object(charms_ceph.utils, 'get_strictest_failure_domain')
+    @patch.object(charms_ceph.utils, 'wait_for_pgs_active_clean')
     @patch.object(charms_ceph.utils, 'wait_on_previous_node')
+    @patch.object(charms_ceph.utils, 'log_upgrade_timings')
     def test_roll_osd_cluster_second(self,
+                                     log_upgrade_timings,
                                      wait_on_previous_node,
-                                     get_upgrade_position,
+                                     wait_for_pgs_active_clean,
+                                     get_strictest_failure_domain,
                                      lock_and_roll,
                                      status_set,
                                      socket,
                                      get_osd_tree):
         wait_on_previous_node.return_value = None
         socket.gethostname.return_value = "ip-192-168-1-3"
-        get_osd_tree.return_value = [
-            charms_ceph.utils.CrushLocation(
-                name="ip-192-168-1-2",
-                identifier='a',
-                host='host-a',
-                rack='rack-a',
-                row='row-a',
-                datacenter='dc-1',
-                chassis='chassis-a',
-                root='ceph'),
-            charms_ceph.utils.CrushLocation(
-                name="ip-192-168-1-3",
-                identifier='a',
-                host='host-b',
-                rack='rack-a',
-                row='row-a',
-                datacenter='dc-1',
-                chassis='chassis-a',
-                root='ceph')
-        ]
-        get_upgrade_position.return_value = 1
+        get_osd_tree.return_value = OSD_TREE[:2]
+        get_strictest_failure_domain.return_value = 'host'
 
         charms_ceph.utils.roll_osd_cluster(new_version='0.94.1',
-                                           upgrade_key='osd-upgrade')
-        status_set.assert_called_with(
+                                           upgrade_key='osd-upgrade',
+                                           parallelism=2)
+        status_set.assert_any_call(
             'waiting',
             'Waiting on ip-192-168-1-2 to finish upgrading')
+        wait_on_previous_node.assert_called_once_with(
+            upgrade_key='osd-upgrade',
+            service='osd',
+            previous_node='ip-192-168-1-2',
+            version='0.94.1')
+        wait_for_pgs_active_clean.assert_called_once_with('osd-upgrade')
+        lock_and_roll.assert_called_with(my_name='ip-192-168-1-3',
+                                         service='osd',
+                                         upgrade_key='osd-upgrade',
+                                         version='0.94.1',
+                                         parallelism=2)
+        log_upgrade_timings.assert_called_once_with(
+            'osd-upgrade', 'osd', '0.94.1',
+            ['ip-192-168-1-2', 'ip-192-168-1-3'])
+
+    @patch.object(charms_ceph.utils, 'get_osd_tree')
+    @patch.object(charms_ceph.utils, 'socket')
+    @patch.object(charms_ceph.utils, 'status_set')
+    @patch.object(charms_ceph.utils, 'lock_and_roll')
+    @patch.object(charms_ceph.utils, 'get_strictest_failure_domain')
+    @patch.object(charms_ceph.utils, 'wait_for_pgs_active_clean')
+    @patch.object(charms_ceph.utils, 'wait_on_previous_node')
+    def test_roll_osd_cluster_same_rack(self,
+                                        wait_on_previous_node,
+                                        wait_for_pgs_active_clean,
+                                        get_strictest_failure_domain,
+                                        lock_and_roll,
+                                        status_set,
+                                        socket,
+                                        get_osd_tree):
+        socket.gethostname.return_value = "ip-192-168-1-3"
+        get_osd_tree.return_value = OSD_TREE
+        get_strictest_failure_domain.return_value = 'rack'
+
+        charms_ceph.utils.roll_osd_cluster(new_version='0.94.1',
+                                           upgrade_key='osd-upgrade')
+        wait_on_previous_node.assert_not_called()
+        wait_for_pgs_active_clean.assert_not_called()
         lock_and_roll.assert_called_with(my_name='ip-192-168-1-3',
                                          service='osd',
                                          upgrade_key='osd-upgrade',
-                                         version='0.94.1')
+                                         version='0.94.1',
+                                         parallelism=4)
+
+        # The third host waits for the whole of rack-a
+        socket.gethostname.return_value = "ip-192-168-1-4"
+        charms_ceph.utils.roll_osd_cluster(new_version='0.94.1',
+                                           upgrade_key='osd-upgrade')
+        status_set.assert_any_call(
+            'waiting',
+            'Waiting on ip-192-168-1-2, ip-192-168-1-3 to finish upgrading')
+        self.assertEqual(
+            [c[1]['previous_node']
+             for c in wait_on_previous_node.call_args_list],
+            ['ip-192-168-1-2', 'ip-192-168-1-3'])
+
+    @patch.object(charms_ceph.utils, 'get_osd_tree')
+    @patch.object(charms_ceph.utils, 'socket')
+    @patch.object(charms_ceph.utils, 'status_set')
+    @patch.object(charms_ceph.utils, 'lock_and_roll')
+    @patch.object(charms_ceph.utils, 'get_strictest_failure_domain')
+    @patch.object(charms_ceph.utils, 'wait_on_previous_node')
+    def test_roll_osd_cluster_no_failure_domain(self,
+                                                wait_on_previous_node,
+                                                get_strictest_failure_domain,
+                                                lock_and_roll,
+                                                status_set,
+                                                socket,
+                                                get_osd_tree):
+        socket.gethostname.return_value = "ip-192-168-1-3"
+        get_osd_tree.return_value = OSD_TREE
+        get_strictest_failure_domain.side_effect = \
+            subprocess.CalledProcessError(1, 'ceph')
+
+        charms_ceph.utils.roll_osd_cluster(new_version='0.94.1',
+                                           upgrade_key='osd-upgrade')
+        status_set.assert_called_once_with('blocked', 'failed to upgrade osd')
+        wait_on_previous_node.assert_not_called()
+        lock_and_roll.assert_not_called()
+
+        # The key hasn't been given the caps of the rolling upgrade yet.
+        get_strictest_failure_domain.side_effect = \
+            subprocess.CalledProcessError(13, 'ceph')
+        charms_ceph.utils.roll_osd_cluster(new_version='0.94.1',
+                                           upgrade_key='osd-upgrade')
+        status_set.assert_called_with(
+            'blocked', 'osd-upgrade key lacks the osd crush rule dump, '
+            'osd pool ls, pg stat and mgr caps: upgrade ceph-mon first')
+        lock_and_roll.assert_not_called()
+
+    def test_get_upgrade_waves(self):
+        waves = charms_ceph.utils.get_upgrade_waves(OSD_TREE, 'host')
+        self.assertEqual([[h.name for h in wave] for wave in waves],
+                         [['ip-192-168-1-2'], ['ip-192-168-1-3'],
+                          ['ip-192-168-1-4']])
+        waves = charms_ceph.utils.get_upgrade_waves(OSD_TREE, 'rack')
+        self.assertEqual([[h.name for h in wave] for wave in waves],
+                         [['ip-192-168-1-2', 'ip-192-168-1-3'],
+                          ['ip-192-168-1-4']])
+        waves = charms_ceph.utils.get_upgrade_waves(OSD_TREE, 'row')
+        self.assertEqual([[h.name for h in wave] for wave in waves],
+                         [['ip-192-168-1-2', 'ip-192-168-1-3',
+                           'ip-192-168-1-4']])
+        waves = charms_ceph.utils.get_upgrade_waves(
+            OSD_TREE, 'row', max_hosts_per_wave=2)
+        self.assertEqual([[h.name for h in wave] for wave in waves],
+                         [['ip-192-168-1-2', 'ip-192-168-1-3'],
+                          ['ip-192-168-1-4']])
+        self.assertEqual(
+            charms_ceph.utils.get_upgrade_wave(waves, 'ip-192-168-1-4'), 1)
+        self.assertRaises(ValueError, charms_ceph.utils.get_upgrade_wave,
+                          waves, 'ip-192-168-1-5')
+
+    @patch.object(charms_ceph.utils.subprocess, 'check_output')
+    def test_get_strictest_failure_domain(self, check_output):
+        rules = [
+            {'rule_id': 0, 'steps': [
+                {'op': 'take', 'item_name': 'default'},
+                {'op': 'chooseleaf_firstn', 'num': 0, 'type': 'rack'},
+                {'op': 'emit'}]},
+            {'rule_id': 1, 'steps': [
+                {'op': 'take', 'item_name': 'default'},
+                {'op': 'choose_firstn', 'num': 2, 'type': 'row'},
+                {'op': 'chooseleaf_firstn', 'num': 2, 'type': 'host'},
+                {'op': 'emit'}]},
+            {'rule_id': 2, 'steps': [
+                {'op': 'take', 'item_name': 'default'},
+                {'op': 'chooseleaf_indep', 'num': 0, 'type': 'row'},
+                {'op': 'emit'}]},
+        ]
+
+        def _check_output(pools):
+            def _output(cmd):
+                if 'rule' in cmd:
+                    return json.dumps(rules).encode()
+                return json.dumps(
+                    [{'pool_name': str(p), 'crush_rule': p}
+                     for p in pools]).encode()
+            return _output
+
+        check_output.side_effect = _check_output([0, 2])
+        self.assertEqual(
+            charms_ceph.utils.get_strictest_failure_domain('osd-upgrade'),
+            'rack')
+        check_output.assert_any_call(
+            ['ceph', '--id', 'osd-upgrade', 'osd', 'crush', 'rule', 'dump',
+             '--format=json'])
+        check_output.side_effect = _check_output([2, 1])
+        self.assertEqual(
+            charms_ceph.utils.get_strictest_failure_domain('osd-upgrade'),
+            'host')
+        check_output.side_effect = subprocess.CalledProcessError(13, 'ceph')
+        self.assertRaises(
+            subprocess.CalledProcessError,
+            charms_ceph.utils.get_strictest_failure_domain, 'osd-upgrade')
+
+    @patch.object(charms_ceph.utils.WatchDog, 'wait_until')
+    @patch.object(charms_ceph.utils.subprocess, 'check_output')
+    def test_wait_for_pgs_active_clean(self, check_output, wait_until):
+        charms_ceph.utils.wait_for_pgs_active_clean('osd-upgrade')
+        _pgs_active_clean = wait_until.call_args[0][0]
+        check_output.return_value = json.dumps({
+            'pg_summary': {
+                'num_pg_by_state': [{'name': 'active+clean', 'num': 30},
+                                    {'name': 'peering', 'num': 2}],
+                'num_pgs': 32}}).encode()
+        self.assertFalse(_pgs_active_clean())
+        check_output.return_value = json.dumps({
+            'num_pg_by_state': [{'name': 'active+clean', 'num': 32}],
+            'num_pgs': 32}).encode()
+        self.assertTrue(_pgs_active_clean())
+        check_output.return_value = json.dumps({
+            'num_pg_by_state': [
+                {'name': 'active+clean', 'num': 28},
+                {'name': 'active+clean+scrubbing+deep', 'num': 2},
+                {'name': 'active+clean+snaptrim', 'num': 1},
+                {'name': 'active+clean+scrubbing', 'num': 1}],
+            'num_pgs': 32}).encode()
+        self.assertTrue(_pgs_active_clean())
+        check_output.return_value = json.dumps({
+            'num_pg_by_state': [
+                {'name': 'active+clean', 'num': 31},
+                {'name': 'active+undersized+degraded', 'num': 1}],
+            'num_pgs': 32}).encode()
+        self.assertFalse(_pgs_active_clean())
+        check_output.assert_called_with(
+            ['ceph', '--id', 'osd-upgrade', 'pg', 'stat', '--format=json'])
+        # A failed query keeps waiting rather than reporting clean.
+        check_output.side_effect = subprocess.CalledProcessError(13, 'ceph')
+        self.assertFalse(_pgs_active_clean())
 
     @patch('os.path.exists')
     @patch('os.listdir')
@@ -13,7 +13,13 @@
 # limitations under the License.
 
 import collections
+import json
+import os
+import socket
+import struct
 import subprocess
+import tempfile
+import threading
 import unittest
 
 from unittest.mock import (
@@ -44,6 +50,30 @@ class TestDevice():
         "/dev/test_device"
 
 
+POOL_LS_DETAIL = [
+    {'pool_name': 'pool',
+     'type': 3,
+     'size': 42,
+     'min_size': 2,
+     'pg_num': 42,
+     'pg_placement_num': 40,
+     'erasure_code_profile': 'my-ec-profile',
+     'quota_max_bytes': 1000,
+     'quota_max_objects': 10,
+     'application_metadata': {'application': {}}},
+    {'pool_name': 'pool2',
+     'type': 1,
+     'size': 3,
+     'min_size': 2,
+     'pg_num': 32,
+     'pg_placement_num': 32,
+     'erasure_code_profile': '',
+     'quota_max_bytes': 0,
+     'quota_max_objects': 0,
+     'application_metadata': {}},
+]
+
+
 class CephTestCase(unittest.TestCase):
     def setUp(self):
         super(CephTestCase, self).setUp()
@@ -187,6 +217,54 @@ class CephTestCase(unittest.TestCase):
         db.set.assert_called_with('osd-devices', ['/dev/sdb'])
         db.flush.assert_called_once()
 
+    @patch.object(utils, 'status_set')
+    @patch.object(utils, 'kv')
+    @patch.object(utils, '_osdize_dev_create')
+    @patch.object(utils, '_osdize_dev_wanted')
+    def test_osdize_devs(self, _wanted, _create, _kv, _status_set):
+        """Test that devices are prepared concurrently."""
+        db = MagicMock()
+        _kv.return_value = db
+        db.get.return_value = ['/dev/sda']
+        _wanted.side_effect = lambda dev, devices: dev != '/dev/sda'
+        barrier = threading.Barrier(2, timeout=10)
+
+        def _osdize(dev, *args):
+            if dev == '/dev/sdd':
+                raise subprocess.CalledProcessError(1, 'ceph-volume')
+            # Both devices are being prepared at the same time.
+            barrier.wait()
+
+        _create.side_effect = _osdize
+        with self.assertRaises(subprocess.CalledProcessError):
+            utils.osdize_devs(['/dev/sda', '/dev/sdb', '/dev/sdc',
+                               '/dev/sdd'],
+                              osd_format=None, osd_journal=None,
+                              max_workers=2)
+        self.assertEqual(sorted(c[0][0] for c in _create.call_args_list),
+                         ['/dev/sdb', '/dev/sdc', '/dev/sdd'])
+        self.assertEqual(sorted(db.set.call_args[0][1]),
+                         ['/dev/sda', '/dev/sdb', '/dev/sdc'])
+        _status_set.assert_called_with(
+            'maintenance', 'Initializing devices (2/3 done)')
+
+        # Nothing is started once a device failed.
+        _create.reset_mock()
+        db.get.return_value = []
+        with self.assertRaises(subprocess.CalledProcessError):
+            utils.osdize_devs(['/dev/sdd', '/dev/sde'],
+                              osd_format=None, osd_journal=None)
+        _create.assert_called_once_with('/dev/sdd', None, None, False,
+                                        False, 'ceph', None, None)
+
+        # A concurrency below 1 still prepares the devices one at a time.
+        _create.reset_mock()
+        _create.side_effect = None
+        utils.osdize_devs(['/dev/sdb', '/dev/sdc'],
+                          osd_format=None, osd_journal=None, max_workers=0)
+        self.assertEqual([c[0][0] for c in _create.call_args_list],
+                         ['/dev/sdb', '/dev/sdc'])
+
     @patch.object(utils, 'kv')
     def test_osdize_dev_already_processed(self, _kv):
         """Ensure that previously processed disks are skipped"""
@@ -551,8 +629,9 @@ class CephTestCase(unittest.TestCase):
     @patch.object(utils, "ceph_user", lambda: "ceph")
     @patch.object(utils.socket, "gethostname", lambda: "osd001")
     def test_get_named_key_with_pool(self, mock_check_output):
-        mock_check_output.side_effect = [CalledProcessError(0, 0, 0), b""]
-        utils.ceph_auth_get.cache_clear()
+        mock_check_output.side_effect = [CalledProcessError(0, 0, 0),
+                                         CalledProcessError(0, 0, 0), b""]
+        utils.flush_ceph_auth_cache()
         utils.get_named_key(name="rgw001", pool_list=["rbd", "block"])
         mock_check_output.assert_has_calls([
             call(['sudo', '-u', 'ceph', 'ceph', '--name',
@@ -571,7 +650,9 @@ class CephTestCase(unittest.TestCase):
     @patch.object(utils, 'ceph_user', lambda: "ceph")
     @patch.object(utils.socket, "gethostname", lambda: "osd001")
     def test_get_named_key(self, mock_check_output):
-        mock_check_output.side_effect = [CalledProcessError(0, 0, 0), b""]
+        mock_check_output.side_effect = [CalledProcessError(0, 0, 0),
+                                         CalledProcessError(0, 0, 0), b""]
+        utils.flush_ceph_auth_cache()
         utils.get_named_key(name="rgw001")
         mock_check_output.assert_has_calls([
             call(['sudo', '-u', 'ceph', 'ceph', '--name',
@@ -586,9 +667,11 @@ class CephTestCase(unittest.TestCase):
                           '; allow command "osd blocklist"'),
                   'osd', 'allow rwx'])])
         mock_check_output.reset_mock()
-        mock_check_output.side_effect = [b'key=test']
+        mock_check_output.side_effect = [CalledProcessError(0, 0, 0),
+                                         b'key=test']
         utils.get_named_key(name="rgw001")
-        mock_check_output.assert_called_once_with([
+        self.assertEqual(mock_check_output.call_count, 2)
+        mock_check_output.assert_called_with([
             'sudo', '-u', 'ceph', 'ceph', '--name',
             'mon.', '--keyring',
             '/var/lib/ceph/mon/ceph-osd001/keyring',
@@ -597,6 +680,66 @@ class CephTestCase(unittest.TestCase):
         utils.get_named_key(name="rgw001")
         mock_check_output.assert_not_called()
 
+    @patch.object(utils.subprocess, 'check_call')
+    @patch.object(utils.subprocess, 'check_output')
+    @patch.object(utils, 'is_leader', lambda: True)
+    @patch.object(utils, 'ceph_user', lambda: "ceph")
+    @patch.object(utils.socket, "gethostname", lambda: "mon001")
+    def test_get_named_key_auth_ls(self, mock_check_output,
+                                   mock_check_call):
+        crash_caps = {'mon': ['profile crash'], 'mgr': ['profile crash']}
+        auth_ls = json.dumps({'auth_dump': [
+            {'entity': 'client.osd-upgrade', 'key': 'upgrade-key',
+             'caps': {'mon': '; '.join(utils.osd_upgrade_caps['mon']),
+                      'mgr': 'allow r',
+                      'osd': utils.osd_upgrade_caps['osd'][0]}},
+            {'entity': 'client.osd-removal', 'key': 'removal-key',
+             'caps': {'mon': 'allow r'}},
+            {'entity': 'client.crash', 'key': 'crash-key',
+             'caps': {'mon': 'profile crash', 'mgr': 'profile crash'}},
+        ]}).encode('UTF-8')
+        mock_check_output.return_value = auth_ls
+        utils.flush_ceph_auth_cache()
+        for _ in range(3):
+            self.assertEqual(
+                utils.get_named_key('osd-upgrade',
+                                    caps=utils.osd_upgrade_caps),
+                'upgrade-key')
+            self.assertEqual(
+                utils.create_named_keyring('client', 'crash',
+                                           caps=crash_caps),
+                'crash-key')
+        mock_check_output.assert_called_once_with([
+            'sudo', '-u', 'ceph', 'ceph', '--name',
+            'mon.', '--keyring',
+            '/var/lib/ceph/mon/ceph-mon001/keyring',
+            'auth', 'ls', '--format=json'])
+        mock_check_call.assert_not_called()
+
+        # Outdated caps are upgraded and the cache is reloaded afterwards.
+        removal_caps = {'mon': ['allow r', 'allow command "osd purge"']}
+        self.assertEqual(
+            utils.get_named_key('osd-removal', caps=removal_caps),
+            'removal-key')
+        mock_check_call.assert_called_once_with([
+            'sudo', '-u', 'ceph', 'ceph', 'auth', 'caps',
+            'client.osd-removal', 'mon', 'allow r; allow command "osd purge"'])
+        utils.get_named_key('osd-upgrade', caps=utils.osd_upgrade_caps)
+        self.assertEqual(mock_check_output.call_count, 2)
+
+        # Unknown entities are created.
+        mock_check_output.side_effect = [b'new-key', auth_ls]
+        self.assertEqual(
+            utils.get_named_key('rgw001'), 'new-key')
+        mock_check_output.assert_called_with([
+            'sudo', '-u', 'ceph', 'ceph', '--name',
+            'mon.', '--keyring',
+            '/var/lib/ceph/mon/ceph-mon001/keyring',
+            'auth', 'get-or-create', 'client.rgw001',
+            'mon', ('allow r; allow command "osd blacklist"'
+                    '; allow command "osd blocklist"'),
+            'osd', 'allow rwx'])
+
     def test_parse_key_with_caps_existing_key(self):
         expected = "AQCm7aVYQFXXFhAAj0WIeqcag88DKOvY4UKR/g=="
         with_caps = "[client.osd-upgrade]\n" \
@@ -1217,30 +1360,27 @@ class CephTestCase(unittest.TestCase):
         self.assertEqual(utils.get_pool_applications(),
                          {'pool': {'application': {}}})
         _check_output.assert_called_with(['ceph', '--id', 'admin', 'osd',
-                                          'pool', 'application', 'get'],
+                                          'pool', 'application', 'get',
+                                          '--format=json'],
                                          universal_newlines=True,
                                          stderr=subprocess.STDOUT)
         utils.get_pool_applications('42')
         _check_output.assert_called_with(['ceph', '--id', 'admin', 'osd',
-                                          'pool', 'application', 'get', '42'],
+                                          'pool', 'application', 'get', '42',
+                                          '--format=json'],
                                          universal_newlines=True,
                                          stderr=subprocess.STDOUT)
 
-    @patch.object(utils, 'get_pool_erasure_profile')
-    @patch.object(utils, 'get_pool_param')
-    @patch.object(utils, 'get_pool_quota')
-    @patch.object(utils, 'list_pools')
-    @patch.object(utils, 'get_pool_applications')
-    def test_list_pools_detail(self, _get_pool_applications, _list_pools,
-                               _get_pool_quota, _get_pool_param,
-                               _get_pool_erasure_profile):
+    @patch.object(utils, '_pool_inventories', {})
+    @patch.object(utils.subprocess, 'check_output')
+    def test_list_pools_detail(self, _check_output):
+        _check_output.return_value = '[]'
         self.assertEqual(utils.list_pools_detail(), {})
-        _get_pool_applications.return_value = {'pool': {'application': {}}}
-        _list_pools.return_value = ['pool', 'pool2']
-        _get_pool_quota.return_value = {'max_objects': '10',
-                                        'max_bytes': '1000'}
-        _get_pool_param.return_value = '42'
-        _get_pool_erasure_profile.return_value = 'my-ec-profile'
+        _check_output.assert_called_once_with(
+            ['ceph', '--id', 'admin', 'osd', 'pool', 'ls', 'detail',
+             '--format=json'],
+            universal_newlines=True, stderr=subprocess.STDOUT)
+        _check_output.return_value = json.dumps(POOL_LS_DETAIL)
         self.assertEqual(
             utils.list_pools_detail(),
             {'pool': {'applications': {'application': {}},
@@ -1251,13 +1391,36 @@ class CephTestCase(unittest.TestCase):
                                 'max_objects': '10'},
                       },
              'pool2': {'applications': {},
-                       'parameters': {'pg_num': '42',
-                                      'size': '42',
-                                      'erasure_code_profile': 'my-ec-profile'},
-                       'quota': {'max_bytes': '1000',
-                                 'max_objects': '10'},
+                       'parameters': {'pg_num': '32',
+                                      'size': '3'},
+                       'quota': {},
                        },
              })
+        self.assertEqual(_check_output.call_count, 2)
+
+    @patch.object(utils, '_pool_inventories', {})
+    @patch.object(utils, 'time')
+    @patch.object(utils.subprocess, 'check_output')
+    def test_pool_inventory_max_age(self, _check_output, _time):
+        _time.time.return_value = 1000
+        _check_output.return_value = json.dumps(POOL_LS_DETAIL)
+        self.assertEqual(utils.list_pools(max_age=5), ['pool', 'pool2'])
+        self.assertEqual(utils.get_pool_param('pool2', 'size', max_age=5),
+                         '3')
+        self.assertEqual(utils.get_pool_param('pool', 'pgp_num', max_age=5),
+                         '40')
+        self.assertEqual(utils.get_pool_quota('pool2', max_age=5), {})
+        self.assertEqual(utils.get_pool_erasure_profile('pool2', max_age=5),
+                         None)
+        self.assertEqual(utils.get_pool_applications(max_age=5),
+                         {'pool': {'application': {}}, 'pool2': {}})
+        _check_output.assert_called_once_with(
+            ['ceph', '--id', 'admin', 'osd', 'pool', 'ls', 'detail',
+             '--format=json'],
+            universal_newlines=True, stderr=subprocess.STDOUT)
+        _time.time.return_value = 1006
+        utils.get_pool_quota('pool', max_age=5)
+        self.assertEqual(_check_output.call_count, 2)
 
     @patch.object(utils.subprocess, 'check_output')
     @patch.object(utils, 'get_version')
@@ -2252,28 +2415,179 @@ class CephManagerAndConfig(unittest.TestCase):
             ['ceph', 'config', 'get', 'mgr', 'mgr/dashboard/ssl'])
 
 
+class CephSessionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.rados = MagicMock()
+        self.rados.Error = type('Error', (Exception,), {})
+        self.cluster = self.rados.Rados.return_value
+        self._atexit = MagicMock()
+        for attr, value in (('rados', self.rados),
+                            ('atexit', self._atexit),
+                            ('_ceph_sessions', {})):
+            patcher = patch.object(utils, attr, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    @patch.object(utils.subprocess, 'check_output')
+    def test_session(self, _check_output):
+        self.cluster.mon_command.return_value = (0, b'size: 3\n', '')
+        self.assertEqual(utils.get_pool_param('rbd', 'size'), '3')
+        self.assertEqual(utils.get_pool_param('rbd', 'size'), '3')
+        self.rados.Rados.assert_called_once_with(
+            rados_id='admin', conffile='/etc/ceph/ceph.conf')
+        self.cluster.mon_command.assert_called_with(
+            json.dumps({'prefix': 'osd pool get', 'pool': 'rbd',
+                        'var': 'size'}), b'')
+        self._atexit.register.assert_called_once_with(
+            utils._close_ceph_sessions)
+        _check_output.assert_not_called()
+
+        self.cluster.mgr_command.return_value = (
+            0, b'{"num_pg_by_state": [{"name": "active+clean", "num": 1}]}',
+            '')
+        self.assertEqual(utils.get_ceph_pg_stat(), {
+            'num_pg_by_state': [{'name': 'active+clean', 'num': 1}]})
+        self.cluster.mgr_command.assert_called_once_with(
+            json.dumps({'prefix': 'pg stat', 'format': 'json'}), b'')
+
+    @patch.object(utils.subprocess, 'check_output')
+    def test_session_errors(self, _check_output):
+        self.cluster.mon_command.return_value = (
+            -2, b'', "option 'foo' is not set on pool 'rbd'")
+        self.assertIsNone(utils.get_pool_param('rbd', 'foo'))
+        self.cluster.mon_command.return_value = (-13, b'', 'access denied')
+        with self.assertRaises(CalledProcessError) as ctx:
+            utils.get_pool_param('rbd', 'size')
+        self.assertEqual(ctx.exception.returncode, 13)
+        self.assertEqual(ctx.exception.output,
+                         'Error EACCES: access denied\n')
+        _check_output.assert_not_called()
+
+        # Transport errors fall back to the CLI.
+        self.cluster.mon_command.side_effect = self.rados.Error('timeout')
+        _check_output.return_value = 'size: 2\n'
+        self.assertEqual(utils.get_pool_param('rbd', 'size'), '2')
+        _check_output.assert_called_once_with(
+            ['ceph', '--id', 'admin', 'osd', 'pool', 'get', 'rbd', 'size'],
+            universal_newlines=True, stderr=subprocess.STDOUT)
+
+    @patch.object(utils.subprocess, 'check_output')
+    @patch.object(utils, 'ceph_user', lambda: 'ceph')
+    @patch.object(utils.socket, 'gethostname', lambda: 'mon001')
+    def test_session_mon_keyring(self, _check_output):
+        self.cluster.mon_command.side_effect = [
+            (0, b'{"auth_dump": []}', ''),
+            (0, b'[client.rgw001]\n\tkey = new-key\n', ''),
+        ]
+        utils.flush_ceph_auth_cache()
+        self.assertEqual(utils.get_named_key('rgw001', caps={
+            'mon': ['allow r'], 'osd': ['allow rwx']}), 'new-key')
+        self.rados.Rados.assert_called_once_with(
+            name='mon.', conffile='/etc/ceph/ceph.conf',
+            conf={'keyring': '/var/lib/ceph/mon/ceph-mon001/keyring'})
+        self.cluster.mon_command.assert_has_calls([
+            call(json.dumps({'prefix': 'auth ls', 'format': 'json'}), b''),
+            call(json.dumps({'prefix': 'auth get-or-create',
+                             'entity': 'client.rgw001',
+                             'caps': ['mon', 'allow r',
+                                      'osd', 'allow rwx']}), b''),
+        ])
+        _check_output.assert_not_called()
+
+    @patch.object(utils.subprocess, 'check_call')
+    def test_session_unavailable(self, _check_call):
+        self.cluster.connect.side_effect = Exception('no cluster')
+        utils.ceph_config_set('mgr/dashboard/ssl', 'true', 'mgr')
+        utils.ceph_config_set('mgr/dashboard/ssl', 'true', 'mgr')
+        self.rados.Rados.assert_called_once()
+        self.assertEqual(_check_call.call_count, 2)
+        _check_call.assert_called_with(
+            ['ceph', 'config', 'set', 'mgr', 'mgr/dashboard/ssl', 'true'])
+
+        utils.rados = None
+        self.assertIsNone(utils.ceph_session('other'))
+
+    def test_ceph_cli_args(self):
+        self.assertEqual(
+            utils._ceph_cli_args({'prefix': 'osd pool ls', 'detail': 'detail',
+                                  'format': 'json'}, service='admin'),
+            ['ceph', '--id', 'admin', 'osd', 'pool', 'ls', 'detail',
+             '--format=json'])
+        self.assertEqual(
+            utils._ceph_cli_args({'prefix': 'auth get-or-create',
+                                  'entity': 'client.foo',
+                                  'caps': ['mon', 'allow r']},
+                                 service='mon.', keyring='/tmp/keyring',
+                                 user='ceph'),
+            ['sudo', '-u', 'ceph', 'ceph', '--name', 'mon.', '--keyring',
+             '/tmp/keyring', 'auth', 'get-or-create', 'client.foo', 'mon',
+             'allow r'])
+
+    def test_admin_socket_command(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        asok = os.path.join(tmpdir.name, 'ceph-mon.asok')
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.addCleanup(server.close)
+        server.bind(asok)
+        server.listen(1)
+        requests = []
+        response = json.dumps({'state': 'leader',
+                               'padding': 'x' * 100000}).encode('UTF-8')
+
+        def _serve():
+            conn, _ = server.accept()
+            with conn:
+                request = b''
+                while not request.endswith(b'\0'):
+                    request += conn.recv(1024)
+                requests.append(json.loads(request[:-1].decode('UTF-8')))
+                conn.sendall(struct.pack('>I', len(response)) + response)
+
+        thread = threading.Thread(target=_serve)
+        thread.start()
+        result = utils._admin_socket_command(asok, 'mon_status')
+        thread.join()
+        self.assertEqual(requests, [{'prefix': 'mon_status'}])
+        self.assertEqual(result['state'], 'leader')
+
+    @patch.object(utils.os.path, 'exists', lambda path: True)
+    @patch.object(utils.subprocess, 'check_output')
+    @patch.object(utils, '_admin_socket_command')
+    def test_is_quorum(self, _admin_socket_command, _check_output):
+        _admin_socket_command.return_value = {'state': 'peon'}
+        self.assertTrue(utils.is_quorum())
+        self.assertFalse(utils.is_leader())
+        _admin_socket_command.side_effect = OSError('denied')
+        _check_output.return_value = b'{"state": "leader"}'
+        self.assertTrue(utils.is_leader())
+        _check_output.side_effect = CalledProcessError(1, 'ceph')
+        self.assertFalse(utils.is_quorum())
+
+
 class CephGetOSDStateTestCase(unittest.TestCase):
 
     @patch.object(utils.time, 'time')
-    @patch.object(utils.subprocess, 'check_output')
-    def test_get_osd_state_timeout(self, _check_output, _time):
+    @patch.object(utils, '_admin_socket_command')
+    def test_get_osd_state_timeout(self, _asok, _time):
         """Test that get_osd_state returns None after timeout."""
         _time.side_effect = [0, 0, 601]
-        _check_output.return_value = b'{"state": "booting"}'
+        _asok.return_value = {"state": "booting"}
 
         result = utils.get_osd_state(0, osd_goal_state='active', timeout=600)
 
         self.assertIsNone(result)
 
     @patch.object(utils.time, 'time')
-    @patch.object(utils.subprocess, 'check_output')
-    def test_get_osd_state_success_after_retries(self, _check_output, _time):
+    @patch.object(utils, '_admin_socket_command')
+    def test_get_osd_state_success_after_retries(self, _asok, _time):
         """Test that get_osd_state succeeds after retries on failure."""
         _time.side_effect = [0, 0, 10, 20, 30, 40]
-        _check_output.side_effect = [
-            CalledProcessError(1, 'cmd'),
-            CalledProcessError(1, 'cmd'),
-            b'{"state": "active"}'
+        _asok.side_effect = [
+            ConnectionRefusedError(),
+            ConnectionRefusedError(),
+            {"state": "active"}
         ]
 
         result = utils.get_osd_state(0, osd_goal_state='active')
@@ -2281,11 +2595,11 @@ class CephGetOSDStateTestCase(unittest.TestCase):
         self.assertEqual(result, 'active')
 
     @patch.object(utils.time, 'time')
-    @patch.object(utils.subprocess, 'check_output')
-    def test_get_osd_state_no_goal_state(self, _check_output, _time):
+    @patch.object(utils, '_admin_socket_command')
+    def test_get_osd_state_no_goal_state(self, _asok, _time):
         """Test get_osd_state returns current state when no goal."""
         _time.side_effect = [0, 0]
-        _check_output.return_value = b'{"state": "booting"}'
+        _asok.return_value = {"state": "booting"}
 
         result = utils.get_osd_state(0)
 
@@ -2293,14 +2607,14 @@ class CephGetOSDStateTestCase(unittest.TestCase):
 
     @patch.object(utils.time, 'sleep')
     @patch.object(utils.time, 'time')
-    @patch.object(utils.subprocess, 'check_output')
-    def test_get_osd_state_custom_retry_interval(self, _check_output, _time,
+    @patch.object(utils, '_admin_socket_command')
+    def test_get_osd_state_custom_retry_interval(self, _asok, _time,
                                                  _sleep):
         """Test custom retry_interval parameter."""
         _time.side_effect = [0, 0, 10]
-        _check_output.side_effect = [
-            b'{"state": "booting"}',
-            b'{"state": "active"}'
+        _asok.side_effect = [
+            {"state": "booting"},
+            {"state": "active"}
         ]
 
         result = utils.get_osd_state(0, osd_goal_state='active',
@@ -2308,3 +2622,39 @@ class CephGetOSDStateTestCase(unittest.TestCase):
 
         self.assertEqual(result, 'active')
         _sleep.assert_called_with(10)
+
+    @patch.object(utils.time, 'sleep')
+    @patch.object(utils.time, 'time')
+    @patch.object(utils, 'get_local_osd_ids')
+    @patch.object(utils, '_query_osd_state')
+    def test_get_all_osd_states(self, _query_osd_state, _get_local_osd_ids,
+                                _time, _sleep):
+        _get_local_osd_ids.return_value = [0, 1, 2]
+        _time.return_value = 0
+        states = {0: iter(['booting']), 1: iter(['active']),
+                  2: iter([None, 'active'])}
+        _query_osd_state.side_effect = lambda osd_num: next(states[osd_num])
+        self.assertEqual(utils.get_all_osd_states(),
+                         {0: 'booting', 1: 'active', 2: 'active'})
+        # OSD 2 is queried again until its admin socket answers
+        _sleep.assert_called_once_with(0.5)
+
+    @patch.object(utils.time, 'sleep')
+    @patch.object(utils.time, 'time')
+    @patch.object(utils, 'get_local_osd_ids')
+    @patch.object(utils, '_query_osd_state')
+    def test_get_all_osd_states_goal(self, _query_osd_state,
+                                     _get_local_osd_ids, _time, _sleep):
+        _get_local_osd_ids.return_value = [0, 1]
+        _time.side_effect = range(0, 1000, 10)
+        states = {0: iter(['booting'] * 2 + ['active']),
+                  1: iter(['booting'] * 10)}
+        _query_osd_state.side_effect = lambda osd_num: next(states[osd_num])
+
+        result = utils.get_all_osd_states({0: 'active', 1: 'active'},
+                                          timeout=50)
+
+        self.assertEqual(result, {0: 'active', 1: None})
+        # Backs off while nothing changes, starts over when an OSD does
+        self.assertEqual([c[0][0] for c in _sleep.call_args_list],
+                         [0.5, 1, 0.5, 1, 2])